@@ -23,8 +23,19 @@ import sys
 import resource
 import errno
 import signal
+import stat
+import fcntl
 import socket
 import atexit
+import ctypes
+import platform
+import time
+import gc
+import select
+
+import lockfile
+
+import notify
 
 
 class DaemonError(Exception):
@@ -74,6 +85,14 @@ class DaemonContext(object):
             object's `fileno()` method) or Python `file` objects. Each
             specifies a file that is not to be closed during daemon start.
 
+            If the process was started by socket activation (the
+            ``LISTEN_PID`` and ``LISTEN_FDS`` environment variables, as set
+            by a supervisor such as `systemd`, name this process), the file
+            descriptors passed to it are also preserved. After `open`, the
+            `activated_sockets` attribute maps each name given in
+            ``LISTEN_FDNAMES`` (``'unknown'`` for any not named) to a list
+            of the sockets with that name.
+
         `chroot_directory`
             :Default: ``None``
 
@@ -118,7 +137,22 @@ class DaemonContext(object):
             this will be set to ``True`` by default, and ``False`` only if
             detaching the process is determined to be redundant; for example,
             in the case when the process was started by `init`, by `initd`, or
-            by `inetd`.
+            by `inetd`, or by socket activation. This is determined when the
+            value is first needed (at the latest, by `open`), not during
+            initialisation.
+
+        `ready_timeout`
+            :Default: ``None``
+
+            If ``None``, the original process exits as soon as the process
+            context is detached. Otherwise, the original process waits, for
+            up to this many seconds, until the daemon process calls
+            `report_ready` or `report_failed` (or exits), and then exits
+            with a status reporting the outcome: ``0`` if the daemon process
+            is ready, `START_FAILED_EXIT_STATUS` if it failed (after writing
+            the reason to `sys.stderr`), or `START_TIMEOUT_EXIT_STATUS` if
+            the time ran out. The status is reported over a pipe, which the
+            daemon process keeps open until it reports.
 
         `signal_map`
             :Default: system-dependent
@@ -170,7 +204,8 @@ class DaemonContext(object):
 
             The default values, the real UID and GID of the process, will
             relinquish any effective privilege elevation inherited by the
-            process.
+            process. They are queried when first needed (at the latest, by
+            `open`), not during initialisation.
 
         `prevent_core`
             :Default: ``True``
@@ -178,6 +213,32 @@ class DaemonContext(object):
             If true, prevents the generation of core files, in order to avoid
             leaking sensitive information from daemons run as `root`.
 
+        `resource_limits`
+            :Default: ``None``
+
+            Mapping of resource limits to set for the process, from each
+            resource to its limit. A resource is named by its `resource`
+            module constant (such as ``resource.RLIMIT_NOFILE``) or by a
+            string such as ``'RLIMIT_NOFILE'`` or ``'NOFILE'``. A limit is
+            one of:
+
+            * An integer, or ``resource.RLIM_INFINITY``, to set the soft
+              limit, leaving the hard limit unchanged.
+
+            * A tuple ``(soft, hard)``, to set both limits.
+
+            * The string ``'hard'``, to raise the soft limit to the
+              current hard limit; for example, to allow the daemon as
+              many open files as the system permits.
+
+            Every limit is validated against the current hard limits
+            before any is set. The limits are set during `open`, after
+            `prevent_core` (so a limit for ``RLIMIT_CORE`` takes precedence)
+            and before the process owner is changed (so hard limits can be
+            raised with the starting privileges). Raising ``RLIMIT_NOFILE``
+            does not increase the number of file descriptors examined
+            when closing files. If ``None``, no limits are set.
+
         `stdin`
             :Default: ``None``
 
@@ -198,9 +259,152 @@ class DaemonContext(object):
             closed during daemon start (that is, it will be treated as though
             it were listed in `files_preserve`).
 
+            Each may instead be a file descriptor (an integer), which is
+            likewise excluded from being closed; or a string, which is the
+            filesystem path of a file to open after other files are closed.
+            The `stdin` file is opened for reading; the `stdout` and `stderr`
+            files are opened for appending, and created if they do not exist.
+
             If ``None``, the corresponding system stream is re-bound to the
             file named by `os.devnull`.
 
+        `listen_addresses`
+            :Default: ``None``
+
+            Sequence of addresses on which the daemon will accept
+            connections. Each address is either a tuple ``(host, port)``
+            for a TCP socket (IPv4 or IPv6, as resolved for `host`; an
+            empty `host` means all interfaces), or a string, which is the
+            filesystem path of a Unix-domain stream socket.
+
+            The sockets are created, bound, and set listening during `open`,
+            before the process owner is changed (so privileged ports can be
+            bound) and before files are closed; they are automatically
+            excluded from being closed. Afterward, the `listen_sockets`
+            attribute holds them, and `get_listen_sockets` returns one
+            socket per address. An address to which a socket passed by
+            socket activation is bound uses that socket instead.
+
+            If ``None``, no sockets are bound.
+
+        `listen_backlog`
+            :Default: ``socket.SOMAXCONN``
+
+            Maximum number of pending connections queued on each listening
+            socket.
+
+        `reuse_port_copies`
+            :Default: ``None``
+
+            If ``None``, one socket is bound for each TCP address. If an
+            integer, that many sockets are bound for each TCP address, all
+            with the ``SO_REUSEPORT`` option, so that each of as many worker
+            processes can accept connections on its own socket and the
+            kernel balances new connections across them. Unix-domain
+            addresses always have a single socket, shared by all workers.
+
+        `cpu_affinity`
+            :Default: ``None``
+
+            Collection of CPU numbers on which the daemon process may run.
+            If ``None``, the CPU affinity is not changed.
+
+        `nice`
+            :Default: ``None``
+
+            Scheduling priority (“niceness”) to set for the process, from
+            −20 (most favourable) to 19 (least favourable). Lowering the
+            value requires appropriate OS privileges. If ``None``, the
+            niceness is not changed.
+
+        `ioprio`
+            :Default: ``None``
+
+            I/O scheduling class and priority to set for the process, as a
+            tuple ``(io_class, level)``. The `io_class` is one of
+            ``'realtime'``, ``'best-effort'``, or ``'idle'`` (or the
+            corresponding number); the `level` is from 0 (highest) to 7.
+            If ``None``, the I/O priority is not changed.
+
+        `sched_policy`
+            :Default: ``None``
+
+        `sched_priority`
+            :Default: ``0``
+
+            CPU scheduling policy and static priority to set for the
+            process. The `sched_policy` is one of ``'other'``, ``'batch'``,
+            ``'idle'``, ``'fifo'``, or ``'rr'`` (or the corresponding
+            number); the `sched_priority` must be 0 except for the real-time
+            policies ``'fifo'`` and ``'rr'``. If `sched_policy` is ``None``,
+            the scheduling policy is not changed.
+
+        `timer_slack`
+            :Default: ``None``
+
+            Timer slack, in nanoseconds, by which the kernel may delay the
+            process's timer expirations in order to coalesce wake-ups. If
+            ``None``, the timer slack is not changed.
+
+            Each of `cpu_affinity`, `nice`, `ioprio`, `sched_policy`, and
+            `timer_slack` is applied during `open`, before the process owner
+            is changed, and is inherited by any child process.
+
+        `preload`
+            :Default: ``None``
+
+            Callable to prepare the program's state before the process is
+            detached; for example, to import modules and build in-memory
+            tables that the daemon (and any worker processes it forks) will
+            only read thereafter. If not ``None``, it is called with no
+            arguments during `open`, after the process owner is changed and
+            before detaching the process context.
+
+            After `preload` returns, every object then tracked by the garbage
+            collector is frozen (via `gc.freeze`, where available), so later
+            garbage collections neither examine those objects nor dirty the
+            memory pages they occupy. Child processes forked from the daemon
+            can thus keep sharing those pages copy-on-write.
+
+        `preload_collect`
+            :Default: ``False``
+
+            If true, run a full garbage collection after `preload` returns
+            and before freezing, so that only live objects are frozen.
+
+        `notify_watchdog`
+            :Default: ``True``
+
+            If true, and the supervisor enabled its watchdog for this
+            process (by the ``WATCHDOG_USEC`` environment variable), start
+            a thread during `open` that notifies the watchdog at half its
+            timeout, until the context is closed. The `watchdog_pinger`
+            attribute is then the running `notify.WatchdogPinger`.
+
+            Whether or not this is set, if the process was started with the
+            ``NOTIFY_SOCKET`` environment variable, the notification socket
+            is connected before anything else in `open`, and preserved.
+            After `open`, the `notifier` attribute is the connected
+            `notify.Notifier` (which the functions of the `notify` module
+            also use), or ``None``.
+
+        `timing_callback`
+            :Default: ``None``
+
+            Callable to receive the time taken by each step of `open`. If
+            not ``None``, it is called after each step as
+            ``timing_callback(step_name, start, duration)``, where
+            `step_name` is a string naming the step, `start` is the time
+            (as returned by `time.time`) the step began, and `duration` is
+            the number of seconds it took.
+
+            The callback is called in the process performing the step;
+            steps after `detach` (including `detach` itself) are reported
+            from within the daemon process. Any file the callback writes
+            to must therefore be listed in `files_preserve`.
+
+            If ``None``, no timings are collected.
+
         """
 
     def __init__(
@@ -211,40 +415,73 @@ class DaemonContext(object):
         uid=None,
         gid=None,
         prevent_core=True,
+        resource_limits=None,
         detach_process=None,
+        ready_timeout=None,
         files_preserve=None,
         pidfile=None,
         stdin=None,
         stdout=None,
         stderr=None,
         signal_map=None,
+        listen_addresses=None,
+        listen_backlog=socket.SOMAXCONN,
+        reuse_port_copies=None,
+        cpu_affinity=None,
+        nice=None,
+        ioprio=None,
+        sched_policy=None,
+        sched_priority=0,
+        timer_slack=None,
+        preload=None,
+        preload_collect=False,
+        notify_watchdog=True,
+        timing_callback=None,
         ):
         """ Set up a new instance. """
         self.chroot_directory = chroot_directory
         self.working_directory = working_directory
         self.umask = umask
         self.prevent_core = prevent_core
+        self.resource_limits = resource_limits
         self.files_preserve = files_preserve
         self.pidfile = pidfile
         self.stdin = stdin
         self.stdout = stdout
         self.stderr = stderr
 
-        if uid is None:
-            uid = os.getuid()
         self.uid = uid
-        if gid is None:
-            gid = os.getgid()
         self.gid = gid
-
-        if detach_process is None:
-            detach_process = is_detach_process_context_required()
         self.detach_process = detach_process
+        self.ready_timeout = ready_timeout
+        self._start_status_fd = None
 
         if signal_map is None:
             signal_map = make_default_signal_map()
         self.signal_map = signal_map
 
+        self.listen_addresses = listen_addresses
+        self.listen_backlog = listen_backlog
+        self.reuse_port_copies = reuse_port_copies
+        self.listen_sockets = []
+        self.activated_sockets = {}
+
+        self.cpu_affinity = cpu_affinity
+        self.nice = nice
+        self.ioprio = ioprio
+        self.sched_policy = sched_policy
+        self.sched_priority = sched_priority
+        self.timer_slack = timer_slack
+
+        self.preload = preload
+        self.preload_collect = preload_collect
+
+        self.notify_watchdog = notify_watchdog
+        self.notifier = None
+        self.watchdog_pinger = None
+
+        self.timing_callback = timing_callback
+
         self._is_open = False
 
     @property
@@ -252,6 +489,42 @@ class DaemonContext(object):
         """ ``True`` if the instance is currently open. """
         return self._is_open
 
+    def _get_uid(self):
+        if self._uid is None:
+            self._uid = os.getuid()
+        return self._uid
+
+    def _set_uid(self, value):
+        self._uid = value
+
+    uid = property(
+        _get_uid, _set_uid,
+        doc=u"The UID to switch to; queried from the process if unset.")
+
+    def _get_gid(self):
+        if self._gid is None:
+            self._gid = os.getgid()
+        return self._gid
+
+    def _set_gid(self, value):
+        self._gid = value
+
+    gid = property(
+        _get_gid, _set_gid,
+        doc=u"The GID to switch to; queried from the process if unset.")
+
+    def _get_detach_process(self):
+        if self._detach_process is None:
+            self._detach_process = is_detach_process_context_required()
+        return self._detach_process
+
+    def _set_detach_process(self, value):
+        self._detach_process = value
+
+    detach_process = property(
+        _get_detach_process, _set_detach_process,
+        doc=u"Whether to detach; determined from the process if unset.")
+
     def open(self):
         """ Become a daemon process.
             :Return: ``None``
@@ -263,9 +536,16 @@ class DaemonContext(object):
               immediately. This makes it safe to call `open` multiple times on
               an instance.
 
+            * If the process was started with the ``NOTIFY_SOCKET``
+              environment variable, connect the notification socket, and
+              store the notifier in the `notifier` attribute.
+
             * If the `prevent_core` attribute is true, set the resource limits
               for the process to prevent any core dump from the process.
 
+            * If the `resource_limits` attribute is not ``None``, set the
+              resource limits it specifies.
+
             * If the `chroot_directory` attribute is not ``None``, set the
               effective root directory of the process to that directory (via
               `os.chroot`).
@@ -288,22 +568,57 @@ class DaemonContext(object):
             * Reset the file access creation mask to the value specified by
               the `umask` attribute.
 
+            * If the process was started by socket activation, make a socket
+              for each file descriptor passed to it, store them by name in the
+              `activated_sockets` attribute, and remove the socket activation
+              variables from the environment.
+
+            * If the `listen_addresses` attribute is not ``None``, bind a
+              listening socket (or, if `reuse_port_copies` is not ``None``,
+              several) to each address, and store them in the
+              `listen_sockets` attribute. This happens before the process
+              owner is changed. If this process replaces a previous daemon
+              process (see the ``reload`` action of `DaemonRunner`), the
+              listening sockets it inherited are used instead. Otherwise,
+              if the `pidfile` attribute is not ``None``, first wait until
+              its lock could be acquired (see
+              `wait_for_pidfile_available`), so that a daemon that could
+              not acquire it takes no address from the daemon holding it.
+
+            * Set the CPU affinity, niceness, I/O priority, scheduling
+              policy, and timer slack of the process, as specified by the
+              `cpu_affinity`, `nice`, `ioprio`, `sched_policy` (with
+              `sched_priority`), and `timer_slack` attributes, skipping each
+              that is ``None``.
+
+            * If the `preload` attribute is not ``None``, call it, then
+              freeze the objects tracked by the garbage collector (after a
+              full collection, if the `preload_collect` attribute is true).
+
             * If the `detach_process` option is true, detach the current
               process into its own process group, and disassociate from any
-              controlling terminal.
+              controlling terminal. The supervisor, if notified, is told the
+              new main process ID. If the `ready_timeout` attribute is not
+              ``None``, the original process waits for the daemon process to
+              report its start-up status (see `report_ready`).
 
             * Set signal handlers as specified by the `signal_map` attribute.
 
-            * If any of the attributes `stdin`, `stdout`, `stderr` are not
-              ``None``, bind the system streams `sys.stdin`, `sys.stdout`,
-              and/or `sys.stderr` to the files represented by the
-              corresponding attributes. Where the attribute has a file
-              descriptor, the descriptor is duplicated (instead of re-binding
-              the name).
+            * Bind the system streams `sys.stdin`, `sys.stdout`, and
+              `sys.stderr` to the files represented by the corresponding
+              attributes, or to the null device for those that are ``None``.
+              The file descriptor of each file is duplicated (instead of
+              re-binding the name). The null device, and any files named by
+              path, are opened only for this step and closed afterward.
 
             * If the `pidfile` attribute is not ``None``, enter its context
               manager.
 
+            * If the `notify_watchdog` attribute is true and the supervisor
+              enabled its watchdog for this process, start notifying the
+              watchdog, and store the pinger in the `watchdog_pinger`
+              attribute.
+
             * Mark this instance as open (for the purpose of future `open` and
               `close` calls).
 
@@ -313,35 +628,121 @@ class DaemonContext(object):
             When the function returns, the running program is a daemon
             process.
 
+            If the `timing_callback` attribute is not ``None``, each step is
+            timed and reported to it.
+
             """
         if self.is_open:
             return
 
+        perform_step = self._perform_step
+
+        self.notifier = perform_step(u'notify_socket', connect_notify_socket)
+        watchdog_interval = None
+        if self.notifier is not None and self.notify_watchdog:
+            # The watchdog names the process started by the supervisor.
+            watchdog_interval = notify.get_watchdog_interval()
+
         if self.chroot_directory is not None:
-            change_root_directory(self.chroot_directory)
+            perform_step(
+                u'chroot', change_root_directory, self.chroot_directory)
 
         if self.prevent_core:
-            prevent_core_dump()
-
-        change_file_creation_mask(self.umask)
-        change_working_directory(self.working_directory)
-        change_process_owner(self.uid, self.gid)
+            perform_step(u'prevent_core', prevent_core_dump)
+
+        close_files_maxfd = None
+        if self.resource_limits is not None:
+            # A raised limit on open files would make closing them slower.
+            close_files_maxfd = get_maximum_file_descriptors()
+            perform_step(
+                u'resource_limits', set_resource_limits,
+                self.resource_limits)
+
+        perform_step(u'umask', change_file_creation_mask, self.umask)
+        perform_step(
+            u'working_directory', change_working_directory,
+            self.working_directory)
+
+        activated_fds = pop_activated_fds()
+        if activated_fds is not None:
+            if self._detach_process is None:
+                # Detaching would leave the process the supervisor started.
+                self._detach_process = False
+            self.activated_sockets = perform_step(
+                u'activated_sockets', make_activated_sockets, activated_fds)
+
+        inherited_listen_fds = pop_inherited_listen_fds()
+        if self.listen_addresses is not None:
+            if inherited_listen_fds is not None:
+                self.listen_sockets = perform_step(
+                    u'listen_sockets', adopt_listen_sockets,
+                    inherited_listen_fds, self.listen_addresses)
+            else:
+                if self.pidfile is not None:
+                    # Stop before taking the addresses of a running
+                    # daemon that holds the lock.
+                    perform_step(
+                        u'pidfile_available', wait_for_pidfile_available,
+                        self.pidfile,
+                        getattr(self.pidfile, 'acquire_timeout', None))
+                self.listen_sockets = perform_step(
+                    u'listen_sockets', make_listen_sockets,
+                    self.listen_addresses, self.listen_backlog,
+                    self.reuse_port_copies, self.activated_sockets)
+
+        if self.cpu_affinity is not None:
+            perform_step(u'cpu_affinity', set_cpu_affinity, self.cpu_affinity)
+        if self.nice is not None:
+            perform_step(u'nice', set_process_niceness, self.nice)
+        if self.ioprio is not None:
+            perform_step(u'ioprio', set_io_priority, self.ioprio)
+        if self.sched_policy is not None:
+            perform_step(
+                u'scheduler', set_scheduler,
+                self.sched_policy, self.sched_priority)
+        if self.timer_slack is not None:
+            perform_step(u'timer_slack', set_timer_slack, self.timer_slack)
+
+        perform_step(
+            u'process_owner', change_process_owner, self.uid, self.gid)
+
+        if self.preload is not None:
+            perform_step(u'preload', self.preload)
+            perform_step(
+                u'freeze_heap', freeze_garbage_collector,
+                collect=self.preload_collect)
 
         if self.detach_process:
-            detach_process_context()
+            if self.ready_timeout is None:
+                perform_step(u'detach', detach_process_context)
+            else:
+                self._start_status_fd = perform_step(
+                    u'detach', detach_process_context,
+                    ready_timeout=self.ready_timeout)
+            if self.notifier is not None:
+                perform_step(
+                    u'notify_main_pid', self.notifier.main_pid, os.getpid())
 
         signal_handler_map = self._make_signal_handler_map()
-        set_signal_handlers(signal_handler_map)
+        perform_step(
+            u'signal_handlers', set_signal_handlers, signal_handler_map)
 
         exclude_fds = self._get_exclude_file_descriptors()
-        close_all_open_files(exclude=exclude_fds)
+        perform_step(
+            u'close_files', close_all_open_files,
+            exclude=exclude_fds, maxfd=close_files_maxfd)
 
-        redirect_stream(sys.stdin, self.stdin)
-        redirect_stream(sys.stdout, self.stdout)
-        redirect_stream(sys.stderr, self.stderr)
+        perform_step(
+            u'redirect_streams', redirect_standard_streams,
+            self.stdin, self.stdout, self.stderr)
 
         if self.pidfile is not None:
-            self.pidfile.__enter__()
+            perform_step(u'pidfile', self.pidfile.__enter__)
+
+        if watchdog_interval is not None:
+            self.watchdog_pinger = perform_step(
+                u'watchdog', start_watchdog_pinger,
+                self.notifier, watchdog_interval)
 
         self._is_open = True
 
@@ -365,6 +766,9 @@ class DaemonContext(object):
             * If the `pidfile` attribute is not ``None``, exit its context
               manager.
 
+            * If the `watchdog_pinger` attribute is not ``None``, stop
+              notifying the watchdog.
+
             * Mark this instance as closed (for the purpose of future `open`
               and `close` calls).
 
@@ -377,12 +781,47 @@ class DaemonContext(object):
             # <URL:http://docs.python.org/library/stdtypes.html#typecontextmanager>.
             self.pidfile.__exit__(None, None, None)
 
+        if self.watchdog_pinger is not None:
+            self.watchdog_pinger.stop()
+            self.watchdog_pinger = None
+
         self._is_open = False
 
     def __exit__(self, exc_type, exc_value, traceback):
         """ Context manager exit point. """
         self.close()
 
+    def report_ready(self):
+        """ Report to the original process that the daemon is ready.
+            :Return: ``None``
+
+            If the original process is waiting (see `ready_timeout`), it
+            exits with status ``0``. Only the first report has any
+            effect.
+
+            """
+        self._report_start_status(u"ready")
+
+    def report_failed(self, reason):
+        """ Report to the original process that the daemon failed.
+            :Return: ``None``
+
+            If the original process is waiting (see `ready_timeout`), it
+            writes `reason` to `sys.stderr` and exits with status
+            `START_FAILED_EXIT_STATUS`. Only the first report has any
+            effect.
+
+            """
+        self._report_start_status(u"failed: %(reason)s" % vars())
+
+    def _report_start_status(self, message):
+        """ Report the start-up status `message`, if not yet reported. """
+        fd = self._start_status_fd
+        if fd is None:
+            return
+        self._start_status_fd = None
+        report_start_status(fd, message)
+
     def terminate(self, signal_number, stack_frame):
         """ Signal handler for end-process signals.
             :Return: ``None``
@@ -398,12 +837,50 @@ class DaemonContext(object):
                 % vars())
         raise exception
 
+    def _perform_step(self, step_name, func, *args, **kwargs):
+        """ Perform one step of opening the daemon context.
+            :Return: The return value of the step.
+
+            Call `func` with the positional arguments `args` and keyword
+            arguments `kwargs`. If `timing_callback` is not ``None``,
+            report the start time and duration of the call to it, under
+            the name `step_name`.
+
+            """
+        timing_callback = self.timing_callback
+        if timing_callback is None:
+            result = func(*args, **kwargs)
+        else:
+            start = time.time()
+            result = func(*args, **kwargs)
+            duration = time.time() - start
+            timing_callback(step_name, start, duration)
+
+        return result
+
+    def get_listen_sockets(self, index=0):
+        """ Get the listening sockets for a worker process.
+            :Return: A list of one socket for each of `listen_addresses`.
+
+            For an address with several sockets (see the
+            `reuse_port_copies` option), the socket for worker `index`
+            is chosen; otherwise the single socket is shared by every
+            worker.
+
+            """
+        result = [
+            sockets[index % len(sockets)]
+            for sockets in self.listen_sockets]
+        return result
+
     def _get_exclude_file_descriptors(self):
         """ Return the set of file descriptors to exclude closing.
 
             Returns a set containing the file descriptors for the
-            items in `files_preserve`, and also each of `stdin`,
-            `stdout`, and `stderr`:
+            items in `files_preserve`, each socket in `listen_sockets`
+            and `activated_sockets`, the `notifier`, the pipe for
+            reporting start-up status, and also each of `stdin`, `stdout`,
+            and `stderr`:
 
             * If the item is ``None``, it is omitted from the return
               set.
@@ -417,9 +894,17 @@ class DaemonContext(object):
         files_preserve = self.files_preserve
         if files_preserve is None:
             files_preserve = []
+        for sockets in self.listen_sockets:
+            files_preserve.extend(sockets)
+        for sockets in self.activated_sockets.values():
+            files_preserve.extend(sockets)
+        if self.notifier is not None:
+            files_preserve.append(self.notifier)
+        if self._start_status_fd is not None:
+            files_preserve.append(self._start_status_fd)
         files_preserve.extend(
             item for item in [self.stdin, self.stdout, self.stderr]
-            if hasattr(item, 'fileno'))
+            if hasattr(item, 'fileno') or is_file_descriptor(item))
         exclude_descriptors = set()
         for item in files_preserve:
             if item is None:
@@ -548,190 +1033,1434 @@ def prevent_core_dump():
     resource.setrlimit(core_resource, core_limit)
 
 
-def detach_process_context():
-    """ Detach the process context from parent and session.
+def get_resource_number(name):
+    """ Get the `resource` module constant for a resource limit.
 
-        Detach from the parent process and session group, allowing the
-        parent to exit while this process continues running.
+        The `name` is either the constant itself, or a string such as
+        ``'RLIMIT_NOFILE'`` or ``'NOFILE'``.
 
-        Reference: “Advanced Programming in the Unix Environment”,
-        section 13.3, by W. Richard Stevens, published 1993 by
-        Addison-Wesley.
-    
         """
+    if isinstance(name, basestring):
+        attribute_name = name.upper()
+        if not attribute_name.startswith('RLIMIT_'):
+            attribute_name = 'RLIMIT_' + attribute_name
+        result = getattr(resource, attribute_name, None)
+        if result is None:
+            error = DaemonOSEnvironmentError(
+                u"System does not support %(attribute_name)s resource limit"
+                % vars())
+            raise error
+    else:
+        result = name
+    return result
 
-    def fork_then_exit_parent(error_message):
-        """ Fork a child process, then exit the parent process.
-
-            If the fork fails, raise a ``DaemonProcessDetachError``
-            with ``error_message``.
 
-            """
-        try:
-            pid = os.fork()
-            if pid > 0:
-                os._exit(0)
-        except OSError, exc:
-            exc_errno = exc.errno
-            exc_strerror = exc.strerror
-            error = DaemonProcessDetachError(
-                u"%(error_message)s: [%(exc_errno)d] %(exc_strerror)s" % vars())
-            raise error
+def is_limit_within(limit, maximum):
+    """ Determine whether a resource limit is no more than a maximum. """
+    infinity = resource.RLIM_INFINITY
+    if maximum == infinity:
+        result = True
+    elif limit == infinity:
+        result = False
+    else:
+        result = (limit <= maximum)
+    return result
 
-    fork_then_exit_parent(error_message=u"Failed first fork")
-    os.setsid()
-    fork_then_exit_parent(error_message=u"Failed second fork")
 
-
-def is_process_started_by_init():
-    """ Determine if the current process is started by `init`.
+CAP_SYS_RESOURCE = 24
+proc_status_path = u"/proc/self/status"
 
-        The `init` process has the process ID of 1; if that is our
-        parent process ID, return ``True``, otherwise ``False``.
-    
-        """
-    result = False
+def has_resource_capability():
+    """ Determine whether this process may raise its hard limits.
 
-    init_pid = 1
-    if os.getppid() == init_pid:
-        result = True
+        Raising a hard resource limit needs the ``CAP_SYS_RESOURCE``
+        capability, read from the effective capability set in
+        `proc_status_path`. Where that is unavailable, the process is
+        taken to have the capability only if its effective UID is 0.
 
+        """
+    result = (os.geteuid() == 0)
+    try:
+        status_file = open(proc_status_path, 'r')
+    except EnvironmentError:
+        return result
+    try:
+        for line in status_file:
+            (field_name, sep, value) = line.partition(u":")
+            if field_name == u"CapEff":
+                capabilities = int(value.strip(), 16)
+                result = bool(capabilities & (1 << CAP_SYS_RESOURCE))
+                break
+    finally:
+        status_file.close()
     return result
 
 
-def is_socket(fd):
-    """ Determine if the file descriptor is a socket.
+def make_resource_limit(name, limit):
+    """ Make the new (soft, hard) limits for a resource.
+        :Return: A tuple (`resource_number`, (`soft`, `hard`)).
 
-        Return ``False`` if querying the socket type of `fd` raises an
-        error; otherwise return ``True``.
+        The `limit` is an integer soft limit, a tuple ``(soft,
+        hard)``, or ``'hard'`` for the current hard limit. Raises
+        ``DaemonOSEnvironmentError`` if the soft limit would exceed
+        the hard limit, or if the hard limit would be raised by a
+        process without the capability to do so.
 
         """
-    result = False
-
-    file_socket = socket.fromfd(fd, socket.AF_INET, socket.SOCK_RAW)
-
+    resource_number = get_resource_number(name)
     try:
-        socket_type = file_socket.getsockopt(
-            socket.SOL_SOCKET, socket.SO_TYPE)
-    except socket.error, exc:
-        exc_errno = exc.args[0]
-        if exc_errno == errno.ENOTSOCK:
-            # Socket operation on non-socket
-            pass
-        else:
-            # Some other socket error
-            result = True
+        (soft_prev, hard_prev) = resource.getrlimit(resource_number)
+    except (ValueError, resource.error), exc:
+        error = DaemonOSEnvironmentError(
+            u"System does not support resource limit %(name)r (%(exc)s)"
+            % vars())
+        raise error
+
+    if limit == u'hard':
+        (soft, hard) = (hard_prev, hard_prev)
+    elif isinstance(limit, tuple):
+        (soft, hard) = limit
     else:
-        # No error getting socket type
-        result = True
+        (soft, hard) = (limit, hard_prev)
+
+    if not is_limit_within(soft, hard):
+        error = DaemonOSEnvironmentError(
+            u"Soft limit %(soft)r exceeds hard limit %(hard)r"
+            u" for resource %(name)r" % vars())
+        raise error
+
+    if not is_limit_within(hard, hard_prev):
+        if not has_resource_capability():
+            error = DaemonOSEnvironmentError(
+                u"Hard limit %(hard)r exceeds current hard limit"
+                u" %(hard_prev)r for resource %(name)r" % vars())
+            raise error
 
+    result = (resource_number, (soft, hard))
     return result
 
 
-def is_process_started_by_superserver():
-    """ Determine if the current process is started by the superserver.
+def set_resource_limits(limits):
+    """ Set the resource limits of this process.
+
+        The `limits` argument is a mapping from resource name to
+        limit; see `make_resource_limit`. Every limit is validated
+        before any is set.
 
-        The internet superserver creates a network socket, and
-        attaches it to the standard streams of the child process. If
-        that is the case for this process, return ``True``, otherwise
-        ``False``.
-    
         """
-    result = False
+    new_limits = [
+        (name, make_resource_limit(name, limit))
+        for (name, limit) in limits.items()]
 
-    stdin_fd = sys.__stdin__.fileno()
-    if is_socket(stdin_fd):
-        result = True
+    for (name, (resource_number, new_limit)) in new_limits:
+        try:
+            resource.setrlimit(resource_number, new_limit)
+        except (ValueError, resource.error), exc:
+            hard_prev = resource.getrlimit(resource_number)[1]
+            error = DaemonOSEnvironmentError(
+                u"Unable to set resource limit %(name)r to %(new_limit)r,"
+                u" with hard limit %(hard_prev)r (%(exc)s)" % vars())
+            raise error
 
-    return result
 
+_libc = NotImplemented
 
-def is_detach_process_context_required():
-    """ Determine whether detaching process context is required.
+def get_libc():
+    """ Return the C library, loaded via `ctypes`, or ``None``.
 
-        Return ``True`` if the process environment indicates the
-        process is already detached:
+        The result is determined once per process and then cached.
+
+        """
+    global _libc
+    if _libc is NotImplemented:
+        try:
+            _libc = ctypes.CDLL(None, use_errno=True)
+        except OSError:
+            _libc = None
+
+    return _libc
 
-        * Process was started by `init`; or
 
-        * Process was started by `inetd`.
+def call_libc_function(name, *args):
+    """ Call the named C library function with the specified arguments.
+        :Return: The return value of the function.
+
+        Raises ``OSError`` if the C library lacks the function, or if
+        the function returns −1, with the error number it set.
 
         """
-    result = True
-    if is_process_started_by_init() or is_process_started_by_superserver():
-        result = False
+    libc = get_libc()
+    func = getattr(libc, name, None)
+    if func is None:
+        raise OSError(
+            errno.ENOSYS, u"C library function %(name)s not available"
+            % vars())
+
+    result = func(*args)
+    if result == -1:
+        error_number = ctypes.get_errno()
+        raise OSError(error_number, os.strerror(error_number))
 
     return result
 
-
-def close_file_descriptor_if_open(fd):
-    """ Close a file descriptor if already open.
 
-        Close the file descriptor `fd`, suppressing an error in the
-        case the file was not open.
+CPU_SET_MIN_SIZE = 1024
 
-        """
+def make_cpu_set(cpus):
+    """ Make a C `cpu_set_t` mask containing the specified CPUs. """
+    bits_per_word = 8 * ctypes.sizeof(ctypes.c_ulong)
+    size = max([CPU_SET_MIN_SIZE] + [cpu + 1 for cpu in cpus])
+    word_count = (size + bits_per_word - 1) // bits_per_word
+    cpu_set = (ctypes.c_ulong * word_count)()
+    for cpu in cpus:
+        cpu_set[cpu // bits_per_word] |= 1 << (cpu % bits_per_word)
+    return cpu_set
+
+
+def get_cpu_affinity():
+    """ Get the set of CPUs on which this process may run. """
+    sched_getaffinity = getattr(os, 'sched_getaffinity', None)
+    if sched_getaffinity is not None:
+        result = set(sched_getaffinity(0))
+    else:
+        cpu_set = make_cpu_set([])
+        call_libc_function(
+            'sched_getaffinity', 0,
+            ctypes.c_size_t(ctypes.sizeof(cpu_set)), cpu_set)
+        bits_per_word = 8 * ctypes.sizeof(ctypes.c_ulong)
+        result = set(
+            index * bits_per_word + bit
+            for (index, word) in enumerate(cpu_set)
+            for bit in range(bits_per_word)
+            if word & (1 << bit))
+    return result
+
+
+def set_cpu_affinity(cpus):
+    """ Restrict this process to run on the specified CPUs. """
+    cpus = set(cpus)
     try:
-        os.close(fd)
-    except OSError, exc:
-        if exc.errno == errno.EBADF:
-            # File descriptor was not open
-            pass
+        sched_setaffinity = getattr(os, 'sched_setaffinity', None)
+        if sched_setaffinity is not None:
+            sched_setaffinity(0, cpus)
         else:
-            error = DaemonOSEnvironmentError(
-                u"Failed to close file descriptor %(fd)d"
-                u" (%(exc)s)"
-                % vars())
-            raise error
+            cpu_set = make_cpu_set(cpus)
+            call_libc_function(
+                'sched_setaffinity', 0,
+                ctypes.c_size_t(ctypes.sizeof(cpu_set)), cpu_set)
+    except (OSError, ValueError, TypeError), exc:
+        error = DaemonOSEnvironmentError(
+            u"Unable to set CPU affinity to %(cpus)r (%(exc)s)" % vars())
+        raise error
 
 
-MAXFD = 2048
+SIG_BLOCK = 0
+SIG_UNBLOCK = 1
+SIG_SETMASK = 2
+SIGSET_SIZE = 1024
 
-def get_maximum_file_descriptors():
-    """ Return the maximum number of open file descriptors for this process.
+def make_signal_set(signals=None):
+    """ Make a C `sigset_t` containing the specified signals.
 
-        Return the process hard resource limit of maximum number of
-        open file descriptors. If the limit is “infinity”, a default
-        value of ``MAXFD`` is returned.
+        If `signals` is ``None``, the set contains every signal.
 
         """
-    limits = resource.getrlimit(resource.RLIMIT_NOFILE)
-    result = limits[1]
-    if result == resource.RLIM_INFINITY:
-        result = MAXFD
-    return result
+    bits_per_word = 8 * ctypes.sizeof(ctypes.c_ulong)
+    signal_set = (ctypes.c_ulong * (SIGSET_SIZE // bits_per_word))()
+    if signals is None:
+        call_libc_function('sigfillset', signal_set)
+    else:
+        call_libc_function('sigemptyset', signal_set)
+        for signal_number in signals:
+            call_libc_function('sigaddset', signal_set, signal_number)
+    return signal_set
 
 
-def close_all_open_files(exclude=set()):
-    """ Close all open file descriptors.
+def set_thread_signal_mask(how, signals=None):
+    """ Change the set of signals blocked in the calling thread.
 
-        Closes every file descriptor (if open) of this process. If
-        specified, `exclude` is a set of file descriptors to *not*
-        close.
+        `how` is one of `SIG_BLOCK`, `SIG_UNBLOCK`, or `SIG_SETMASK`,
+        applied to the set of `signals` (see `make_signal_set`).
 
         """
-    maxfd = get_maximum_file_descriptors()
-    for fd in reversed(range(maxfd)):
-        if fd not in exclude:
-            close_file_descriptor_if_open(fd)
+    error_number = call_libc_function(
+        'pthread_sigmask', how, make_signal_set(signals), None)
+    if error_number != 0:
+        raise OSError(error_number, os.strerror(error_number))
 
-
-def redirect_stream(system_stream, target_stream):
-    """ Redirect a system stream to a specified file.
 
-        `system_stream` is a standard system stream such as
-        ``sys.stdout``. `target_stream` is an open file object that
-        should replace the corresponding system stream object.
+def wait_for_signal(signals):
+    """ Wait for one of the specified signals to be pending.
+        :Return: The number of the signal, which is then no longer
+            pending.
 
-        If `target_stream` is ``None``, defaults to opening the
-        operating system's null device and using its file descriptor.
+        The `signals` must be blocked in every thread; otherwise the
+        signal is delivered to its handler instead.
 
         """
-    if target_stream is None:
-        target_fd = os.open(os.devnull, os.O_RDWR)
-    else:
-        target_fd = target_stream.fileno()
-    os.dup2(target_fd, system_stream.fileno())
+    signal_number = ctypes.c_int()
+    error_number = call_libc_function(
+        'sigwait', make_signal_set(signals), ctypes.byref(signal_number))
+    if error_number != 0:
+        raise OSError(error_number, os.strerror(error_number))
+    result = signal_number.value
+    return result
+
+
+PRIO_PROCESS = 0
+
+def set_process_niceness(nice):
+    """ Set the scheduling priority (“niceness”) of this process. """
+    try:
+        setpriority = getattr(os, 'setpriority', None)
+        if setpriority is not None:
+            setpriority(os.PRIO_PROCESS, 0, nice)
+        else:
+            call_libc_function('setpriority', PRIO_PROCESS, 0, nice)
+    except OSError, exc:
+        error = DaemonOSEnvironmentError(
+            u"Unable to set niceness to %(nice)r (%(exc)s)" % vars())
+        raise error
+
+
+IOPRIO_CLASSES = {
+    u'realtime': 1,
+    u'best-effort': 2,
+    u'idle': 3,
+    }
+IOPRIO_CLASS_SHIFT = 13
+IOPRIO_WHO_PROCESS = 1
+
+ioprio_set_syscall_numbers = {
+    'x86_64': 251,
+    'i386': 289,
+    'i686': 289,
+    'aarch64': 30,
+    'armv7l': 314,
+    'ppc64le': 273,
+    's390x': 282,
+    }
+
+def set_io_priority(ioprio):
+    """ Set the I/O scheduling class and priority of this process.
+
+        The `ioprio` argument is a tuple ``(io_class, level)``, where
+        `io_class` is a name from `IOPRIO_CLASSES` or the class number.
+        The ``ioprio_set`` system call is used, which is specific to
+        Linux.
+
+        """
+    (io_class, level) = ioprio
+    io_class = IOPRIO_CLASSES.get(io_class, io_class)
+    machine = platform.machine()
+    syscall_number = ioprio_set_syscall_numbers.get(machine)
+    try:
+        if syscall_number is None:
+            raise OSError(
+                errno.ENOSYS, u"ioprio_set not known on %(machine)s"
+                % vars())
+        value = (io_class << IOPRIO_CLASS_SHIFT) | level
+        call_libc_function(
+            'syscall', syscall_number, IOPRIO_WHO_PROCESS, 0, value)
+    except (OSError, TypeError), exc:
+        error = DaemonOSEnvironmentError(
+            u"Unable to set I/O priority to %(ioprio)r (%(exc)s)" % vars())
+        raise error
+
+
+SCHED_POLICIES = {
+    u'other': 0,
+    u'fifo': 1,
+    u'rr': 2,
+    u'batch': 3,
+    u'idle': 5,
+    }
+
+def set_scheduler(policy, priority=0):
+    """ Set the CPU scheduling policy and priority of this process.
+
+        The `policy` is a name from `SCHED_POLICIES` or the policy
+        number.
+
+        """
+    policy_number = SCHED_POLICIES.get(policy, policy)
+    try:
+        sched_setscheduler = getattr(os, 'sched_setscheduler', None)
+        if sched_setscheduler is not None:
+            sched_setscheduler(0, policy_number, os.sched_param(priority))
+        else:
+            sched_param = ctypes.c_int(priority)
+            call_libc_function(
+                'sched_setscheduler', 0, policy_number,
+                ctypes.byref(sched_param))
+    except (OSError, TypeError), exc:
+        error = DaemonOSEnvironmentError(
+            u"Unable to set scheduling policy %(policy)r"
+            u" with priority %(priority)r (%(exc)s)" % vars())
+        raise error
+
+
+PR_SET_TIMERSLACK = 29
+
+def set_timer_slack(nanoseconds):
+    """ Set the timer slack of this process, in nanoseconds. """
+    try:
+        call_libc_function(
+            'prctl', PR_SET_TIMERSLACK, ctypes.c_ulong(nanoseconds),
+            ctypes.c_ulong(0), ctypes.c_ulong(0), ctypes.c_ulong(0))
+    except (OSError, TypeError), exc:
+        error = DaemonOSEnvironmentError(
+            u"Unable to set timer slack to %(nanoseconds)r (%(exc)s)"
+            % vars())
+        raise error
+
+
+pidfile_wait_poll_max_delay = 0.1
+
+def wait_for_pidfile_available(pidfile, timeout=None):
+    """ Wait until the PID file lock could be acquired.
+
+        The `pidfile` is available if it is not locked or, for a pool
+        of PID files (with a `locks` attribute), if any of its locks
+        is not; the lock is not acquired. If `timeout` is ``None``,
+        wait until it is available; if it is greater than zero, wait
+        up to that many seconds, then raise ``lockfile.LockTimeout``;
+        otherwise, raise ``lockfile.AlreadyLocked`` at once if it is
+        not available.
+
+        """
+    locks = getattr(pidfile, 'locks', [pidfile])
+    deadline = None
+    if timeout is not None and timeout > 0:
+        deadline = time.time() + timeout
+    delay = 0.001
+    while True:
+        for lock in locks:
+            if not lock.is_locked():
+                return
+        pidfile_path = pidfile.path
+        if deadline is None:
+            if timeout is not None:
+                raise lockfile.AlreadyLocked(
+                    u"PID file %(pidfile_path)r already locked" % vars())
+        elif time.time() >= deadline:
+            raise lockfile.LockTimeout(
+                u"Timeout waiting for PID file %(pidfile_path)r"
+                % vars())
+        time.sleep(delay)
+        delay = min(delay * 2, pidfile_wait_poll_max_delay)
+
+
+def get_reuse_port_option():
+    """ Get the socket option number of ``SO_REUSEPORT``.
+        :Return: The option number, or ``None`` if unknown.
+
+        Older versions of the `socket` module lack the constant,
+        though the running system supports the option.
+
+        """
+    result = getattr(socket, 'SO_REUSEPORT', None)
+    if result is None and sys.platform.startswith('linux'):
+        result = 15
+    return result
+
+
+def get_socket_domain_option():
+    """ Get the socket option number of ``SO_DOMAIN``.
+        :Return: The option number, or ``None`` if unknown.
+
+        Older versions of the `socket` module lack the constant,
+        though the running system supports the option.
+
+        """
+    result = getattr(socket, 'SO_DOMAIN', None)
+    if result is None and sys.platform.startswith('linux'):
+        result = 39
+    return result
+
+
+def is_socket_file(path):
+    """ Determine if the filesystem path names a socket file.
+
+        Return ``True`` if the file type reported by `os.stat` for
+        `path` is a socket; otherwise (including when no file exists
+        at `path`) return ``False``.
+
+        """
+    result = False
+
+    try:
+        file_stat = os.stat(path)
+    except OSError:
+        file_stat = None
+
+    if file_stat is not None and stat.S_ISSOCK(file_stat.st_mode):
+        result = True
+
+    return result
+
+
+def is_socket_listening(path):
+    """ Determine if a process is listening on the socket file `path`.
+
+        Return ``False`` only if a connection to `path` is refused or
+        there is no such file; any other outcome is taken to mean the
+        socket belongs to a running process.
+
+        """
+    result = True
+
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(path)
+    except socket.error, exc:
+        if exc.errno in [errno.ECONNREFUSED, errno.ENOENT]:
+            result = False
+    finally:
+        sock.close()
+
+    return result
+
+
+def make_listen_socket(address, backlog, reuse_port=False):
+    """ Make a socket listening on the specified address.
+        :Return: The new socket object.
+
+        If `address` is a string, it is the filesystem path of a
+        Unix-domain socket; a socket file already at that path is
+        removed if no process is listening on it (see
+        `is_socket_listening`), and is otherwise an error. Otherwise
+        `address` is a tuple ``(host, port)`` for a TCP socket, with
+        the ``SO_REUSEADDR`` option set, and ``SO_REUSEPORT`` also if
+        `reuse_port` is true.
+
+        """
+    sock = None
+    try:
+        if isinstance(address, basestring):
+            if is_socket_file(address):
+                if is_socket_listening(address):
+                    raise socket.error(
+                        errno.EADDRINUSE, u"Socket in use by a process")
+                os.remove(address)
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            sock.bind(address)
+        else:
+            (host, port) = address
+            (family, socktype, proto, canonname, sockaddr) = (
+                socket.getaddrinfo(
+                    host or None, port, socket.AF_UNSPEC,
+                    socket.SOCK_STREAM, 0, socket.AI_PASSIVE)[0])
+            sock = socket.socket(family, socktype, proto)
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            if reuse_port:
+                reuse_port_option = get_reuse_port_option()
+                if reuse_port_option is None:
+                    raise socket.error(
+                        errno.ENOPROTOOPT, u"SO_REUSEPORT not supported")
+                sock.setsockopt(socket.SOL_SOCKET, reuse_port_option, 1)
+            sock.bind(sockaddr)
+        sock.listen(backlog)
+    except (socket.error, OSError), exc:
+        if sock is not None:
+            sock.close()
+        error = DaemonOSEnvironmentError(
+            u"Unable to listen on %(address)r (%(exc)s)" % vars())
+        raise error
+
+    return sock
+
+
+def make_listen_sockets(
+        addresses, backlog, reuse_port_copies=None,
+        activated_sockets=None):
+    """ Make the listening sockets for the specified addresses.
+        :Return: A list, for each address, of a list of its sockets.
+
+        Each Unix-domain address has one socket. Each TCP address
+        has one socket if `reuse_port_copies` is ``None``, otherwise
+        that many sockets with the ``SO_REUSEPORT`` option set.
+
+        If any of `activated_sockets` (a mapping of names to lists of
+        sockets, as passed by socket activation) is bound to an
+        address, that socket is the only one for the address.
+
+        """
+    result = []
+    sockets_found = []
+    try:
+        for address in addresses:
+            sockets = []
+            result.append(sockets)
+            activated_socket = find_activated_socket(
+                address, activated_sockets)
+            if activated_socket is not None:
+                sockets.append(activated_socket)
+                sockets_found.append(activated_socket)
+            elif (reuse_port_copies is None
+                    or isinstance(address, basestring)):
+                sockets.append(make_listen_socket(address, backlog))
+            else:
+                for i in range(reuse_port_copies):
+                    sock = make_listen_socket(
+                        address, backlog, reuse_port=True)
+                    sockets.append(sock)
+                    # Bind any further copies to the port chosen for
+                    # the first, in case the address specified port 0.
+                    address = (address[0], sock.getsockname()[1])
+    except DaemonOSEnvironmentError:
+        for sockets in result:
+            for sock in sockets:
+                if sock not in sockets_found:
+                    sock.close()
+        raise
+
+    return result
+
+
+INHERITED_LISTEN_FDS_ENV = "PYTHON_DAEMON_LISTEN_FDS"
+
+
+def format_listen_fds(listen_sockets):
+    """ Format the file descriptors of listening sockets as text.
+        :Return: The text, as for the ``PYTHON_DAEMON_LISTEN_FDS``
+            environment variable.
+
+        `listen_sockets` is a list, for each address, of a list of its
+        sockets. The file descriptors of the sockets for an address
+        are separated by commas, and the addresses by semicolons.
+
+        """
+    result = u";".join(
+        u",".join(unicode(sock.fileno()) for sock in sockets)
+        for sockets in listen_sockets)
+    return result
+
+
+def parse_listen_fds(text):
+    """ Parse the text of inherited listening file descriptors.
+        :Return: A list, for each address, of a list of its file
+            descriptors.
+
+        This is the inverse of `format_listen_fds`.
+
+        """
+    try:
+        result = [
+            [int(fd) for fd in item.split(u",")]
+            for item in text.split(u";")]
+    except ValueError:
+        error = DaemonOSEnvironmentError(
+            u"Invalid inherited listening sockets: %(text)r" % vars())
+        raise error
+    return result
+
+
+def pop_inherited_listen_fds():
+    """ Remove the inherited listening file descriptors from the
+        environment.
+        :Return: A list, for each address, of a list of its file
+            descriptors; or ``None`` if none were inherited.
+
+        A process that replaces a previous daemon process inherits
+        its listening sockets, named by the ``PYTHON_DAEMON_LISTEN_FDS``
+        environment variable. The variable is removed, so that it is
+        not inherited further.
+
+        """
+    result = None
+    text = os.environ.pop(INHERITED_LISTEN_FDS_ENV, None)
+    if text is not None:
+        result = parse_listen_fds(text)
+    return result
+
+
+def make_socket_from_fd(fd):
+    """ Make a socket object for an inherited socket file descriptor.
+        :Return: The new socket object.
+
+        The socket object is made with the address family and type of
+        the socket itself, and the file descriptor `fd` is closed.
+
+        """
+    try:
+        probe = socket.fromfd(fd, socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            domain_option = get_socket_domain_option()
+            if domain_option is None:
+                raise socket.error(
+                    errno.ENOPROTOOPT, u"SO_DOMAIN not supported")
+            family = probe.getsockopt(socket.SOL_SOCKET, domain_option)
+            socktype = probe.getsockopt(socket.SOL_SOCKET, socket.SO_TYPE)
+        finally:
+            probe.close()
+        result = socket.fromfd(fd, family, socktype)
+        os.close(fd)
+    except (socket.error, OSError), exc:
+        error = DaemonOSEnvironmentError(
+            u"Unable to use inherited socket %(fd)d (%(exc)s)" % vars())
+        raise error
+
+    return result
+
+
+def adopt_listen_sockets(listen_fds, addresses):
+    """ Make listening sockets from inherited file descriptors.
+        :Return: A list, for each address, of a list of its sockets.
+
+        `listen_fds` is a list, for each of `addresses`, of a list of
+        the file descriptors of its listening sockets.
+
+        """
+    fds_count = len(listen_fds)
+    addresses_count = len(addresses)
+    if fds_count != addresses_count:
+        error = DaemonOSEnvironmentError(
+            u"Inherited sockets for %(fds_count)d addresses,"
+            u" expected %(addresses_count)d" % vars())
+        raise error
+
+    result = [
+        [make_socket_from_fd(fd) for fd in fds]
+        for fds in listen_fds]
+    return result
+
+
+SD_LISTEN_FDS_START = 3
+
+
+def is_process_started_by_socket_activation():
+    """ Determine if the current process is started by socket activation.
+
+        A supervisor that activates sockets passes them to the process
+        it starts as file descriptors, and names that process by the
+        ``LISTEN_PID`` environment variable. If that is the case for
+        this process, return ``True``, otherwise ``False``.
+
+        """
+    result = False
+
+    pid = os.getpid()
+    if (os.environ.get('LISTEN_PID') == str(pid)
+            and 'LISTEN_FDS' in os.environ):
+        result = True
+
+    return result
+
+
+def pop_activated_fds():
+    """ Remove the socket activation variables from the environment.
+        :Return: A list of (`name`, `fd`) pairs for the file
+            descriptors passed to this process; or ``None`` if it was
+            not started by socket activation.
+
+        The ``LISTEN_FDS`` variable is the number of file descriptors
+        passed, starting at file descriptor 3, and ``LISTEN_FDNAMES``
+        their names, separated by colons. The variables are removed
+        whether or not ``LISTEN_PID`` names this process, so that they
+        are not inherited further.
+
+        """
+    result = None
+    activated = is_process_started_by_socket_activation()
+    listen_fds = os.environ.pop('LISTEN_FDS', None)
+    listen_fdnames = os.environ.pop('LISTEN_FDNAMES', None)
+    os.environ.pop('LISTEN_PID', None)
+
+    if activated:
+        try:
+            count = int(listen_fds)
+        except ValueError:
+            error = DaemonOSEnvironmentError(
+                u"Invalid LISTEN_FDS: %(listen_fds)r" % vars())
+            raise error
+        names = []
+        if listen_fdnames:
+            names = listen_fdnames.split(":")
+        names.extend([u"unknown"] * (count - len(names)))
+        result = [
+            (unicode(names[i]), SD_LISTEN_FDS_START + i)
+            for i in range(count)]
+
+    return result
+
+
+def make_activated_sockets(activated_fds):
+    """ Make sockets from the file descriptors passed by activation.
+        :Return: A mapping from each name to a list of its sockets.
+
+        `activated_fds` is a list of (`name`, `fd`) pairs. Each file
+        descriptor that is a socket is made into a socket object;
+        any other file descriptor (such as a FIFO) remains as it is.
+
+        """
+    result = {}
+    for (name, fd) in activated_fds:
+        item = fd
+        if is_socket(fd):
+            item = make_socket_from_fd(fd)
+        result.setdefault(name, []).append(item)
+    return result
+
+
+def is_socket_bound_to(sock, address):
+    """ Determine if a listening socket is bound to an address.
+
+        A Unix-domain `address` matches a socket bound to the same
+        path. A TCP `address` ``(host, port)`` matches a TCP socket
+        bound to the same port and, unless `host` is empty, the same
+        host address.
+
+        """
+    result = False
+    try:
+        sockname = sock.getsockname()
+    except socket.error:
+        sockname = None
+
+    if sockname is not None and sock.type == socket.SOCK_STREAM:
+        if isinstance(address, basestring):
+            result = (sock.family == socket.AF_UNIX and sockname == address)
+        elif sock.family in [socket.AF_INET, socket.AF_INET6]:
+            (host, port) = address
+            result = (
+                sockname[1] == port and (not host or sockname[0] == host))
+
+    return result
+
+
+def find_activated_socket(address, activated_sockets):
+    """ Find the activated socket bound to an address.
+        :Return: The socket, or ``None`` if none is bound to `address`.
+        """
+    result = None
+    if activated_sockets:
+        for name in sorted(activated_sockets):
+            for sock in activated_sockets[name]:
+                if (hasattr(sock, 'getsockname')
+                        and is_socket_bound_to(sock, address)):
+                    result = sock
+                    break
+            if result is not None:
+                break
+    return result
+
+
+def connect_notify_socket():
+    """ Connect the socket for notifying the service supervisor.
+        :Return: The connected `notify.Notifier`, or ``None`` if the
+            process was not started with ``NOTIFY_SOCKET``.
+        """
+    result = None
+    notifier = notify.get_default_notifier()
+    if notifier.enabled:
+        try:
+            notifier.connect()
+        except notify.NotifyError, exc:
+            error = DaemonOSEnvironmentError(
+                u"Unable to connect to supervisor (%(exc)s)" % vars())
+            raise error
+        result = notifier
+    return result
+
+
+def start_watchdog_pinger(notifier, interval):
+    """ Start notifying the supervisor's watchdog every `interval` seconds.
+        :Return: The running `notify.WatchdogPinger`.
+        """
+    result = notify.WatchdogPinger(notifier, interval)
+    result.start()
+    return result
+
+
+def freeze_garbage_collector(collect=False):
+    """ Freeze the objects currently tracked by the garbage collector.
+
+        Move every object tracked by the garbage collector into the
+        permanent generation (via `gc.freeze`), which later
+        collections ignore. If `collect` is true, first run a full
+        collection so that garbage is not frozen along with live
+        objects.
+
+        Where `gc.freeze` is not available, only the optional
+        collection is performed.
+
+        """
+    if collect:
+        gc.collect()
+
+    freeze = getattr(gc, 'freeze', None)
+    if freeze is not None:
+        freeze()
+
+
+def detach_process_context(ready_timeout=None):
+    """ Detach the process context from parent and session.
+        :Return: The file descriptor on which to report the start-up
+            status, or ``None``.
+
+        Detach from the parent process and session group, allowing the
+        parent to exit while this process continues running.
+
+        If `ready_timeout` is not ``None``, keep a pipe from the
+        detached process to the original process, which waits up to
+        `ready_timeout` seconds for a start-up status reported on it
+        (see `report_start_status`), then exits with a status to match
+        (see `wait_for_start_status`).
+
+        Reference: “Advanced Programming in the Unix Environment”,
+        section 13.3, by W. Richard Stevens, published 1993 by
+        Addison-Wesley.
+    
+        """
+    status_fds = None
+    if ready_timeout is not None:
+        status_fds = make_start_status_pipe()
+
+    def fork_then_exit_parent(error_message, wait_for_status=False):
+        """ Fork a child process, then exit the parent process.
+
+            If `wait_for_status` is true, the parent process first waits
+            for the start-up status, and exits with a matching status.
+
+            If the fork fails, raise a ``DaemonProcessDetachError``
+            with ``error_message``.
+
+            """
+        try:
+            pid = os.fork()
+            if pid > 0:
+                exit_status = 0
+                if wait_for_status:
+                    os.close(status_fds[1])
+                    exit_status = wait_for_start_status(
+                        status_fds[0], ready_timeout)
+                os._exit(exit_status)
+        except OSError, exc:
+            exc_errno = exc.errno
+            exc_strerror = exc.strerror
+            error = DaemonProcessDetachError(
+                u"%(error_message)s: [%(exc_errno)d] %(exc_strerror)s" % vars())
+            raise error
+
+    fork_then_exit_parent(
+        error_message=u"Failed first fork",
+        wait_for_status=(status_fds is not None))
+    result = None
+    if status_fds is not None:
+        os.close(status_fds[0])
+        result = status_fds[1]
+    os.setsid()
+    fork_then_exit_parent(error_message=u"Failed second fork")
+
+    return result
+
+
+START_FAILED_EXIT_STATUS = 1
+START_TIMEOUT_EXIT_STATUS = 2
+
+
+def make_start_status_pipe():
+    """ Make a pipe for reporting the start-up status of the daemon.
+        :Return: A tuple (`read_fd`, `write_fd`).
+
+        Neither end is inherited by a program the daemon executes.
+
+        """
+    result = os.pipe()
+    for fd in result:
+        flags = fcntl.fcntl(fd, fcntl.F_GETFD)
+        fcntl.fcntl(fd, fcntl.F_SETFD, flags | fcntl.FD_CLOEXEC)
+    return result
+
+
+def report_start_status(fd, message):
+    """ Report the start-up status `message` on `fd`, then close it.
+
+        The message is ``'ready'`` or ``'failed: '`` followed by the
+        reason. If the original process is no longer waiting, the
+        message is discarded.
+
+        """
+    data = (message + u"\n").encode('utf-8')
+    try:
+        os.write(fd, data)
+    except OSError, exc:
+        if exc.errno != errno.EPIPE:
+            raise
+    finally:
+        os.close(fd)
+
+
+def read_start_status(fd, deadline):
+    """ Read the start-up status reported on `fd` before `deadline`.
+        :Return: The status message, ``u''`` if the pipe was closed
+            without one, or ``None`` if the time ran out.
+        """
+    data = ""
+    closed = False
+    while not (closed or data.endswith("\n")):
+        timeout = deadline - time.time()
+        if timeout <= 0:
+            break
+        try:
+            (readable, writable, errored) = select.select(
+                [fd], [], [], timeout)
+        except (select.error, OSError), exc:
+            if exc.args[0] != errno.EINTR:
+                raise
+            continue
+        if not readable:
+            continue
+        try:
+            chunk = os.read(fd, 4096)
+        except OSError, exc:
+            if exc.errno == errno.EINTR:
+                continue
+            raise
+        if not chunk:
+            closed = True
+        data += chunk
+
+    result = None
+    if closed or data.endswith("\n"):
+        result = data.decode('utf-8', 'replace').rstrip(u"\n")
+    return result
+
+
+def wait_for_start_status(fd, timeout):
+    """ Wait up to `timeout` seconds for the start-up status on `fd`.
+        :Return: The exit status for the original process.
+
+        If the daemon process reports that it is ready, the exit status
+        is ``0``. Otherwise, the reason is written to `sys.stderr`, and
+        the exit status is `START_TIMEOUT_EXIT_STATUS` if the time ran
+        out, or `START_FAILED_EXIT_STATUS`.
+
+        """
+    message = read_start_status(fd, time.time() + timeout)
+    os.close(fd)
+
+    result = 0
+    if message != u"ready":
+        result = START_FAILED_EXIT_STATUS
+        if message is None:
+            reason = u"not ready after %(timeout)r seconds" % vars()
+            result = START_TIMEOUT_EXIT_STATUS
+        elif message.startswith(u"failed: "):
+            reason = message[len(u"failed: "):]
+        else:
+            reason = u"daemon process exited before it was ready"
+        message = u"Daemon failed to start: %(reason)s\n" % vars()
+        sys.stderr.write(message.encode('utf-8'))
+        sys.stderr.flush()
+    return result
+
+
+def is_process_started_by_init():
+    """ Determine if the current process is started by `init`.
+
+        The `init` process has the process ID of 1; if that is our
+        parent process ID, return ``True``, otherwise ``False``.
+    
+        """
+    result = False
+
+    init_pid = 1
+    if os.getppid() == init_pid:
+        result = True
+
+    return result
+
+
+def is_socket(fd):
+    """ Determine if the file descriptor is a socket.
+
+        Return ``True`` if the file type reported by `os.fstat` for
+        `fd` is a socket; otherwise (including when `fd` is not open)
+        return ``False``. No socket object is created, and no file
+        descriptor is duplicated.
+
+        """
+    result = False
+
+    try:
+        file_stat = os.fstat(fd)
+    except OSError:
+        file_stat = None
+
+    if file_stat is not None and stat.S_ISSOCK(file_stat.st_mode):
+        result = True
+
+    return result
+
+
+def is_process_started_by_superserver():
+    """ Determine if the current process is started by the superserver.
+
+        The internet superserver creates a network socket, and
+        attaches it to the standard streams of the child process. If
+        that is the case for this process, return ``True``, otherwise
+        ``False``.
+    
+        """
+    result = False
+
+    stdin_fd = sys.__stdin__.fileno()
+    if is_socket(stdin_fd):
+        result = True
+
+    return result
+
+
+_detach_process_context_required = {}
+
+def is_detach_process_context_required():
+    """ Determine whether detaching process context is required.
+
+        Return ``False`` if the process environment indicates the
+        process is already detached:
+
+        * Process was started by `init`; or
+
+        * Process was started by `inetd`; or
+
+        * Process was started by socket activation.
+
+        Otherwise, return ``True``.
+
+        The environment is examined once per process; the result is
+        cached, by process ID, for subsequent calls.
+
+        """
+    pid = os.getpid()
+    result = _detach_process_context_required.get(pid)
+    if result is None:
+        result = True
+        if (is_process_started_by_init()
+            or is_process_started_by_superserver()
+            or is_process_started_by_socket_activation()):
+            result = False
+        _detach_process_context_required[pid] = result
+
+    return result
+
+
+def close_file_descriptor_if_open(fd):
+    """ Close a file descriptor if already open.
+
+        Close the file descriptor `fd`, suppressing an error in the
+        case the file was not open.
+
+        """
+    try:
+        os.close(fd)
+    except OSError, exc:
+        if exc.errno == errno.EBADF:
+            # File descriptor was not open
+            pass
+        else:
+            error = DaemonOSEnvironmentError(
+                u"Failed to close file descriptor %(fd)d"
+                u" (%(exc)s)"
+                % vars())
+            raise error
+
+
+MAXFD = 2048
+
+def get_maximum_file_descriptors():
+    """ Return the maximum number of open file descriptors for this process.
+
+        Return the process hard resource limit of maximum number of
+        open file descriptors. If the limit is “infinity”, a default
+        value of ``MAXFD`` is returned.
+
+        """
+    limits = resource.getrlimit(resource.RLIMIT_NOFILE)
+    result = limits[1]
+    if result == resource.RLIM_INFINITY:
+        result = MAXFD
+    return result
+
+
+CLOSE_RANGE_MAX_FD = 0xFFFFFFFF
+
+_close_range_function = NotImplemented
+
+def get_close_range_function():
+    """ Return a callable for the `close_range` system call, if usable.
+
+        Return the C library's `close_range` function if both the C
+        library and the running kernel provide the `close_range(2)`
+        system call; otherwise return ``None``. The kernel is probed
+        by closing an empty range of file descriptors.
+
+        The result is determined once per process and then cached.
+
+        """
+    global _close_range_function
+    if _close_range_function is NotImplemented:
+        _close_range_function = None
+        try:
+            libc = ctypes.CDLL(None, use_errno=True)
+            close_range = libc.close_range
+        except (OSError, AttributeError):
+            close_range = None
+        if close_range is not None:
+            close_range.argtypes = [ctypes.c_uint, ctypes.c_uint, ctypes.c_int]
+            close_range.restype = ctypes.c_int
+            if close_range(CLOSE_RANGE_MAX_FD, CLOSE_RANGE_MAX_FD, 0) == 0:
+                _close_range_function = close_range
+
+    return _close_range_function
+
+
+def close_file_descriptor_range(low, high):
+    """ Close every open file descriptor from `low` to `high` inclusive.
+
+        Uses a single `close_range(2)` system call if available (see
+        `get_close_range_function`), otherwise `os.closerange`, and
+        otherwise closes each descriptor in turn.
+
+        """
+    close_range = get_close_range_function()
+    if close_range is not None:
+        if close_range(low, high, 0) != 0:
+            exc_errno = ctypes.get_errno()
+            exc = OSError(exc_errno, os.strerror(exc_errno))
+            error = DaemonOSEnvironmentError(
+                u"Failed to close file descriptors %(low)d to %(high)d"
+                u" (%(exc)s)"
+                % vars())
+            raise error
+    elif hasattr(os, 'closerange'):
+        os.closerange(low, high + 1)
+    else:
+        for fd in reversed(range(low, high + 1)):
+            close_file_descriptor_if_open(fd)
+
+
+def get_file_descriptor_ranges(exclude, maxfd):
+    """ Return the ranges of file descriptors that are not excluded.
+
+        Return a list of ``(low, high)`` pairs, in ascending order,
+        which together cover every file descriptor from 0 to `maxfd`
+        inclusive except those in the set `exclude`. A process that
+        preserves *n* file descriptors thus needs at most *n* + 1
+        ranges to be closed.
+
+        """
+    fd_ranges = []
+    low = 0
+    for fd in sorted(exclude):
+        if fd > maxfd:
+            break
+        if fd > low:
+            fd_ranges.append((low, fd - 1))
+        low = max(low, fd + 1)
+    if low <= maxfd:
+        fd_ranges.append((low, maxfd))
+
+    return fd_ranges
+
+
+PROC_FD_DIRECTORY = u"/proc/self/fd"
+
+def get_open_file_descriptors():
+    """ Return the set of file descriptors open in this process.
+
+        Enumerate the entries of ``PROC_FD_DIRECTORY``, which on Linux
+        name exactly the file descriptors open in the current
+        process. If that directory is not available (for example,
+        because `/proc` is not mounted inside a chroot), return
+        ``None``.
+
+        The result may include the descriptor used to read the
+        directory, which is already closed by the time this function
+        returns.
+
+        """
+    result = None
+
+    try:
+        entries = os.listdir(PROC_FD_DIRECTORY)
+    except OSError:
+        entries = None
+
+    if entries is not None:
+        result = set(int(entry) for entry in entries if entry.isdigit())
+
+    return result
+
+
+def probe_close_files_strategy():
+    """ Determine the fastest available way to close all open files.
+
+        Return the name of the strategy `close_all_open_files` will
+        use in the current process:
+
+        * ``'close_range'``: close each range of file descriptors
+          between the excluded ones with one `close_range(2)` system
+          call.
+
+        * ``'proc'``: close only the file descriptors enumerated by
+          `get_open_file_descriptors`.
+
+        * ``'closerange'``: close each range of file descriptors
+          between the excluded ones, up to the limit reported by
+          `get_maximum_file_descriptors`, with `os.closerange`.
+
+        * ``'close'``: close every possible file descriptor in turn.
+
+        """
+    if get_close_range_function() is not None:
+        result = u'close_range'
+    elif os.path.isdir(PROC_FD_DIRECTORY):
+        result = u'proc'
+    elif hasattr(os, 'closerange'):
+        result = u'closerange'
+    else:
+        result = u'close'
+
+    return result
+
+
+def close_all_open_files(exclude=set(), maxfd=None):
+    """ Close all open file descriptors.
+
+        :Return: The name of the strategy used.
+
+        Closes every file descriptor (if open) of this process. If
+        specified, `exclude` is a set of file descriptors to *not*
+        close. If specified, `maxfd` is used instead of the value of
+        `get_maximum_file_descriptors` where the strategy needs it.
+
+        The strategy is chosen by `probe_close_files_strategy`, so
+        that the cost is proportional to the number of excluded or
+        open files where the system allows it, rather than to the
+        limit on the number of open files.
+
+        """
+    strategy = probe_close_files_strategy()
+
+    candidate_fds = None
+    if strategy == u'proc':
+        candidate_fds = get_open_file_descriptors()
+
+    if candidate_fds is not None:
+        for fd in sorted(candidate_fds, reverse=True):
+            if fd not in exclude:
+                close_file_descriptor_if_open(fd)
+    else:
+        if strategy == u'close_range':
+            maxfd = CLOSE_RANGE_MAX_FD
+        else:
+            if maxfd is None:
+                maxfd = get_maximum_file_descriptors()
+            maxfd = maxfd - 1
+        fd_ranges = get_file_descriptor_ranges(exclude, maxfd)
+        for (low, high) in reversed(fd_ranges):
+            close_file_descriptor_range(low, high)
+
+    return strategy
+
+
+def is_file_descriptor(item):
+    """ Determine whether `item` is a file descriptor (an integer). """
+    result = isinstance(item, (int, long)) and not isinstance(item, bool)
+    return result
+
+
+def redirect_stream(system_stream, target_stream):
+    """ Redirect a system stream to a specified file.
+
+        `system_stream` is a standard system stream such as
+        ``sys.stdout``. `target_stream` is an open file object (or any
+        object with a `fileno()` method), or a file descriptor, that
+        should replace the corresponding system stream object.
+
+        If `target_stream` is ``None``, defaults to opening the
+        operating system's null device and using its file descriptor.
+        That file descriptor is closed again afterward, unless it is
+        the one now used by the system stream.
+
+        """
+    system_fd = system_stream.fileno()
+    if target_stream is None:
+        target_fd = os.open(os.devnull, os.O_RDWR)
+        os.dup2(target_fd, system_fd)
+        if target_fd != system_fd:
+            os.close(target_fd)
+    else:
+        if is_file_descriptor(target_stream):
+            target_fd = target_stream
+        else:
+            target_fd = target_stream.fileno()
+        os.dup2(target_fd, system_fd)
+
+
+def open_stream_file(path, flags):
+    """ Open the named file for redirecting a standard stream.
+        :Return: The file descriptor of the opened file.
+
+        Open the file at `path` with the `os.open` flags `flags`. The
+        returned file descriptor is never one of the standard stream
+        file descriptors 0, 1 or 2 (which may be closed at the time),
+        so that redirecting one stream cannot replace the file that
+        another stream is about to be redirected to.
+
+        """
+    create_mode = 0666
+    fd = os.open(path, flags, create_mode)
+    if fd <= 2:
+        low_fd = fd
+        fd = fcntl.fcntl(low_fd, fcntl.F_DUPFD, 3)
+        os.close(low_fd)
+
+    return fd
+
+
+def redirect_standard_streams(stdin=None, stdout=None, stderr=None):
+    """ Redirect the standard system streams to the specified files.
+
+        Each of `stdin`, `stdout`, and `stderr` specifies the file that
+        should replace the corresponding system stream `sys.stdin`,
+        `sys.stdout`, and `sys.stderr`: an open file object (or any
+        object with a `fileno()` method), a file descriptor, the
+        filesystem path of a file, or ``None`` for the operating
+        system's null device.
+
+        A path for `stdin` is opened for reading; a path for `stdout`
+        or `stderr` is opened for appending, and created if it does not
+        exist. The null device is opened at most once, and shared by
+        every stream redirected to it. Every file opened by this
+        function is closed again once the streams are redirected.
+
+        """
+    write_flags = os.O_WRONLY | os.O_CREAT | os.O_APPEND
+    redirections = [
+        (sys.stdin, stdin, os.O_RDONLY),
+        (sys.stdout, stdout, write_flags),
+        (sys.stderr, stderr, write_flags),
+        ]
+
+    opened_fds = {}
+    try:
+        for (system_stream, target_stream, flags) in redirections:
+            if target_stream is None:
+                target_stream = os.devnull
+                flags = os.O_RDWR
+            if isinstance(target_stream, basestring):
+                open_key = (target_stream, flags)
+                if open_key not in opened_fds:
+                    opened_fds[open_key] = open_stream_file(
+                        target_stream, flags)
+                target_stream = opened_fds[open_key]
+            redirect_stream(system_stream, target_stream)
+    finally:
+        for fd in opened_fds.values():
+            os.close(fd)
 
 
 def make_default_signal_map():
@@ -0,0 +1,280 @@
+# -*- coding: utf-8 -*-
+
+# daemon/notify.py
+# Part of python-daemon, an implementation of PEP 3143.
+#
+# Copyright © 2026 agent <agent@local>
+#
+# This is free software: you may copy, modify, and/or distribute this work
+# under the terms of the Python Software Foundation License, version 2 or
+# later as published by the Python Software Foundation.
+# No warranty expressed or implied. See the file LICENSE.PSF-2 for details.
+
+""" Notification of the service supervisor over ``NOTIFY_SOCKET``.
+
+    A supervisor such as `systemd` that starts the program with the
+    ``NOTIFY_SOCKET`` environment variable listens on that Unix-domain
+    datagram socket for messages about the state of the service: when
+    it is ready, a human-readable status, a keep-alive for its
+    watchdog, and when it is stopping.
+
+    Without ``NOTIFY_SOCKET``, every notification is silently
+    discarded, so a program can notify unconditionally.
+
+    """
+
+import os
+import errno
+import fcntl
+import socket
+import select
+import threading
+
+
+class NotifyError(Exception):
+    """ Abstract base class for errors from notification. """
+
+class NotifySocketError(NotifyError, socket.error):
+    """ Raised when a notification cannot be sent. """
+
+
+NOTIFY_SOCKET_ENV = "NOTIFY_SOCKET"
+WATCHDOG_USEC_ENV = "WATCHDOG_USEC"
+WATCHDOG_PID_ENV = "WATCHDOG_PID"
+
+
+class Notifier(object):
+    """ Sender of notifications to the service supervisor.
+
+        The datagram socket is connected to `address` on first use
+        (or by calling `connect`), and stays connected, so that
+        notifications still reach the supervisor after the process
+        changes its root directory.
+
+        """
+
+    def __init__(self, address=None):
+        """ Set up a new instance.
+
+            If `address` is ``None``, it is read from the
+            ``NOTIFY_SOCKET`` environment variable; if that is also
+            unset, notification is disabled.
+
+            """
+        if address is None:
+            address = get_notify_socket_address()
+        self.address = address
+        self.socket = None
+
+    @property
+    def enabled(self):
+        """ ``True`` if notifications are sent to a supervisor. """
+        return (self.address is not None)
+
+    def connect(self):
+        """ Connect the notification socket, if not already connected.
+            :Return: ``None``
+            """
+        if not self.enabled or self.socket is not None:
+            return
+        address = self.address
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        flags = fcntl.fcntl(sock.fileno(), fcntl.F_GETFD)
+        fcntl.fcntl(sock.fileno(), fcntl.F_SETFD, flags | fcntl.FD_CLOEXEC)
+        try:
+            sock.connect(address)
+        except socket.error, exc:
+            sock.close()
+            error = NotifySocketError(
+                u"Unable to connect notification socket %(address)r"
+                u" (%(exc)s)"
+                    % vars())
+            raise error
+        self.socket = sock
+
+    def fileno(self):
+        """ Get the file descriptor of the notification socket.
+            :Return: The file descriptor, or ``None`` if not connected.
+            """
+        result = None
+        if self.socket is not None:
+            result = self.socket.fileno()
+        return result
+
+    def close(self):
+        """ Close the notification socket, if connected. """
+        if self.socket is not None:
+            self.socket.close()
+            self.socket = None
+
+    def notify(self, state):
+        """ Send the text `state` to the supervisor.
+            :Return: ``True`` if sent, ``False`` if notification is
+                disabled.
+
+            The `state` is one or more lines of ``NAME=value``
+            assignments, as for the `sd_notify` C function.
+
+            """
+        if not self.enabled:
+            return False
+        self.connect()
+        if isinstance(state, unicode):
+            state = state.encode('utf-8')
+        try:
+            self.socket.send(state)
+        except socket.error, exc:
+            error = NotifySocketError(
+                u"Unable to send notification (%(exc)s)" % vars())
+            raise error
+        return True
+
+    def ready(self):
+        """ Notify that the service has finished starting up. """
+        return self.notify(u"READY=1")
+
+    def status(self, text):
+        """ Notify a single line of human-readable status text. """
+        text = u" ".join(text.splitlines())
+        return self.notify(u"STATUS=%(text)s" % vars())
+
+    def watchdog_ping(self):
+        """ Notify the watchdog that the service is still alive. """
+        return self.notify(u"WATCHDOG=1")
+
+    def stopping(self):
+        """ Notify that the service is beginning to shut down. """
+        return self.notify(u"STOPPING=1")
+
+    def main_pid(self, pid):
+        """ Notify that `pid` is now the main process of the service. """
+        return self.notify(u"MAINPID=%(pid)d" % vars())
+
+
+class WatchdogPinger(object):
+    """ Thread sending a watchdog notification at a regular interval.
+
+        The thread sleeps in `select` on a pipe between notifications,
+        so it costs nothing while waiting, and wakes immediately when
+        `stop` is called.
+
+        """
+
+    def __init__(self, notifier, interval):
+        """ Set up a new instance.
+
+            Every `interval` seconds, `notifier` sends a watchdog
+            notification.
+
+            """
+        self.notifier = notifier
+        self.interval = interval
+        self._stop_fds = None
+        self._thread = None
+
+    def start(self):
+        """ Start the thread, sending the first notification at once. """
+        self._stop_fds = os.pipe()
+        for fd in self._stop_fds:
+            flags = fcntl.fcntl(fd, fcntl.F_GETFD)
+            fcntl.fcntl(fd, fcntl.F_SETFD, flags | fcntl.FD_CLOEXEC)
+        self._thread = threading.Thread(target=self._run)
+        self._thread.setDaemon(True)
+        self._thread.start()
+
+    def _run(self):
+        """ Send notifications until a byte arrives on the stop pipe. """
+        stop_read_fd = self._stop_fds[0]
+        readable = []
+        while not readable:
+            try:
+                self.notifier.watchdog_ping()
+            except NotifyError:
+                # The supervisor may be restarting; try again next time.
+                pass
+            try:
+                (readable, writable, errored) = select.select(
+                    [stop_read_fd], [], [], self.interval)
+            except (select.error, OSError), exc:
+                if exc.args[0] != errno.EINTR:
+                    raise
+                readable = []
+
+    def stop(self):
+        """ Stop the thread, and wait for it to finish. """
+        if self._thread is None:
+            return
+        os.write(self._stop_fds[1], "\0")
+        self._thread.join()
+        self._thread = None
+        for fd in self._stop_fds:
+            os.close(fd)
+        self._stop_fds = None
+
+
+def get_notify_socket_address():
+    """ Get the address of the supervisor's notification socket.
+        :Return: The address, or ``None`` if ``NOTIFY_SOCKET`` is unset.
+
+        An address beginning with ``@`` is in the Linux abstract
+        socket namespace; the ``@`` is replaced by a null byte.
+
+        """
+    result = os.environ.get(NOTIFY_SOCKET_ENV) or None
+    if result is not None and result.startswith("@"):
+        result = "\0" + result[1:]
+    return result
+
+
+def get_watchdog_interval():
+    """ Get the interval at which to notify the supervisor's watchdog.
+        :Return: The interval in seconds, or ``None`` if the watchdog
+            is not enabled for this process.
+
+        The interval is half the timeout given in microseconds by the
+        ``WATCHDOG_USEC`` environment variable, if ``WATCHDOG_PID`` is
+        unset or names this process.
+
+        """
+    result = None
+    watchdog_pid = os.environ.get(WATCHDOG_PID_ENV)
+    if watchdog_pid is None or watchdog_pid == str(os.getpid()):
+        try:
+            usec = int(os.environ.get(WATCHDOG_USEC_ENV, ""))
+        except ValueError:
+            usec = 0
+        if usec > 0:
+            result = usec / 2000000.0
+    return result
+
+
+_default_notifier = None
+
+def get_default_notifier():
+    """ Get the notifier shared by this process.
+        :Return: The `Notifier` for the ``NOTIFY_SOCKET`` address.
+        """
+    global _default_notifier
+    if _default_notifier is None:
+        _default_notifier = Notifier()
+    return _default_notifier
+
+
+def ready():
+    """ Notify the supervisor that the service has finished starting. """
+    return get_default_notifier().ready()
+
+
+def status(text):
+    """ Notify the supervisor of human-readable status text. """
+    return get_default_notifier().status(text)
+
+
+def watchdog_ping():
+    """ Notify the supervisor's watchdog that the service is alive. """
+    return get_default_notifier().watchdog_ping()
+
+
+def stopping():
+    """ Notify the supervisor that the service is shutting down. """
+    return get_default_notifier().stopping()
@@ -13,15 +13,24 @@
 """ Lockfile behaviour implemented via Unix PID files.
     """
 
+import sys
 import os
 import errno
+import fcntl
+import signal
+import select
+import struct
+import tempfile
+import time
 
 from lockfile import (
-    LinkFileLock,
-    AlreadyLocked, LockFailed,
+    LockBase, LinkFileLock,
+    AlreadyLocked, LockFailed, LockTimeout,
     NotLocked, NotMyLock,
     )
 
+from daemon import call_libc_function
+
 
 class PIDFileError(Exception):
     """ Abstract base class for errors specific to PID files. """
@@ -30,35 +39,190 @@ class PIDFileParseError(ValueError, PIDFileError):
     """ Raised when parsing contents of PID file fails. """
 
 
-class PIDLockFile(LinkFileLock, object):
+class WatchedLinkFileLock(LinkFileLock, object):
+    """ Lockfile implemented via `link`, waking when it is released.
+
+        This uses the ``LinkFileLock`` implementation, except that
+        while waiting to acquire the lock, it sleeps until the lock
+        file is removed (see `PathRemovalWatch`), instead of polling
+        at intervals of a tenth of the timeout.
+
+        """
+
+    _removal_watch = None
+
+    def acquire(self, timeout=None):
+        """ Acquire the lock.
+
+            The `timeout` parameter is used as for the `LinkFileLock`
+            class: if ``None``, wait until the lock is free; if
+            greater than zero, wait up to that many seconds, then
+            raise ``LockTimeout``; otherwise, raise ``AlreadyLocked``
+            at once if the lock is held.
+
+            """
+        try:
+            open(self.unique_name, 'wb').close()
+        except IOError, exc:
+            error = LockFailed(u"%(exc)s" % vars())
+            raise error
+
+        deadline = None
+        if timeout is not None:
+            deadline = time.time() + timeout
+        watch = None
+        locked = False
+        try:
+            while not self._link_lock_file():
+                if timeout is not None and timeout <= 0:
+                    raise AlreadyLocked
+                if watch is None:
+                    # Try again once watching, so that a removal just
+                    # before the watch begins is not missed.
+                    watch = PathRemovalWatch(self.lock_file)
+                    continue
+                remaining = None
+                if deadline is not None:
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        raise LockTimeout
+                watch.wait(remaining)
+            locked = True
+        except (AlreadyLocked, LockTimeout):
+            os.unlink(self.unique_name)
+            raise
+        finally:
+            if watch is not None:
+                watch.stop()
+                if locked:
+                    # Closing the watch can take the kernel some
+                    # milliseconds, so leave that until release.
+                    self._removal_watch = watch
+                else:
+                    watch.close()
+
+    def release(self):
+        """ Release the lock, then close any watch used to acquire it. """
+        super(WatchedLinkFileLock, self).release()
+        self._close_removal_watch()
+
+    def _close_removal_watch(self):
+        """ Close the watch used to acquire the lock, if any. """
+        if self._removal_watch is not None:
+            self._removal_watch.close()
+            self._removal_watch = None
+
+    def _link_lock_file(self):
+        """ Try to link the lock file to this lock's unique file.
+            :Return: ``True`` if this lock now holds the lock file.
+            """
+        result = True
+        try:
+            os.link(self.unique_name, self.lock_file)
+        except OSError:
+            # The lock is held, unless it is already held by this lock.
+            result = (os.stat(self.unique_name).st_nlink == 2)
+        return result
+
+
+class PIDLockFile(WatchedLinkFileLock):
     """ Lockfile implemented as a Unix PID file.
 
         The PID file is named by the attribute `path`. When locked,
-        the file will be created with a single line of text,
-        containing the process ID (PID) of the process that acquired
-        the lock.
+        the file will be created with a line of text containing the
+        process ID (PID) of the process that acquired the lock,
+        followed (where available) by a line recording the start time
+        of that process.
+
+        The lock is acquired and maintained as per
+        `WatchedLinkFileLock`. The PID file is written as for
+        `write_pid_to_pidfile`, so it never has partial content, with
+        the `durability` given to the initialiser.
+
+        If a `PIDFileCache` is given to the initialiser as `cache`,
+        the PID file is read through it.
 
-        The lock is acquired and maintained as per `LinkFileLock`.
+        The PID file also records the extra fields in the `fields`
+        attribute (see `make_pidfile_text`), which may be changed
+        while the lock is held by `update_fields`.
 
         """
 
+    def __init__(self, path, threaded=True, durability=u'none', cache=None):
+        """ Set up the parameters of a PIDLockFile. """
+        super(PIDLockFile, self).__init__(path, threaded)
+        check_pidfile_durability(durability)
+        self.durability = durability
+        self.cache = cache
+        self.fields = {}
+
     def read_pid(self):
         """ Get the PID from the lock file.
             """
-        result = read_pid_from_pidfile(self.path)
+        if self.cache is None:
+            result = read_pid_from_pidfile(self.path)
+        else:
+            result = self.cache.read_pid(self.path)
+        return result
+
+    def read_start_time(self, pid):
+        """ Get the start time of process `pid` from the lock file.
+            :Return: The start time recorded with `pid` (see
+                `get_process_start_time`), or ``None`` if the PID file
+                does not record a start time for that PID.
+
+            """
+        if self.cache is None:
+            (pidfile_pid, start_time) = (
+                read_pid_and_start_time_from_pidfile(self.path))
+        else:
+            (pidfile_pid, start_time) = (
+                self.cache.read_pid_and_start_time(self.path))
+        result = None
+        if pidfile_pid == pid:
+            result = start_time
         return result
 
+    def read_record(self):
+        """ Get the record in the lock file.
+            :Return: A mapping as for `read_pidfile_record`.
+            """
+        if self.cache is None:
+            result = read_pidfile_record(self.path)
+        else:
+            result = self.cache.read_record(self.path)
+        return result
+
+    def update_fields(self, fields):
+        """ Update the extra fields recorded in the PID file.
+
+            The items of `fields` are merged into the `fields`
+            attribute, as for `update_pidfile_fields`. If this process
+            holds the lock, the PID file is then replaced as for
+            `replace_pid_in_pidfile`, so a reader sees either the
+            previous record or the new one.
+
+            """
+        self.fields = update_pidfile_fields(self.fields, fields)
+        if not self.i_am_locking():
+            return
+        try:
+            replace_pid_in_pidfile(self.path, self.durability, self.fields)
+        except (IOError, OSError), exc:
+            error = LockFailed(u"%(exc)s" % vars())
+            raise error
+
     def acquire(self, *args, **kwargs):
         """ Acquire the lock.
 
             Locks the PID file then creates the PID file for this
             lock. The `timeout` parameter is used as for the
-            `LinkFileLock` class.
+            `WatchedLinkFileLock` class.
 
             """
         super(PIDLockFile, self).acquire(*args, **kwargs)
         try:
-            write_pid_to_pidfile(self.path)
+            write_pid_to_pidfile(self.path, self.durability, self.fields)
         except OSError, exc:
             error = LockFailed(u"%(exc)s" % vars())
             raise error
@@ -84,6 +248,56 @@ class PIDLockFile(LinkFileLock, object):
         super(PIDLockFile, self).break_lock()
         remove_existing_pidfile(self.path)
 
+    def fileno(self):
+        """ Get the file descriptor that holds the lock.
+            :Return: ``None``, since this lock is held by a link in
+                the filesystem, not by an open file.
+
+            """
+        return None
+
+    def take_over(self, inherited_fd=None):
+        """ Take over the lock from the process that holds it.
+
+            Replaces the lock file with a link to this lock's unique
+            file, then replaces the PID file with one containing the
+            PID of this process. Each file is replaced by renaming
+            over it, so the lock is held throughout, by one process
+            or the other. The `inherited_fd` argument is ignored, as
+            for `fileno`.
+
+            """
+        link_path = u"%(unique_name)s.link" % vars(self)
+        try:
+            open(self.unique_name, 'wb').close()
+            os.link(self.unique_name, link_path)
+            os.rename(link_path, self.lock_file)
+            replace_pid_in_pidfile(self.path, self.durability, self.fields)
+        except (IOError, OSError), exc:
+            error = LockFailed(u"%(exc)s" % vars())
+            raise error
+
+    def relinquish(self):
+        """ Give up a lock that another process has taken over.
+
+            Removes the unique file of this lock, leaving the lock
+            file and PID file to the process that took them over, or
+            raises an error if the current process still holds the
+            lock.
+
+            """
+        if self.i_am_locking():
+            path = self.path
+            error = LockFailed(
+                u"Lock on %(path)r not taken over" % vars())
+            raise error
+        try:
+            os.unlink(self.unique_name)
+        except OSError, exc:
+            if exc.errno != errno.ENOENT:
+                raise
+        self._close_removal_watch()
+
 
 class TimeoutPIDLockFile(PIDLockFile):
     """ Lockfile with default timeout, implemented as a Unix PID file.
@@ -109,6 +323,768 @@ class TimeoutPIDLockFile(PIDLockFile):
         super(TimeoutPIDLockFile, self).acquire(timeout, *args, **kwargs)
 
 
+class FlockPIDLockFile(LockBase, object):
+    """ Lockfile implemented as a Unix PID file locked by the kernel.
+
+        The PID file is named by the attribute `path`, and has the
+        same content as for `PIDLockFile`. The lock is a ``flock``
+        lock on the open PID file itself, so acquiring it is a single
+        system call, and the kernel releases it when the process that
+        holds it exits, however it exits. A PID file left behind by
+        such a process is not locked, and is simply replaced by the
+        next process to acquire the lock.
+
+        Each process that acquires the lock writes a new file, locks
+        it, and only then moves it into place (see `write_new_pidfile`
+        for the `durability` given to the initialiser), so the PID
+        file never has partial content, and is always locked by the
+        process it names. The PID file is read through the `cache`
+        given to the initialiser, if any, and records the extra
+        `fields`, as for `PIDLockFile`.
+
+        The lock belongs to the open file, which is shared with any
+        child processes forked while it is held.
+
+        """
+
+    def __init__(self, path, threaded=True, durability=u'none', cache=None):
+        """ Set up the parameters of a FlockPIDLockFile. """
+        LockBase.__init__(self, path, threaded)
+        check_pidfile_durability(durability)
+        self.durability = durability
+        self.cache = cache
+        self.fields = {}
+        self.fd = None
+
+    def read_pid(self):
+        """ Get the PID from the lock file.
+            """
+        if self.cache is None:
+            result = read_pid_from_pidfile(self.path)
+        else:
+            result = self.cache.read_pid(self.path)
+        return result
+
+    def read_start_time(self, pid):
+        """ Get the start time of process `pid` from the lock file.
+            :Return: The start time recorded with `pid`, as for
+                `PIDLockFile.read_start_time`.
+
+            """
+        if self.cache is None:
+            (pidfile_pid, start_time) = (
+                read_pid_and_start_time_from_pidfile(self.path))
+        else:
+            (pidfile_pid, start_time) = (
+                self.cache.read_pid_and_start_time(self.path))
+        result = None
+        if pidfile_pid == pid:
+            result = start_time
+        return result
+
+    def read_record(self):
+        """ Get the record in the lock file.
+            :Return: A mapping as for `read_pidfile_record`.
+            """
+        if self.cache is None:
+            result = read_pidfile_record(self.path)
+        else:
+            result = self.cache.read_record(self.path)
+        return result
+
+    def update_fields(self, fields):
+        """ Update the extra fields recorded in the PID file.
+
+            The items of `fields` are merged into the `fields`
+            attribute, as for `PIDLockFile.update_fields`. If this
+            process holds the lock, a new locked PID file replaces the
+            current one, whose file descriptor is then closed.
+
+            """
+        self.fields = update_pidfile_fields(self.fields, fields)
+        if not self.i_am_locking():
+            return
+        fd = self.fd
+        self.fd = None
+        try:
+            self._move_new_lock_into_place(replace=True)
+        finally:
+            if self.fd is None:
+                self.fd = fd
+            else:
+                os.close(fd)
+
+    def fileno(self):
+        """ Get the file descriptor that holds the lock.
+            :Return: The file descriptor of the open PID file, or
+                ``None`` if this instance does not hold the lock.
+
+            """
+        return self.fd
+
+    def acquire(self, timeout=None):
+        """ Acquire the lock.
+
+            Opens and locks the PID file, then replaces it with a new
+            locked PID file for this process; if there is no PID file,
+            the new file is moved into place without waiting. If
+            `timeout` is ``None``, wait until the lock is free; if it
+            is greater than zero, wait up to that many seconds, then
+            raise ``LockTimeout``; otherwise, raise ``AlreadyLocked``
+            at once if the lock is held.
+
+            """
+        deadline = None
+        if timeout is not None and timeout > 0:
+            deadline = time.time() + timeout
+        path = self.path
+        while self.fd is None:
+            try:
+                fd = open_pidfile_for_lock(path)
+            except OSError, exc:
+                if exc.errno != errno.ENOENT:
+                    error = LockFailed(u"%(exc)s" % vars())
+                    raise error
+                self._move_new_lock_into_place(replace=False)
+                continue
+            locked = False
+            try:
+                if deadline is None:
+                    lock_file_descriptor(fd, timeout)
+                else:
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        raise LockTimeout
+                    lock_file_descriptor(fd, remaining)
+                locked = True
+            finally:
+                if not locked:
+                    os.close(fd)
+            try:
+                # The file may have been replaced or removed by the
+                # previous holder.
+                if is_file_at_path(fd, path):
+                    self._move_new_lock_into_place(replace=True)
+            finally:
+                os.close(fd)
+
+    def _move_new_lock_into_place(self, replace):
+        """ Lock a new PID file for this process, and move it into place.
+
+            The new file is moved as for `move_new_pidfile`. Unless
+            `replace` is true, this lock is left unlocked if there is
+            already a PID file.
+
+            """
+        path = self.path
+        try:
+            (fd, new_path) = write_new_pidfile(
+                path, self.durability, self.fields)
+        except (IOError, OSError), exc:
+            error = LockFailed(u"%(exc)s" % vars())
+            raise error
+        try:
+            # No other process has opened the new file yet.
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            move_new_pidfile(new_path, path, replace, self.durability)
+        except (IOError, OSError), exc:
+            os.close(fd)
+            remove_existing_pidfile(new_path)
+            if not replace and exc.errno == errno.EEXIST:
+                return
+            error = LockFailed(u"%(exc)s" % vars())
+            raise error
+        self.fd = fd
+
+    def release(self):
+        """ Release the lock.
+
+            Removes the PID file then releases the lock, or raises an
+            error if the current process does not hold the lock.
+
+            """
+        if not self.is_locked():
+            raise NotLocked
+        if not self.i_am_locking():
+            raise NotMyLock
+        remove_existing_pidfile(self.path)
+        fcntl.flock(self.fd, fcntl.LOCK_UN)
+        self._close_lock()
+
+    def is_locked(self):
+        """ Determine whether the lock is held by any process.
+
+            Unless this instance holds the lock, the locks held on the
+            PID file are looked up with `read_flocked_file_ids`, which
+            leaves them undisturbed. Where the kernel does not list
+            its locks, this instead briefly takes a shared lock on the
+            PID file to test it; another process that tries to
+            acquire the lock at that instant then fails as though the
+            lock were held.
+
+            """
+        if self.fd is not None:
+            return True
+        result = None
+        while result is None:
+            try:
+                fd = os.open(self.path, os.O_RDONLY)
+            except OSError, exc:
+                if exc.errno != errno.ENOENT:
+                    raise
+                return False
+            try:
+                result = is_file_descriptor_flocked(fd)
+                if not is_file_at_path(fd, self.path):
+                    # The file was replaced or removed meanwhile.
+                    result = None
+            finally:
+                os.close(fd)
+        return result
+
+    def i_am_locking(self):
+        """ Determine whether this process holds the lock.
+
+            The lock is held by this process if this instance holds
+            it, and the PID file names this process (rather than, for
+            instance, the parent of a forked process, or the process
+            that has taken over the lock).
+
+            """
+        result = False
+        if self.fd is not None:
+            result = (self.read_pid() == os.getpid())
+        return result
+
+    def break_lock(self):
+        """ Break an existing lock.
+
+            The kernel releases the lock when the process holding it
+            exits, so this only removes a PID file that is not locked.
+
+            """
+        if not self.is_locked():
+            remove_existing_pidfile(self.path)
+
+    def take_over(self, inherited_fd=None):
+        """ Take over the lock from the process that holds it.
+
+            The process that holds the lock must have left open in
+            this process its file descriptor holding the lock, which
+            is `inherited_fd`, so that the lock belongs to both. The
+            PID file is then replaced with a new locked PID file for
+            this process, and `inherited_fd` is closed.
+
+            """
+        if inherited_fd is None:
+            path = self.path
+            error = LockFailed(
+                u"No inherited lock on %(path)r to take over" % vars())
+            raise error
+        try:
+            set_close_on_exec(inherited_fd)
+            if not is_file_at_path(inherited_fd, self.path):
+                path = self.path
+                raise OSError(
+                    errno.ESTALE, u"Not the PID file %(path)r" % vars())
+        except (IOError, OSError), exc:
+            error = LockFailed(u"%(exc)s" % vars())
+            raise error
+        try:
+            self._move_new_lock_into_place(replace=True)
+        finally:
+            os.close(inherited_fd)
+
+    def relinquish(self):
+        """ Give up a lock that another process has taken over.
+
+            Closes the file descriptor of this lock without releasing
+            the lock, which the other process shares, or raises an
+            error if the current process still holds the lock.
+
+            """
+        if self.i_am_locking():
+            path = self.path
+            error = LockFailed(
+                u"Lock on %(path)r not taken over" % vars())
+            raise error
+        self._close_lock()
+
+    def _close_lock(self):
+        """ Close the file descriptor of this lock, if open. """
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+
+class TimeoutFlockPIDLockFile(FlockPIDLockFile):
+    """ Kernel-locked PID file with default timeout.
+
+        This uses the ``FlockPIDLockFile`` implementation, with the
+        `acquire_timeout` parameter used as for ``TimeoutPIDLockFile``.
+
+        """
+
+    def __init__(self, path, acquire_timeout=None, *args, **kwargs):
+        """ Set up the parameters of a TimeoutFlockPIDLockFile. """
+        self.acquire_timeout = acquire_timeout
+        super(TimeoutFlockPIDLockFile, self).__init__(path, *args, **kwargs)
+
+    def acquire(self, timeout=None, *args, **kwargs):
+        """ Acquire the lock. """
+        if timeout is None:
+            timeout = self.acquire_timeout
+        super(TimeoutFlockPIDLockFile, self).acquire(
+            timeout, *args, **kwargs)
+
+
+class PIDLockPool(object):
+    """ Pool of PID file locks, any one of which a process may hold.
+
+        Each of `locks` is the PID file lock for one slot of the pool;
+        the slot index of each is its position in the list. The
+        `path` names the pool as a whole, and is the path from which
+        the path of each slot is made by `get_pidfile_slot_path`.
+
+        Acquiring the pool claims the first slot whose lock is free,
+        so that each process running from the same pool has a slot
+        of its own. The `slot` attribute is then the index of that
+        slot, and `lock` is its lock; otherwise both are ``None``.
+
+        """
+
+    def __init__(self, path, locks, acquire_timeout=None):
+        """ Set up the parameters of a PIDLockPool. """
+        self.path = path
+        self.locks = list(locks)
+        self.acquire_timeout = acquire_timeout
+        self.slot = None
+
+    @property
+    def lock(self):
+        """ The lock on the slot claimed, or ``None``. """
+        result = None
+        if self.slot is not None:
+            result = self.locks[self.slot]
+        return result
+
+    def __enter__(self):
+        """ Context manager entry point. """
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc_info):
+        """ Context manager exit point. """
+        self.release()
+
+    def acquire(self, timeout=None):
+        """ Claim the first free slot of the pool.
+
+            Tries the lock on each slot in turn, without waiting. If
+            every slot is held, the `timeout` (by default, the
+            `acquire_timeout` given to the initialiser) is as for
+            `FlockPIDLockFile.acquire`: until the timeout, the slots
+            are tried again after each delay, which doubles from one
+            millisecond up to `lock_wait_poll_max_delay` seconds.
+
+            """
+        if timeout is None:
+            timeout = self.acquire_timeout
+        deadline = None
+        if timeout is not None and timeout > 0:
+            deadline = time.time() + timeout
+        delay = 0.001
+        while True:
+            for (slot, lock) in enumerate(self.locks):
+                try:
+                    lock.acquire(0)
+                except AlreadyLocked:
+                    continue
+                self.slot = slot
+                return
+            if timeout is not None and timeout <= 0:
+                path = self.path
+                error = AlreadyLocked(
+                    u"Every slot of %(path)r is locked" % vars())
+                raise error
+            if deadline is not None:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    raise LockTimeout
+                delay = min(delay, remaining)
+            time.sleep(delay)
+            delay = min(delay * 2, lock_wait_poll_max_delay)
+
+    def release(self):
+        """ Release the lock on the slot claimed.
+
+            Raises ``NotLocked`` if no slot is claimed.
+
+            """
+        if self.slot is None:
+            raise NotLocked
+        self.lock.release()
+        self.slot = None
+
+    def is_locked(self):
+        """ Determine whether the lock on any slot is held. """
+        result = False
+        for lock in self.locks:
+            if lock.is_locked():
+                result = True
+                break
+        return result
+
+    def i_am_locking(self):
+        """ Determine whether this process holds a slot of the pool. """
+        result = False
+        if self.slot is not None:
+            result = self.lock.i_am_locking()
+        return result
+
+    def update_fields(self, fields):
+        """ Update the extra fields recorded for the slot claimed.
+
+            The fields of the lock on the slot are updated as for
+            `PIDLockFile.update_fields`. Raises ``NotLocked`` if no
+            slot is claimed.
+
+            """
+        if self.slot is None:
+            raise NotLocked
+        self.lock.update_fields(fields)
+
+
+def get_pidfile_slot_path(pidfile_path, slot):
+    """ Get the path of the PID file for `slot` of a pool.
+        :Return: The `pidfile_path` with the slot index inserted
+            before its extension: slot 2 of ``name.pid`` is
+            ``name.2.pid``.
+
+        """
+    (root, extension) = os.path.splitext(pidfile_path)
+    result = u"%(root)s.%(slot)d%(extension)s" % vars()
+    return result
+
+
+class PathRemovalWatch(object):
+    """ Watch for the removal of the file at a path.
+
+        Where the Linux ``inotify`` interface is available, `wait`
+        sleeps until an entry is removed from the directory of `path`,
+        so it wakes as soon as the file is removed. Elsewhere, it
+        sleeps for an interval doubling from a millisecond, up to
+        `lock_wait_poll_max_delay` seconds.
+
+        """
+
+    def __init__(self, path):
+        """ Set up a new instance, watching the file at `path`. """
+        self.path = path
+        (self.fd, self.watch) = open_directory_watch(
+            os.path.dirname(path))
+        self.poll_delay = 0.001
+
+    def wait(self, timeout=None):
+        """ Wait until the file may have been removed.
+
+            Return once the file is removed (or, without ``inotify``,
+            after the poll interval), or after `timeout` seconds if it
+            is not ``None``.
+
+            """
+        if self.fd is None:
+            delay = self.poll_delay
+            if timeout is not None:
+                delay = min(delay, timeout)
+            time.sleep(delay)
+            self.poll_delay = min(
+                self.poll_delay * 2, lock_wait_poll_max_delay)
+            return
+
+        name = os.path.basename(self.path)
+        if isinstance(name, unicode):
+            name = name.encode(sys.getfilesystemencoding())
+        deadline = None
+        if timeout is not None:
+            deadline = time.time() + timeout
+        removed_names = set()
+        while name not in removed_names and None not in removed_names:
+            remaining = None
+            if deadline is not None:
+                remaining = max(deadline - time.time(), 0)
+            try:
+                (readable, writable, errored) = select.select(
+                    [self.fd], [], [], remaining)
+            except (select.error, OSError), exc:
+                if exc.args[0] != errno.EINTR:
+                    raise
+                continue
+            if not readable:
+                break
+            removed_names = read_removed_names(self.fd)
+
+    def stop(self):
+        """ Stop watching, leaving the file descriptor open. """
+        if self.watch is not None:
+            try:
+                call_libc_function('inotify_rm_watch', self.fd, self.watch)
+            except OSError:
+                # The watch has already ended.
+                pass
+            self.watch = None
+
+    def close(self):
+        """ Stop watching, and close the file descriptor. """
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+
+IN_MOVED_FROM = 0x00000040
+IN_DELETE = 0x00000200
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+
+inotify_event_header = struct.Struct("iIII")
+
+def open_directory_watch(directory_path):
+    """ Watch for entries being removed from a directory.
+        :Return: A tuple (`fd`, `watch`) of a non-blocking ``inotify``
+            file descriptor, which is readable once an entry is
+            removed from the directory at `directory_path`, and the
+            watch descriptor; or (``None``, ``None``) if not supported.
+
+        """
+    result = (None, None)
+    if not sys.platform.startswith('linux'):
+        return result
+    if isinstance(directory_path, unicode):
+        directory_path = directory_path.encode(sys.getfilesystemencoding())
+    try:
+        fd = call_libc_function('inotify_init')
+    except OSError:
+        return result
+    try:
+        set_close_on_exec(fd)
+        flags = fcntl.fcntl(fd, fcntl.F_GETFL)
+        fcntl.fcntl(fd, fcntl.F_SETFL, flags | os.O_NONBLOCK)
+        watch = call_libc_function(
+            'inotify_add_watch', fd, directory_path,
+            IN_DELETE | IN_MOVED_FROM)
+    except (IOError, OSError):
+        os.close(fd)
+    else:
+        result = (fd, watch)
+    return result
+
+
+def read_removed_names(watch_fd):
+    """ Read the pending events from a directory watch.
+        :Return: The set of names of entries removed from the
+            directory, including ``None`` if the watch has ended or
+            events were lost.
+
+        """
+    result = set()
+    while True:
+        try:
+            data = os.read(watch_fd, 4096)
+        except OSError, exc:
+            if exc.errno not in [errno.EAGAIN, errno.EWOULDBLOCK]:
+                raise
+            break
+        offset = 0
+        while offset < len(data):
+            (watch, mask, cookie, length) = (
+                inotify_event_header.unpack_from(data, offset))
+            offset += inotify_event_header.size
+            name = data[offset:(offset + length)].rstrip("\0")
+            offset += length
+            if mask & (IN_IGNORED | IN_Q_OVERFLOW):
+                name = None
+            result.add(name)
+    return result
+
+
+def set_close_on_exec(fd):
+    """ Set the close-on-exec flag of the file descriptor `fd`. """
+    flags = fcntl.fcntl(fd, fcntl.F_GETFD)
+    fcntl.fcntl(fd, fcntl.F_SETFD, flags | fcntl.FD_CLOEXEC)
+
+
+def open_pidfile_for_lock(pidfile_path):
+    """ Open the existing named PID file to lock it.
+        :Return: The file descriptor of the open file.
+        """
+    open_flags = os.O_RDWR
+    result = os.open(pidfile_path, open_flags)
+    set_close_on_exec(result)
+    return result
+
+
+def is_file_at_path(fd, path):
+    """ Determine whether the open file `fd` is the file at `path`. """
+    result = False
+    try:
+        path_stat = os.stat(path)
+    except OSError, exc:
+        if exc.errno != errno.ENOENT:
+            raise
+    else:
+        fd_stat = os.fstat(fd)
+        result = (
+            (path_stat.st_dev, path_stat.st_ino)
+            == (fd_stat.st_dev, fd_stat.st_ino))
+    return result
+
+
+proc_locks_path = u"/proc/locks"
+
+def read_flocked_file_ids():
+    """ Get the files on which a ``flock`` lock is held.
+        :Return: A set of (`major`, `minor`, `inode`) identifying the
+            device and inode of each locked file, or ``None`` if the
+            kernel does not list its locks in `proc_locks_path`.
+
+        """
+    try:
+        locks_file = open(proc_locks_path, 'r')
+    except EnvironmentError:
+        return None
+    result = set()
+    try:
+        for line in locks_file:
+            # Lines for processes waiting on a lock have an extra
+            # ``->`` field, and are not locks held.
+            fields = line.split()
+            if len(fields) < 6 or fields[1] != "FLOCK":
+                continue
+            (major, minor, inode) = fields[5].split(":")
+            result.add((int(major, 16), int(minor, 16), int(inode)))
+    finally:
+        locks_file.close()
+    return result
+
+
+def is_file_descriptor_flocked(fd):
+    """ Determine whether any ``flock`` lock is held on the open file `fd`.
+
+        The locks are looked up with `read_flocked_file_ids`, if
+        possible; otherwise a shared lock is briefly taken on `fd`,
+        which can make another process fail to take an exclusive lock
+        at the same instant.
+
+        """
+    flocked_file_ids = read_flocked_file_ids()
+    if flocked_file_ids is not None:
+        fd_stat = os.fstat(fd)
+        file_id = (
+            os.major(fd_stat.st_dev), os.minor(fd_stat.st_dev),
+            fd_stat.st_ino)
+        return (file_id in flocked_file_ids)
+    result = False
+    try:
+        fcntl.flock(fd, fcntl.LOCK_SH | fcntl.LOCK_NB)
+    except IOError, exc:
+        if exc.errno not in [errno.EWOULDBLOCK, errno.EAGAIN]:
+            raise
+        result = True
+    return result
+
+
+lock_wait_poll_max_delay = 0.1
+
+def lock_file_descriptor(fd, timeout=None):
+    """ Take an exclusive lock on the open file `fd`.
+
+        If `timeout` is ``None``, wait until the lock is free; if it
+        is greater than zero, wait up to that many seconds, then raise
+        ``LockTimeout``; otherwise, raise ``AlreadyLocked`` at once if
+        the lock is held.
+
+        While waiting, the main thread blocks in the ``flock`` system
+        call, interrupted by a ``SIGALRM`` timer at the timeout; the
+        signal handler and any timer already set are restored after.
+        Where that is not possible (in other threads, or while another
+        timer is pending), poll at intervals doubling from a
+        millisecond, up to `lock_wait_poll_max_delay` seconds.
+
+        """
+    if timeout is None:
+        while not try_lock_file_descriptor(fd, blocking=True):
+            pass
+        return
+    if try_lock_file_descriptor(fd):
+        return
+    if timeout <= 0:
+        raise AlreadyLocked
+    deadline = time.time() + timeout
+    if not wait_for_lock_with_timer(fd, deadline):
+        delay = 0.001
+        while not try_lock_file_descriptor(fd):
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                raise LockTimeout
+            time.sleep(min(delay, remaining))
+            delay = min(delay * 2, lock_wait_poll_max_delay)
+
+
+def try_lock_file_descriptor(fd, blocking=False):
+    """ Try to take an exclusive lock on the open file `fd`.
+        :Return: ``True`` if locked, or ``False`` if the lock is held
+            elsewhere or the wait was interrupted by a signal.
+
+        """
+    operation = fcntl.LOCK_EX
+    if not blocking:
+        operation |= fcntl.LOCK_NB
+    result = True
+    try:
+        fcntl.flock(fd, operation)
+    except IOError, exc:
+        if exc.errno not in [errno.EWOULDBLOCK, errno.EAGAIN, errno.EINTR]:
+            raise
+        result = False
+    return result
+
+
+def _handle_lock_wait_timer(signal_number, stack_frame):
+    """ Signal handler for the timer ending a wait for a lock. """
+    pass
+
+def wait_for_lock_with_timer(fd, deadline):
+    """ Block until the open file `fd` is locked, or `deadline` passes.
+        :Return: ``False`` if a timer cannot be used to wait;
+            otherwise ``True`` once the file is locked.
+
+        Raise ``LockTimeout`` if the `deadline` passes first.
+
+        """
+    (previous_delay, previous_interval) = signal.getitimer(
+        signal.ITIMER_REAL)
+    if previous_delay:
+        return False
+    try:
+        previous_handler = signal.signal(
+            signal.SIGALRM, _handle_lock_wait_timer)
+    except ValueError:
+        # Signal handlers can be set only in the main thread.
+        return False
+    try:
+        locked = False
+        while not locked:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                raise LockTimeout
+            signal.setitimer(signal.ITIMER_REAL, remaining)
+            locked = try_lock_file_descriptor(fd, blocking=True)
+    finally:
+        signal.setitimer(signal.ITIMER_REAL, 0)
+        signal.signal(signal.SIGALRM, previous_handler)
+    return True
+
+
 def read_pid_from_pidfile(pidfile_path):
     """ Read the PID recorded in the named PID file.
 
@@ -117,7 +1093,47 @@ def read_pid_from_pidfile(pidfile_path):
         the content is not a valid PID, raise ``PIDFileParseError``.
 
         """
-    pid = None
+    (pid, start_time) = read_pid_and_start_time_from_pidfile(pidfile_path)
+    return pid
+
+
+def read_pid_and_start_time_from_pidfile(pidfile_path):
+    """ Read the PID and process start time in the named PID file.
+
+        Return a tuple of the numeric PID and the start time of that
+        process, as recorded in the named PID file; the start time is
+        ``None`` if not recorded, as in a PID file written by an
+        earlier version. If the PID file does not exist, return
+        ``(None, None)``. If the content is not a valid PID, raise
+        ``PIDFileParseError``.
+
+        """
+    record = read_pidfile_record(pidfile_path)
+    if record is None:
+        result = (None, None)
+    else:
+        result = (record[u'pid'], record[u'start_time'])
+    return result
+
+
+def read_pidfile_record(pidfile_path):
+    """ Read the whole record in the named PID file.
+        :Return: A mapping of the items recorded in the PID file, or
+            ``None`` if the PID file does not exist.
+
+        The mapping always has the items 'pid' and 'start_time' (which
+        is ``None`` if not recorded), and also has each of the extra
+        fields (see `make_pidfile_text`) recorded in the file: the
+        'generation' as a number, 'listen_addresses' as a list, and
+        any other field as text. A field with an invalid value is
+        omitted. If the content is not a valid PID, raise
+        ``PIDFileParseError``.
+
+        The file is read once, so the items are all from the same
+        record.
+
+        """
+    result = None
     pidfile = None
     try:
         pidfile = open(pidfile_path, 'r')
@@ -138,32 +1154,315 @@ def read_pid_from_pidfile(pidfile_path):
         #   whitespace, leading zeroes, absence of the trailing
         #   newline, or additional lines in the PID file.
 
-        line = pidfile.readline().strip()
         try:
-            pid = int(line)
-        except ValueError:
-            raise PIDFileParseError(
-                u"PID file %(pidfile_path)r contents invalid" % vars())
-        pidfile.close()
+            line = pidfile.readline().strip()
+            try:
+                pid = int(line)
+            except ValueError:
+                raise PIDFileParseError(
+                    u"PID file %(pidfile_path)r contents invalid" % vars())
+            result = {u'pid': pid, u'start_time': None}
+            for line in pidfile.readlines():
+                (name, sep, value) = line.strip().partition("=")
+                if not sep:
+                    continue
+                name = name.decode('utf-8', 'replace')
+                value = value.decode('utf-8', 'replace')
+                if name in [u'start_time', u'generation']:
+                    try:
+                        result[name] = int(value)
+                    except ValueError:
+                        result.pop(name, None)
+                        if name == u'start_time':
+                            result[name] = None
+                elif name == u'listen_address':
+                    result.setdefault(u'listen_addresses', []).append(value)
+                elif name != u'pid':
+                    result[name] = value
+        finally:
+            pidfile.close()
 
-    return pid
+    return result
+
+
+class PIDFileCache(object):
+    """ Cache of the content of PID files, revalidated on each read.
+
+        Each read of a PID file through the cache costs a single
+        ``stat`` of the file, unless the file has changed since it was
+        last read, in which case it is read and parsed again. A change
+        is detected by the device, inode, size and modification time
+        of the file; since a PID file is replaced by moving a new file
+        into place (see `move_new_pidfile`), each PID file written has
+        a new inode.
+
+        """
+
+    def __init__(self):
+        """ Set up a new instance. """
+        self.entries = {}
+
+    def _read_cached_record(self, pidfile_path):
+        """ Get the record in the named PID file, as cached. """
+        try:
+            pidfile_stat = os.stat(pidfile_path)
+        except OSError, exc:
+            if exc.errno != errno.ENOENT:
+                raise
+            self.entries.pop(pidfile_path, None)
+            return None
+        key = (
+            pidfile_stat.st_dev, pidfile_stat.st_ino,
+            pidfile_stat.st_size, pidfile_stat.st_mtime)
+        entry = self.entries.get(pidfile_path)
+        if entry is not None and entry[0] == key:
+            result = entry[1]
+        else:
+            result = read_pidfile_record(pidfile_path)
+            self.entries[pidfile_path] = (key, result)
+        return result
 
+    def read_record(self, pidfile_path):
+        """ Get the record in the named PID file.
+            :Return: A new mapping as for `read_pidfile_record`.
+            """
+        record = self._read_cached_record(pidfile_path)
+        result = None
+        if record is not None:
+            result = dict(record)
+        return result
 
-def write_pid_to_pidfile(pidfile_path):
+    def read_pid_and_start_time(self, pidfile_path):
+        """ Get the PID and start time in the named PID file.
+            :Return: A tuple as for `read_pid_and_start_time_from_pidfile`.
+            """
+        record = self._read_cached_record(pidfile_path)
+        if record is None:
+            result = (None, None)
+        else:
+            result = (record[u'pid'], record[u'start_time'])
+        return result
+
+    def read_pid(self, pidfile_path):
+        """ Get the PID in the named PID file.
+            :Return: The PID, as for `read_pid_from_pidfile`.
+            """
+        (pid, start_time) = self.read_pid_and_start_time(pidfile_path)
+        return pid
+
+    def clear(self):
+        """ Forget every PID file read. """
+        self.entries.clear()
+
+
+def read_pids(pidfile_paths, cache=None, errors=None):
+    """ Read the PID recorded in each of the named PID files.
+        :Return: A mapping from each path in `pidfile_paths` to the
+            PID in that file, or ``None`` if there is no such file or
+            it cannot be read as a PID file.
+
+        To poll a directory of PID files repeatedly, keep a
+        `PIDFileCache` and give it as `cache`; each unchanged file
+        then costs a single ``stat``.
+
+        A file that cannot be read, or whose content is not a valid
+        PID, does not stop the other files being read; if `errors` is
+        a mapping, the exception for each such path is recorded in it.
+
+        """
+    if cache is None:
+        cache = PIDFileCache()
+    result = {}
+    for pidfile_path in pidfile_paths:
+        try:
+            pid = cache.read_pid(pidfile_path)
+        except (PIDFileParseError, EnvironmentError), exc:
+            pid = None
+            if errors is not None:
+                errors[pidfile_path] = exc
+        result[pidfile_path] = pid
+    return result
+
+
+def write_pid_to_pidfile(pidfile_path, durability=u'none', fields=None):
     """ Write the PID in the named PID file.
 
         Get the numeric process ID (“PID”) of the current process
-        and write it to the named file as a line of text.
+        and write it to a new file as a line of text. If the start
+        time of the current process is available, write it as a
+        following line ``start_time=``\ `ticks`, followed by any
+        extra `fields` (see `make_pidfile_text`). Then link the new
+        file to the named file, which must not already exist, so
+        that the named file never has partial content.
 
+        The `durability` is as for `write_new_pidfile`.
+
+        """
+    (new_fd, new_pidfile_path) = write_new_pidfile(
+        pidfile_path, durability, fields)
+    os.close(new_fd)
+    move_new_pidfile(new_pidfile_path, pidfile_path, durability=durability)
+
+
+pidfile_durabilities = [u'none', u'fdatasync', u'fsync']
+
+def check_pidfile_durability(durability):
+    """ Raise ``ValueError`` unless `durability` is a known durability.
         """
-    open_flags = (os.O_CREAT | os.O_EXCL | os.O_WRONLY)
-    open_mode = (
-        ((os.R_OK | os.W_OK) << 6) |
-        ((os.R_OK) << 3) |
-        ((os.R_OK)))
-    pidfile_fd = os.open(pidfile_path, open_flags, open_mode)
-    pidfile = os.fdopen(pidfile_fd, 'w')
+    if durability not in pidfile_durabilities:
+        error = ValueError(
+            u"Unknown PID file durability: %(durability)r" % vars())
+        raise error
+
 
+def write_new_pidfile(pidfile_path, durability=u'none', fields=None):
+    """ Write the PID of the current process to a new PID file.
+        :Return: A tuple (`fd`, `path`) of the new file, open for
+            reading and writing.
+
+        The new file is created with a unique name in the same
+        directory as the named PID file, to be moved into its place
+        by `move_new_pidfile`. It records any extra `fields`, as for
+        `write_pid_to_pidfile_descriptor`.
+
+        The `durability` is one of `pidfile_durabilities`. If it is
+        ``'fdatasync'`` or ``'fsync'``, the content of the new file
+        is written to disk before returning.
+
+        """
+    check_pidfile_durability(durability)
+    (directory, name) = os.path.split(pidfile_path)
+    (fd, path) = tempfile.mkstemp(prefix=u"%(name)s." % vars(), dir=directory)
+    written = False
+    try:
+        os.fchmod(fd, 0644)
+        write_pid_to_pidfile_descriptor(fd, fields)
+        if durability != u'none':
+            fdatasync = getattr(os, 'fdatasync', os.fsync)
+            fdatasync(fd)
+        written = True
+    finally:
+        if not written:
+            os.close(fd)
+            remove_existing_pidfile(path)
+    result = (fd, path)
+    return result
+
+
+def move_new_pidfile(
+        new_pidfile_path, pidfile_path, replace=False, durability=u'none'):
+    """ Move the new PID file into place as the named PID file.
+
+        If `replace` is true, rename the new file over the named file.
+        Otherwise, link the new file to the named file, raising
+        ``OSError`` if that already exists, then remove the new file.
+        Either way, the named file has the complete content of one
+        file or the other.
+
+        If the `durability` is ``'fsync'``, the directory is then
+        written to disk, so that the named file survives a crash.
+
+        """
+    if replace:
+        os.rename(new_pidfile_path, pidfile_path)
+    else:
+        try:
+            os.link(new_pidfile_path, pidfile_path)
+        finally:
+            remove_existing_pidfile(new_pidfile_path)
+    if durability == u'fsync':
+        directory = os.path.dirname(pidfile_path) or os.curdir
+        directory_fd = os.open(directory, os.O_RDONLY)
+        try:
+            os.fsync(directory_fd)
+        finally:
+            os.close(directory_fd)
+
+
+def write_pid_to_pidfile_descriptor(fd, fields=None):
+    """ Write the PID in the open PID file `fd`, replacing its content.
+
+        The text, made by `make_pidfile_text` with any extra
+        `fields`, is written over the start of the file, which is then
+        truncated to its length.
+
+        """
+    text = make_pidfile_text(os.getpid(), fields)
+    data = text.encode('utf-8')
+    os.lseek(fd, 0, os.SEEK_SET)
+    os.write(fd, data)
+    os.ftruncate(fd, len(data))
+
+
+pidfile_fields = [
+    u'generation', u'state', u'control_socket', u'listen_addresses']
+
+def check_pidfile_fields(fields):
+    """ Raise ``ValueError`` unless `fields` are valid PID file fields.
+
+        Each key of the mapping `fields` must be one of
+        `pidfile_fields`. The 'generation' is a number, the
+        'listen_addresses' a sequence of text, and any other value is
+        text; no text may contain a line break.
+
+        """
+    for (name, value) in fields.items():
+        if name not in pidfile_fields:
+            error = ValueError(u"Unknown PID file field: %(name)r" % vars())
+            raise error
+        if name == u'generation':
+            valid = isinstance(value, (int, long))
+        else:
+            if name == u'listen_addresses':
+                valid = not isinstance(value, basestring)
+                values = list(value)
+            else:
+                valid = True
+                values = [value]
+            for text in values:
+                if not isinstance(text, basestring):
+                    valid = False
+                elif u"\n" in text or u"\r" in text:
+                    valid = False
+        if not valid:
+            error = ValueError(
+                u"Invalid PID file field %(name)s: %(value)r" % vars())
+            raise error
+
+
+def update_pidfile_fields(fields, changes):
+    """ Get the PID file `fields`, updated by `changes`.
+        :Return: A new mapping of `fields` with each item of
+            `changes` set, or removed if its value is ``None``.
+
+        The result is checked by `check_pidfile_fields`.
+
+        """
+    result = dict(fields)
+    for (name, value) in changes.items():
+        if value is None:
+            result.pop(name, None)
+        else:
+            result[name] = value
+    check_pidfile_fields(result)
+    return result
+
+
+def make_pidfile_text(pid, fields=None):
+    """ Make the text of a PID file for the process `pid`.
+
+        The text is the PID as a line of text, then, if the start
+        time of the process is available, a line
+        ``start_time=``\ `ticks`.
+
+        Each of the extra `fields` (a mapping checked by
+        `check_pidfile_fields`) follows as a line `name`\ ``=``\
+        `value`, in the order of `pidfile_fields`, except that each
+        of the 'listen_addresses' has its own line
+        ``listen_address=``\ `address`. A reader that knows only the
+        PID, as described by the FHS, ignores these lines.
+
+        """
     # According to the FHS 2.3 section on PID files in ‘/var/run’:
     #
     #   The file must consist of the process identifier in
@@ -171,10 +1470,67 @@ def write_pid_to_pidfile(pidfile_path):
     #   example, if crond was process number 25, /var/run/crond.pid
     #   would contain three characters: two, five, and newline.
 
-    pid = os.getpid()
-    line = u"%(pid)d\n" % vars()
-    pidfile.write(line)
-    pidfile.close()
+    result = u"%(pid)d\n" % vars()
+    start_time = get_process_start_time(pid)
+    if start_time is not None:
+        result += u"start_time=%(start_time)d\n" % vars()
+    if fields:
+        check_pidfile_fields(fields)
+        for name in pidfile_fields:
+            if name not in fields:
+                continue
+            value = fields[name]
+            if name == u'generation':
+                result += u"generation=%(value)d\n" % vars()
+            elif name == u'listen_addresses':
+                for address in value:
+                    result += u"listen_address=%(address)s\n" % vars()
+            else:
+                result += u"%(name)s=%(value)s\n" % vars()
+    return result
+
+
+def replace_pid_in_pidfile(pidfile_path, durability=u'none', fields=None):
+    """ Replace the PID in the named PID file.
+
+        Write the PID of the current process, with any extra `fields`,
+        to a new file, then rename it over the named PID file, so that
+        the file always contains a complete record. The `durability`
+        is as for `write_new_pidfile`.
+
+        """
+    (new_fd, new_pidfile_path) = write_new_pidfile(
+        pidfile_path, durability, fields)
+    os.close(new_fd)
+    move_new_pidfile(
+        new_pidfile_path, pidfile_path, replace=True, durability=durability)
+
+
+def get_process_start_time(pid):
+    """ Get the start time of the process `pid`.
+        :Return: The time the process started, in clock ticks since
+            the system booted, or ``None`` if not available.
+
+        The start time is read from the Linux ``/proc`` filesystem.
+        Together with its PID, it identifies a process: a process that
+        is later given the same PID has a later start time.
+
+        """
+    result = None
+    stat_path = u"/proc/%(pid)d/stat" % vars()
+    try:
+        stat_file = open(stat_path, 'r')
+        try:
+            stat_text = stat_file.read()
+        finally:
+            stat_file.close()
+        # The command name, in parentheses, may itself contain spaces.
+        # The start time is the 22nd field of the line.
+        fields = stat_text[stat_text.rindex(")") + 1:].split()
+        result = int(fields[19])
+    except (EnvironmentError, ValueError, IndexError):
+        result = None
+    return result
 
 
 def remove_existing_pidfile(pidfile_path):
@@ -21,10 +21,24 @@ import sys
 import os
 import signal
 import errno
+import fcntl
+import socket
+import select
+import time
+import json
+import threading
 
 import pidlockfile
 
-from daemon import DaemonContext
+from daemon import (
+    DaemonContext,
+    INHERITED_LISTEN_FDS_ENV, format_listen_fds,
+    get_cpu_affinity, set_cpu_affinity,
+    call_libc_function,
+    SIG_BLOCK, SIG_SETMASK, set_thread_signal_mask, wait_for_signal,
+    )
+from workerpool import WorkerPool
+from notify import NotifyError
 
 
 class DaemonRunnerError(Exception):
@@ -39,19 +53,45 @@ class DaemonRunnerStartFailureError(RuntimeError, DaemonRunnerError):
 class DaemonRunnerStopFailureError(RuntimeError, DaemonRunnerError):
     """ Raised when failure stopping DaemonRunner. """
 
+class DaemonRunnerReloadFailureError(RuntimeError, DaemonRunnerError):
+    """ Raised when failure reloading DaemonRunner. """
+
 
 class DaemonRunner(object):
     """ Controller for a callable running in a separate background process.
 
         The first command-line argument is the action to take:
 
-        * 'start': Become a daemon and call `app.run()`.
-        * 'stop': Exit the daemon process specified in the PID file.
+        * 'start': Become a daemon and call `app.run()`, or run a
+          pool of worker processes if the app specifies `workers`.
+        * 'stop': Exit the daemon process specified in the PID file,
+          and wait until it has exited.
         * 'restart': Stop, then start.
+        * 'reload': Start a new daemon process, which takes over the
+          listening sockets and the PID file of the daemon process
+          specified in the PID file once it is ready, then exit that
+          daemon process.
+        * 'status': Report on the daemon process specified in the PID
+          file, and exit with the status code defined for an LSB init
+          script.
+
+        If the app has `pidfile_slots`, the second command-line
+        argument, if any, is the slot of the PID file pool for the
+        action; or ``all``, the default. The 'start' action without a
+        slot claims the first free slot. The 'stop' and 'reload'
+        actions without a slot act on every locked slot, and 'restart'
+        then starts one daemon process. The 'status' action without a
+        slot reports on every slot, as a JSON object keyed by slot,
+        and exits with the lowest of their status codes.
 
         """
 
     start_message = u"started with pid %(pid)d"
+    ready_timeout = 60
+    reload_timeout = 60
+    reload_reap_timeout = 5
+    stop_timeout = 10
+    stop_kill = False
 
     def __init__(self, app):
         """ Set up the parameters of a new runner.
@@ -60,7 +100,9 @@ class DaemonRunner(object):
 
             * `stdin_path`, `stdout_path`, `stderr_path`: Filesystem
               paths to open and replace the existing `sys.stdin`,
-              `sys.stdout`, `sys.stderr`.
+              `sys.stdout`, `sys.stderr`. The files are opened (see
+              `open_streams`) only by the actions that start a daemon
+              process.
 
             * `pidfile_path`: Absolute filesystem path to a file that
               will be used as the PID file for the daemon. If
@@ -71,28 +113,163 @@ class DaemonRunner(object):
 
             * `run`: Callable that will be invoked when the daemon is
               started.
-            
+
+            The `app` may also have the following optional attributes:
+
+            * `preload`: Callable that will be invoked before the
+              daemon detaches, to prepare state that the daemon will
+              only read thereafter. See the `preload` option of
+              `DaemonContext`.
+
+            * `resource_limits`: Mapping of resource limits for the
+              daemon process, as for the `resource_limits` option of
+              `DaemonContext`.
+
+            * `ready_timeout`: Seconds for which the 'start' action
+              waits until the daemon is ready, as for the
+              `ready_timeout` option of `DaemonContext` (default: the
+              runner's `ready_timeout`); if ``None``, 'start' does not
+              wait. See `report_ready` for when the daemon is ready.
+
+            * `reports_ready`: If true, the app reports when it is
+              ready: the runner sets the app's `report_ready`
+              attribute to its own `report_ready` method before it
+              calls `app.run()`, and the app calls it once it can do
+              its work. Otherwise the daemon is ready just before
+              `app.run()` is called. This does not apply to an app
+              with `workers`.
+
+            * `pidfile_lock`: How the PID file is locked: ``'link'``
+              (the default), by a hard link to a lock file, as for
+              `pidlockfile.PIDLockFile`; or ``'flock'``, by a kernel
+              lock on the PID file itself, which is released when the
+              daemon process exits, as for
+              `pidlockfile.FlockPIDLockFile`.
+
+            * `pidfile_durability`: Whether the PID file is written to
+              disk before the daemon starts: ``'none'`` (the default);
+              ``'fdatasync'``, to write its content; or ``'fsync'``, to
+              write its content and its directory entry, so that it
+              survives a crash. See `pidlockfile.write_new_pidfile`.
+
+            * `pidfile_slots`: Number of daemon processes that may run
+              at once from this app, each with its own PID file,
+              ``name.``\ `slot`\ ``.pid`` for the `pidfile_path`
+              ``name.pid`` (see `pidlockfile.PIDLockPool`). The slot
+              of the daemon process is set as the app's `pidfile_slot`
+              attribute: at once, if named on the command line, so
+              that the app can choose (for instance) its stream files
+              and addresses to suit; otherwise when it claims a free
+              slot, once the daemon context is open and before the
+              app runs.
+
+            * `stop_timeout`: Seconds for which the 'stop' action
+              waits until the daemon process exits (default: the
+              runner's `stop_timeout`).
+
+            * `stop_kill`: If true, the 'stop' action kills the daemon
+              process with ``SIGKILL`` if it has not exited within
+              `stop_timeout` seconds, instead of failing (default: the
+              runner's `stop_kill`).
+
+            * `workers`: Number of worker processes. If this attribute
+              is present, the daemon process becomes the master of a
+              `WorkerPool` that forks this many worker processes, and
+              restarts each that exits; if ``None``, the number of
+              CPUs available to the daemon. Each worker calls
+              `app.run_worker(index)` if the app has that attribute,
+              else `app.run()`.
+
+            * `worker_cpu_affinity`: CPUs on which each worker process
+              may run. Either a sequence, whose item `index` (wrapping
+              around) is the collection of CPU numbers for the worker
+              with that index; or ``'spread'``, to pin each worker to
+              a distinct one of the CPUs available to the daemon (while
+              there are enough).
+
+            * `listen_addresses`: Sequence of addresses on which to
+              listen, as for the `listen_addresses` option of
+              `DaemonContext`. Before the app runs, its `listen_sockets`
+              attribute is set to a list of one listening socket for
+              each address.
+
+            * `listen_strategy`: How worker processes share the
+              listening sockets: ``'shared'`` (the default), where all
+              workers accept connections on the same socket; or
+              ``'reuseport'``, where each worker has its own socket
+              with the ``SO_REUSEPORT`` option, and the kernel
+              balances connections across them.
+
             """
-        self.parse_args()
         self.app = app
+        self.parse_args()
         self.daemon_context = DaemonContext()
-        self.daemon_context.stdin = open(app.stdin_path, 'r')
-        self.daemon_context.stdout = open(app.stdout_path, 'w+')
-        self.daemon_context.stderr = open(
-            app.stderr_path, 'w+', buffering=0)
+        self.daemon_context.preload = getattr(app, 'preload', None)
+        self.daemon_context.resource_limits = getattr(
+            app, 'resource_limits', None)
+        self.daemon_context.ready_timeout = getattr(
+            app, 'ready_timeout', self.ready_timeout)
+        self.stop_timeout = getattr(app, 'stop_timeout', self.stop_timeout)
+        self.stop_kill = getattr(app, 'stop_kill', self.stop_kill)
 
         self.pidfile = None
-        if app.pidfile_path is not None:
+        self.pidfile_pool = None
+        self.pidfile_slot = None
+        pidfile_slots = getattr(app, 'pidfile_slots', None)
+        if app.pidfile_path is None:
+            pass
+        elif pidfile_slots is None:
             self.pidfile = make_pidlockfile(
-                app.pidfile_path, app.pidfile_timeout)
+                app.pidfile_path, app.pidfile_timeout,
+                getattr(app, 'pidfile_lock', u'link'),
+                getattr(app, 'pidfile_durability', u'none'))
+        else:
+            self.pidfile_pool = make_pidlockpool(
+                app.pidfile_path, pidfile_slots, app.pidfile_timeout,
+                getattr(app, 'pidfile_lock', u'link'),
+                getattr(app, 'pidfile_durability', u'none'))
+            self.pidfile = self.pidfile_pool
+            slot = self._parse_pidfile_slot()
+            if slot is not None:
+                self._set_pidfile_slot(slot)
         self.daemon_context.pidfile = self.pidfile
 
+        self.daemon_pid = None
+        self._inherited_lock_fd = None
+        self._ready_reported = False
+        self.daemon_context.signal_map[reload_signal] = (
+            self._handle_reload_signal)
+
+        self.worker_pool = None
+        if hasattr(app, 'workers'):
+            self.worker_pool = WorkerPool(self._run_worker, app.workers)
+            self.worker_pool.start_action = self.report_ready
+            self.worker_pool.signal_actions[reload_signal] = (
+                self._reload_daemon_process)
+
+        self.worker_cpu_affinity = getattr(app, 'worker_cpu_affinity', None)
+
+        self.daemon_context.listen_addresses = getattr(
+            app, 'listen_addresses', None)
+        listen_strategy = getattr(app, 'listen_strategy', u'shared')
+        if listen_strategy not in listen_strategies:
+            error = ValueError(
+                u"Unknown listen strategy: %(listen_strategy)r" % vars())
+            raise error
+        if listen_strategy == u'reuseport':
+            reuse_port_copies = 1
+            if self.worker_pool is not None:
+                reuse_port_copies = self.worker_pool.workers
+            self.daemon_context.reuse_port_copies = reuse_port_copies
+
     def _usage_exit(self, argv):
         """ Emit a usage message, then exit.
             """
         progname = os.path.basename(argv[0])
         usage_exit_code = 2
         action_usage = u"|".join(self.action_funcs.keys())
+        if getattr(self.app, 'pidfile_slots', None) is not None:
+            action_usage += u" [SLOT|all]"
         message = u"usage: %(progname)s %(action_usage)s" % vars()
         emit_message(message)
         sys.exit(usage_exit_code)
@@ -111,34 +288,457 @@ class DaemonRunner(object):
         if self.action not in self.action_funcs:
             self._usage_exit(argv)
 
+        self.action_args = argv[2:]
+        program_path = os.path.abspath(argv[0])
+        self.reload_argv = (
+            [sys.executable, program_path, u'start'] + argv[2:])
+
+    def _parse_pidfile_slot(self):
+        """ Parse the slot of the PID file pool for the action.
+            :Return: The slot index named on the command line, or
+                ``None`` for every slot.
+
+            Emits a usage message and exits if the argument is not a
+            slot of the pool, nor ``all``.
+
+            """
+        result = None
+        if not self.action_args or self.action_args[0] == u'all':
+            return result
+        slot_arg = self.action_args[0]
+        try:
+            result = int(slot_arg)
+        except ValueError:
+            result = None
+        if result is None or not 0 <= result < len(self.pidfile_pool.locks):
+            self._usage_exit(sys.argv)
+        return result
+
+    def _set_pidfile_slot(self, slot):
+        """ Use the PID file in `slot` of the pool, and tell the app.
+
+            A new daemon process started by the 'reload' action takes
+            over the same slot.
+
+            """
+        self.pidfile_slot = slot
+        self.pidfile = self.pidfile_pool.locks[slot]
+        self.app.pidfile_slot = slot
+        self.reload_argv[3:4] = [unicode(slot)]
+
+    def _targets_all_slots(self):
+        """ Determine whether the action is for every slot of the pool.
+            """
+        result = (self.pidfile_pool is not None and self.pidfile_slot is None)
+        return result
+
+    def open_streams(self):
+        """ Open the files for the standard streams of the daemon.
+
+            The app's `stdin_path` is opened for reading, and its
+            `stdout_path` and `stderr_path` for appending, as the
+            `stdin`, `stdout` and `stderr` of the daemon context.
+
+            This is called only by the actions that start a daemon
+            process, just before the daemon context is opened, so the
+            other actions leave the files of a running daemon alone. A
+            subclass may override this to set up the streams otherwise.
+
+            """
+        app = self.app
+        self.daemon_context.stdin = open(app.stdin_path, 'r')
+        self.daemon_context.stdout = open(app.stdout_path, 'a+')
+        self.daemon_context.stderr = open(
+            app.stderr_path, 'a+', buffering=0)
+
     def _start(self):
         """ Open the daemon context and run the application.
+
+            If this process was started by the ``reload`` action, it
+            takes over from the previous daemon process once the daemon
+            context is open.
+
+            The PID file records the generation of the daemon process
+            (one more than that of the process it takes over from, or
+            1), its listening addresses, and its state: ``'starting'``
+            until it is ready, then ``'ready'``.
+
+            The original process waits until the daemon process is
+            ready, or has failed, and exits with a status to match (see
+            the `ready_timeout` option of `DaemonContext`). The daemon
+            is ready when `report_ready` is called: by the app, if it
+            `reports_ready`; once the `WorkerPool` has started its
+            workers; or else just before the app runs.
+
             """
-        if is_pidfile_stale(self.pidfile):
+        reload_socket = pop_reload_socket()
+        generation = 1
+        if reload_socket is not None:
+            # The PID file is taken over once this process is ready.
+            generation = self._get_previous_generation() + 1
+            self.daemon_context.pidfile = None
+            files_preserve = list(self.daemon_context.files_preserve or [])
+            files_preserve.append(reload_socket)
+            self._inherited_lock_fd = pop_inherited_lock_fd()
+            if self._inherited_lock_fd is not None:
+                files_preserve.append(self._inherited_lock_fd)
+            self.daemon_context.files_preserve = files_preserve
+        elif self._targets_all_slots():
+            for pidfile in self.pidfile_pool.locks:
+                if is_pidfile_stale(pidfile):
+                    pidfile.break_lock()
+        elif is_pidfile_stale(self.pidfile):
             self.pidfile.break_lock()
+        starting_fields = {u'generation': generation, u'state': u'starting'}
+        if self._targets_all_slots():
+            # The slot is not yet claimed, so whichever is claimed
+            # records the fields.
+            for pidfile in self.pidfile_pool.locks:
+                pidfile.update_fields(starting_fields)
+        elif self.pidfile is not None:
+            self.pidfile.update_fields(starting_fields)
+
+        self.open_streams()
+        try:
+            self._open_daemon_context(reload_socket)
+        except Exception, exc:
+            reason = unicode(exc) or unicode(exc.__class__.__name__)
+            self.daemon_context.report_failed(reason)
+            raise
+
+        pid = self.daemon_pid
+        message = self.start_message % vars()
+        emit_message(message)
+
+        if self.worker_pool is None:
+            self._set_app_listen_sockets(0)
+            self._start_reload_thread()
+            if getattr(self.app, 'reports_ready', False):
+                self.app.report_ready = self.report_ready
+            else:
+                self.report_ready()
+            self.app.run()
+        else:
+            self.worker_pool.run()
+
+    def report_ready(self):
+        """ Report that the daemon process is ready.
+            :Return: ``None``
+
+            Record the ``'ready'`` state and the listening addresses in
+            the PID file, report to the original process that the
+            daemon is ready (see `DaemonContext.report_ready`), and tell
+            the supervisor, if notified (see `DaemonContext`), that the
+            daemon is ready, and the daemon process ID. Only the first
+            call has any effect.
+
+            """
+        if self._ready_reported:
+            return
+        self._ready_reported = True
+        if self.pidfile is not None:
+            self.pidfile.update_fields({
+                u'state': u'ready',
+                u'listen_addresses': self._get_listen_addresses(),
+                })
+        self.daemon_context.report_ready()
+        pid = self.daemon_pid
+        self._notify_supervisor(u"MAINPID=%(pid)d\nREADY=1" % vars())
 
+    def _open_daemon_context(self, reload_socket):
+        """ Open the daemon context, and take over if reloading. """
         try:
             self.daemon_context.open()
         except pidlockfile.AlreadyLocked:
             pidfile_path = self.pidfile.path
+            if self._targets_all_slots():
+                raise DaemonRunnerStartFailureError(
+                    u"Every slot of PID file %(pidfile_path)r already locked"
+                    % vars())
             raise DaemonRunnerStartFailureError(
                 u"PID file %(pidfile_path)r already locked" % vars())
 
-        pid = os.getpid()
-        message = self.start_message % vars()
-        emit_message(message)
+        self.daemon_pid = os.getpid()
+        if self._targets_all_slots():
+            self._set_pidfile_slot(self.pidfile_pool.slot)
+        if reload_socket is not None:
+            self._take_over_daemon(reload_socket)
+
+    def _get_previous_generation(self):
+        """ Get the generation recorded in the PID file, or 0 if none. """
+        result = 0
+        if self.pidfile is None:
+            return result
+        try:
+            record = self.pidfile.read_record()
+        except (pidlockfile.PIDFileParseError, EnvironmentError):
+            record = None
+        if record is not None:
+            result = record.get(u'generation', result)
+        return result
+
+    def _get_listen_addresses(self):
+        """ Get the addresses of the listening sockets, as text.
+            :Return: A list with the address of each of the listening
+                sockets (see `format_socket_address`), or ``None`` if
+                there are none.
+
+            """
+        if self.daemon_context.listen_addresses is None:
+            return None
+        result = [
+            format_socket_address(sockets[0].getsockname())
+            for sockets in self.daemon_context.listen_sockets]
+        return result
+
+    def _set_app_listen_sockets(self, index):
+        """ Give the app the listening sockets for worker `index`.
+
+            Any listening sockets belonging to other workers are closed
+            in this process.
+
+            """
+        if self.daemon_context.listen_addresses is None:
+            return
+        listen_sockets = self.daemon_context.get_listen_sockets(index)
+        for sockets in self.daemon_context.listen_sockets:
+            for sock in sockets:
+                if sock not in listen_sockets:
+                    sock.close()
+        self.app.listen_sockets = listen_sockets
+
+    def _get_worker_cpu_affinity(self, index):
+        """ Get the CPUs on which worker `index` may run.
+            :Return: A collection of CPU numbers, or ``None``.
+            """
+        worker_cpu_affinity = self.worker_cpu_affinity
+        if worker_cpu_affinity == u'spread':
+            available_cpus = sorted(get_cpu_affinity())
+            result = [available_cpus[index % len(available_cpus)]]
+        elif worker_cpu_affinity:
+            result = worker_cpu_affinity[index % len(worker_cpu_affinity)]
+        else:
+            result = None
+        return result
+
+    def _run_worker(self, index):
+        """ Run the application in the worker process `index`.
+            """
+        # Only the daemon process handles the reload signal; system calls
+        # in a worker resume after it.
+        signal.siginterrupt(reload_signal, False)
+        cpus = self._get_worker_cpu_affinity(index)
+        if cpus is not None:
+            set_cpu_affinity(cpus)
+        self._set_app_listen_sockets(index)
+        run_worker = getattr(self.app, 'run_worker', None)
+        if run_worker is not None:
+            run_worker(index)
+        else:
+            self.app.run()
+
+    def _notify_supervisor(self, state):
+        """ Notify the supervisor, if any, of the text `state`. """
+        notifier = self.daemon_context.notifier
+        if notifier is None:
+            return
+        try:
+            notifier.notify(state)
+        except NotifyError, exc:
+            emit_message(u"notification failed: %(exc)s" % vars())
+
+    def _take_over_daemon(self, reload_socket):
+        """ Take over from the daemon process this process replaces.
+
+            Report to the previous daemon process that this process is
+            ready, and when it agrees, take over the PID file.
+
+            """
+        try:
+            send_reload_message(reload_socket, u"ready")
+            deadline = time.time() + self.reload_timeout
+            message = receive_reload_message(reload_socket, deadline)
+            if message != u"proceed":
+                raise DaemonRunnerStartFailureError(
+                    u"Previous daemon process declined: %(message)r"
+                    % vars())
+            if self.pidfile is not None:
+                self.pidfile.take_over(self._inherited_lock_fd)
+                self.daemon_context.pidfile = self.pidfile
+            try:
+                send_reload_message(reload_socket, u"done")
+            except DaemonRunnerReloadFailureError:
+                # This process holds the PID file now, regardless.
+                pass
+        finally:
+            reload_socket.close()
+
+    def _hand_over_daemon(self):
+        """ Hand over this daemon process to a new daemon process.
+
+            Start a new daemon process that inherits the listening
+            sockets, wait (for up to `reload_timeout` seconds) until it
+            reports it is ready, then let it take over the PID file. A
+            PID file locked by an open file (see `pidfile_lock`) is
+            taken over by inheriting that file. If the hand-over fails,
+            wait up to `reload_reap_timeout` seconds to reap the child
+            process.
+
+            """
+        (control_socket, reload_socket) = socket.socketpair()
+        set_close_on_exec(control_socket.fileno(), True)
+        environ = dict(os.environ)
+        environ[RELOAD_FD_ENV] = str(reload_socket.fileno())
+        inherit_fds = [reload_socket.fileno()]
+        listen_sockets = self.daemon_context.listen_sockets
+        if listen_sockets:
+            environ[INHERITED_LISTEN_FDS_ENV] = str(
+                format_listen_fds(listen_sockets))
+            inherit_fds.extend(
+                sock.fileno() for sockets in listen_sockets
+                for sock in sockets)
+        if self.pidfile is not None:
+            lock_fd = self.pidfile.fileno()
+            if lock_fd is not None:
+                environ[RELOAD_LOCK_FD_ENV] = str(lock_fd)
+                inherit_fds.append(lock_fd)
+
+        pid = os.fork()
+        if pid == 0:
+            exec_new_daemon(self.reload_argv, environ, inherit_fds)
+        reload_socket.close()
+
+        handed_over = False
+        try:
+            deadline = time.time() + self.reload_timeout
+            message = receive_reload_message(control_socket, deadline)
+            if message != u"ready":
+                raise DaemonRunnerReloadFailureError(
+                    u"New daemon process not ready: %(message)r" % vars())
+            send_reload_message(control_socket, u"proceed")
+            try:
+                receive_reload_message(control_socket, deadline)
+            except DaemonRunnerReloadFailureError:
+                # Whether the PID file was taken over is checked below.
+                pass
+            if self.pidfile is not None:
+                if self.pidfile.i_am_locking():
+                    raise DaemonRunnerReloadFailureError(
+                        u"New daemon process did not take over PID file")
+                self.pidfile.relinquish()
+                self.daemon_context.pidfile = None
+            handed_over = True
+        finally:
+            control_socket.close()
+            reap_timeout = self.reload_reap_timeout
+            if handed_over:
+                # This process terminates next, and the child process
+                # is then reaped by its new parent.
+                reap_timeout = 0
+            reap_child_process(pid, reap_timeout)
+
+    def _handle_reload_signal(self, signal_number, stack_frame):
+        """ Signal handler for the reload signal.
+
+            Ignore the signal. The daemon process hands over on reload
+            from the reload thread (see `_start_reload_thread`), or
+            from the master loop of its `WorkerPool`; a worker process,
+            or a daemon process not yet running the application, does
+            not. The handler (rather than ignoring the signal outright)
+            keeps the signal pending while it is blocked.
+
+            """
 
-        self.app.run()
+    def _start_reload_thread(self):
+        """ Start the thread that hands over the daemon on reload.
+
+            The application's `run` owns the main thread, so the
+            hand-over, which forks and waits on the new daemon process,
+            runs in a separate thread. The reload signal is blocked in
+            every thread, and the reload thread waits for it to be
+            pending; so the signal never interrupts a system call in
+            the application. Processes the application starts inherit
+            the blocked signal.
+
+            """
+        try:
+            set_thread_signal_mask(SIG_BLOCK, [reload_signal])
+        except OSError, exc:
+            emit_message(u"reload unavailable: %(exc)s" % vars())
+            return
+        thread = threading.Thread(
+            target=self._run_reload_loop, name="reload")
+        thread.daemon = True
+        thread.start()
+
+    def _run_reload_loop(self):
+        """ Hand over the daemon process whenever the reload signal arrives.
+
+            Every signal is blocked in the reload thread, so that the
+            main thread handles any other signal.
+
+            """
+        set_thread_signal_mask(SIG_SETMASK)
+        while True:
+            wait_for_signal([reload_signal])
+            self._reload_daemon_process()
+
+    def _reload_daemon_process(self):
+        """ Hand over to a new daemon process, then terminate.
+
+            Hand over the daemon process to a new daemon process, then
+            terminate this process as for ``SIGTERM``. If the hand-over
+            fails, this process continues as the daemon process, and
+            tells the supervisor so.
+
+            """
+        try:
+            self._hand_over_daemon()
+        except DaemonRunnerReloadFailureError, exc:
+            emit_message(u"reload failed: %(exc)s" % vars())
+            # The new daemon process may have announced itself as main.
+            pid = self.daemon_pid
+            self._notify_supervisor(u"MAINPID=%(pid)d" % vars())
+            return
+        os.kill(self.daemon_pid, signal.SIGTERM)
 
     def _terminate_daemon_process(self):
         """ Terminate the daemon process specified in the current PID file.
+
+            Send ``SIGTERM`` to the daemon process, and wait up to
+            `stop_timeout` seconds until it exits. If it is still
+            running, and `stop_kill` is true, send ``SIGKILL`` and wait
+            as long again, breaking the lock it leaves on the PID file.
+
             """
         pid = self.pidfile.read_pid()
+        # Refer to the process before signalling it, lest its PID be reused.
+        pidfd = open_process_fd(pid)
         try:
-            os.kill(pid, signal.SIGTERM)
-        except OSError, exc:
-            raise DaemonRunnerStopFailureError(
-                u"Failed to terminate %(pid)d: %(exc)s" % vars())
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except OSError, exc:
+                raise DaemonRunnerStopFailureError(
+                    u"Failed to terminate %(pid)d: %(exc)s" % vars())
+            timeout = self.stop_timeout
+            exited = wait_for_process_exit(pid, timeout, pidfd)
+            if not exited and self.stop_kill:
+                try:
+                    os.kill(pid, signal.SIGKILL)
+                except OSError, exc:
+                    if exc.errno != errno.ESRCH:
+                        raise DaemonRunnerStopFailureError(
+                            u"Failed to kill %(pid)d: %(exc)s" % vars())
+                exited = wait_for_process_exit(pid, timeout, pidfd)
+                if exited and is_pidfile_stale(self.pidfile):
+                    self.pidfile.break_lock()
+            if not exited:
+                raise DaemonRunnerStopFailureError(
+                    u"Process %(pid)d did not exit within %(timeout)r seconds"
+                    % vars())
+        finally:
+            if pidfd is not None:
+                os.close(pidfd)
 
     def _stop(self):
         """ Exit the daemon process specified in the current PID file.
@@ -159,10 +759,186 @@ class DaemonRunner(object):
         self._stop()
         self._start()
 
+    def _reload(self):
+        """ Replace the daemon process specified in the current PID file.
+
+            The daemon process is sent the reload signal, upon which it
+            hands over to a new daemon process.
+
+            """
+        if not self.pidfile.is_locked():
+            pidfile_path = self.pidfile.path
+            raise DaemonRunnerReloadFailureError(
+                u"PID file %(pidfile_path)r not locked" % vars())
+
+        if is_pidfile_stale(self.pidfile):
+            pidfile_path = self.pidfile.path
+            raise DaemonRunnerReloadFailureError(
+                u"PID file %(pidfile_path)r is stale" % vars())
+
+        pid = self.pidfile.read_pid()
+        try:
+            os.kill(pid, reload_signal)
+        except OSError, exc:
+            raise DaemonRunnerReloadFailureError(
+                u"Failed to reload %(pid)d: %(exc)s" % vars())
+
+    def _get_daemon_status(self):
+        """ Get the status of the daemon process in the PID file.
+            :Return: A mapping with items 'status' (one of the keys of
+                `status_exit_codes`) and 'pid'; and, if the daemon
+                process is running, 'uptime' (seconds), 'rss' (bytes
+                of resident memory) and 'fds' (number of open file
+                descriptors), each ``None`` if unavailable, and any of
+                the fields 'generation', 'state', 'control_socket' and
+                'listen_addresses' recorded in the PID file.
+
+            The process is taken to be running if a signal can be sent
+            to it. It is not the daemon process if its PID has been
+            reused: if its start time differs from that in the PID
+            file, or (for a PID file that records no start time) if it
+            started after the PID file was written.
+
+            """
+        result = {u'status': u'unknown', u'pid': None}
+        if self.pidfile is None:
+            return result
+        try:
+            pid = self.pidfile.read_pid()
+        except (pidlockfile.PIDFileParseError, EnvironmentError):
+            return result
+
+        result[u'pid'] = pid
+        if pid is None:
+            result[u'status'] = u'not running'
+        elif not is_process_running(pid):
+            result[u'status'] = u'dead'
+        elif is_pid_reused(self.pidfile, pid):
+            result[u'status'] = u'dead'
+        else:
+            info = get_process_info(pid)
+            start_time = None
+            if info is not None:
+                start_time = info['start_time']
+            if (start_time is not None
+                    and self.pidfile.read_start_time(pid) is None):
+                # The process must have started before writing the file.
+                try:
+                    pidfile_mtime = os.path.getmtime(self.pidfile.path)
+                except OSError:
+                    info = None
+                else:
+                    if start_time > (
+                            pidfile_mtime + process_start_time_tolerance):
+                        info = None
+            if info is None:
+                result[u'status'] = u'dead'
+            else:
+                result[u'status'] = u'running'
+                uptime = None
+                if start_time is not None:
+                    uptime = round(max(time.time() - start_time, 0), 2)
+                result[u'uptime'] = uptime
+                result[u'rss'] = info['rss']
+                result[u'fds'] = info['fds']
+                record = None
+                try:
+                    record = self.pidfile.read_record()
+                except (pidlockfile.PIDFileParseError, EnvironmentError):
+                    pass
+                if record is not None and record[u'pid'] == pid:
+                    for name in pidlockfile.pidfile_fields:
+                        if name in record:
+                            result[name] = record[name]
+
+        return result
+
+    def _do_action_in_slots(self, action_func, error_class):
+        """ Perform `action_func` for each locked slot of the pool.
+
+            Raises `error_class` if no slot of the pool is locked.
+
+            """
+        pidfiles = [
+            pidfile for pidfile in self.pidfile_pool.locks
+            if pidfile.is_locked()]
+        if not pidfiles:
+            pidfile_path = self.pidfile_pool.path
+            raise error_class(
+                u"No slot of PID file %(pidfile_path)r locked" % vars())
+        try:
+            for pidfile in pidfiles:
+                self.pidfile = pidfile
+                action_func()
+        finally:
+            self.pidfile = self.pidfile_pool
+
+    def _stop_all_slots(self):
+        """ Exit the daemon process in each locked slot of the pool.
+            """
+        self._do_action_in_slots(self._stop, DaemonRunnerStopFailureError)
+
+    def _restart_all_slots(self):
+        """ Stop every slot, then start in the first free slot.
+            """
+        self._stop_all_slots()
+        self._start()
+
+    def _reload_all_slots(self):
+        """ Replace the daemon process in each locked slot of the pool.
+            """
+        self._do_action_in_slots(
+            self._reload, DaemonRunnerReloadFailureError)
+
+    def _status_all_slots(self):
+        """ Report on the daemon process in each slot of the pool.
+
+            Emit to `sys.stdout` a JSON object of the status of each
+            slot (see `_get_daemon_status`), keyed by slot index, then
+            exit with the lowest of their status codes: success if any
+            slot is running.
+
+            """
+        statuses = {}
+        try:
+            for (slot, pidfile) in enumerate(self.pidfile_pool.locks):
+                self.pidfile = pidfile
+                statuses[unicode(slot)] = self._get_daemon_status()
+        finally:
+            self.pidfile = self.pidfile_pool
+        message = json.dumps(statuses, sort_keys=True)
+        emit_message(message, sys.stdout)
+        exit_code = min(
+            status_exit_codes[status[u'status']]
+            for status in statuses.values())
+        sys.exit(exit_code)
+
+    def _status(self):
+        """ Report on the daemon process specified in the PID file.
+
+            Emit to `sys.stdout` the status of the daemon process as a
+            JSON object (see `_get_daemon_status`), then exit with the
+            status code defined for an LSB init script.
+
+            """
+        status = self._get_daemon_status()
+        message = json.dumps(status, sort_keys=True)
+        emit_message(message, sys.stdout)
+        sys.exit(status_exit_codes[status[u'status']])
+
     action_funcs = {
         u'start': _start,
         u'stop': _stop,
         u'restart': _restart,
+        u'reload': _reload,
+        u'status': _status,
+        }
+
+    pool_action_funcs = {
+        u'stop': _stop_all_slots,
+        u'restart': _restart_all_slots,
+        u'reload': _reload_all_slots,
+        u'status': _status_all_slots,
         }
 
     def _get_action_func(self):
@@ -183,9 +959,27 @@ class DaemonRunner(object):
         """ Perform the requested action.
             """
         func = self._get_action_func()
+        if self._targets_all_slots():
+            func = self.pool_action_funcs.get(self.action, func)
         func(self)
 
 
+listen_strategies = [u'shared', u'reuseport']
+
+reload_signal = signal.SIGUSR2
+
+RELOAD_FD_ENV = "PYTHON_DAEMON_RELOAD_FD"
+RELOAD_LOCK_FD_ENV = "PYTHON_DAEMON_RELOAD_LOCK_FD"
+
+# Exit status of the 'status' action, as for an LSB init script.
+status_exit_codes = {
+    u'running': 0,
+    u'dead': 1,
+    u'not running': 3,
+    u'unknown': 4,
+    }
+
+
 def emit_message(message, stream=None):
     """ Emit a message to the specified stream (default `sys.stderr`). """
     if stream is None:
@@ -194,25 +988,356 @@ def emit_message(message, stream=None):
     stream.flush()
 
 
-def make_pidlockfile(path, acquire_timeout):
-    """ Make a PIDLockFile instance with the given filesystem path. """
+def set_close_on_exec(fd, close_on_exec):
+    """ Set or clear the close-on-exec flag of a file descriptor. """
+    flags = fcntl.fcntl(fd, fcntl.F_GETFD)
+    if close_on_exec:
+        flags |= fcntl.FD_CLOEXEC
+    else:
+        flags &= ~fcntl.FD_CLOEXEC
+    fcntl.fcntl(fd, fcntl.F_SETFD, flags)
+
+
+def exec_new_daemon(argv, environ, inherit_fds):
+    """ Replace this process with a new daemon process.
+
+        Execute the program `argv` with the environment `environ`,
+        leaving the file descriptors `inherit_fds` open, and no signals
+        blocked, across the execution. This function does not return;
+        if the program cannot be executed, the process exits.
+
+        """
+    try:
+        # The calling thread may block signals (see
+        # `DaemonRunner._start_reload_thread`).
+        set_thread_signal_mask(SIG_SETMASK, [])
+        for fd in inherit_fds:
+            set_close_on_exec(fd, False)
+        os.execve(argv[0], argv, environ)
+    except EnvironmentError, exc:
+        emit_message(u"Unable to start new daemon process (%(exc)s)" % vars())
+    finally:
+        os._exit(127)
+
+
+def pop_reload_socket():
+    """ Remove the reload socket from the environment.
+        :Return: The socket connected to the previous daemon process,
+            or ``None`` if this process was not started by ``reload``.
+
+        """
+    result = None
+    text = os.environ.pop(RELOAD_FD_ENV, None)
+    if text is not None:
+        try:
+            fd = int(text)
+            result = socket.fromfd(fd, socket.AF_UNIX, socket.SOCK_STREAM)
+            os.close(fd)
+        except (ValueError, socket.error, OSError), exc:
+            raise DaemonRunnerStartFailureError(
+                u"Invalid reload socket %(text)r: %(exc)s" % vars())
+    return result
+
+
+def pop_inherited_lock_fd():
+    """ Remove the inherited PID file lock from the environment.
+        :Return: The file descriptor holding the lock on the PID file
+            of the previous daemon process, or ``None`` if this process
+            did not inherit one.
+
+        """
+    result = None
+    text = os.environ.pop(RELOAD_LOCK_FD_ENV, None)
+    if text is not None:
+        try:
+            result = int(text)
+        except ValueError, exc:
+            raise DaemonRunnerStartFailureError(
+                u"Invalid PID file lock %(text)r: %(exc)s" % vars())
+    return result
+
+
+def send_reload_message(sock, message):
+    """ Send a message between old and new daemon processes. """
+    data = u"%(message)s\n" % vars()
+    try:
+        sock.sendall(data.encode('ascii'))
+    except socket.error, exc:
+        raise DaemonRunnerReloadFailureError(
+            u"Failed to send %(message)r: %(exc)s" % vars())
+
+
+def receive_reload_message(sock, deadline):
+    """ Receive a message between old and new daemon processes.
+        :Return: The text of the message.
+
+        Raise ``DaemonRunnerReloadFailureError`` if the connection is
+        closed, or the time `deadline` passes, before a complete
+        message arrives.
+
+        """
+    data = ""
+    while not data.endswith("\n"):
+        timeout = deadline - time.time()
+        if timeout <= 0:
+            raise DaemonRunnerReloadFailureError(
+                u"Timed out waiting for message")
+        sock.settimeout(timeout)
+        try:
+            # Read no further than the end of this message.
+            chunk = sock.recv(1)
+        except socket.timeout:
+            continue
+        except socket.error, exc:
+            if exc.args[0] == errno.EINTR:
+                continue
+            raise DaemonRunnerReloadFailureError(
+                u"Failed to receive message: %(exc)s" % vars())
+        if not chunk:
+            raise DaemonRunnerReloadFailureError(
+                u"Connection closed while waiting for message")
+        data += chunk
+    result = data.strip().decode('ascii')
+    return result
+
+
+child_reap_poll_max_delay = 0.1
+
+def reap_child_process(pid, timeout=0):
+    """ Reap the child process `pid`, waiting up to `timeout` seconds.
+        :Return: ``True`` if the process was reaped (or is not a child
+            of this process), ``False`` if it had not exited in time.
+
+        """
+    deadline = time.time() + timeout
+    delay = 0.001
+    while True:
+        try:
+            (reaped_pid, status) = os.waitpid(pid, os.WNOHANG)
+        except OSError, exc:
+            if exc.errno == errno.EINTR:
+                continue
+            if exc.errno != errno.ECHILD:
+                raise
+            return True
+        if reaped_pid != 0:
+            return True
+        if time.time() >= deadline:
+            return False
+        time.sleep(delay)
+        delay = min(delay * 2, child_reap_poll_max_delay)
+
+
+def format_socket_address(address):
+    """ Format the socket `address` (as from ``getsockname``) as text.
+        :Return: ``host:port`` for an IPv4 address, ``[host]:port``
+            for an IPv6 address, the path for a Unix-domain address,
+            or ``@name`` for an abstract Unix-domain address.
+
+        """
+    if isinstance(address, tuple):
+        (host, port) = address[:2]
+        if len(address) == 4:
+            host = u"[%(host)s]" % vars()
+        result = u"%(host)s:%(port)d" % vars()
+    elif address.startswith("\0"):
+        result = u"@" + address[1:].decode('utf-8', 'replace')
+    else:
+        result = address.decode('utf-8', 'replace')
+    return result
+
+
+pidfile_locks = [u'link', u'flock']
+
+def make_pidlockfile(
+        path, acquire_timeout, lock=u'link', durability=u'none'):
+    """ Make a PIDLockFile instance with the given filesystem path.
+
+        If `lock` is ``'flock'``, make a `FlockPIDLockFile` instance
+        instead (see the `pidfile_lock` attribute of the app). The
+        PID file is written with the specified `durability`.
+
+        """
     if not isinstance(path, basestring):
         error = ValueError(u"Not a filesystem path: %(path)r" % vars())
         raise error
     if not os.path.isabs(path):
         error = ValueError(u"Not an absolute path: %(path)r" % vars())
         raise error
-    lockfile = pidlockfile.TimeoutPIDLockFile(path, acquire_timeout)
+    if lock not in pidfile_locks:
+        error = ValueError(u"Unknown PID file lock: %(lock)r" % vars())
+        raise error
+    if lock == u'flock':
+        lockfile_class = pidlockfile.TimeoutFlockPIDLockFile
+    else:
+        lockfile_class = pidlockfile.TimeoutPIDLockFile
+    lockfile = lockfile_class(path, acquire_timeout, durability=durability)
 
     return lockfile
 
 
+def make_pidlockpool(
+        path, slots, acquire_timeout, lock=u'link', durability=u'none'):
+    """ Make a pool of `slots` PID file locks for the specified path.
+        :Return: A `pidlockfile.PIDLockPool` instance, whose slot
+            locks are made as for `make_pidlockfile`.
+
+        """
+    if not isinstance(slots, (int, long)) or slots < 1:
+        error = ValueError(u"Invalid PID file slots: %(slots)r" % vars())
+        raise error
+    locks = [
+        make_pidlockfile(
+            pidlockfile.get_pidfile_slot_path(path, slot),
+            acquire_timeout, lock, durability)
+        for slot in range(slots)]
+    result = pidlockfile.PIDLockPool(path, locks, acquire_timeout)
+    return result
+
+
+PIDFD_OPEN_SYSCALL_NUMBER = 434
+
+def open_process_fd(pid):
+    """ Open a file descriptor referring to the process `pid`.
+        :Return: The file descriptor, or ``None`` if not supported.
+
+        The file descriptor becomes readable when the process exits,
+        and keeps referring to that process even if its PID is reused.
+        The ``pidfd_open`` system call is used, which is specific to
+        Linux (since version 5.3), and has the same number on every
+        architecture.
+
+        """
+    result = None
+    if sys.platform.startswith('linux'):
+        try:
+            result = call_libc_function(
+                'syscall', PIDFD_OPEN_SYSCALL_NUMBER, pid, 0)
+        except (OSError, TypeError):
+            result = None
+    return result
+
+
+def is_process_running(pid):
+    """ Determine whether the process `pid` is running. """
+    result = True
+    try:
+        os.kill(pid, signal.SIG_DFL)
+    except OSError, exc:
+        if exc.errno == errno.ESRCH:
+            result = False
+    return result
+
+
+proc_root = "/proc"
+
+# Slack allowed between clocks, when comparing a process start time.
+process_start_time_tolerance = 1.0
+
+def get_process_info(pid):
+    """ Get information about the running process `pid`.
+        :Return: A mapping with items 'start_time' (seconds since the
+            epoch), 'rss' (bytes of resident memory) and 'fds' (number
+            of open file descriptors), each ``None`` if unavailable; or
+            ``None`` if the process is not running.
+
+        The information is read from the Linux ``/proc`` filesystem;
+        where that is not available, every item is ``None``.
+
+        """
+    result = dict(start_time=None, rss=None, fds=None)
+    if not os.path.isdir(os.path.join(proc_root, "self")):
+        return result
+
+    process_path = os.path.join(proc_root, str(pid))
+    try:
+        stat_text = read_proc_file(os.path.join(process_path, "stat"))
+        uptime_text = read_proc_file(os.path.join(proc_root, "uptime"))
+    except EnvironmentError, exc:
+        if exc.errno == errno.ENOENT:
+            result = None
+        return result
+
+    # The command name, in parentheses, may itself contain spaces.
+    # Fields are numbered from the state, the third field of the line.
+    fields = stat_text[stat_text.rindex(")") + 1:].split()
+    if fields[0] in ["Z", "X"]:
+        # A zombie process has exited, but has not been reaped.
+        return None
+    start_ticks = int(fields[19])
+    rss_pages = int(fields[21])
+    system_uptime = float(uptime_text.split()[0])
+    clock_ticks = os.sysconf('SC_CLK_TCK')
+    process_uptime = system_uptime - (start_ticks / float(clock_ticks))
+    result['start_time'] = time.time() - process_uptime
+    result['rss'] = rss_pages * os.sysconf('SC_PAGE_SIZE')
+    try:
+        result['fds'] = len(os.listdir(os.path.join(process_path, "fd")))
+    except OSError:
+        # The process may belong to another user.
+        pass
+
+    return result
+
+
+def read_proc_file(path):
+    """ Read the entire text of the ``/proc`` file at `path`. """
+    proc_file = open(path, 'r')
+    try:
+        result = proc_file.read()
+    finally:
+        proc_file.close()
+    return result
+
+
+process_exit_poll_max_delay = 0.1
+
+def wait_for_process_exit(pid, timeout, pidfd=None):
+    """ Wait up to `timeout` seconds for the process `pid` to exit.
+        :Return: ``True`` if the process has exited, else ``False``.
+
+        If `pidfd` is not ``None``, it is a file descriptor from
+        `open_process_fd`, and this sleeps in `poll` until it is
+        readable. Otherwise, check whether the process is running
+        at intervals doubling from a millisecond, up to
+        `process_exit_poll_max_delay` seconds.
+
+        """
+    deadline = time.time() + timeout
+    if pidfd is not None:
+        poller = select.poll()
+        poller.register(pidfd, select.POLLIN)
+        exited = False
+        while not exited:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                break
+            try:
+                exited = bool(poller.poll(remaining * 1000))
+            except select.error, exc:
+                if exc.args[0] != errno.EINTR:
+                    raise
+    else:
+        delay = 0.001
+        exited = not is_process_running(pid)
+        while not exited:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                break
+            time.sleep(min(delay, remaining))
+            delay = min(delay * 2, process_exit_poll_max_delay)
+            exited = not is_process_running(pid)
+
+    return exited
+
+
 def is_pidfile_stale(pidfile):
     """ Determine whether a PID file is stale.
 
         Return ``True`` (“stale”) if the contents of the PID file are
-        valid but do not match the PID of a currently-running process;
-        otherwise return ``False``.
+        valid but do not match the PID of a currently-running process,
+        or the process with that PID is not the one that wrote the PID
+        file (see `is_pid_reused`); otherwise return ``False``.
 
         """
     result = False
@@ -225,5 +1350,24 @@ def is_pidfile_stale(pidfile):
             if exc.errno == errno.ESRCH:
                 # The specified PID does not exist
                 result = True
+        if not result:
+            result = is_pid_reused(pidfile, pidfile_pid)
+
+    return result
+
 
+def is_pid_reused(pidfile, pid):
+    """ Determine whether the PID in a PID file has been reused.
+
+        Return ``True`` if the PID file records a start time for the
+        process `pid`, and the process now running with that PID
+        started at a different time; otherwise return ``False``.
+
+        """
+    result = False
+    recorded_start_time = pidfile.read_start_time(pid)
+    if recorded_start_time is not None:
+        start_time = pidlockfile.get_process_start_time(pid)
+        if start_time is not None and start_time != recorded_start_time:
+            result = True
     return result
@@ -0,0 +1,385 @@
+# -*- coding: utf-8 -*-
+
+# daemon/workerpool.py
+# Part of python-daemon, an implementation of PEP 3143.
+#
+# Copyright © 2026 agent <agent@local>
+#
+# This is free software: you may copy, modify, and/or distribute this work
+# under the terms of the Python Software Foundation License, version 2 or
+# later as published by the Python Software Foundation.
+# No warranty expressed or implied. See the file LICENSE.PSF-2 for details.
+
+""" Pool of worker processes forked from a daemon process.
+    """
+
+import os
+import sys
+import errno
+import fcntl
+import signal
+import select
+import time
+import traceback
+
+
+class WorkerPoolError(Exception):
+    """ Abstract base class for errors from WorkerPool. """
+
+class WorkerPoolValueError(ValueError, WorkerPoolError):
+    """ Raised when a WorkerPool parameter is invalid. """
+
+
+PROC_STATUS_PATH = u"/proc/self/status"
+
+
+class WorkerPool(object):
+    """ Master supervising a pool of forked worker processes.
+
+        The master process forks `workers` worker processes, each of
+        which calls `target` with its worker index (from 0 up to
+        `workers` − 1) and exits when `target` returns.
+
+        While the pool runs, the master:
+
+        * once it has forked the initial workers, calls the
+          `start_action`, if any, with no arguments;
+
+        * sleeps until a signal arrives, without polling;
+
+        * reaps each worker process that exits, and forks a
+          replacement with the same index;
+
+        * on ``SIGTERM`` or ``SIGINT``, forwards the signal to every
+          worker, waits for all of them to exit, and returns;
+
+        * on any other signal in the `signal_actions` mapping, calls
+          the action for that signal, with no arguments, from its
+          loop (not from the signal handler).
+
+        A replacement for a worker that exited less than
+        `respawn_delay` seconds after it started is forked only after
+        that delay, so that a worker that fails at start-up does not
+        make the master spin.
+
+        """
+
+    stop_signals = [signal.SIGTERM, signal.SIGINT]
+
+    def __init__(self, target, workers=None, respawn_delay=1.0):
+        """ Set up the parameters of a new worker pool.
+
+            If `workers` is ``None``, the number of worker processes
+            is the number of CPUs available to this process.
+
+            """
+        if workers is None:
+            workers = get_available_cpu_count()
+        if workers < 1:
+            raise WorkerPoolValueError(
+                u"Invalid number of workers: %(workers)r" % vars())
+
+        self.target = target
+        self.workers = workers
+        self.respawn_delay = respawn_delay
+
+        self.worker_pids = {}
+        self.worker_start_times = {}
+        self.pending_respawns = {}
+        self.stop_signal = None
+        self.start_action = None
+        self.signal_actions = {}
+        self.pending_signals = set()
+
+        self._wakeup_fds = None
+        self._saved_signal_handlers = {}
+
+    def _get_master_signals(self):
+        """ Get the signals handled by the master process. """
+        result = (
+            [signal.SIGCHLD] + self.stop_signals
+            + list(self.signal_actions.keys()))
+        return result
+
+    def _handle_signal(self, signal_number, stack_frame):
+        """ Signal handler for the master process.
+
+            Record a stop signal, or a signal with an action, and
+            wake the master process.
+
+            """
+        if signal_number in self.stop_signals:
+            self.stop_signal = signal_number
+        elif signal_number in self.signal_actions:
+            self.pending_signals.add(signal_number)
+        try:
+            os.write(self._wakeup_fds[1], "\0")
+        except OSError, exc:
+            if exc.errno != errno.EAGAIN:
+                raise
+
+    def _install_signal_handlers(self):
+        """ Set up the wake-up pipe and the master signal handlers. """
+        self._wakeup_fds = make_wakeup_pipe()
+        for signal_number in self._get_master_signals():
+            self._saved_signal_handlers[signal_number] = signal.signal(
+                signal_number, self._handle_signal)
+
+    def _restore_signal_handlers(self):
+        """ Restore the signal handlers, and close the wake-up pipe. """
+        for (signal_number, handler) in (
+                self._saved_signal_handlers.items()):
+            signal.signal(signal_number, handler)
+        self._saved_signal_handlers = {}
+        if self._wakeup_fds is not None:
+            for fd in self._wakeup_fds:
+                os.close(fd)
+            self._wakeup_fds = None
+
+    def spawn_worker(self, index):
+        """ Fork a worker process with the specified index.
+            :Return: The process ID of the worker process.
+
+            The worker process never returns from this method.
+
+            """
+        pid = os.fork()
+        if pid == 0:
+            self._run_worker(index)
+        self.worker_pids[pid] = index
+        self.worker_start_times[index] = time.time()
+        return pid
+
+    def _run_worker(self, index):
+        """ Run the target in a worker process, then exit the process.
+
+            The worker process inherits the signal handlers that were
+            in place before the master installed its own, and exits
+            with the status from any ``SystemExit`` raised by the
+            target. Any other exception is reported on `sys.stderr`
+            and the process exits with status 1.
+
+            """
+        exit_code = 0
+        try:
+            self._restore_signal_handlers()
+            self.target(index)
+        except SystemExit, exc:
+            exit_code = get_system_exit_status(exc)
+        except Exception:
+            traceback.print_exc()
+            exit_code = 1
+        try:
+            sys.stdout.flush()
+            sys.stderr.flush()
+        finally:
+            os._exit(exit_code)
+
+    def reap_workers(self):
+        """ Reap every worker process that has exited.
+
+            Schedule a replacement for each reaped worker, unless the
+            pool is stopping.
+
+            """
+        while self.worker_pids:
+            try:
+                (pid, status) = os.waitpid(-1, os.WNOHANG)
+            except OSError, exc:
+                if exc.errno == errno.EINTR:
+                    continue
+                if exc.errno == errno.ECHILD:
+                    break
+                raise
+            if pid == 0:
+                break
+            index = self.worker_pids.pop(pid, None)
+            if index is None:
+                continue
+            if self.stop_signal is None:
+                now = time.time()
+                due_time = now
+                start_time = self.worker_start_times[index]
+                if now - start_time < self.respawn_delay:
+                    due_time = start_time + self.respawn_delay
+                self.pending_respawns[index] = due_time
+
+    def perform_signal_actions(self):
+        """ Call the action for each signal that has arrived. """
+        while self.pending_signals:
+            signal_number = self.pending_signals.pop()
+            self.signal_actions[signal_number]()
+
+    def respawn_workers(self):
+        """ Fork the replacement workers that are now due. """
+        now = time.time()
+        for (index, due_time) in sorted(self.pending_respawns.items()):
+            if due_time <= now:
+                del self.pending_respawns[index]
+                self.spawn_worker(index)
+
+    def _get_wait_timeout(self):
+        """ Get the seconds until the next replacement worker is due.
+            :Return: The timeout, or ``None`` if none is pending.
+            """
+        result = None
+        if self.pending_respawns:
+            due_time = min(self.pending_respawns.values())
+            result = max(0, due_time - time.time())
+        return result
+
+    def _wait_for_wakeup(self, timeout):
+        """ Sleep until a signal arrives or `timeout` seconds pass. """
+        wakeup_read_fd = self._wakeup_fds[0]
+        try:
+            (readable, writable, errored) = select.select(
+                [wakeup_read_fd], [], [], timeout)
+        except (select.error, OSError), exc:
+            if exc.args[0] != errno.EINTR:
+                raise
+            readable = []
+        if readable:
+            drain_wakeup_pipe(wakeup_read_fd)
+
+    def stop_workers(self, signal_number=signal.SIGTERM):
+        """ Send a signal to every worker, and wait for all to exit. """
+        self.pending_respawns = {}
+        for pid in self.worker_pids.keys():
+            try:
+                os.kill(pid, signal_number)
+            except OSError, exc:
+                if exc.errno != errno.ESRCH:
+                    raise
+        while self.worker_pids:
+            try:
+                (pid, status) = os.waitpid(-1, 0)
+            except OSError, exc:
+                if exc.errno == errno.EINTR:
+                    continue
+                if exc.errno == errno.ECHILD:
+                    self.worker_pids = {}
+                    break
+                raise
+            self.worker_pids.pop(pid, None)
+
+    def run(self):
+        """ Run the master process until a stop signal arrives.
+            :Return: ``None``
+            """
+        self.stop_signal = None
+        self.pending_signals = set()
+        self._install_signal_handlers()
+        try:
+            for index in range(self.workers):
+                self.spawn_worker(index)
+            if self.start_action is not None:
+                self.start_action()
+            while self.stop_signal is None:
+                self._wait_for_wakeup(self._get_wait_timeout())
+                self.reap_workers()
+                if self.stop_signal is None:
+                    self.perform_signal_actions()
+                if self.stop_signal is None:
+                    self.respawn_workers()
+            self.stop_workers(self.stop_signal)
+        finally:
+            self._restore_signal_handlers()
+
+
+def make_wakeup_pipe():
+    """ Make a non-blocking pipe for waking the master process.
+        :Return: A tuple (`read_fd`, `write_fd`).
+        """
+    result = os.pipe()
+    for fd in result:
+        flags = fcntl.fcntl(fd, fcntl.F_GETFL)
+        fcntl.fcntl(fd, fcntl.F_SETFL, flags | os.O_NONBLOCK)
+        flags = fcntl.fcntl(fd, fcntl.F_GETFD)
+        fcntl.fcntl(fd, fcntl.F_SETFD, flags | fcntl.FD_CLOEXEC)
+    return result
+
+
+def drain_wakeup_pipe(fd):
+    """ Read and discard everything waiting in the wake-up pipe. """
+    while True:
+        try:
+            data = os.read(fd, 4096)
+        except OSError, exc:
+            if exc.errno == errno.EAGAIN:
+                break
+            raise
+        if not data:
+            break
+
+
+def get_system_exit_status(exc):
+    """ Get the process exit status for a ``SystemExit`` exception. """
+    code = exc.code
+    if code is None:
+        result = 0
+    elif isinstance(code, (int, long)):
+        result = code
+    else:
+        sys.stderr.write(u"%(code)s\n" % vars())
+        result = 1
+    return result
+
+
+def get_available_cpu_count():
+    """ Get the number of CPUs available to this process.
+
+        Use the CPU affinity mask of this process where it can be
+        determined, otherwise the number of CPUs on the system, or
+        ``1`` if neither can be determined.
+
+        """
+    result = None
+    sched_getaffinity = getattr(os, 'sched_getaffinity', None)
+    if sched_getaffinity is not None:
+        result = len(sched_getaffinity(0))
+    if result is None:
+        result = read_allowed_cpu_count(PROC_STATUS_PATH)
+    if result is None:
+        try:
+            result = os.sysconf('SC_NPROCESSORS_ONLN')
+        except (ValueError, OSError):
+            result = None
+    if not result or result < 1:
+        result = 1
+    return result
+
+
+def read_allowed_cpu_count(path):
+    """ Read the number of allowed CPUs from a process status file.
+        :Return: The number of CPUs, or ``None`` if not available.
+
+        Count the CPUs in the ``Cpus_allowed_list`` field.
+
+        """
+    result = None
+    try:
+        status_file = open(path, 'r')
+    except IOError:
+        status_file = None
+    if status_file is not None:
+        for line in status_file:
+            if line.startswith("Cpus_allowed_list:"):
+                cpu_list = line.split(":", 1)[1].strip()
+                result = count_cpu_list(cpu_list)
+                break
+        status_file.close()
+    return result
+
+
+def count_cpu_list(cpu_list):
+    """ Count the CPUs in a CPU list of the form ``0-3,8,10-11``. """
+    result = 0
+    for item in cpu_list.split(","):
+        if not item:
+            continue
+        if "-" in item:
+            (low, high) = item.split("-", 1)
+            result += int(high) - int(low) + 1
+        else:
+            result += 1
+    return result
@@ -0,0 +1,540 @@
+# -*- coding: utf-8 -*-
+#
+# test/benchmark.py
+# Part of python-daemon, an implementation of PEP 3143.
+#
+# Copyright © 2026 agent <agent@local>
+#
+# This is free software: you may copy, modify, and/or distribute this work
+# under the terms of the Python Software Foundation License, version 2 or
+# later as published by the Python Software Foundation.
+# No warranty expressed or implied. See the file LICENSE.PSF-2 for details.
+
+""" Benchmark suite for daemon start-up and control costs.
+
+    Unlike the unit tests, these benchmarks really daemonise child
+    processes, in temporary directories, and measure the wall-clock
+    time taken by:
+
+    * `DaemonContext.open`, across a range of limits on open file
+      descriptors, parent process sizes, and numbers of open files;
+
+    * the `DaemonRunner` actions ‘start’, ‘stop’, and ‘restart’;
+
+    * `PIDLockFile.acquire` and `PIDLockFile.release`;
+
+    * the memory each forked worker process dirties during a garbage
+      collection, with and without the `preload` option of
+      `DaemonContext` freezing the preloaded objects.
+
+    The results are written as JSON, so that runs against different
+    revisions can be compared mechanically. Run with ``--help`` for
+    the available options.
+
+    """
+
+import os
+import sys
+import time
+import resource
+import tempfile
+import shutil
+import signal
+import subprocess
+import optparse
+import json
+import gc
+
+test_dir = os.path.dirname(os.path.abspath(__file__))
+parent_dir = os.path.dirname(test_dir)
+if not parent_dir in sys.path:
+    sys.path.insert(1, parent_dir)
+
+import daemon
+from daemon import pidlockfile
+
+
+size_suffixes = {
+    u'K': 2 ** 10,
+    u'M': 2 ** 20,
+    u'G': 2 ** 30,
+    }
+
+def parse_size(text):
+    """ Parse a size in bytes, with an optional ‘K’, ‘M’, or ‘G’ suffix. """
+    text = text.strip().upper()
+    multiplier = 1
+    if text[-1:] in size_suffixes:
+        multiplier = size_suffixes[text[-1:]]
+        text = text[:-1]
+    result = int(text) * multiplier
+    return result
+
+
+def parse_list(text, parse_func=int):
+    """ Parse a comma-separated list of values. """
+    result = [parse_func(item) for item in text.split(u',') if item.strip()]
+    return result
+
+
+def summarise_times(times):
+    """ Summarise a sequence of durations (or other values) as a mapping. """
+    ordered = sorted(times)
+    result = {
+        'count': len(ordered),
+        'min': ordered[0],
+        'median': ordered[len(ordered) // 2],
+        'max': ordered[-1],
+        }
+    return result
+
+
+def wait_for(predicate, timeout, interval=0.001):
+    """ Wait until `predicate` returns true, or `timeout` seconds pass.
+        :Return: ``True`` if the predicate became true, else ``False``.
+        """
+    deadline = time.time() + timeout
+    result = predicate()
+    while not result and time.time() < deadline:
+        time.sleep(interval)
+        result = predicate()
+    return result
+
+
+def make_ballast(size):
+    """ Make an object occupying `size` bytes of resident memory. """
+    ballast = bytearray(size)
+    page_size = resource.getpagesize()
+    for offset in xrange(0, size, page_size):
+        ballast[offset] = 1
+    return ballast
+
+
+def open_context_in_child(nofile_limit, rss, open_files, work_dir):
+    """ Daemonise a child process and measure `DaemonContext.open`.
+        :Return: A mapping of the measurements reported by the daemon.
+
+        In a forked child, set the file descriptor limit to
+        `nofile_limit`, grow the process by `rss` bytes, open
+        `open_files` extra file descriptors, then open a
+        `DaemonContext`. The resulting daemon process reports its
+        measurements back through a pipe.
+
+        """
+    (read_fd, write_fd) = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        os.close(read_fd)
+        report = {}
+        try:
+            resource.setrlimit(
+                resource.RLIMIT_NOFILE, (nofile_limit, nofile_limit))
+            ballast = make_ballast(rss)
+            extra_fds = [
+                os.open(os.devnull, os.O_RDONLY)
+                for i in xrange(open_files)]
+
+            step_timings = []
+            def record_timing(step_name, start, duration):
+                step_timings.append((step_name, duration))
+
+            context = daemon.DaemonContext(
+                working_directory=work_dir,
+                files_preserve=[write_fd],
+                detach_process=True,
+                timing_callback=record_timing,
+                )
+            start = time.time()
+            context.open()
+            duration = time.time() - start
+
+            report['seconds'] = duration
+            report['steps'] = dict(step_timings)
+            report['close_files_strategy'] = (
+                daemon.daemon.probe_close_files_strategy())
+        except Exception, exc:
+            report['error'] = u"%(exc)s" % vars()
+        os.write(write_fd, json.dumps(report))
+        os._exit(0)
+
+    os.close(write_fd)
+    chunks = []
+    chunk = os.read(read_fd, 65536)
+    while chunk:
+        chunks.append(chunk)
+        chunk = os.read(read_fd, 65536)
+    os.close(read_fd)
+    os.waitpid(pid, 0)
+
+    text = "".join(chunks)
+    if text:
+        result = json.loads(text)
+    else:
+        result = {'error': u"No report from daemon process"}
+    return result
+
+
+def benchmark_daemon_context_open(options, work_dir):
+    """ Benchmark `DaemonContext.open` across the parameter space. """
+    results = []
+    for nofile_limit in options.nofile_limits:
+        for rss in options.rss_sizes:
+            for open_files in options.open_files:
+                params = {
+                    'nofile_limit': nofile_limit,
+                    'rss': rss,
+                    'open_files': open_files,
+                    }
+                reports = [
+                    open_context_in_child(
+                        nofile_limit, rss, open_files, work_dir)
+                    for i in range(options.repeat)]
+                result = {
+                    'benchmark': u"DaemonContext.open",
+                    'params': params,
+                    }
+                errors = [r['error'] for r in reports if 'error' in r]
+                if errors:
+                    result['error'] = errors[0]
+                else:
+                    result['seconds'] = summarise_times(
+                        [r['seconds'] for r in reports])
+                    result['steps'] = reports[0]['steps']
+                    result['close_files_strategy'] = (
+                        reports[0]['close_files_strategy'])
+                results.append(result)
+    return results
+
+
+runner_app_template = u"""\
+import sys
+import time
+sys.path.insert(0, %(parent_dir)r)
+from daemon import runner
+
+class App(object):
+    stdin_path = %(devnull)r
+    stdout_path = %(devnull)r
+    stderr_path = %(devnull)r
+    pidfile_path = %(pidfile_path)r
+    pidfile_timeout = 5
+
+    def run(self):
+        while True:
+            time.sleep(60)
+
+runner.DaemonRunner(App()).do_action()
+"""
+
+def run_runner_action(app_path, action):
+    """ Run the runner application with the specified action.
+        :Return: The exit status of the command.
+        """
+    devnull = open(os.devnull, 'w')
+    result = subprocess.call(
+        [sys.executable, app_path, action],
+        stdout=devnull, stderr=devnull, close_fds=True)
+    devnull.close()
+    return result
+
+
+def benchmark_daemon_runner(options, work_dir):
+    """ Benchmark the `DaemonRunner` start, stop and restart actions.
+
+        Each action is timed from running the command until its
+        effect is visible: the PID file naming a new process for
+        ‘start’ and ‘restart’, and the PID file being removed for
+        ‘stop’.
+
+        """
+    pidfile_path = os.path.join(work_dir, u"runner.pid")
+    app_path = os.path.join(work_dir, u"runner_app.py")
+    app_file = open(app_path, 'w')
+    app_file.write(runner_app_template % dict(
+        parent_dir=parent_dir,
+        devnull=os.devnull,
+        pidfile_path=pidfile_path,
+        ))
+    app_file.close()
+
+    def read_pid():
+        try:
+            result = pidlockfile.read_pid_from_pidfile(pidfile_path)
+        except pidlockfile.PIDFileParseError:
+            result = None
+        return result
+
+    times = dict((action, []) for action in [u'start', u'stop', u'restart'])
+    errors = {}
+
+    def measure(action, predicate):
+        start = time.time()
+        status = run_runner_action(app_path, action)
+        if status != 0:
+            errors.setdefault(
+                action, u"Exit status %(status)d" % vars())
+        elif not wait_for(predicate, options.timeout):
+            errors.setdefault(
+                action, u"Timed out after %r seconds" % options.timeout)
+        else:
+            times[action].append(time.time() - start)
+
+    for i in range(options.repeat):
+        measure(u'start', lambda: read_pid() is not None)
+        old_pid = read_pid()
+        measure(
+            u'restart',
+            lambda: read_pid() not in [None, old_pid])
+        measure(u'stop', lambda: not os.path.exists(pidfile_path))
+
+        pid = read_pid()
+        if pid is not None:
+            try:
+                os.kill(pid, signal.SIGKILL)
+            except OSError:
+                pass
+            pidlockfile.TimeoutPIDLockFile(pidfile_path).break_lock()
+
+    results = []
+    for action in [u'start', u'stop', u'restart']:
+        result = {
+            'benchmark': u"DaemonRunner.%(action)s" % vars(),
+            'params': {},
+            }
+        if action in errors:
+            result['error'] = errors[action]
+        if times[action]:
+            result['seconds'] = summarise_times(times[action])
+        results.append(result)
+    return results
+
+
+def get_private_dirty_size():
+    """ Return the private dirty memory of this process, in bytes. """
+    try:
+        smaps_file = open(u"/proc/self/smaps_rollup")
+    except IOError:
+        smaps_file = open(u"/proc/self/smaps")
+    result = 0
+    for line in smaps_file:
+        if line.startswith("Private_Dirty:"):
+            result += int(line.split()[1]) * 1024
+    smaps_file.close()
+    return result
+
+
+def build_preload_table(size):
+    """ Build a table of `size` small objects, as a daemon might preload. """
+    result = dict(
+        (index, [u"%(index)d" % vars(), float(index)])
+        for index in xrange(size))
+    return result
+
+
+def measure_workers_in_child(use_preload, table_size, workers, work_dir):
+    """ Measure memory dirtied by workers forked from a daemon.
+        :Return: A list of the bytes dirtied by each worker.
+
+        In a forked child, build a table of `table_size` objects,
+        either through the `preload` option of `DaemonContext` (if
+        `use_preload` is true) or before opening the context. The
+        resulting daemon forks `workers` worker processes, each of
+        which reports how much private memory a full garbage
+        collection dirties in it.
+
+        """
+    (read_fd, write_fd) = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        os.close(read_fd)
+        tables = []
+        def preload():
+            tables.append(build_preload_table(table_size))
+
+        context = daemon.DaemonContext(
+            working_directory=work_dir,
+            files_preserve=[write_fd],
+            detach_process=True,
+            )
+        if use_preload:
+            context.preload = preload
+            context.preload_collect = True
+        else:
+            preload()
+        context.open()
+
+        worker_pids = []
+        for i in range(workers):
+            worker_pid = os.fork()
+            if worker_pid == 0:
+                before = get_private_dirty_size()
+                gc.collect()
+                dirtied = get_private_dirty_size() - before
+                os.write(write_fd, "%(dirtied)d\n" % vars())
+                os._exit(0)
+            worker_pids.append(worker_pid)
+        for worker_pid in worker_pids:
+            os.waitpid(worker_pid, 0)
+        os._exit(0)
+
+    os.close(write_fd)
+    chunks = []
+    chunk = os.read(read_fd, 65536)
+    while chunk:
+        chunks.append(chunk)
+        chunk = os.read(read_fd, 65536)
+    os.close(read_fd)
+    os.waitpid(pid, 0)
+
+    result = [int(line) for line in "".join(chunks).split()]
+    return result
+
+
+def benchmark_preload(options, work_dir):
+    """ Benchmark per-worker memory with and without a frozen preload. """
+    results = []
+    for use_preload in [False, True]:
+        dirtied = []
+        for i in range(options.repeat):
+            dirtied.extend(measure_workers_in_child(
+                use_preload, options.preload_objects, options.workers,
+                work_dir))
+        result = {
+            'benchmark': u"worker GC dirty memory",
+            'params': {
+                'preload': use_preload,
+                'preload_objects': options.preload_objects,
+                'workers': options.workers,
+                'gc_freeze_available': hasattr(gc, 'freeze'),
+                },
+            }
+        if dirtied:
+            result['bytes'] = summarise_times(dirtied)
+        else:
+            result['error'] = u"No report from worker processes"
+        results.append(result)
+    return results
+
+
+def benchmark_pidlockfile(options, work_dir):
+    """ Benchmark `PIDLockFile.acquire` and `PIDLockFile.release`. """
+    pidfile_path = os.path.join(work_dir, u"lock.pid")
+    lock = pidlockfile.PIDLockFile(pidfile_path)
+
+    acquire_times = []
+    release_times = []
+    for i in range(options.lock_iterations):
+        start = time.time()
+        lock.acquire()
+        acquire_times.append(time.time() - start)
+        start = time.time()
+        lock.release()
+        release_times.append(time.time() - start)
+
+    results = [
+        {
+            'benchmark': u"PIDLockFile.acquire",
+            'params': {},
+            'seconds': summarise_times(acquire_times),
+            },
+        {
+            'benchmark': u"PIDLockFile.release",
+            'params': {},
+            'seconds': summarise_times(release_times),
+            },
+        ]
+    return results
+
+
+benchmark_funcs = {
+    u'open': benchmark_daemon_context_open,
+    u'runner': benchmark_daemon_runner,
+    u'pidlockfile': benchmark_pidlockfile,
+    u'preload': benchmark_preload,
+    }
+
+
+def make_option_parser():
+    """ Make the command-line option parser. """
+    parser = optparse.OptionParser(
+        usage=u"%prog [options] [benchmark ...]",
+        description=(
+            u"Run the named benchmarks (default: all of "
+            + u", ".join(sorted(benchmark_funcs)) + u")"
+            u" and write the results as JSON."))
+    parser.add_option(
+        u"--nofile", dest="nofile_limits", metavar=u"LIMITS",
+        default=u"1024,65536,1048576",
+        help=u"Comma-separated RLIMIT_NOFILE values (default: %default)")
+    parser.add_option(
+        u"--rss", dest="rss_sizes", metavar=u"SIZES",
+        default=u"10M,512M,2G",
+        help=u"Comma-separated parent process sizes (default: %default)")
+    parser.add_option(
+        u"--open-files", dest="open_files", metavar=u"COUNTS",
+        default=u"0,1000",
+        help=u"Comma-separated counts of open files (default: %default)")
+    parser.add_option(
+        u"--repeat", dest="repeat", type="int", default=3,
+        help=u"Repetitions of each measurement (default: %default)")
+    parser.add_option(
+        u"--lock-iterations", dest="lock_iterations", type="int",
+        default=1000,
+        help=u"Lock acquire/release iterations (default: %default)")
+    parser.add_option(
+        u"--preload-objects", dest="preload_objects", type="int",
+        default=200000,
+        help=u"Objects in the preloaded table (default: %default)")
+    parser.add_option(
+        u"--workers", dest="workers", type="int", default=4,
+        help=u"Workers forked from the preloaded daemon (default: %default)")
+    parser.add_option(
+        u"--timeout", dest="timeout", type="float", default=10.0,
+        help=u"Seconds to wait for a runner action (default: %default)")
+    parser.add_option(
+        u"-o", u"--output", dest="output", metavar=u"FILE",
+        help=u"Write the results to FILE (default: stdout)")
+    return parser
+
+
+def main(argv=None):
+    """ Run the benchmarks and emit the results. """
+    if argv is None:
+        argv = sys.argv
+    parser = make_option_parser()
+    (options, args) = parser.parse_args(argv[1:])
+    options.nofile_limits = parse_list(options.nofile_limits)
+    options.rss_sizes = parse_list(options.rss_sizes, parse_size)
+    options.open_files = parse_list(options.open_files)
+
+    names = args or sorted(benchmark_funcs)
+    for name in names:
+        if name not in benchmark_funcs:
+            parser.error(u"Unknown benchmark: %(name)r" % vars())
+
+    work_dir = tempfile.mkdtemp(prefix=u"daemon-benchmark-")
+    results = []
+    try:
+        for name in names:
+            results.extend(benchmark_funcs[name](options, work_dir))
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    report = {
+        'version': daemon.version.version,
+        'python': sys.version.split()[0],
+        'platform': sys.platform,
+        'time': time.time(),
+        'results': results,
+        }
+    text = json.dumps(report, indent=2, sort_keys=True)
+    if options.output is None:
+        sys.stdout.write(text + u"\n")
+    else:
+        output_file = open(options.output, 'w')
+        output_file.write(text + u"\n")
+        output_file.close()
+
+
+if __name__ == '__main__':
+    main()
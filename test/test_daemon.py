@@ -13,17 +13,28 @@
 """ Unit test for daemon module.
     """
 
+import __builtin__ as builtins
 import os
 import sys
 import tempfile
+import shutil
 import resource
 import errno
 import signal
 import socket
+import stat
+import fcntl
+import time
+import itertools
+import gc
+import ctypes
+import platform
 from types import ModuleType
 import atexit
 from StringIO import StringIO
 
+import lockfile
+
 import scaffold
 from test_pidlockfile import (
     FakeFileDescriptorStringIO,
@@ -270,6 +281,273 @@ class DaemonContext_TestCase(scaffold.TestCase):
         instance = daemon.daemon.DaemonContext(**args)
         self.failUnlessEqual(expect_signal_map, instance.signal_map)
 
+    def test_initialiser_queries_nothing_from_process(self):
+        """ Initialiser should defer querying the process environment. """
+        args = dict()
+        self.mock_tracker.clear()
+        expect_mock_output = u"""\
+            Called daemon.daemon.make_default_signal_map()
+            """
+        instance = daemon.daemon.DaemonContext(**args)
+        self.failUnlessMockCheckerMatch(expect_mock_output)
+
+    def test_has_specified_preload(self):
+        """ Should have specified preload option. """
+        args = dict(
+            preload = object(),
+            )
+        expect_preload = args['preload']
+        instance = daemon.daemon.DaemonContext(**args)
+        self.failUnlessEqual(expect_preload, instance.preload)
+
+    def test_has_default_preload(self):
+        """ Should have default preload option. """
+        args = dict()
+        expect_preload = None
+        instance = daemon.daemon.DaemonContext(**args)
+        self.failUnlessIs(expect_preload, instance.preload)
+
+    def test_has_specified_preload_collect(self):
+        """ Should have specified preload_collect option. """
+        args = dict(
+            preload_collect = object(),
+            )
+        expect_collect = args['preload_collect']
+        instance = daemon.daemon.DaemonContext(**args)
+        self.failUnlessEqual(expect_collect, instance.preload_collect)
+
+    def test_has_default_preload_collect(self):
+        """ Should have default preload_collect option. """
+        args = dict()
+        expect_collect = False
+        instance = daemon.daemon.DaemonContext(**args)
+        self.failUnlessEqual(expect_collect, instance.preload_collect)
+
+    def test_has_specified_listen_addresses(self):
+        """ Should have specified listen_addresses option. """
+        args = dict(
+            listen_addresses = object(),
+            )
+        expect_addresses = args['listen_addresses']
+        instance = daemon.daemon.DaemonContext(**args)
+        self.failUnlessEqual(expect_addresses, instance.listen_addresses)
+
+    def test_has_default_listen_addresses(self):
+        """ Should have default listen_addresses option. """
+        args = dict()
+        expect_addresses = None
+        instance = daemon.daemon.DaemonContext(**args)
+        self.failUnlessIs(expect_addresses, instance.listen_addresses)
+
+    def test_has_specified_listen_backlog(self):
+        """ Should have specified listen_backlog option. """
+        args = dict(
+            listen_backlog = object(),
+            )
+        expect_backlog = args['listen_backlog']
+        instance = daemon.daemon.DaemonContext(**args)
+        self.failUnlessEqual(expect_backlog, instance.listen_backlog)
+
+    def test_has_default_listen_backlog(self):
+        """ Should have default listen_backlog option. """
+        args = dict()
+        expect_backlog = socket.SOMAXCONN
+        instance = daemon.daemon.DaemonContext(**args)
+        self.failUnlessEqual(expect_backlog, instance.listen_backlog)
+
+    def test_has_specified_reuse_port_copies(self):
+        """ Should have specified reuse_port_copies option. """
+        args = dict(
+            reuse_port_copies = object(),
+            )
+        expect_copies = args['reuse_port_copies']
+        instance = daemon.daemon.DaemonContext(**args)
+        self.failUnlessEqual(expect_copies, instance.reuse_port_copies)
+
+    def test_has_default_reuse_port_copies(self):
+        """ Should have default reuse_port_copies option. """
+        args = dict()
+        expect_copies = None
+        instance = daemon.daemon.DaemonContext(**args)
+        self.failUnlessIs(expect_copies, instance.reuse_port_copies)
+
+    def test_has_no_listen_sockets(self):
+        """ Should have no listen sockets before opening. """
+        args = dict()
+        expect_sockets = []
+        instance = daemon.daemon.DaemonContext(**args)
+        self.failUnlessEqual(expect_sockets, instance.listen_sockets)
+
+    def test_has_no_activated_sockets(self):
+        """ Should have no activated sockets before opening. """
+        args = dict()
+        expect_sockets = {}
+        instance = daemon.daemon.DaemonContext(**args)
+        self.failUnlessEqual(expect_sockets, instance.activated_sockets)
+
+    def test_has_specified_resource_limits(self):
+        """ Should have specified resource_limits option. """
+        args = dict(
+            resource_limits = object(),
+            )
+        expect_limits = args['resource_limits']
+        instance = daemon.daemon.DaemonContext(**args)
+        self.failUnlessEqual(expect_limits, instance.resource_limits)
+
+    def test_has_default_resource_limits(self):
+        """ Should have default resource_limits option. """
+        args = dict()
+        expect_limits = None
+        instance = daemon.daemon.DaemonContext(**args)
+        self.failUnlessIs(expect_limits, instance.resource_limits)
+
+    def test_has_specified_cpu_affinity(self):
+        """ Should have specified cpu_affinity option. """
+        args = dict(
+            cpu_affinity = object(),
+            )
+        expect_cpus = args['cpu_affinity']
+        instance = daemon.daemon.DaemonContext(**args)
+        self.failUnlessEqual(expect_cpus, instance.cpu_affinity)
+
+    def test_has_default_cpu_affinity(self):
+        """ Should have default cpu_affinity option. """
+        args = dict()
+        expect_cpus = None
+        instance = daemon.daemon.DaemonContext(**args)
+        self.failUnlessIs(expect_cpus, instance.cpu_affinity)
+
+    def test_has_specified_nice(self):
+        """ Should have specified nice option. """
+        args = dict(
+            nice = object(),
+            )
+        expect_nice = args['nice']
+        instance = daemon.daemon.DaemonContext(**args)
+        self.failUnlessEqual(expect_nice, instance.nice)
+
+    def test_has_default_nice(self):
+        """ Should have default nice option. """
+        args = dict()
+        expect_nice = None
+        instance = daemon.daemon.DaemonContext(**args)
+        self.failUnlessIs(expect_nice, instance.nice)
+
+    def test_has_specified_ioprio(self):
+        """ Should have specified ioprio option. """
+        args = dict(
+            ioprio = object(),
+            )
+        expect_ioprio = args['ioprio']
+        instance = daemon.daemon.DaemonContext(**args)
+        self.failUnlessEqual(expect_ioprio, instance.ioprio)
+
+    def test_has_default_ioprio(self):
+        """ Should have default ioprio option. """
+        args = dict()
+        expect_ioprio = None
+        instance = daemon.daemon.DaemonContext(**args)
+        self.failUnlessIs(expect_ioprio, instance.ioprio)
+
+    def test_has_specified_sched_policy(self):
+        """ Should have specified sched_policy option. """
+        args = dict(
+            sched_policy = object(),
+            )
+        expect_policy = args['sched_policy']
+        instance = daemon.daemon.DaemonContext(**args)
+        self.failUnlessEqual(expect_policy, instance.sched_policy)
+
+    def test_has_default_sched_policy(self):
+        """ Should have default sched_policy option. """
+        args = dict()
+        expect_policy = None
+        instance = daemon.daemon.DaemonContext(**args)
+        self.failUnlessIs(expect_policy, instance.sched_policy)
+
+    def test_has_specified_sched_priority(self):
+        """ Should have specified sched_priority option. """
+        args = dict(
+            sched_priority = object(),
+            )
+        expect_priority = args['sched_priority']
+        instance = daemon.daemon.DaemonContext(**args)
+        self.failUnlessEqual(expect_priority, instance.sched_priority)
+
+    def test_has_default_sched_priority(self):
+        """ Should have default sched_priority option. """
+        args = dict()
+        expect_priority = 0
+        instance = daemon.daemon.DaemonContext(**args)
+        self.failUnlessEqual(expect_priority, instance.sched_priority)
+
+    def test_has_specified_timer_slack(self):
+        """ Should have specified timer_slack option. """
+        args = dict(
+            timer_slack = object(),
+            )
+        expect_slack = args['timer_slack']
+        instance = daemon.daemon.DaemonContext(**args)
+        self.failUnlessEqual(expect_slack, instance.timer_slack)
+
+    def test_has_default_timer_slack(self):
+        """ Should have default timer_slack option. """
+        args = dict()
+        expect_slack = None
+        instance = daemon.daemon.DaemonContext(**args)
+        self.failUnlessIs(expect_slack, instance.timer_slack)
+
+    def test_has_specified_timing_callback(self):
+        """ Should have specified timing_callback option. """
+        args = dict(
+            timing_callback = object(),
+            )
+        expect_callback = args['timing_callback']
+        instance = daemon.daemon.DaemonContext(**args)
+        self.failUnlessEqual(expect_callback, instance.timing_callback)
+
+    def test_has_default_timing_callback(self):
+        """ Should have default timing_callback option. """
+        args = dict()
+        expect_callback = None
+        instance = daemon.daemon.DaemonContext(**args)
+        self.failUnlessIs(expect_callback, instance.timing_callback)
+
+    def test_has_specified_ready_timeout(self):
+        """ Should have specified ready_timeout option. """
+        args = dict(
+            ready_timeout = 30,
+            )
+        instance = daemon.daemon.DaemonContext(**args)
+        self.failUnlessEqual(30, instance.ready_timeout)
+
+    def test_has_default_ready_timeout(self):
+        """ Should not wait for the daemon to be ready by default. """
+        args = dict()
+        instance = daemon.daemon.DaemonContext(**args)
+        self.failUnlessIs(None, instance.ready_timeout)
+
+    def test_has_specified_notify_watchdog(self):
+        """ Should have specified notify_watchdog option. """
+        args = dict(
+            notify_watchdog = False,
+            )
+        instance = daemon.daemon.DaemonContext(**args)
+        self.failUnlessIs(False, instance.notify_watchdog)
+
+    def test_has_default_notify_watchdog(self):
+        """ Should notify the watchdog by default. """
+        args = dict()
+        instance = daemon.daemon.DaemonContext(**args)
+        self.failUnlessIs(True, instance.notify_watchdog)
+
+    def test_has_no_notifier(self):
+        """ Should have no notifier or watchdog pinger before opening. """
+        args = dict()
+        instance = daemon.daemon.DaemonContext(**args)
+        self.failUnlessIs(None, instance.notifier)
+        self.failUnlessIs(None, instance.watchdog_pinger)
+
 
 class DaemonContext_is_open_TestCase(scaffold.TestCase):
     """ Test cases for DaemonContext.is_open property. """
@@ -323,11 +601,74 @@ class DaemonContext_open_TestCase(scaffold.TestCase):
         scaffold.mock(
             u"daemon.daemon.prevent_core_dump",
             tracker=self.mock_tracker)
+        scaffold.mock(
+            u"daemon.daemon.set_resource_limits",
+            tracker=self.mock_tracker)
+        self.test_maxfd = 1024
+        scaffold.mock(
+            u"daemon.daemon.get_maximum_file_descriptors",
+            returns=self.test_maxfd,
+            tracker=self.mock_tracker)
+        scaffold.mock(
+            u"daemon.daemon.freeze_garbage_collector",
+            tracker=self.mock_tracker)
+        self.test_listen_sockets = [[object()], [object()]]
+        scaffold.mock(
+            u"daemon.daemon.make_listen_sockets",
+            returns=self.test_listen_sockets,
+            tracker=self.mock_tracker)
+        scaffold.mock(
+            u"daemon.daemon.wait_for_pidfile_available",
+            tracker=self.mock_tracker)
+        scaffold.mock(
+            u"daemon.daemon.pop_inherited_listen_fds",
+            returns=None,
+            tracker=self.mock_tracker)
+        scaffold.mock(
+            u"daemon.daemon.pop_activated_fds",
+            returns=None,
+            tracker=self.mock_tracker)
+        self.test_activated_sockets = {u"http": [object()]}
+        scaffold.mock(
+            u"daemon.daemon.make_activated_sockets",
+            returns=self.test_activated_sockets,
+            tracker=self.mock_tracker)
+        scaffold.mock(
+            u"daemon.daemon.adopt_listen_sockets",
+            returns=self.test_listen_sockets,
+            tracker=self.mock_tracker)
+        scaffold.mock(
+            u"daemon.daemon.connect_notify_socket",
+            returns=None,
+            tracker=self.mock_tracker)
+        self.test_notifier = scaffold.Mock(
+            u"Notifier",
+            tracker=self.mock_tracker)
+        self.test_watchdog_interval = 15.0
+        scaffold.mock(
+            u"daemon.notify.get_watchdog_interval",
+            returns=self.test_watchdog_interval,
+            tracker=self.mock_tracker)
+        self.test_watchdog_pinger = object()
+        scaffold.mock(
+            u"daemon.daemon.start_watchdog_pinger",
+            returns=self.test_watchdog_pinger,
+            tracker=self.mock_tracker)
+        for name in [
+                u"set_cpu_affinity",
+                u"set_process_niceness",
+                u"set_io_priority",
+                u"set_scheduler",
+                u"set_timer_slack",
+                ]:
+            scaffold.mock(
+                u"daemon.daemon.%(name)s" % vars(),
+                tracker=self.mock_tracker)
         scaffold.mock(
             u"daemon.daemon.close_all_open_files",
             tracker=self.mock_tracker)
         scaffold.mock(
-            u"daemon.daemon.redirect_stream",
+            u"daemon.daemon.redirect_standard_streams",
             tracker=self.mock_tracker)
         scaffold.mock(
             u"daemon.daemon.set_signal_handlers",
@@ -369,6 +710,7 @@ class DaemonContext_open_TestCase(scaffold.TestCase):
         instance.detach_process = True
         instance.pidfile = self.mock_pidlockfile
         expect_mock_output = u"""\
+            Called daemon.daemon.connect_notify_socket()
             Called daemon.daemon.change_root_directory(...)
             Called daemon.daemon.prevent_core_dump()
             Called daemon.daemon.change_file_creation_mask(...)
@@ -379,9 +721,7 @@ class DaemonContext_open_TestCase(scaffold.TestCase):
             Called daemon.daemon.set_signal_handlers(...)
             Called daemon.daemon.DaemonContext._get_exclude_file_descriptors()
             Called daemon.daemon.close_all_open_files(...)
-            Called daemon.daemon.redirect_stream(...)
-            Called daemon.daemon.redirect_stream(...)
-            Called daemon.daemon.redirect_stream(...)
+            Called daemon.daemon.redirect_standard_streams(...)
             Called pidlockfile.PIDLockFile.__enter__()
             Called daemon.daemon.register_atexit_function(...)
             """ % vars()
@@ -405,6 +745,7 @@ class DaemonContext_open_TestCase(scaffold.TestCase):
         chroot_directory = object()
         instance.chroot_directory = chroot_directory
         expect_mock_output = u"""\
+            Called daemon.daemon.connect_notify_socket()
             Called daemon.daemon.change_root_directory(
                 %(chroot_directory)r)
             ...
@@ -425,6 +766,7 @@ class DaemonContext_open_TestCase(scaffold.TestCase):
         """ Should request prevention of core dumps. """
         instance = self.test_instance
         expect_mock_output = u"""\
+            Called daemon.daemon.connect_notify_socket()
             Called daemon.daemon.prevent_core_dump()
             ...
             """ % vars()
@@ -447,12 +789,55 @@ class DaemonContext_open_TestCase(scaffold.TestCase):
         expect_mock_output = u"""\
             ...
             Called daemon.daemon.close_all_open_files(
-                exclude=%(expect_exclude)r)
+                exclude=%(expect_exclude)r,
+                maxfd=None)
+            ...
+            """ % vars()
+        instance.open()
+        self.failUnlessMockCheckerMatch(expect_mock_output)
+
+    def test_sets_resource_limits_after_preventing_core(self):
+        """ Should set resource limits after preventing core dumps. """
+        instance = self.test_instance
+        instance.resource_limits = {u'NOFILE': u'hard'}
+        limits = instance.resource_limits
+        expect_mock_output = u"""\
+            Called daemon.daemon.connect_notify_socket()
+            Called daemon.daemon.prevent_core_dump()
+            Called daemon.daemon.get_maximum_file_descriptors()
+            Called daemon.daemon.set_resource_limits(%(limits)r)
+            ...
+            Called daemon.daemon.change_process_owner(...)
+            ...
+            """ % vars()
+        instance.open()
+        self.failUnlessMockCheckerMatch(expect_mock_output)
+
+    def test_closes_files_within_limit_before_resource_limits(self):
+        """ Should close files within the limit before it was raised. """
+        instance = self.test_instance
+        instance.resource_limits = {u'NOFILE': u'hard'}
+        expect_exclude = self.test_files_preserve_fds
+        expect_maxfd = self.test_maxfd
+        expect_mock_output = u"""\
+            ...
+            Called daemon.daemon.close_all_open_files(
+                exclude=%(expect_exclude)r,
+                maxfd=%(expect_maxfd)r)
             ...
             """ % vars()
         instance.open()
         self.failUnlessMockCheckerMatch(expect_mock_output)
 
+    def test_omits_resource_limits_if_not_specified(self):
+        """ Should not set resource limits if `resource_limits` is None. """
+        instance = self.test_instance
+        instance.resource_limits = None
+        unwanted_output = u"""\
+            ...Called daemon.daemon.set_resource_limits(...)..."""
+        instance.open()
+        self.failIfMockCheckerMatch(unwanted_output)
+
     def test_changes_directory_to_working_directory(self):
         """ Should change current directory to `working_directory` option. """
         instance = self.test_instance
@@ -515,46 +900,74 @@ class DaemonContext_open_TestCase(scaffold.TestCase):
         instance.open()
         self.failIfMockCheckerMatch(unwanted_output)
 
-    def test_sets_signal_handlers_from_signal_map(self):
-        """ Should set signal handlers according to `signal_map`. """
+    def test_preloads_then_freezes_before_detach(self):
+        """ Should call `preload` and freeze the heap before detaching. """
         instance = self.test_instance
-        instance.signal_map = object()
-        expect_signal_handler_map = self.test_signal_handler_map
+        instance.preload = scaffold.Mock(
+            u"preload",
+            tracker=self.mock_tracker)
+        instance.preload_collect = object()
+        instance.detach_process = True
+        collect = instance.preload_collect
         expect_mock_output = u"""\
             ...
-            Called daemon.daemon.set_signal_handlers(
-                %(expect_signal_handler_map)r)
+            Called daemon.daemon.change_process_owner(...)
+            Called preload()
+            Called daemon.daemon.freeze_garbage_collector(
+                collect=%(collect)r)
+            Called daemon.daemon.detach_process_context()
             ...
             """ % vars()
         instance.open()
         self.failUnlessMockCheckerMatch(expect_mock_output)
 
-    def test_redirects_standard_streams(self):
-        """ Should request redirection of standard stream files. """
+    def test_omits_preload_and_freeze_if_no_preload(self):
+        """ Should omit preload and freezing the heap if no `preload`. """
         instance = self.test_instance
-        (system_stdin, system_stdout, system_stderr) = (
-            sys.stdin, sys.stdout, sys.stderr)
-        (target_stdin, target_stdout, target_stderr) = (
-            self.stream_files_by_name[name]
-            for name in ['stdin', 'stdout', 'stderr'])
+        instance.preload = None
+        unwanted_output = u"""\
+            ...Called daemon.daemon.freeze_garbage_collector(...)..."""
+        instance.open()
+        self.failIfMockCheckerMatch(unwanted_output)
+
+    def test_binds_listen_sockets_before_changing_owner(self):
+        """ Should bind listening sockets before changing owner. """
+        instance = self.test_instance
+        instance.listen_addresses = object()
+        instance.listen_backlog = object()
+        instance.reuse_port_copies = object()
+        addresses = instance.listen_addresses
+        backlog = instance.listen_backlog
+        copies = instance.reuse_port_copies
+        activated_sockets = instance.activated_sockets
         expect_mock_output = u"""\
             ...
-            Called daemon.daemon.redirect_stream(
-                %(system_stdin)r, %(target_stdin)r)
-            Called daemon.daemon.redirect_stream(
-                %(system_stdout)r, %(target_stdout)r)
-            Called daemon.daemon.redirect_stream(
-                %(system_stderr)r, %(target_stderr)r)
+            Called daemon.daemon.change_working_directory(...)
+            ...
+            Called daemon.daemon.make_listen_sockets(
+                %(addresses)r,
+                %(backlog)r,
+                %(copies)r,
+                %(activated_sockets)r)
+            ...
+            Called daemon.daemon.change_process_owner(...)
             ...
             """ % vars()
         instance.open()
         self.failUnlessMockCheckerMatch(expect_mock_output)
 
-    def test_enters_pidfile_context(self):
-        """ Should enter the PID file context manager. """
+    def test_waits_for_pidfile_before_binding_listen_sockets(self):
+        """ Should wait until the PID file is available before binding. """
         instance = self.test_instance
+        instance.listen_addresses = object()
         instance.pidfile = self.mock_pidlockfile
+        instance.pidfile.acquire_timeout = 5
         expect_mock_output = u"""\
+            ...
+            Called daemon.daemon.wait_for_pidfile_available(
+                <Mock ... pidlockfile.PIDLockFile>,
+                5)
+            Called daemon.daemon.make_listen_sockets(...)
             ...
             Called pidlockfile.PIDLockFile.__enter__()
             ...
@@ -562,43 +975,404 @@ class DaemonContext_open_TestCase(scaffold.TestCase):
         instance.open()
         self.failUnlessMockCheckerMatch(expect_mock_output)
 
-    def test_sets_is_open_true(self):
-        """ Should set the `is_open` property to True. """
+    def test_raises_error_and_binds_nothing_if_pidfile_locked(self):
+        """ Should bind no socket if the PID file is not available. """
+        instance = self.test_instance
+        instance.listen_addresses = object()
+        instance.pidfile = self.mock_pidlockfile
+        daemon.daemon.wait_for_pidfile_available.mock_raises = (
+            lockfile.AlreadyLocked)
+        unwanted_output = u"""\
+            ...Called daemon.daemon.make_listen_sockets(...)..."""
+        try:
+            instance.open()
+        except lockfile.AlreadyLocked:
+            pass
+        self.failIfMockCheckerMatch(unwanted_output)
+
+    def test_omits_pidfile_wait_if_adopting_listen_sockets(self):
+        """ Should not wait for the PID file if adopting sockets. """
+        instance = self.test_instance
+        instance.listen_addresses = object()
+        instance.pidfile = self.mock_pidlockfile
+        daemon.daemon.pop_inherited_listen_fds.mock_returns = [[5]]
+        unwanted_output = u"""\
+            ...Called daemon.daemon.wait_for_pidfile_available(...)..."""
+        instance.open()
+        self.failIfMockCheckerMatch(unwanted_output)
+
+    def test_stores_listen_sockets(self):
+        """ Should store the listening sockets made. """
         instance = self.test_instance
+        instance.listen_addresses = object()
+        expect_sockets = self.test_listen_sockets
         instance.open()
-        self.failUnlessEqual(True, instance.is_open)
+        self.failUnlessIs(expect_sockets, instance.listen_sockets)
 
-    def test_registers_close_method_for_atexit(self):
-        """ Should register the `close` method for atexit processing. """
+    def test_omits_listen_sockets_if_no_listen_addresses(self):
+        """ Should omit binding sockets if no `listen_addresses`. """
         instance = self.test_instance
-        close_method = instance.close
+        instance.listen_addresses = None
+        unwanted_output = u"""\
+            ...Called daemon.daemon.make_listen_sockets(...)..."""
+        instance.open()
+        self.failIfMockCheckerMatch(unwanted_output)
+
+    def test_makes_activated_sockets_before_listen_sockets(self):
+        """ Should make activated sockets, and use them for listening. """
+        instance = self.test_instance
+        instance.listen_addresses = object()
+        test_activated_fds = [(u"http", 3)]
+        daemon.daemon.pop_activated_fds.mock_returns = test_activated_fds
+        activated_sockets = self.test_activated_sockets
         expect_mock_output = u"""\
             ...
-            Called daemon.daemon.register_atexit_function(%(close_method)r)
+            Called daemon.daemon.pop_activated_fds()
+            Called daemon.daemon.make_activated_sockets(%(test_activated_fds)r)
+            ...
+            Called daemon.daemon.make_listen_sockets(
+                ...,
+                %(activated_sockets)r)
+            ...
             """ % vars()
         instance.open()
         self.failUnlessMockCheckerMatch(expect_mock_output)
 
-
-class DaemonContext_close_TestCase(scaffold.TestCase):
-    """ Test cases for DaemonContext.close method. """
-
-    def setUp(self):
-        """ Set up test fixtures. """
-        setup_daemon_context_fixtures(self)
-        self.mock_tracker.clear()
-
-        self.test_instance._is_open = True
+    def test_stores_activated_sockets(self):
+        """ Should store the activated sockets made. """
+        instance = self.test_instance
+        daemon.daemon.pop_activated_fds.mock_returns = [(u"http", 3)]
+        expect_sockets = self.test_activated_sockets
+        instance.open()
+        self.failUnlessIs(expect_sockets, instance.activated_sockets)
 
-    def tearDown(self):
-        """ Tear down test fixtures. """
-        scaffold.mock_restore()
+    def test_does_not_detach_by_default_if_activated(self):
+        """ Should not detach by default if started by activation. """
+        instance = daemon.daemon.DaemonContext()
+        daemon.daemon.pop_activated_fds.mock_returns = [(u"http", 3)]
+        unwanted_output = u"""\
+            ...Called daemon.daemon.detach_process_context()..."""
+        instance.open()
+        self.failIfMockCheckerMatch(unwanted_output)
 
-    def test_returns_immediately_if_not_is_open(self):
-        """ Should return immediately if is_open property is false. """
+    def test_detaches_if_specified_when_activated(self):
+        """ Should detach if specified, though started by activation. """
         instance = self.test_instance
-        instance._is_open = False
-        instance.pidfile = object()
+        instance.detach_process = True
+        daemon.daemon.pop_activated_fds.mock_returns = [(u"http", 3)]
+        expect_mock_output = u"""\
+            ...
+            Called daemon.daemon.detach_process_context()
+            ...
+            """
+        instance.open()
+        self.failUnlessMockCheckerMatch(expect_mock_output)
+
+    def test_adopts_inherited_listen_sockets(self):
+        """ Should adopt inherited listening sockets instead of binding. """
+        instance = self.test_instance
+        instance.listen_addresses = object()
+        addresses = instance.listen_addresses
+        test_listen_fds = [[5, 6], [7]]
+        daemon.daemon.pop_inherited_listen_fds.mock_returns = (
+            test_listen_fds)
+        expect_mock_output = u"""\
+            ...
+            Called daemon.daemon.pop_inherited_listen_fds()
+            Called daemon.daemon.adopt_listen_sockets(
+                %(test_listen_fds)r,
+                %(addresses)r)
+            ...
+            Called daemon.daemon.change_process_owner(...)
+            ...
+            """ % vars()
+        unwanted_output = u"""\
+            ...Called daemon.daemon.make_listen_sockets(...)..."""
+        instance.open()
+        self.failUnlessMockCheckerMatch(expect_mock_output)
+        self.failIfMockCheckerMatch(unwanted_output)
+
+    def test_sets_scheduling_before_changing_owner(self):
+        """ Should set scheduling attributes before changing owner. """
+        instance = self.test_instance
+        instance.cpu_affinity = [1, 3]
+        instance.nice = 5
+        instance.ioprio = (u'idle', 0)
+        instance.sched_policy = u'batch'
+        instance.sched_priority = 0
+        instance.timer_slack = 50000
+        expect_mock_output = u"""\
+            ...
+            Called daemon.daemon.change_working_directory(...)
+            Called daemon.daemon.set_cpu_affinity([1, 3])
+            Called daemon.daemon.set_process_niceness(5)
+            Called daemon.daemon.set_io_priority((u'idle', 0))
+            Called daemon.daemon.set_scheduler(u'batch', 0)
+            Called daemon.daemon.set_timer_slack(50000)
+            ...
+            Called daemon.daemon.change_process_owner(...)
+            ...
+            """
+        instance.open()
+        self.failUnlessMockCheckerMatch(expect_mock_output)
+
+    def test_omits_scheduling_if_not_specified(self):
+        """ Should not set scheduling attributes left as ``None``. """
+        instance = self.test_instance
+        instance.open()
+        for name in [
+                u"set_cpu_affinity",
+                u"set_process_niceness",
+                u"set_io_priority",
+                u"set_scheduler",
+                u"set_timer_slack",
+                ]:
+            unwanted_output = u"""\
+                ...Called daemon.daemon.%(name)s(...)...""" % vars()
+            self.failIfMockCheckerMatch(unwanted_output)
+
+    def test_sets_signal_handlers_from_signal_map(self):
+        """ Should set signal handlers according to `signal_map`. """
+        instance = self.test_instance
+        instance.signal_map = object()
+        expect_signal_handler_map = self.test_signal_handler_map
+        expect_mock_output = u"""\
+            ...
+            Called daemon.daemon.set_signal_handlers(
+                %(expect_signal_handler_map)r)
+            ...
+            """ % vars()
+        instance.open()
+        self.failUnlessMockCheckerMatch(expect_mock_output)
+
+    def test_redirects_standard_streams(self):
+        """ Should request redirection of standard stream files. """
+        instance = self.test_instance
+        (target_stdin, target_stdout, target_stderr) = (
+            self.stream_files_by_name[name]
+            for name in ['stdin', 'stdout', 'stderr'])
+        expect_mock_output = u"""\
+            ...
+            Called daemon.daemon.redirect_standard_streams(
+                %(target_stdin)r, %(target_stdout)r, %(target_stderr)r)
+            ...
+            """ % vars()
+        instance.open()
+        self.failUnlessMockCheckerMatch(expect_mock_output)
+
+    def test_enters_pidfile_context(self):
+        """ Should enter the PID file context manager. """
+        instance = self.test_instance
+        instance.pidfile = self.mock_pidlockfile
+        expect_mock_output = u"""\
+            ...
+            Called pidlockfile.PIDLockFile.__enter__()
+            ...
+            """
+        instance.open()
+        self.failUnlessMockCheckerMatch(expect_mock_output)
+
+    def test_sets_is_open_true(self):
+        """ Should set the `is_open` property to True. """
+        instance = self.test_instance
+        instance.open()
+        self.failUnlessEqual(True, instance.is_open)
+
+    def test_registers_close_method_for_atexit(self):
+        """ Should register the `close` method for atexit processing. """
+        instance = self.test_instance
+        close_method = instance.close
+        expect_mock_output = u"""\
+            ...
+            Called daemon.daemon.register_atexit_function(%(close_method)r)
+            """ % vars()
+        instance.open()
+        self.failUnlessMockCheckerMatch(expect_mock_output)
+
+    def test_detaches_with_ready_timeout(self):
+        """ Should detach keeping a status pipe if `ready_timeout` is set. """
+        instance = self.test_instance
+        instance.detach_process = True
+        instance.ready_timeout = 30
+        test_fd = 8
+        daemon.daemon.detach_process_context.mock_returns = test_fd
+        expect_mock_output = u"""\
+            ...
+            Called daemon.daemon.detach_process_context(ready_timeout=30)
+            ...
+            """
+        instance.open()
+        self.failUnlessMockCheckerMatch(expect_mock_output)
+        self.failUnlessEqual(test_fd, instance._start_status_fd)
+
+    def test_connects_notify_socket_and_stores_notifier(self):
+        """ Should connect the notification socket and store the notifier. """
+        instance = self.test_instance
+        daemon.daemon.connect_notify_socket.mock_returns = self.test_notifier
+        instance.open()
+        self.failUnlessIs(self.test_notifier, instance.notifier)
+
+    def test_notifies_main_pid_after_detach(self):
+        """ Should notify the supervisor of the new PID after detaching. """
+        instance = self.test_instance
+        instance.detach_process = True
+        daemon.daemon.connect_notify_socket.mock_returns = self.test_notifier
+        test_pid = 235
+        scaffold.mock(
+            u"os.getpid",
+            returns=test_pid,
+            tracker=self.mock_tracker)
+        expect_mock_output = u"""\
+            ...
+            Called daemon.daemon.detach_process_context()
+            Called os.getpid()
+            Called Notifier.main_pid(%(test_pid)r)
+            ...
+            """ % vars()
+        instance.open()
+        self.failUnlessMockCheckerMatch(expect_mock_output)
+
+    def test_omits_main_pid_if_not_detached(self):
+        """ Should not notify the supervisor of the PID if not detached. """
+        instance = self.test_instance
+        instance.detach_process = False
+        daemon.daemon.connect_notify_socket.mock_returns = self.test_notifier
+        unwanted_output = u"""\
+            ...Called Notifier.main_pid(...)..."""
+        instance.open()
+        self.failIfMockCheckerMatch(unwanted_output)
+
+    def test_starts_watchdog_pinger_after_pidfile(self):
+        """ Should notify the watchdog after entering the PID file. """
+        instance = self.test_instance
+        instance.pidfile = self.mock_pidlockfile
+        daemon.daemon.connect_notify_socket.mock_returns = self.test_notifier
+        test_notifier = self.test_notifier
+        interval = self.test_watchdog_interval
+        expect_mock_output = u"""\
+            Called daemon.daemon.connect_notify_socket()
+            Called daemon.notify.get_watchdog_interval()
+            ...
+            Called pidlockfile.PIDLockFile.__enter__()
+            Called daemon.daemon.start_watchdog_pinger(
+                <Mock ... Notifier>,
+                %(interval)r)
+            ...
+            """ % vars()
+        instance.open()
+        self.failUnlessMockCheckerMatch(expect_mock_output)
+        self.failUnlessIs(self.test_watchdog_pinger, instance.watchdog_pinger)
+
+    def test_omits_watchdog_if_notify_watchdog_false(self):
+        """ Should not notify the watchdog if `notify_watchdog` is false. """
+        instance = self.test_instance
+        instance.notify_watchdog = False
+        daemon.daemon.connect_notify_socket.mock_returns = self.test_notifier
+        unwanted_output = u"""\
+            ...Called daemon.daemon.start_watchdog_pinger(...)..."""
+        instance.open()
+        self.failIfMockCheckerMatch(unwanted_output)
+        self.failUnlessIs(None, instance.watchdog_pinger)
+
+    def test_omits_watchdog_if_not_enabled(self):
+        """ Should not notify the watchdog if the supervisor has none. """
+        instance = self.test_instance
+        daemon.daemon.connect_notify_socket.mock_returns = self.test_notifier
+        daemon.notify.get_watchdog_interval.mock_returns = None
+        unwanted_output = u"""\
+            ...Called daemon.daemon.start_watchdog_pinger(...)..."""
+        instance.open()
+        self.failIfMockCheckerMatch(unwanted_output)
+
+    def test_omits_watchdog_if_no_notify_socket(self):
+        """ Should not notify the watchdog without a notification socket. """
+        instance = self.test_instance
+        unwanted_output = u"""\
+            ...Called daemon.daemon.start_watchdog_pinger(...)..."""
+        instance.open()
+        self.failIfMockCheckerMatch(unwanted_output)
+
+    def test_reports_step_timings_to_callback(self):
+        """ Should report the timing of each step to `timing_callback`. """
+        instance = self.test_instance
+        instance.chroot_directory = object()
+        instance.detach_process = True
+        instance.pidfile = self.mock_pidlockfile
+        instance.timing_callback = scaffold.Mock(
+            u"timing_callback",
+            tracker=self.mock_tracker)
+        test_times = itertools.chain(
+            [5.0, 5.125, 10.0, 10.5, 20.0, 20.25], itertools.repeat(30.0))
+        scaffold.mock(
+            u"time.time",
+            returns_func=(lambda: test_times.next()),
+            tracker=self.mock_tracker)
+        instance.open()
+        expect_mock_output = u"""\
+            Called time.time()
+            Called daemon.daemon.connect_notify_socket()
+            Called time.time()
+            Called timing_callback(u'notify_socket', 5.0, 0.125)
+            Called time.time()
+            Called daemon.daemon.change_root_directory(...)
+            Called time.time()
+            Called timing_callback(u'chroot', 10.0, 0.5)
+            Called time.time()
+            Called daemon.daemon.prevent_core_dump()
+            Called time.time()
+            Called timing_callback(u'prevent_core', 20.0, 0.25)
+            ...
+            Called timing_callback(u'umask', ...)
+            ...
+            Called timing_callback(u'working_directory', ...)
+            ...
+            Called timing_callback(u'process_owner', ...)
+            ...
+            Called timing_callback(u'detach', ...)
+            ...
+            Called timing_callback(u'signal_handlers', ...)
+            ...
+            Called timing_callback(u'close_files', ...)
+            ...
+            Called timing_callback(u'redirect_streams', ...)
+            ...
+            Called timing_callback(u'pidfile', ...)
+            Called daemon.daemon.register_atexit_function(...)
+            """
+        self.failUnlessMockCheckerMatch(expect_mock_output)
+
+    def test_omits_timing_if_no_timing_callback(self):
+        """ Should not query the time if no `timing_callback`. """
+        instance = self.test_instance
+        instance.timing_callback = None
+        scaffold.mock(
+            u"time.time",
+            tracker=self.mock_tracker)
+        unwanted_output = u"""\
+            ...Called time.time()..."""
+        instance.open()
+        self.failIfMockCheckerMatch(unwanted_output)
+
+
+class DaemonContext_close_TestCase(scaffold.TestCase):
+    """ Test cases for DaemonContext.close method. """
+
+    def setUp(self):
+        """ Set up test fixtures. """
+        setup_daemon_context_fixtures(self)
+        self.mock_tracker.clear()
+
+        self.test_instance._is_open = True
+
+    def tearDown(self):
+        """ Tear down test fixtures. """
+        scaffold.mock_restore()
+
+    def test_returns_immediately_if_not_is_open(self):
+        """ Should return immediately if is_open property is false. """
+        instance = self.test_instance
+        instance._is_open = False
+        instance.pidfile = object()
         expect_mock_output = u"""\
             """
         self.mock_tracker.clear()
@@ -615,6 +1389,19 @@ class DaemonContext_close_TestCase(scaffold.TestCase):
         instance.close()
         self.failUnlessMockCheckerMatch(expect_mock_output)
 
+    def test_stops_watchdog_pinger(self):
+        """ Should stop notifying the watchdog. """
+        instance = self.test_instance
+        instance.watchdog_pinger = scaffold.Mock(
+            u"WatchdogPinger",
+            tracker=self.mock_tracker)
+        expect_mock_output = u"""\
+            Called WatchdogPinger.stop()
+            """
+        instance.close()
+        self.failUnlessMockCheckerMatch(expect_mock_output)
+        self.failUnlessIs(None, instance.watchdog_pinger)
+
     def test_returns_none(self):
         """ Should return None. """
         instance = self.test_instance
@@ -740,6 +1527,68 @@ class DaemonContext_terminate_TestCase(scaffold.TestCase):
         self.failUnlessIn(str(exc), str(signal_number))
 
 
+class DaemonContext_report_start_status_TestCase(scaffold.TestCase):
+    """ Test cases for DaemonContext start-up status report methods. """
+
+    def setUp(self):
+        """ Set up test fixtures. """
+        setup_daemon_context_fixtures(self)
+        self.mock_tracker.clear()
+
+        self.test_fd = 8
+        self.test_instance._start_status_fd = self.test_fd
+        scaffold.mock(
+            u"daemon.daemon.report_start_status",
+            tracker=self.mock_tracker)
+
+    def tearDown(self):
+        """ Tear down test fixtures. """
+        scaffold.mock_restore()
+
+    def test_report_ready_reports_ready(self):
+        """ Should report that the daemon is ready. """
+        instance = self.test_instance
+        test_fd = self.test_fd
+        expect_mock_output = u"""\
+            Called daemon.daemon.report_start_status(%(test_fd)r, u'ready')
+            """ % vars()
+        instance.report_ready()
+        self.failUnlessMockCheckerMatch(expect_mock_output)
+
+    def test_report_failed_reports_reason(self):
+        """ Should report that the daemon failed, with the reason. """
+        instance = self.test_instance
+        test_fd = self.test_fd
+        expect_mock_output = u"""\
+            Called daemon.daemon.report_start_status(
+                %(test_fd)r,
+                u'failed: Spam')
+            """ % vars()
+        instance.report_failed(u"Spam")
+        self.failUnlessMockCheckerMatch(expect_mock_output)
+
+    def test_reports_only_once(self):
+        """ Should report only the first status. """
+        instance = self.test_instance
+        test_fd = self.test_fd
+        expect_mock_output = u"""\
+            Called daemon.daemon.report_start_status(%(test_fd)r, u'ready')
+            """ % vars()
+        instance.report_ready()
+        instance.report_failed(u"Spam")
+        self.failUnlessMockCheckerMatch(expect_mock_output)
+        self.failUnlessIs(None, instance._start_status_fd)
+
+    def test_does_nothing_if_not_waited_for(self):
+        """ Should do nothing if the original process is not waiting. """
+        instance = self.test_instance
+        instance._start_status_fd = None
+        expect_mock_output = u"""\
+            """
+        instance.report_ready()
+        self.failUnlessMockCheckerMatch(expect_mock_output)
+
+
 class DaemonContext_get_exclude_file_descriptors_TestCase(scaffold.TestCase):
     """ Test cases for DaemonContext._get_exclude_file_descriptors function. """
 
@@ -812,27 +1661,133 @@ class DaemonContext_get_exclude_file_descriptors_TestCase(scaffold.TestCase):
         result = instance._get_exclude_file_descriptors()
         self.failUnlessEqual(expect_result, result)
 
-
-class DaemonContext_make_signal_handler_TestCase(scaffold.TestCase):
-    """ Test cases for DaemonContext._make_signal_handler function. """
-
-    def setUp(self):
-        """ Set up test fixtures. """
-        setup_daemon_context_fixtures(self)
-
-    def tearDown(self):
-        """ Tear down test fixtures. """
-        scaffold.mock_restore()
-
-    def test_returns_ignore_for_none(self):
-        """ Should return SIG_IGN when None handler specified. """
+    def test_returns_stream_file_descriptors(self):
+        """ Should return streams specified as file descriptors. """
         instance = self.test_instance
-        target = None
-        expect_result = signal.SIG_IGN
-        result = instance._make_signal_handler(target)
+        instance.files_preserve = None
+        instance.stdin = 7
+        instance.stdout = u"/tmp/spam.log"
+        instance.stderr = 9
+        expect_result = set([7, 9])
+        result = instance._get_exclude_file_descriptors()
         self.failUnlessEqual(expect_result, result)
 
-    def test_returns_method_for_name(self):
+    def test_returns_listen_socket_file_descriptors(self):
+        """ Should return the file descriptors of listening sockets. """
+        instance = self.test_instance
+        instance.files_preserve = None
+        for name in ['stdin', 'stdout', 'stderr']:
+            setattr(instance, name, None)
+        instance.listen_sockets = [
+            [FakeFileDescriptorStringIO(), FakeFileDescriptorStringIO()],
+            [FakeFileDescriptorStringIO()],
+            ]
+        expect_result = set(
+            sock.fileno()
+            for sockets in instance.listen_sockets
+            for sock in sockets)
+        result = instance._get_exclude_file_descriptors()
+        self.failUnlessEqual(expect_result, result)
+
+    def test_returns_activated_file_descriptors(self):
+        """ Should return the file descriptors passed by activation. """
+        instance = self.test_instance
+        instance.files_preserve = None
+        for name in ['stdin', 'stdout', 'stderr']:
+            setattr(instance, name, None)
+        test_socket = FakeFileDescriptorStringIO()
+        instance.activated_sockets = {
+            u"http": [test_socket],
+            u"fifo": [4],
+            }
+        expect_result = set([test_socket.fileno(), 4])
+        result = instance._get_exclude_file_descriptors()
+        self.failUnlessEqual(expect_result, result)
+
+    def test_returns_start_status_file_descriptor(self):
+        """ Should return the file descriptor for the start-up status. """
+        instance = self.test_instance
+        instance.files_preserve = None
+        for name in ['stdin', 'stdout', 'stderr']:
+            setattr(instance, name, None)
+        instance._start_status_fd = 8
+        expect_result = set([8])
+        result = instance._get_exclude_file_descriptors()
+        self.failUnlessEqual(expect_result, result)
+
+    def test_returns_notifier_file_descriptor(self):
+        """ Should return the file descriptor of the notifier. """
+        instance = self.test_instance
+        instance.files_preserve = None
+        for name in ['stdin', 'stdout', 'stderr']:
+            setattr(instance, name, None)
+        instance.notifier = FakeFileDescriptorStringIO()
+        expect_result = set([instance.notifier.fileno()])
+        result = instance._get_exclude_file_descriptors()
+        self.failUnlessEqual(expect_result, result)
+
+
+class DaemonContext_get_listen_sockets_TestCase(scaffold.TestCase):
+    """ Test cases for DaemonContext.get_listen_sockets method. """
+
+    def setUp(self):
+        """ Set up test fixtures. """
+        setup_daemon_context_fixtures(self)
+
+        self.test_shared_socket = object()
+        self.test_copy_sockets = [object(), object(), object()]
+        self.test_instance.listen_sockets = [
+            [self.test_shared_socket],
+            self.test_copy_sockets,
+            ]
+
+    def tearDown(self):
+        """ Tear down test fixtures. """
+        scaffold.mock_restore()
+
+    def test_returns_first_sockets_by_default(self):
+        """ Should return the first socket for each address. """
+        instance = self.test_instance
+        expect_result = [self.test_shared_socket, self.test_copy_sockets[0]]
+        result = instance.get_listen_sockets()
+        self.failUnlessEqual(expect_result, result)
+
+    def test_returns_worker_copy_and_shared_sockets(self):
+        """ Should return the worker's copy, or the shared socket. """
+        instance = self.test_instance
+        expect_result = [self.test_shared_socket, self.test_copy_sockets[2]]
+        result = instance.get_listen_sockets(2)
+        self.failUnlessEqual(expect_result, result)
+
+    def test_returns_empty_list_if_no_listen_sockets(self):
+        """ Should return an empty list if there are no sockets. """
+        instance = self.test_instance
+        instance.listen_sockets = []
+        expect_result = []
+        result = instance.get_listen_sockets(1)
+        self.failUnlessEqual(expect_result, result)
+
+
+class DaemonContext_make_signal_handler_TestCase(scaffold.TestCase):
+    """ Test cases for DaemonContext._make_signal_handler function. """
+
+    def setUp(self):
+        """ Set up test fixtures. """
+        setup_daemon_context_fixtures(self)
+
+    def tearDown(self):
+        """ Tear down test fixtures. """
+        scaffold.mock_restore()
+
+    def test_returns_ignore_for_none(self):
+        """ Should return SIG_IGN when None handler specified. """
+        instance = self.test_instance
+        target = None
+        expect_result = signal.SIG_IGN
+        result = instance._make_signal_handler(target)
+        self.failUnlessEqual(expect_result, result)
+
+    def test_returns_method_for_name(self):
         """ Should return method of DaemonContext when name specified. """
         instance = self.test_instance
         target = 'terminate'
@@ -1366,32 +2321,27 @@ class close_all_open_files_TestCase(scaffold.TestCase):
         """ Set up test fixtures. """
         self.mock_tracker = scaffold.MockTracker()
 
-        self.RLIMIT_NOFILE = object()
-        self.RLIM_INFINITY = object()
-        self.test_rlimit_nofile = self.RLIM_INFINITY
-
-        def mock_getrlimit(resource):
-            result = (self.test_rlimit_nofile, object())
-            if resource != self.RLIMIT_NOFILE:
-                result = NotImplemented
-            return result
-
         self.test_maxfd = 8
         scaffold.mock(
             u"daemon.daemon.get_maximum_file_descriptors",
             returns=self.test_maxfd,
             tracker=self.mock_tracker)
 
+        self.test_strategy = u'closerange'
         scaffold.mock(
-            u"resource.RLIMIT_NOFILE", mock_obj=self.RLIMIT_NOFILE,
+            u"daemon.daemon.probe_close_files_strategy",
+            returns_func=(lambda: self.test_strategy),
             tracker=self.mock_tracker)
+
+        self.test_open_fds = None
         scaffold.mock(
-            u"resource.RLIM_INFINITY", mock_obj=self.RLIM_INFINITY,
+            u"daemon.daemon.get_open_file_descriptors",
+            returns_func=(lambda: self.test_open_fds),
             tracker=self.mock_tracker)
+
         scaffold.mock(
-            u"resource.getrlimit", returns_func=mock_getrlimit,
+            u"daemon.daemon.close_file_descriptor_range",
             tracker=self.mock_tracker)
-
         scaffold.mock(
             u"daemon.daemon.close_file_descriptor_if_open",
             tracker=self.mock_tracker)
@@ -1402,11 +2352,11 @@ class close_all_open_files_TestCase(scaffold.TestCase):
 
     def test_requests_all_open_files_to_close(self):
         """ Should request close of all open files. """
-        expect_file_descriptors = reversed(range(self.test_maxfd))
-        expect_mock_output = u"...\n" + u"".join(
-            u"Called daemon.daemon.close_file_descriptor_if_open(%(fd)r)\n"
-                % vars()
-            for fd in expect_file_descriptors)
+        expect_mock_output = u"""\
+            Called daemon.daemon.probe_close_files_strategy()
+            Called daemon.daemon.get_maximum_file_descriptors()
+            Called daemon.daemon.close_file_descriptor_range(0, 7)
+            """
         daemon.daemon.close_all_open_files()
         self.failUnlessMockCheckerMatch(expect_mock_output)
 
@@ -1416,16 +2366,298 @@ class close_all_open_files_TestCase(scaffold.TestCase):
         args = dict(
             exclude = test_exclude,
             )
-        expect_file_descriptors = (
-            fd for fd in reversed(range(self.test_maxfd))
-            if fd not in test_exclude)
-        expect_mock_output = u"...\n" + "".join(
-            u"Called daemon.daemon.close_file_descriptor_if_open(%(fd)r)\n"
-                % vars()
-            for fd in expect_file_descriptors)
+        expect_mock_output = u"""\
+            ...
+            Called daemon.daemon.close_file_descriptor_range(4, 6)
+            Called daemon.daemon.close_file_descriptor_range(0, 2)
+            """
+        daemon.daemon.close_all_open_files(**args)
+        self.failUnlessMockCheckerMatch(expect_mock_output)
+
+    def test_requests_kernel_ranges_to_close(self):
+        """ Should request close of ranges up to the kernel maximum. """
+        self.test_strategy = u'close_range'
+        test_exclude = set([0, 1, 2])
+        args = dict(
+            exclude = test_exclude,
+            )
+        expect_maxfd = daemon.daemon.CLOSE_RANGE_MAX_FD
+        expect_mock_output = u"""\
+            Called daemon.daemon.probe_close_files_strategy()
+            Called daemon.daemon.close_file_descriptor_range(
+                3, %(expect_maxfd)r)
+            """ % vars()
+        daemon.daemon.close_all_open_files(**args)
+        self.failUnlessMockCheckerMatch(expect_mock_output)
+
+    def test_requests_only_enumerated_files_to_close(self):
+        """ Should request close of only the enumerated open files. """
+        self.test_strategy = u'proc'
+        self.test_open_fds = set([0, 1, 2, 5, 1000])
+        test_exclude = set([2])
+        args = dict(
+            exclude = test_exclude,
+            )
+        expect_mock_output = u"""\
+            Called daemon.daemon.probe_close_files_strategy()
+            Called daemon.daemon.get_open_file_descriptors()
+            Called daemon.daemon.close_file_descriptor_if_open(1000)
+            Called daemon.daemon.close_file_descriptor_if_open(5)
+            Called daemon.daemon.close_file_descriptor_if_open(1)
+            Called daemon.daemon.close_file_descriptor_if_open(0)
+            """
+        daemon.daemon.close_all_open_files(**args)
+        self.failUnlessMockCheckerMatch(expect_mock_output)
+
+    def test_omits_maximum_if_open_files_enumerated(self):
+        """ Should not query maximum file descriptors if enumerated. """
+        self.test_strategy = u'proc'
+        self.test_open_fds = set([0, 1, 2])
+        unwanted_output = u"""\
+            ...Called daemon.daemon.get_maximum_file_descriptors()..."""
+        daemon.daemon.close_all_open_files()
+        self.failIfMockCheckerMatch(unwanted_output)
+
+    def test_falls_back_to_ranges_if_enumeration_fails(self):
+        """ Should close ranges if open files cannot be enumerated. """
+        self.test_strategy = u'proc'
+        self.test_open_fds = None
+        expect_mock_output = u"""\
+            ...
+            Called daemon.daemon.close_file_descriptor_range(0, 7)
+            """
+        daemon.daemon.close_all_open_files()
+        self.failUnlessMockCheckerMatch(expect_mock_output)
+
+    def test_uses_specified_maximum(self):
+        """ Should close ranges up to the specified maximum. """
+        args = dict(
+            maxfd = 4,
+            )
+        expect_mock_output = u"""\
+            Called daemon.daemon.probe_close_files_strategy()
+            Called daemon.daemon.close_file_descriptor_range(0, 3)
+            """
         daemon.daemon.close_all_open_files(**args)
         self.failUnlessMockCheckerMatch(expect_mock_output)
 
+    def test_returns_strategy_name(self):
+        """ Should return the name of the strategy used. """
+        self.test_strategy = u'close_range'
+        expect_result = self.test_strategy
+        result = daemon.daemon.close_all_open_files()
+        self.failUnlessEqual(expect_result, result)
+
+
+
+class get_file_descriptor_ranges_TestCase(scaffold.TestCase):
+    """ Test cases for get_file_descriptor_ranges function. """
+
+    def test_returns_single_range_if_no_exclude(self):
+        """ Should return a single range if nothing is excluded. """
+        expect_result = [(0, 99)]
+        result = daemon.daemon.get_file_descriptor_ranges(set(), 99)
+        self.failUnlessEqual(expect_result, result)
+
+    def test_returns_gaps_between_excluded(self):
+        """ Should return the gaps between excluded file descriptors. """
+        test_exclude = set([7, 0, 1, 2, 4])
+        expect_result = [(3, 3), (5, 6), (8, 99)]
+        result = daemon.daemon.get_file_descriptor_ranges(test_exclude, 99)
+        self.failUnlessEqual(expect_result, result)
+
+    def test_omits_excluded_above_maximum(self):
+        """ Should ignore excluded file descriptors above the maximum. """
+        test_exclude = set([3, 500])
+        expect_result = [(0, 2), (4, 99)]
+        result = daemon.daemon.get_file_descriptor_ranges(test_exclude, 99)
+        self.failUnlessEqual(expect_result, result)
+
+    def test_omits_final_range_if_maximum_excluded(self):
+        """ Should omit the final range if the maximum is excluded. """
+        test_exclude = set([98, 99])
+        expect_result = [(0, 97)]
+        result = daemon.daemon.get_file_descriptor_ranges(test_exclude, 99)
+        self.failUnlessEqual(expect_result, result)
+
+
+
+class close_file_descriptor_range_TestCase(scaffold.TestCase):
+    """ Test cases for close_file_descriptor_range function. """
+
+    def setUp(self):
+        """ Set up test fixtures. """
+        self.mock_tracker = scaffold.MockTracker()
+
+        self.mock_close_range = scaffold.Mock(
+            u"close_range", returns=0,
+            tracker=self.mock_tracker)
+        self.test_close_range = None
+        scaffold.mock(
+            u"daemon.daemon.get_close_range_function",
+            returns_func=(lambda: self.test_close_range),
+            tracker=self.mock_tracker)
+
+        scaffold.mock(
+            u"os.closerange",
+            tracker=self.mock_tracker)
+        scaffold.mock(
+            u"daemon.daemon.close_file_descriptor_if_open",
+            tracker=self.mock_tracker)
+
+        self.test_args = dict(
+            low = 3,
+            high = 5,
+            )
+
+    def tearDown(self):
+        """ Tear down test fixtures. """
+        scaffold.mock_restore()
+
+    def test_requests_kernel_close_range(self):
+        """ Should request close of the range with `close_range`. """
+        self.test_close_range = self.mock_close_range
+        args = self.test_args
+        expect_mock_output = u"""\
+            Called daemon.daemon.get_close_range_function()
+            Called close_range(3, 5, 0)
+            """
+        daemon.daemon.close_file_descriptor_range(**args)
+        self.failUnlessMockCheckerMatch(expect_mock_output)
+
+    def test_raises_error_if_kernel_close_range_fails(self):
+        """ Should raise DaemonError if `close_range` fails. """
+        self.test_close_range = self.mock_close_range
+        self.mock_close_range.mock_returns = -1
+        args = self.test_args
+        expect_error = daemon.daemon.DaemonOSEnvironmentError
+        self.failUnlessRaises(
+            expect_error,
+            daemon.daemon.close_file_descriptor_range, **args)
+
+    def test_requests_os_closerange_without_kernel_close_range(self):
+        """ Should request `os.closerange` if no `close_range`. """
+        args = self.test_args
+        expect_mock_output = u"""\
+            Called daemon.daemon.get_close_range_function()
+            Called os.closerange(3, 6)
+            """
+        daemon.daemon.close_file_descriptor_range(**args)
+        self.failUnlessMockCheckerMatch(expect_mock_output)
+
+    def test_requests_each_file_close_without_closerange(self):
+        """ Should request close of each file if no `os.closerange`. """
+        del os.closerange
+        args = self.test_args
+        expect_mock_output = u"""\
+            Called daemon.daemon.get_close_range_function()
+            Called daemon.daemon.close_file_descriptor_if_open(5)
+            Called daemon.daemon.close_file_descriptor_if_open(4)
+            Called daemon.daemon.close_file_descriptor_if_open(3)
+            """
+        daemon.daemon.close_file_descriptor_range(**args)
+        self.failUnlessMockCheckerMatch(expect_mock_output)
+
+
+
+class probe_close_files_strategy_TestCase(scaffold.TestCase):
+    """ Test cases for probe_close_files_strategy function. """
+
+    def setUp(self):
+        """ Set up test fixtures. """
+        self.mock_tracker = scaffold.MockTracker()
+
+        self.test_close_range = object()
+        scaffold.mock(
+            u"daemon.daemon.get_close_range_function",
+            returns_func=(lambda: self.test_close_range),
+            tracker=self.mock_tracker)
+
+        self.test_proc_available = True
+        scaffold.mock(
+            u"os.path.isdir",
+            returns_func=(lambda path: self.test_proc_available),
+            tracker=self.mock_tracker)
+
+        scaffold.mock(
+            u"os.closerange",
+            tracker=self.mock_tracker)
+
+    def tearDown(self):
+        """ Tear down test fixtures. """
+        scaffold.mock_restore()
+
+    def test_prefers_kernel_close_range(self):
+        """ Should choose `close_range` if available. """
+        expect_result = u'close_range'
+        result = daemon.daemon.probe_close_files_strategy()
+        self.failUnlessEqual(expect_result, result)
+
+    def test_chooses_proc_without_kernel_close_range(self):
+        """ Should choose enumeration if no `close_range`. """
+        self.test_close_range = None
+        expect_result = u'proc'
+        result = daemon.daemon.probe_close_files_strategy()
+        self.failUnlessEqual(expect_result, result)
+
+    def test_chooses_closerange_without_proc(self):
+        """ Should choose `os.closerange` if no enumeration. """
+        self.test_close_range = None
+        self.test_proc_available = False
+        expect_result = u'closerange'
+        result = daemon.daemon.probe_close_files_strategy()
+        self.failUnlessEqual(expect_result, result)
+
+    def test_chooses_close_as_last_resort(self):
+        """ Should choose closing each file if nothing else is available. """
+        self.test_close_range = None
+        self.test_proc_available = False
+        del os.closerange
+        expect_result = u'close'
+        result = daemon.daemon.probe_close_files_strategy()
+        self.failUnlessEqual(expect_result, result)
+
+
+class get_open_file_descriptors_TestCase(scaffold.TestCase):
+    """ Test cases for get_open_file_descriptors function. """
+
+    def setUp(self):
+        """ Set up test fixtures. """
+        self.mock_tracker = scaffold.MockTracker()
+
+        self.test_entries = [u"0", u"1", u"2", u"17"]
+        scaffold.mock(
+            u"os.listdir",
+            returns_func=(lambda path: self.test_entries),
+            tracker=self.mock_tracker)
+
+    def tearDown(self):
+        """ Tear down test fixtures. """
+        scaffold.mock_restore()
+
+    def test_lists_process_fd_directory(self):
+        """ Should list the process file descriptor directory. """
+        expect_path = daemon.daemon.PROC_FD_DIRECTORY
+        expect_mock_output = u"""\
+            Called os.listdir(%(expect_path)r)
+            """ % vars()
+        daemon.daemon.get_open_file_descriptors()
+        self.failUnlessMockCheckerMatch(expect_mock_output)
+
+    def test_returns_file_descriptors_from_entries(self):
+        """ Should return the set of descriptors named by the entries. """
+        expect_result = set([0, 1, 2, 17])
+        result = daemon.daemon.get_open_file_descriptors()
+        self.failUnlessEqual(expect_result, result)
+
+    def test_returns_none_if_directory_unavailable(self):
+        """ Should return None if the directory cannot be listed. """
+        test_error = OSError(errno.ENOENT, u"No such file or directory")
+        os.listdir.mock_raises = test_error
+        expect_result = None
+        result = daemon.daemon.get_open_file_descriptors()
+        self.failUnlessIs(expect_result, result)
+
 
 class detach_process_context_TestCase(scaffold.TestCase):
     """ Test cases for detach_process_context function. """
@@ -1562,27 +2794,225 @@ class detach_process_context_TestCase(scaffold.TestCase):
         daemon.daemon.detach_process_context()
         self.failUnlessMockCheckerMatch(expect_mock_output)
 
-
-class is_process_started_by_init_TestCase(scaffold.TestCase):
-    """ Test cases for is_process_started_by_init function. """
+    def test_returns_none_by_default(self):
+        """ Should return None if not waiting for the start-up status. """
+        result = daemon.daemon.detach_process_context()
+        self.failUnlessIs(None, result)
+
+
+class detach_process_context_ready_timeout_TestCase(scaffold.TestCase):
+    """ Test cases for detach_process_context with a ready timeout. """
+
+    class FakeOSExit(SystemExit):
+        """ Fake exception raised for os._exit(). """
 
     def setUp(self):
         """ Set up test fixtures. """
         self.mock_tracker = scaffold.MockTracker()
 
-        self.test_ppid = 765
-
         scaffold.mock(
-            u"os.getppid",
-            returns=self.test_ppid,
+            u"os.fork", returns_iter=[0, 0],
+            tracker=self.mock_tracker)
+        scaffold.mock(
+            u"os.setsid",
+            tracker=self.mock_tracker)
+        scaffold.mock(
+            u"os.close",
             tracker=self.mock_tracker)
 
-    def tearDown(self):
-        """ Tear down test fixtures. """
-        scaffold.mock_restore()
+        def raise_os_exit(status=None):
+            raise self.FakeOSExit(status)
 
-    def test_returns_false_by_default(self):
-        """ Should return False under normal circumstances. """
+        scaffold.mock(
+            u"os._exit", returns_func=raise_os_exit,
+            tracker=self.mock_tracker)
+
+        self.test_status_fds = (7, 8)
+        scaffold.mock(
+            u"daemon.daemon.make_start_status_pipe",
+            returns=self.test_status_fds,
+            tracker=self.mock_tracker)
+        self.test_exit_status = 1
+        scaffold.mock(
+            u"daemon.daemon.wait_for_start_status",
+            returns=self.test_exit_status,
+            tracker=self.mock_tracker)
+
+        self.test_timeout = 30
+
+    def tearDown(self):
+        """ Tear down test fixtures. """
+        scaffold.mock_restore()
+
+    def test_parent_waits_then_exits_with_status(self):
+        """ Parent should wait for the status, then exit with it. """
+        scaffold.mock(
+            u"os.fork", returns_iter=[23],
+            tracker=self.mock_tracker)
+        timeout = self.test_timeout
+        exit_status = self.test_exit_status
+        expect_mock_output = u"""\
+            Called daemon.daemon.make_start_status_pipe()
+            Called os.fork()
+            Called os.close(8)
+            Called daemon.daemon.wait_for_start_status(7, %(timeout)r)
+            Called os._exit(%(exit_status)r)
+            """ % vars()
+        self.failUnlessRaises(
+            self.FakeOSExit,
+            daemon.daemon.detach_process_context, ready_timeout=timeout)
+        self.failUnlessMockCheckerMatch(expect_mock_output)
+
+    def test_intermediate_parent_exits_at_once(self):
+        """ Second parent should exit without waiting. """
+        scaffold.mock(
+            u"os.fork", returns_iter=[0, 42],
+            tracker=self.mock_tracker)
+        expect_mock_output = u"""\
+            Called daemon.daemon.make_start_status_pipe()
+            Called os.fork()
+            Called os.close(7)
+            Called os.setsid()
+            Called os.fork()
+            Called os._exit(0)
+            """
+        self.failUnlessRaises(
+            self.FakeOSExit,
+            daemon.daemon.detach_process_context,
+            ready_timeout=self.test_timeout)
+        self.failUnlessMockCheckerMatch(expect_mock_output)
+
+    def test_child_returns_status_write_fd(self):
+        """ Daemon process should return the status pipe write end. """
+        expect_result = self.test_status_fds[1]
+        result = daemon.daemon.detach_process_context(
+            ready_timeout=self.test_timeout)
+        self.failUnlessEqual(expect_result, result)
+
+
+class start_status_TestCase(scaffold.TestCase):
+    """ Test cases for the start-up status pipe functions. """
+
+    def setUp(self):
+        """ Set up test fixtures. """
+        self.mock_tracker = scaffold.MockTracker()
+
+        (self.read_fd, self.write_fd) = daemon.daemon.make_start_status_pipe()
+        self.mock_stderr = FakeFileDescriptorStringIO()
+        scaffold.mock(
+            u"sys.stderr",
+            mock_obj=self.mock_stderr,
+            tracker=self.mock_tracker)
+
+    def tearDown(self):
+        """ Tear down test fixtures. """
+        scaffold.mock_restore()
+        for fd in [self.read_fd, self.write_fd]:
+            if fd is not None:
+                os.close(fd)
+
+    def test_pipe_is_close_on_exec(self):
+        """ Should make a pipe not inherited across `exec`. """
+        for fd in [self.read_fd, self.write_fd]:
+            flags = fcntl.fcntl(fd, fcntl.F_GETFD)
+            self.failUnless(flags & fcntl.FD_CLOEXEC)
+
+    def test_report_writes_line_and_closes(self):
+        """ Should write the message as a line, then close the pipe. """
+        daemon.daemon.report_start_status(self.write_fd, u"ready")
+        self.write_fd = None
+        self.failUnlessEqual("ready\n", os.read(self.read_fd, 100))
+        self.failUnlessEqual("", os.read(self.read_fd, 100))
+
+    def test_report_ignores_closed_reader(self):
+        """ Should discard the message if nobody is reading it. """
+        os.close(self.read_fd)
+        self.read_fd = None
+        daemon.daemon.report_start_status(self.write_fd, u"ready")
+        self.write_fd = None
+
+    def test_read_returns_message(self):
+        """ Should return the message reported. """
+        daemon.daemon.report_start_status(self.write_fd, u"failed: Café")
+        self.write_fd = None
+        result = daemon.daemon.read_start_status(
+            self.read_fd, time.time() + 5)
+        self.failUnlessEqual(u"failed: Café", result)
+
+    def test_read_returns_empty_if_closed(self):
+        """ Should return an empty message if the pipe is closed. """
+        os.close(self.write_fd)
+        self.write_fd = None
+        result = daemon.daemon.read_start_status(
+            self.read_fd, time.time() + 5)
+        self.failUnlessEqual(u"", result)
+
+    def test_read_returns_none_if_time_runs_out(self):
+        """ Should return None if no message arrives in time. """
+        result = daemon.daemon.read_start_status(
+            self.read_fd, time.time() + 0.01)
+        self.failUnlessIs(None, result)
+
+    def test_wait_returns_zero_if_ready(self):
+        """ Should return status 0 if the daemon is ready. """
+        daemon.daemon.report_start_status(self.write_fd, u"ready")
+        self.write_fd = None
+        result = daemon.daemon.wait_for_start_status(self.read_fd, 5)
+        self.read_fd = None
+        self.failUnlessEqual(0, result)
+        self.failUnlessEqual("", self.mock_stderr.getvalue())
+
+    def test_wait_reports_failure_reason(self):
+        """ Should emit the reason and return failure status. """
+        daemon.daemon.report_start_status(self.write_fd, u"failed: Spam")
+        self.write_fd = None
+        expect_status = daemon.daemon.START_FAILED_EXIT_STATUS
+        result = daemon.daemon.wait_for_start_status(self.read_fd, 5)
+        self.read_fd = None
+        self.failUnlessEqual(expect_status, result)
+        self.failUnlessEqual(
+            "Daemon failed to start: Spam\n", self.mock_stderr.getvalue())
+
+    def test_wait_reports_failure_if_daemon_exits(self):
+        """ Should return failure status if the daemon exits unready. """
+        os.close(self.write_fd)
+        self.write_fd = None
+        expect_status = daemon.daemon.START_FAILED_EXIT_STATUS
+        result = daemon.daemon.wait_for_start_status(self.read_fd, 5)
+        self.read_fd = None
+        self.failUnlessEqual(expect_status, result)
+        self.failUnlessIn(
+            self.mock_stderr.getvalue(), u"exited before it was ready")
+
+    def test_wait_reports_timeout(self):
+        """ Should return timeout status if the time runs out. """
+        expect_status = daemon.daemon.START_TIMEOUT_EXIT_STATUS
+        result = daemon.daemon.wait_for_start_status(self.read_fd, 0.01)
+        self.read_fd = None
+        self.failUnlessEqual(expect_status, result)
+        self.failUnlessIn(self.mock_stderr.getvalue(), u"not ready after")
+
+
+class is_process_started_by_init_TestCase(scaffold.TestCase):
+    """ Test cases for is_process_started_by_init function. """
+
+    def setUp(self):
+        """ Set up test fixtures. """
+        self.mock_tracker = scaffold.MockTracker()
+
+        self.test_ppid = 765
+
+        scaffold.mock(
+            u"os.getppid",
+            returns=self.test_ppid,
+            tracker=self.mock_tracker)
+
+    def tearDown(self):
+        """ Tear down test fixtures. """
+        scaffold.mock_restore()
+
+    def test_returns_false_by_default(self):
+        """ Should return False under normal circumstances. """
         expect_result = False
         result = daemon.daemon.is_process_started_by_init()
         self.failUnlessIs(expect_result, result)
@@ -1603,29 +3033,19 @@ class is_socket_TestCase(scaffold.TestCase):
         """ Set up test fixtures. """
         self.mock_tracker = scaffold.MockTracker()
 
-        def mock_getsockopt(level, optname, buflen=None):
-            result = object()
-            if optname is socket.SO_TYPE:
-                result = socket.SOCK_RAW
-            return result
-
-        self.mock_socket_getsockopt_func = mock_getsockopt
+        self.test_mode = stat.S_IFREG | 0644
 
-        self.mock_socket_error = socket.error(
-            errno.ENOTSOCK,
-            u"Socket operation on non-socket")
+        def mock_fstat(fd):
+            result = scaffold.Mock(u"stat_result")
+            result.st_mode = self.test_mode
+            return result
 
-        self.mock_socket = scaffold.Mock(
-            u"socket.socket",
+        scaffold.mock(
+            u"os.fstat",
+            returns_func=mock_fstat,
             tracker=self.mock_tracker)
-        self.mock_socket.getsockopt.mock_raises = self.mock_socket_error
-
-        def mock_socket_fromfd(fd, family, type, proto=None):
-            return self.mock_socket
-
         scaffold.mock(
             u"socket.fromfd",
-            returns_func=mock_socket_fromfd,
             tracker=self.mock_tracker)
 
     def tearDown(self):
@@ -1642,24 +3062,39 @@ class is_socket_TestCase(scaffold.TestCase):
     def test_returns_true_if_stdin_is_socket(self):
         """ Should return True if `stdin` is a socket. """
         test_fd = 23
-        getsockopt = self.mock_socket.getsockopt
-        getsockopt.mock_raises = None
-        getsockopt.mock_returns_func = self.mock_socket_getsockopt_func
+        self.test_mode = stat.S_IFSOCK | 0777
         expect_result = True
         result = daemon.daemon.is_socket(test_fd)
         self.failUnlessIs(expect_result, result)
 
-    def test_returns_false_if_stdin_socket_raises_error(self):
-        """ Should return True if `stdin` is a socket and raises error. """
+    def test_returns_false_if_fstat_raises_error(self):
+        """ Should return False if `fstat` raises an error. """
         test_fd = 23
-        getsockopt = self.mock_socket.getsockopt
-        getsockopt.mock_raises = socket.error(
-            object(), u"Weird socket stuff")
-        expect_result = True
+        os.fstat.mock_raises = OSError(errno.EBADF, u"Bad file descriptor")
+        expect_result = False
         result = daemon.daemon.is_socket(test_fd)
         self.failUnlessIs(expect_result, result)
 
+    def test_does_not_create_socket(self):
+        """ Should not create a socket object for the file descriptor. """
+        test_fd = 23
+        self.test_mode = stat.S_IFSOCK | 0777
+        expect_mock_output = u"""\
+            Called os.fstat(%(test_fd)r)
+            """ % vars()
+        daemon.daemon.is_socket(test_fd)
+        self.failUnlessMockCheckerMatch(expect_mock_output)
+
+    def test_returns_true_for_actual_socket(self):
+        """ Should return True for an actual socket. """
+        scaffold.mock_restore()
+        test_socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        result = daemon.daemon.is_socket(test_socket.fileno())
+        test_socket.close()
+        self.failUnlessIs(True, result)
+
 
+
 class is_process_started_by_superserver_TestCase(scaffold.TestCase):
     """ Test cases for is_process_started_by_superserver function. """
 
@@ -1699,6 +3134,49 @@ class is_process_started_by_superserver_TestCase(scaffold.TestCase):
         self.failUnlessIs(expect_result, result)
 
 
+class is_process_started_by_socket_activation_TestCase(scaffold.TestCase):
+    """ Test cases for is_process_started_by_socket_activation function. """
+
+    def setUp(self):
+        """ Set up test fixtures. """
+        self.mock_tracker = scaffold.MockTracker()
+
+        self.test_pid = 235
+        scaffold.mock(
+            u"os.getpid",
+            returns=self.test_pid,
+            tracker=self.mock_tracker)
+        self.test_environ = {}
+        scaffold.mock(
+            u"os.environ",
+            mock_obj=self.test_environ,
+            tracker=self.mock_tracker)
+
+    def tearDown(self):
+        """ Tear down test fixtures. """
+        scaffold.mock_restore()
+
+    def test_returns_false_by_default(self):
+        """ Should return False under normal circumstances. """
+        expect_result = False
+        result = daemon.daemon.is_process_started_by_socket_activation()
+        self.failUnlessIs(expect_result, result)
+
+    def test_returns_true_if_listen_pid_is_current_process(self):
+        """ Should return True if `LISTEN_PID` names this process. """
+        self.test_environ.update(LISTEN_PID="235", LISTEN_FDS="1")
+        expect_result = True
+        result = daemon.daemon.is_process_started_by_socket_activation()
+        self.failUnlessIs(expect_result, result)
+
+    def test_returns_false_if_listen_pid_is_other_process(self):
+        """ Should return False if `LISTEN_PID` names another process. """
+        self.test_environ.update(LISTEN_PID="8642", LISTEN_FDS="1")
+        expect_result = False
+        result = daemon.daemon.is_process_started_by_socket_activation()
+        self.failUnlessIs(expect_result, result)
+
+
 class is_detach_process_context_required_TestCase(scaffold.TestCase):
     """ Test cases for is_detach_process_context_required function. """
 
@@ -1706,12 +3184,20 @@ class is_detach_process_context_required_TestCase(scaffold.TestCase):
         """ Set up test fixtures. """
         self.mock_tracker = scaffold.MockTracker()
 
+        scaffold.mock(
+            u"daemon.daemon._detach_process_context_required",
+            mock_obj={},
+            tracker=self.mock_tracker)
+
         scaffold.mock(
             u"daemon.daemon.is_process_started_by_init",
             tracker=self.mock_tracker)
         scaffold.mock(
             u"daemon.daemon.is_process_started_by_superserver",
             tracker=self.mock_tracker)
+        scaffold.mock(
+            u"daemon.daemon.is_process_started_by_socket_activation",
+            tracker=self.mock_tracker)
 
     def tearDown(self):
         """ Tear down test fixtures. """
@@ -1737,53 +3223,184 @@ class is_detach_process_context_required_TestCase(scaffold.TestCase):
         result = daemon.daemon.is_detach_process_context_required()
         self.failUnlessIs(expect_result, result)
 
+    def test_returns_false_if_started_by_socket_activation(self):
+        """ Should return False if process started by socket activation. """
+        func = daemon.daemon.is_process_started_by_socket_activation
+        func.mock_returns = True
+        expect_result = False
+        result = daemon.daemon.is_detach_process_context_required()
+        self.failUnlessIs(expect_result, result)
+
+    def test_examines_environment_once_per_process(self):
+        """ Should examine the process environment only once. """
+        daemon.daemon.is_detach_process_context_required()
+        self.mock_tracker.clear()
+        expect_mock_output = u"""\
+            """
+        daemon.daemon.is_detach_process_context_required()
+        self.failUnlessMockCheckerMatch(expect_mock_output)
+
+    def test_examines_environment_again_in_new_process(self):
+        """ Should examine the environment again in a new process. """
+        daemon.daemon.is_detach_process_context_required()
+        self.mock_tracker.clear()
+        scaffold.mock(
+            u"os.getpid",
+            returns=object(),
+            tracker=self.mock_tracker)
+        expect_mock_output = u"""\
+            Called os.getpid()
+            Called daemon.daemon.is_process_started_by_init()
+            ...
+            """
+        daemon.daemon.is_detach_process_context_required()
+        self.failUnlessMockCheckerMatch(expect_mock_output)
+
 
-def setup_streams_fixtures(testcase):
-    """ Set up common test fixtures for standard streams. """
-    testcase.mock_tracker = scaffold.MockTracker()
+class get_resource_number_TestCase(scaffold.TestCase):
+    """ Test cases for get_resource_number function. """
 
-    testcase.stream_file_paths = dict(
-        stdin = tempfile.mktemp(),
-        stdout = tempfile.mktemp(),
-        stderr = tempfile.mktemp(),
-        )
+    def test_returns_constant_for_full_name(self):
+        """ Should return the constant for a full resource name. """
+        expect_result = resource.RLIMIT_NOFILE
+        result = daemon.daemon.get_resource_number(u'RLIMIT_NOFILE')
+        self.failUnlessEqual(expect_result, result)
 
-    testcase.stream_files_by_name = dict(
-        (name, FakeFileDescriptorStringIO())
-        for name in ['stdin', 'stdout', 'stderr']
-        )
+    def test_returns_constant_for_short_name(self):
+        """ Should return the constant for a short resource name. """
+        expect_result = resource.RLIMIT_AS
+        result = daemon.daemon.get_resource_number(u'as')
+        self.failUnlessEqual(expect_result, result)
 
-    testcase.stream_files_by_path = dict(
-        (testcase.stream_file_paths[name],
-            testcase.stream_files_by_name[name])
-        for name in ['stdin', 'stdout', 'stderr']
-        )
+    def test_returns_constant_unchanged(self):
+        """ Should return a resource constant unchanged. """
+        expect_result = resource.RLIMIT_CORE
+        result = daemon.daemon.get_resource_number(resource.RLIMIT_CORE)
+        self.failUnlessEqual(expect_result, result)
 
-    scaffold.mock(
-        u"os.dup2",
-        tracker=testcase.mock_tracker)
+    def test_raises_daemon_error_for_unknown_name(self):
+        """ Should raise a DaemonError for an unknown resource name. """
+        expect_error = daemon.daemon.DaemonOSEnvironmentError
+        self.failUnlessRaises(
+            expect_error,
+            daemon.daemon.get_resource_number, u'BOGUS')
 
-
-class redirect_stream_TestCase(scaffold.TestCase):
-    """ Test cases for redirect_stream function. """
+
+class make_resource_limit_TestCase(scaffold.TestCase):
+    """ Test cases for make_resource_limit function. """
 
     def setUp(self):
         """ Set up test fixtures. """
-        setup_streams_fixtures(self)
+        self.mock_tracker = scaffold.MockTracker()
 
-        self.test_system_stream = FakeFileDescriptorStringIO()
-        self.test_target_stream = FakeFileDescriptorStringIO()
-        self.test_null_file = FakeFileDescriptorStringIO()
+        self.test_limits_prev = (1024, 4096)
+        scaffold.mock(
+            u"resource.getrlimit",
+            returns=self.test_limits_prev,
+            tracker=self.mock_tracker)
+        scaffold.mock(
+            u"daemon.daemon.has_resource_capability",
+            returns=False,
+            tracker=self.mock_tracker)
 
-        def mock_open(path, flag, mode=None):
-            if path == os.devnull:
-                result = self.test_null_file.fileno()
-            else:
-                raise OSError(errno.NOENT, u"No such file", path)
-            return result
+        self.test_resource = resource.RLIMIT_NOFILE
+
+    def tearDown(self):
+        """ Tear down test fixtures. """
+        scaffold.mock_restore()
+
+    def test_sets_soft_limit_for_integer(self):
+        """ Should set only the soft limit for an integer limit. """
+        expect_result = (self.test_resource, (2048, 4096))
+        result = daemon.daemon.make_resource_limit(self.test_resource, 2048)
+        self.failUnlessEqual(expect_result, result)
+
+    def test_sets_both_limits_for_tuple(self):
+        """ Should set both limits for a tuple limit. """
+        expect_result = (self.test_resource, (256, 512))
+        result = daemon.daemon.make_resource_limit(
+            self.test_resource, (256, 512))
+        self.failUnlessEqual(expect_result, result)
+
+    def test_raises_soft_limit_to_hard_limit(self):
+        """ Should raise the soft limit to the hard limit for 'hard'. """
+        expect_result = (self.test_resource, (4096, 4096))
+        result = daemon.daemon.make_resource_limit(
+            self.test_resource, u'hard')
+        self.failUnlessEqual(expect_result, result)
+
+    def test_allows_infinity_within_infinite_hard_limit(self):
+        """ Should allow an infinite soft limit if hard limit infinite. """
+        infinity = resource.RLIM_INFINITY
+        resource.getrlimit.mock_returns = (1024, infinity)
+        expect_result = (self.test_resource, (infinity, infinity))
+        result = daemon.daemon.make_resource_limit(
+            self.test_resource, infinity)
+        self.failUnlessEqual(expect_result, result)
+
+    def test_raises_daemon_error_if_soft_exceeds_hard(self):
+        """ Should raise a DaemonError if soft exceeds hard limit. """
+        expect_error = daemon.daemon.DaemonOSEnvironmentError
+        self.failUnlessRaises(
+            expect_error,
+            daemon.daemon.make_resource_limit, self.test_resource, 8192)
+
+    def test_raises_daemon_error_if_soft_infinite_above_hard(self):
+        """ Should raise a DaemonError for infinity over a finite hard. """
+        expect_error = daemon.daemon.DaemonOSEnvironmentError
+        self.failUnlessRaises(
+            expect_error,
+            daemon.daemon.make_resource_limit,
+            self.test_resource, resource.RLIM_INFINITY)
+
+    def test_raises_daemon_error_if_hard_raised_without_capability(self):
+        """ Should raise a DaemonError raising hard without capability. """
+        expect_error = daemon.daemon.DaemonOSEnvironmentError
+        self.failUnlessRaises(
+            expect_error,
+            daemon.daemon.make_resource_limit,
+            self.test_resource, (8192, 8192))
+
+    def test_allows_hard_raised_with_capability(self):
+        """ Should allow raising the hard limit with the capability. """
+        daemon.daemon.has_resource_capability.mock_returns = True
+        expect_result = (self.test_resource, (8192, 8192))
+        result = daemon.daemon.make_resource_limit(
+            self.test_resource, (8192, 8192))
+        self.failUnlessEqual(expect_result, result)
 
+    def test_allows_hard_lowered_without_capability(self):
+        """ Should allow lowering the hard limit without capability. """
+        expect_mock_output = u"""\
+            Called resource.getrlimit(...)
+            """
+        daemon.daemon.make_resource_limit(self.test_resource, (256, 512))
+        self.failUnlessMockCheckerMatch(expect_mock_output)
+
+
+class has_resource_capability_TestCase(scaffold.TestCase):
+    """ Test cases for has_resource_capability function. """
+
+    def setUp(self):
+        """ Set up test fixtures. """
+        self.mock_tracker = scaffold.MockTracker()
+
+        self.test_status_text = u"""\
+            Name:\tspam
+            CapInh:\t0000000000000000
+            CapEff:\t%(cap_eff)s
+            """
+        self.test_status_file = StringIO()
         scaffold.mock(
-            u"os.open",
+            u"os.geteuid",
+            returns=0,
+            tracker=self.mock_tracker)
+
+        def mock_open(filename, mode=None, buffering=None):
+            return self.test_status_file
+
+        scaffold.mock(
+            u"builtins.open",
             returns_func=mock_open,
             tracker=self.mock_tracker)
 
@@ -1791,34 +3408,1583 @@ class redirect_stream_TestCase(scaffold.TestCase):
         """ Tear down test fixtures. """
         scaffold.mock_restore()
 
-    def test_duplicates_target_file_descriptor(self):
-        """ Should duplicate file descriptor from target to system stream. """
-        system_stream = self.test_system_stream
-        system_fileno = system_stream.fileno()
-        target_stream = self.test_target_stream
-        target_fileno = target_stream.fileno()
+    def set_status(self, cap_eff):
+        """ Set the status file content for the effective capabilities. """
+        text = self.test_status_text % vars()
+        lines = [line.strip() for line in text.splitlines()]
+        self.test_status_file.write(u"\n".join(lines))
+        self.test_status_file.seek(0)
+
+    def test_returns_true_if_capability_effective(self):
+        """ Should return True if CAP_SYS_RESOURCE is effective. """
+        self.set_status(u"0000000001000000")
+        result = daemon.daemon.has_resource_capability()
+        self.failUnless(result)
+
+    def test_returns_false_if_capability_not_effective(self):
+        """ Should return False if CAP_SYS_RESOURCE is not effective. """
+        self.set_status(u"00000000feffffff")
+        result = daemon.daemon.has_resource_capability()
+        self.failIf(result)
+
+    def test_returns_true_for_root_if_status_unavailable(self):
+        """ Should return True for root if status is unavailable. """
+        builtins.open.mock_raises = IOError(errno.ENOENT, u"No such file")
+        result = daemon.daemon.has_resource_capability()
+        self.failUnless(result)
+
+    def test_returns_false_for_user_if_status_unavailable(self):
+        """ Should return False for non-root if status is unavailable. """
+        builtins.open.mock_raises = IOError(errno.ENOENT, u"No such file")
+        os.geteuid.mock_returns = 1000
+        result = daemon.daemon.has_resource_capability()
+        self.failIf(result)
+
+
+class set_resource_limits_TestCase(scaffold.TestCase):
+    """ Test cases for set_resource_limits function. """
+
+    def setUp(self):
+        """ Set up test fixtures. """
+        self.mock_tracker = scaffold.MockTracker()
+
+        scaffold.mock(
+            u"resource.getrlimit",
+            returns=(1024, 4096),
+            tracker=self.mock_tracker)
+        scaffold.mock(
+            u"resource.setrlimit",
+            tracker=self.mock_tracker)
+        scaffold.mock(
+            u"daemon.daemon.has_resource_capability",
+            returns=True,
+            tracker=self.mock_tracker)
+
+    def tearDown(self):
+        """ Tear down test fixtures. """
+        scaffold.mock_restore()
+
+    def test_sets_each_resource_limit(self):
+        """ Should set the limit for each resource. """
+        nofile = resource.RLIMIT_NOFILE
         expect_mock_output = u"""\
-            Called os.dup2(%(target_fileno)r, %(system_fileno)r)
+            Called resource.getrlimit(%(nofile)r)
+            Called resource.setrlimit(%(nofile)r, (4096, 4096))
             """ % vars()
-        daemon.daemon.redirect_stream(system_stream, target_stream)
+        daemon.daemon.set_resource_limits({u'NOFILE': u'hard'})
         self.failUnlessMockCheckerMatch(expect_mock_output)
 
-    def test_duplicates_null_file_descriptor_by_default(self):
-        """ Should by default duplicate the null file to the system stream. """
-        system_stream = self.test_system_stream
-        system_fileno = system_stream.fileno()
-        target_stream = None
-        null_path = os.devnull
-        null_flag = os.O_RDWR
-        null_file = self.test_null_file
+    def test_sets_no_limit_if_any_invalid(self):
+        """ Should set no limits if any limit is invalid. """
+        limits = {
+            resource.RLIMIT_NOFILE: u'hard',
+            resource.RLIMIT_AS: (8192, 4096),
+            }
+        unwanted_output = u"""\
+            ...Called resource.setrlimit(...)..."""
+        try:
+            daemon.daemon.set_resource_limits(limits)
+        except daemon.daemon.DaemonOSEnvironmentError:
+            pass
+        self.failIfMockCheckerMatch(unwanted_output)
+
+    def test_sets_no_limit_if_hard_raised_without_capability(self):
+        """ Should set no limits if a hard limit cannot be raised. """
+        daemon.daemon.has_resource_capability.mock_returns = False
+        limits = {
+            resource.RLIMIT_NOFILE: u'hard',
+            resource.RLIMIT_AS: (8192, 8192),
+            }
+        unwanted_output = u"""\
+            ...Called resource.setrlimit(...)..."""
+        try:
+            daemon.daemon.set_resource_limits(limits)
+        except daemon.daemon.DaemonOSEnvironmentError:
+            pass
+        self.failIfMockCheckerMatch(unwanted_output)
+
+    def test_raises_daemon_error_if_setting_fails(self):
+        """ Should raise a DaemonError if setting a limit fails. """
+        resource.setrlimit.mock_raises = ValueError(u"not allowed")
+        expect_error = daemon.daemon.DaemonOSEnvironmentError
+        self.failUnlessRaises(
+            expect_error,
+            daemon.daemon.set_resource_limits, {u'NOFILE': (8192, 8192)})
+
+
+class call_libc_function_TestCase(scaffold.TestCase):
+    """ Test cases for call_libc_function function. """
+
+    def setUp(self):
+        """ Set up test fixtures. """
+        self.mock_tracker = scaffold.MockTracker()
+
+        self.mock_libc = scaffold.Mock(
+            u"libc",
+            tracker=self.mock_tracker)
+        self.mock_libc.spam.mock_returns = 0
+        scaffold.mock(
+            u"daemon.daemon.get_libc",
+            returns=self.mock_libc,
+            tracker=self.mock_tracker)
+        scaffold.mock(
+            u"ctypes.get_errno",
+            returns=errno.EPERM,
+            tracker=self.mock_tracker)
+
+    def tearDown(self):
+        """ Tear down test fixtures. """
+        scaffold.mock_restore()
+
+    def test_returns_function_result(self):
+        """ Should call the function and return its result. """
+        expect_mock_output = u"""\
+            Called daemon.daemon.get_libc()
+            Called libc.spam(1, 2)
+            """
+        result = daemon.daemon.call_libc_function('spam', 1, 2)
+        self.failUnlessMockCheckerMatch(expect_mock_output)
+        self.failUnlessEqual(0, result)
+
+    def test_raises_os_error_with_errno_on_failure(self):
+        """ Should raise OSError with the C `errno` on failure. """
+        self.mock_libc.spam.mock_returns = -1
+        expect_errno = errno.EPERM
+        try:
+            daemon.daemon.call_libc_function('spam')
+        except OSError, exc:
+            pass
+        else:
+            raise self.failureException(u"Failed to raise OSError")
+        self.failUnlessEqual(expect_errno, exc.errno)
+
+    def test_raises_os_error_if_no_function(self):
+        """ Should raise OSError if the C library is unavailable. """
+        daemon.daemon.get_libc.mock_returns = None
+        expect_error = OSError
+        self.failUnlessRaises(
+            expect_error,
+            daemon.daemon.call_libc_function, 'spam')
+
+
+class make_cpu_set_TestCase(scaffold.TestCase):
+    """ Test cases for make_cpu_set function. """
+
+    def test_sets_bits_for_cpus(self):
+        """ Should set the bit for each specified CPU. """
+        bits_per_word = 8 * ctypes.sizeof(ctypes.c_ulong)
+        cpus = [0, 3, bits_per_word + 1]
+        result = daemon.daemon.make_cpu_set(cpus)
+        self.failUnlessEqual([0b1001, 0b10], list(result)[:2])
+
+    def test_has_minimum_size(self):
+        """ Should be large enough for the kernel's CPU mask. """
+        expect_size = daemon.daemon.CPU_SET_MIN_SIZE // 8
+        result = daemon.daemon.make_cpu_set([])
+        self.failUnlessEqual(expect_size, ctypes.sizeof(result))
+
+    def test_grows_for_high_cpu_numbers(self):
+        """ Should grow to hold CPU numbers above the minimum size. """
+        cpu = daemon.daemon.CPU_SET_MIN_SIZE + 5
+        result = daemon.daemon.make_cpu_set([cpu])
+        self.failUnless(ctypes.sizeof(result) * 8 > cpu)
+
+
+class make_signal_set_TestCase(scaffold.TestCase):
+    """ Test cases for make_signal_set function. """
+
+    def test_sets_bits_for_signals(self):
+        """ Should set the bit for each specified signal. """
+        signals = [signal.SIGHUP, signal.SIGTERM]
+        expect_word = (1 << (signal.SIGHUP - 1)) | (1 << (signal.SIGTERM - 1))
+        result = daemon.daemon.make_signal_set(signals)
+        self.failUnlessEqual(expect_word, result[0])
+
+    def test_empty_for_no_signals(self):
+        """ Should make an empty set for an empty sequence of signals. """
+        result = daemon.daemon.make_signal_set([])
+        self.failUnlessEqual([0], list(set(result)))
+
+    def test_sets_every_signal_for_none(self):
+        """ Should contain every signal if no signals are specified. """
+        expect_bits = (1 << (signal.SIGHUP - 1)) | (1 << (signal.SIGTERM - 1))
+        result = daemon.daemon.make_signal_set()
+        self.failUnlessEqual(expect_bits, result[0] & expect_bits)
+
+
+class set_thread_signal_mask_TestCase(scaffold.TestCase):
+    """ Test cases for set_thread_signal_mask function. """
+
+    def setUp(self):
+        """ Set up test fixtures. """
+        self.mock_tracker = scaffold.MockTracker()
+
+        scaffold.mock(
+            u"daemon.daemon.make_signal_set",
+            returns=object(),
+            tracker=self.mock_tracker)
+        scaffold.mock(
+            u"daemon.daemon.call_libc_function",
+            returns=0,
+            tracker=self.mock_tracker)
+
+    def tearDown(self):
+        """ Tear down test fixtures. """
+        scaffold.mock_restore()
+
+    def test_requests_pthread_sigmask(self):
+        """ Should request `pthread_sigmask` for the set of signals. """
+        expect_mock_output = u"""\
+            Called daemon.daemon.make_signal_set([12])
+            Called daemon.daemon.call_libc_function(
+                'pthread_sigmask', 0, <object object at ...>, None)
+            """
+        daemon.daemon.set_thread_signal_mask(
+            daemon.daemon.SIG_BLOCK, [12])
+        self.failUnlessMockCheckerMatch(expect_mock_output)
+
+    def test_raises_os_error_on_error_number(self):
+        """ Should raise OSError if the function returns an error. """
+        daemon.daemon.call_libc_function.mock_returns = errno.EINVAL
+        expect_error = OSError
+        self.failUnlessRaises(
+            expect_error,
+            daemon.daemon.set_thread_signal_mask,
+            daemon.daemon.SIG_BLOCK, [12])
+
+
+class wait_for_signal_TestCase(scaffold.TestCase):
+    """ Test cases for wait_for_signal function. """
+
+    def test_returns_pending_signal(self):
+        """ Should return the number of the pending blocked signal. """
+        pid = os.fork()
+        if pid == 0:
+            exit_status = 1
+            try:
+                daemon.daemon.set_thread_signal_mask(
+                    daemon.daemon.SIG_BLOCK, [signal.SIGUSR2])
+                os.kill(os.getpid(), signal.SIGUSR2)
+                signal_number = daemon.daemon.wait_for_signal(
+                    [signal.SIGUSR1, signal.SIGUSR2])
+                if signal_number == signal.SIGUSR2:
+                    exit_status = 0
+            finally:
+                os._exit(exit_status)
+        (pid, status) = os.waitpid(pid, 0)
+        self.failUnlessEqual(0, status)
+
+
+class set_cpu_affinity_TestCase(scaffold.TestCase):
+    """ Test cases for set_cpu_affinity function. """
+
+    def setUp(self):
+        """ Set up test fixtures. """
+        self.mock_tracker = scaffold.MockTracker()
+
+        scaffold.mock(
+            u"daemon.daemon.call_libc_function",
+            returns=0,
+            tracker=self.mock_tracker)
+
+        self.test_cpus = [1, 2]
+
+    def tearDown(self):
+        """ Tear down test fixtures. """
+        scaffold.mock_restore()
+
+    def test_requests_sched_setaffinity_for_this_process(self):
+        """ Should request `sched_setaffinity` for this process. """
+        expect_mock_output = u"""\
+            Called daemon.daemon.call_libc_function(
+                'sched_setaffinity',
+                0,
+                ...)
+            """
+        daemon.daemon.set_cpu_affinity(self.test_cpus)
+        self.failUnlessMockCheckerMatch(expect_mock_output)
+
+    def test_raises_daemon_error_on_os_error(self):
+        """ Should raise a DaemonError on receiving an OSError. """
+        test_error = OSError(errno.EINVAL, u"Invalid argument")
+        daemon.daemon.call_libc_function.mock_raises = test_error
+        expect_error = daemon.daemon.DaemonOSEnvironmentError
+        self.failUnlessRaises(
+            expect_error,
+            daemon.daemon.set_cpu_affinity, self.test_cpus)
+
+
+class set_process_niceness_TestCase(scaffold.TestCase):
+    """ Test cases for set_process_niceness function. """
+
+    def setUp(self):
+        """ Set up test fixtures. """
+        self.mock_tracker = scaffold.MockTracker()
+
+        scaffold.mock(
+            u"daemon.daemon.call_libc_function",
+            returns=0,
+            tracker=self.mock_tracker)
+
+    def tearDown(self):
+        """ Tear down test fixtures. """
+        scaffold.mock_restore()
+
+    def test_requests_setpriority_for_this_process(self):
+        """ Should request `setpriority` for this process. """
+        expect_mock_output = u"""\
+            Called daemon.daemon.call_libc_function('setpriority', 0, 0, 10)
+            """
+        daemon.daemon.set_process_niceness(10)
+        self.failUnlessMockCheckerMatch(expect_mock_output)
+
+    def test_raises_daemon_error_on_os_error(self):
+        """ Should raise a DaemonError on receiving an OSError. """
+        test_error = OSError(errno.EACCES, u"Permission denied")
+        daemon.daemon.call_libc_function.mock_raises = test_error
+        expect_error = daemon.daemon.DaemonOSEnvironmentError
+        self.failUnlessRaises(
+            expect_error,
+            daemon.daemon.set_process_niceness, -5)
+
+
+class set_io_priority_TestCase(scaffold.TestCase):
+    """ Test cases for set_io_priority function. """
+
+    def setUp(self):
+        """ Set up test fixtures. """
+        self.mock_tracker = scaffold.MockTracker()
+
+        scaffold.mock(
+            u"daemon.daemon.call_libc_function",
+            returns=0,
+            tracker=self.mock_tracker)
+        scaffold.mock(
+            u"platform.machine",
+            returns='x86_64',
+            tracker=self.mock_tracker)
+
+    def tearDown(self):
+        """ Tear down test fixtures. """
+        scaffold.mock_restore()
+
+    def test_requests_ioprio_set_with_class_and_level(self):
+        """ Should request `ioprio_set` with the class and level. """
+        expect_value = (2 << 13) | 4
+        expect_mock_output = u"""\
+            Called platform.machine()
+            Called daemon.daemon.call_libc_function(
+                'syscall',
+                251,
+                1,
+                0,
+                %(expect_value)r)
+            """ % vars()
+        daemon.daemon.set_io_priority((u'best-effort', 4))
+        self.failUnlessMockCheckerMatch(expect_mock_output)
+
+    def test_raises_daemon_error_on_unknown_machine(self):
+        """ Should raise a DaemonError if the system call is unknown. """
+        platform.machine.mock_returns = 'pdp11'
+        expect_error = daemon.daemon.DaemonOSEnvironmentError
+        self.failUnlessRaises(
+            expect_error,
+            daemon.daemon.set_io_priority, (u'idle', 0))
+
+    def test_raises_daemon_error_on_os_error(self):
+        """ Should raise a DaemonError on receiving an OSError. """
+        test_error = OSError(errno.EPERM, u"Operation not permitted")
+        daemon.daemon.call_libc_function.mock_raises = test_error
+        expect_error = daemon.daemon.DaemonOSEnvironmentError
+        self.failUnlessRaises(
+            expect_error,
+            daemon.daemon.set_io_priority, (u'realtime', 0))
+
+
+class set_scheduler_TestCase(scaffold.TestCase):
+    """ Test cases for set_scheduler function. """
+
+    def setUp(self):
+        """ Set up test fixtures. """
+        self.mock_tracker = scaffold.MockTracker()
+
+        scaffold.mock(
+            u"daemon.daemon.call_libc_function",
+            returns=0,
+            tracker=self.mock_tracker)
+
+    def tearDown(self):
+        """ Tear down test fixtures. """
+        scaffold.mock_restore()
+
+    def test_requests_sched_setscheduler_with_policy_number(self):
+        """ Should request `sched_setscheduler` with the policy number. """
+        expect_mock_output = u"""\
+            Called daemon.daemon.call_libc_function(
+                'sched_setscheduler',
+                0,
+                2,
+                ...)
+            """
+        daemon.daemon.set_scheduler(u'rr', 10)
+        self.failUnlessMockCheckerMatch(expect_mock_output)
+
+    def test_raises_daemon_error_on_os_error(self):
+        """ Should raise a DaemonError on receiving an OSError. """
+        test_error = OSError(errno.EINVAL, u"Invalid argument")
+        daemon.daemon.call_libc_function.mock_raises = test_error
+        expect_error = daemon.daemon.DaemonOSEnvironmentError
+        self.failUnlessRaises(
+            expect_error,
+            daemon.daemon.set_scheduler, u'fifo', 200)
+
+
+class set_timer_slack_TestCase(scaffold.TestCase):
+    """ Test cases for set_timer_slack function. """
+
+    def setUp(self):
+        """ Set up test fixtures. """
+        self.mock_tracker = scaffold.MockTracker()
+
+        scaffold.mock(
+            u"daemon.daemon.call_libc_function",
+            returns=0,
+            tracker=self.mock_tracker)
+
+    def tearDown(self):
+        """ Tear down test fixtures. """
+        scaffold.mock_restore()
+
+    def test_requests_prctl_set_timer_slack(self):
+        """ Should request `prctl` to set the timer slack. """
+        expect_mock_output = u"""\
+            Called daemon.daemon.call_libc_function(
+                'prctl',
+                29,
+                c_ulong(50000L),
+                ...)
+            """
+        daemon.daemon.set_timer_slack(50000)
+        self.failUnlessMockCheckerMatch(expect_mock_output)
+
+    def test_raises_daemon_error_on_os_error(self):
+        """ Should raise a DaemonError on receiving an OSError. """
+        test_error = OSError(errno.EINVAL, u"Invalid argument")
+        daemon.daemon.call_libc_function.mock_raises = test_error
+        expect_error = daemon.daemon.DaemonOSEnvironmentError
+        self.failUnlessRaises(
+            expect_error,
+            daemon.daemon.set_timer_slack, 50000)
+
+
+
+class is_socket_file_TestCase(scaffold.TestCase):
+    """ Test cases for is_socket_file function. """
+
+    def setUp(self):
+        """ Set up test fixtures. """
+        self.test_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        """ Tear down test fixtures. """
+        for name in os.listdir(self.test_dir):
+            os.remove(os.path.join(self.test_dir, name))
+        os.rmdir(self.test_dir)
+
+    def test_returns_true_for_socket_file(self):
+        """ Should return ``True`` for a Unix-domain socket file. """
+        path = os.path.join(self.test_dir, u"spam.sock")
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.bind(path)
+        result = daemon.daemon.is_socket_file(path)
+        sock.close()
+        self.failUnlessEqual(True, result)
+
+    def test_returns_false_for_regular_file(self):
+        """ Should return ``False`` for a regular file. """
+        path = os.path.join(self.test_dir, u"spam")
+        open(path, 'w').close()
+        result = daemon.daemon.is_socket_file(path)
+        self.failUnlessEqual(False, result)
+
+    def test_returns_false_if_no_file(self):
+        """ Should return ``False`` if no file exists at the path. """
+        path = os.path.join(self.test_dir, u"spam")
+        result = daemon.daemon.is_socket_file(path)
+        self.failUnlessEqual(False, result)
+
+
+class wait_for_pidfile_available_TestCase(scaffold.TestCase):
+    """ Test cases for wait_for_pidfile_available function. """
+
+    def setUp(self):
+        """ Set up test fixtures. """
+        self.mock_tracker = scaffold.MockTracker()
+
+        class FakePIDLockFile(object):
+            """ A PID file lock with no pool of locks. """
+            path = tempfile.mktemp()
+            is_locked = scaffold.Mock(
+                u"pidfile.is_locked",
+                tracker=self.mock_tracker)
+
+        self.mock_pidfile = FakePIDLockFile()
+
+        self.test_time = 1000.0
+        def mock_time():
+            return self.test_time
+        def mock_sleep(delay):
+            self.test_time += delay
+        scaffold.mock(
+            u"time.time",
+            returns_func=mock_time,
+            tracker=self.mock_tracker)
+        scaffold.mock(
+            u"time.sleep",
+            returns_func=mock_sleep,
+            tracker=self.mock_tracker)
+
+    def tearDown(self):
+        """ Tear down test fixtures. """
+        scaffold.mock_restore()
+
+    def test_returns_at_once_if_not_locked(self):
+        """ Should return without waiting if the lock is not held. """
+        self.mock_pidfile.is_locked.mock_returns = False
+        unwanted_output = u"""\
+            ...Called time.sleep(...)..."""
+        daemon.daemon.wait_for_pidfile_available(self.mock_pidfile, 0)
+        self.failIfMockCheckerMatch(unwanted_output)
+
+    def test_raises_already_locked_if_no_timeout(self):
+        """ Should raise AlreadyLocked at once for a zero timeout. """
+        self.mock_pidfile.is_locked.mock_returns = True
+        self.failUnlessRaises(
+            lockfile.AlreadyLocked,
+            daemon.daemon.wait_for_pidfile_available,
+            self.mock_pidfile, 0)
+
+    def test_raises_lock_timeout_after_timeout(self):
+        """ Should raise LockTimeout once the timeout has passed. """
+        self.mock_pidfile.is_locked.mock_returns = True
+        self.failUnlessRaises(
+            lockfile.LockTimeout,
+            daemon.daemon.wait_for_pidfile_available,
+            self.mock_pidfile, 5)
+        self.failUnless(self.test_time >= 1005.0)
+
+    def test_returns_once_lock_released(self):
+        """ Should wait until the lock is released. """
+        self.mock_pidfile.is_locked.mock_returns_iter = [True, True, False]
+        expect_mock_output = u"""\
+            Called pidfile.is_locked()
+            Called time.sleep(...)
+            Called pidfile.is_locked()
+            Called time.sleep(...)
+            Called pidfile.is_locked()
+            """
+        daemon.daemon.wait_for_pidfile_available(self.mock_pidfile)
+        self.failUnlessMockCheckerMatch(expect_mock_output)
+
+    def test_returns_if_any_lock_of_pool_not_locked(self):
+        """ Should return if any lock of a pool is not held. """
+        locks = []
+        for is_locked in [True, False]:
+            lock = scaffold.Mock(
+                u"lock",
+                tracker=self.mock_tracker)
+            lock.is_locked.mock_returns = is_locked
+            locks.append(lock)
+        self.mock_pidfile.locks = locks
+        daemon.daemon.wait_for_pidfile_available(self.mock_pidfile, 0)
+
+
+class is_socket_listening_TestCase(scaffold.TestCase):
+    """ Test cases for is_socket_listening function. """
+
+    def setUp(self):
+        """ Set up test fixtures. """
+        self.test_dir = tempfile.mkdtemp()
+        self.test_path = os.path.join(self.test_dir, u"spam.sock")
+        self.test_socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.test_socket.bind(self.test_path)
+
+    def tearDown(self):
+        """ Tear down test fixtures. """
+        self.test_socket.close()
+        shutil.rmtree(self.test_dir)
+
+    def test_returns_true_if_listening(self):
+        """ Should return True if a socket listens on the path. """
+        self.test_socket.listen(1)
+        self.failUnless(daemon.daemon.is_socket_listening(self.test_path))
+
+    def test_returns_false_if_not_listening(self):
+        """ Should return False if no socket listens on the path. """
+        self.test_socket.close()
+        self.failIf(daemon.daemon.is_socket_listening(self.test_path))
+
+
+class make_listen_socket_TestCase(scaffold.TestCase):
+    """ Test cases for make_listen_socket function. """
+
+    def setUp(self):
+        """ Set up test fixtures. """
+        self.mock_tracker = scaffold.MockTracker()
+
+        self.mock_socket = scaffold.Mock(
+            u"socket",
+            tracker=self.mock_tracker)
+        scaffold.mock(
+            u"socket.socket",
+            returns=self.mock_socket,
+            tracker=self.mock_tracker)
+
+        self.test_sockaddr = (u"192.0.2.1", 8080)
+        self.test_addrinfo = (
+            socket.AF_INET, socket.SOCK_STREAM, 6, u"",
+            self.test_sockaddr)
+        scaffold.mock(
+            u"socket.getaddrinfo",
+            returns=[self.test_addrinfo],
+            tracker=self.mock_tracker)
+
+        self.test_unix_path = tempfile.mktemp()
+        scaffold.mock(
+            u"daemon.daemon.is_socket_file",
+            returns=False,
+            tracker=self.mock_tracker)
+        scaffold.mock(
+            u"daemon.daemon.is_socket_listening",
+            returns=False,
+            tracker=self.mock_tracker)
+        scaffold.mock(
+            u"os.remove",
+            tracker=self.mock_tracker)
+
+        self.test_backlog = 64
+        self.test_address = (u"192.0.2.1", 8080)
+
+    def tearDown(self):
+        """ Tear down test fixtures. """
+        scaffold.mock_restore()
+
+    def test_returns_socket(self):
+        """ Should return the new socket. """
+        expect_result = self.mock_socket
+        result = daemon.daemon.make_listen_socket(
+            self.test_address, self.test_backlog)
+        self.failUnlessIs(expect_result, result)
+
+    def test_binds_tcp_socket_and_listens(self):
+        """ Should bind a TCP socket with SO_REUSEADDR, then listen. """
+        (family, socktype, proto, canonname, sockaddr) = self.test_addrinfo
+        test_backlog = self.test_backlog
+        sol_socket = socket.SOL_SOCKET
+        reuse_addr = socket.SO_REUSEADDR
+        expect_mock_output = u"""\
+            Called socket.getaddrinfo(...)
+            Called socket.socket(%(family)r, %(socktype)r, %(proto)r)
+            Called socket.setsockopt(%(sol_socket)r, %(reuse_addr)r, 1)
+            Called socket.bind(%(sockaddr)r)
+            Called socket.listen(%(test_backlog)r)
+            """ % vars()
+        daemon.daemon.make_listen_socket(
+            self.test_address, self.test_backlog)
+        self.failUnlessMockCheckerMatch(expect_mock_output)
+
+    def test_resolves_empty_host_as_all_interfaces(self):
+        """ Should resolve an empty host as a passive address. """
+        address = (u"", 8080)
+        unspec = socket.AF_UNSPEC
+        stream = socket.SOCK_STREAM
+        passive = socket.AI_PASSIVE
+        expect_mock_output = u"""\
+            Called socket.getaddrinfo(
+                None, 8080, %(unspec)r, %(stream)r, 0, %(passive)r)
+            ...
+            """ % vars()
+        daemon.daemon.make_listen_socket(address, self.test_backlog)
+        self.failUnlessMockCheckerMatch(expect_mock_output)
+
+    def test_sets_reuse_port_if_requested(self):
+        """ Should set SO_REUSEPORT if `reuse_port` is true. """
+        sol_socket = socket.SOL_SOCKET
+        reuse_port = daemon.daemon.get_reuse_port_option()
+        expect_mock_output = u"""\
+            ...
+            Called socket.setsockopt(%(sol_socket)r, %(reuse_port)r, 1)
+            Called socket.bind(...)
+            ...
+            """ % vars()
+        daemon.daemon.make_listen_socket(
+            self.test_address, self.test_backlog, reuse_port=True)
+        self.failUnlessMockCheckerMatch(expect_mock_output)
+
+    def test_binds_unix_socket_to_path(self):
+        """ Should bind a Unix-domain socket to a path address. """
+        path = self.test_unix_path
+        family = socket.AF_UNIX
+        socktype = socket.SOCK_STREAM
+        expect_mock_output = u"""\
+            Called daemon.daemon.is_socket_file(%(path)r)
+            Called socket.socket(%(family)r, %(socktype)r)
+            Called socket.bind(%(path)r)
+            Called socket.listen(...)
+            """ % vars()
+        daemon.daemon.make_listen_socket(path, self.test_backlog)
+        self.failUnlessMockCheckerMatch(expect_mock_output)
+
+    def test_removes_stale_unix_socket_file(self):
+        """ Should remove a socket file already at the path. """
+        path = self.test_unix_path
+        daemon.daemon.is_socket_file.mock_returns = True
+        expect_mock_output = u"""\
+            ...
+            Called os.remove(%(path)r)
+            Called socket.socket(...)
+            ...
+            """ % vars()
+        daemon.daemon.make_listen_socket(path, self.test_backlog)
+        self.failUnlessMockCheckerMatch(expect_mock_output)
+
+    def test_raises_daemon_error_if_unix_socket_in_use(self):
+        """ Should raise error, keeping a socket file in use. """
+        path = self.test_unix_path
+        daemon.daemon.is_socket_file.mock_returns = True
+        daemon.daemon.is_socket_listening.mock_returns = True
+        expect_error = daemon.daemon.DaemonOSEnvironmentError
+        unwanted_output = u"""\
+            ...Called os.remove(...)..."""
+        self.failUnlessRaises(
+            expect_error,
+            daemon.daemon.make_listen_socket, path, self.test_backlog)
+        self.failIfMockCheckerMatch(unwanted_output)
+
+    def test_keeps_other_file_at_unix_socket_path(self):
+        """ Should not remove a file at the path that is not a socket. """
+        path = self.test_unix_path
+        unwanted_output = u"""\
+            ...Called os.remove(...)..."""
+        daemon.daemon.make_listen_socket(path, self.test_backlog)
+        self.failIfMockCheckerMatch(unwanted_output)
+
+    def test_raises_daemon_error_and_closes_on_socket_error(self):
+        """ Should close the socket and raise error if bind fails. """
+        test_error = socket.error(errno.EADDRINUSE, u"Address in use")
+        self.mock_socket.bind.mock_raises = test_error
+        expect_error = daemon.daemon.DaemonOSEnvironmentError
+        expect_mock_output = u"""\
+            ...
+            Called socket.close()
+            """
+        self.failUnlessRaises(
+            expect_error,
+            daemon.daemon.make_listen_socket,
+            self.test_address, self.test_backlog)
+        self.failUnlessMockCheckerMatch(expect_mock_output)
+
+
+class make_listen_sockets_TestCase(scaffold.TestCase):
+    """ Test cases for make_listen_sockets function. """
+
+    def setUp(self):
+        """ Set up test fixtures. """
+        self.mock_tracker = scaffold.MockTracker()
+
+        self.test_port = 8080
+        def mock_make_listen_socket(address, backlog, reuse_port=False):
+            result = scaffold.Mock(
+                u"socket",
+                tracker=self.mock_tracker)
+            result.getsockname.mock_returns = (u"192.0.2.1", self.test_port)
+            return result
+
+        scaffold.mock(
+            u"daemon.daemon.make_listen_socket",
+            returns_func=mock_make_listen_socket,
+            tracker=self.mock_tracker)
+
+        self.test_backlog = 64
+        self.test_addresses = [(u"192.0.2.1", 0), u"/var/run/spam.sock"]
+
+    def tearDown(self):
+        """ Tear down test fixtures. """
+        scaffold.mock_restore()
+
+    def test_returns_one_socket_per_address(self):
+        """ Should return a list of one socket for each address. """
+        result = daemon.daemon.make_listen_sockets(
+            self.test_addresses, self.test_backlog)
+        self.failUnlessEqual([1, 1], [len(sockets) for sockets in result])
+
+    def test_returns_copies_for_tcp_addresses(self):
+        """ Should return the specified copies of each TCP socket. """
+        result = daemon.daemon.make_listen_sockets(
+            self.test_addresses, self.test_backlog, reuse_port_copies=3)
+        self.failUnlessEqual([3, 1], [len(sockets) for sockets in result])
+
+    def test_binds_copies_to_same_port_with_reuse_port(self):
+        """ Should bind every copy to the port of the first. """
+        backlog = self.test_backlog
+        test_port = self.test_port
+        expect_mock_output = u"""\
+            Called daemon.daemon.make_listen_socket(
+                (u'192.0.2.1', 0), %(backlog)r, reuse_port=True)
+            Called socket.getsockname()
+            Called daemon.daemon.make_listen_socket(
+                (u'192.0.2.1', %(test_port)r), %(backlog)r, reuse_port=True)
+            Called socket.getsockname()
+            Called daemon.daemon.make_listen_socket(
+                u'/var/run/spam.sock', %(backlog)r)
+            """ % vars()
+        daemon.daemon.make_listen_sockets(
+            self.test_addresses, self.test_backlog, reuse_port_copies=2)
+        self.failUnlessMockCheckerMatch(expect_mock_output)
+
+    def test_uses_activated_socket_bound_to_address(self):
+        """ Should use an activated socket bound to the address. """
+        test_socket = object()
+        activated_sockets = {u"http": [test_socket]}
+        def mock_find_activated_socket(address, activated_sockets):
+            result = None
+            if address == self.test_addresses[0]:
+                result = test_socket
+            return result
+        scaffold.mock(
+            u"daemon.daemon.find_activated_socket",
+            returns_func=mock_find_activated_socket,
+            tracker=self.mock_tracker)
+        backlog = self.test_backlog
+        expect_mock_output = u"""\
+            ...
+            Called daemon.daemon.make_listen_socket(
+                u'/var/run/spam.sock', %(backlog)r)
+            """ % vars()
+        result = daemon.daemon.make_listen_sockets(
+            self.test_addresses, self.test_backlog,
+            reuse_port_copies=2, activated_sockets=activated_sockets)
+        self.failUnlessIs(test_socket, result[0][0])
+        self.failUnlessEqual([1, 1], [len(sockets) for sockets in result])
+        self.failUnlessMockCheckerMatch(expect_mock_output)
+
+    def test_closes_sockets_made_if_error(self):
+        """ Should close the sockets already made if one fails. """
+        test_error = daemon.daemon.DaemonOSEnvironmentError(u"Bad address")
+        sockets_made = []
+        def mock_make_listen_socket(address, backlog, reuse_port=False):
+            if sockets_made:
+                raise test_error
+            result = scaffold.Mock(
+                u"socket",
+                tracker=self.mock_tracker)
+            sockets_made.append(result)
+            return result
+        daemon.daemon.make_listen_socket.mock_returns_func = (
+            mock_make_listen_socket)
+        expect_error = daemon.daemon.DaemonOSEnvironmentError
+        expect_mock_output = u"""\
+            ...
+            Called socket.close()
+            """
+        self.failUnlessRaises(
+            expect_error,
+            daemon.daemon.make_listen_sockets,
+            self.test_addresses, self.test_backlog)
+        self.failUnlessMockCheckerMatch(expect_mock_output)
+
+
+class format_listen_fds_TestCase(scaffold.TestCase):
+    """ Test cases for format_listen_fds function. """
+
+    def setUp(self):
+        """ Set up test fixtures. """
+        self.mock_tracker = scaffold.MockTracker()
+
+    def test_formats_fds_by_address(self):
+        """ Should separate sockets by commas, addresses by semicolons. """
+        listen_sockets = []
+        for fds in [[3, 4], [5]]:
+            sockets = []
+            for fd in fds:
+                sock = scaffold.Mock(
+                    u"socket",
+                    tracker=self.mock_tracker)
+                sock.fileno.mock_returns = fd
+                sockets.append(sock)
+            listen_sockets.append(sockets)
+        expect_result = u"3,4;5"
+        result = daemon.daemon.format_listen_fds(listen_sockets)
+        self.failUnlessEqual(expect_result, result)
+
+
+class parse_listen_fds_TestCase(scaffold.TestCase):
+    """ Test cases for parse_listen_fds function. """
+
+    def test_parses_fds_by_address(self):
+        """ Should return a list of file descriptors for each address. """
+        expect_result = [[3, 4], [5]]
+        result = daemon.daemon.parse_listen_fds(u"3,4;5")
+        self.failUnlessEqual(expect_result, result)
+
+    def test_raises_daemon_error_if_invalid(self):
+        """ Should raise a DaemonError if the text is invalid. """
+        expect_error = daemon.daemon.DaemonOSEnvironmentError
+        self.failUnlessRaises(
+            expect_error,
+            daemon.daemon.parse_listen_fds, u"3,spam")
+
+
+class pop_inherited_listen_fds_TestCase(scaffold.TestCase):
+    """ Test cases for pop_inherited_listen_fds function. """
+
+    def setUp(self):
+        """ Set up test fixtures. """
+        self.mock_tracker = scaffold.MockTracker()
+
+        self.test_environ = {}
+        scaffold.mock(
+            u"os.environ",
+            mock_obj=self.test_environ,
+            tracker=self.mock_tracker)
+
+    def tearDown(self):
+        """ Tear down test fixtures. """
+        scaffold.mock_restore()
+
+    def test_returns_none_if_not_inherited(self):
+        """ Should return None if no sockets were inherited. """
+        result = daemon.daemon.pop_inherited_listen_fds()
+        self.failUnlessIs(None, result)
+
+    def test_returns_inherited_fds(self):
+        """ Should return the inherited file descriptors. """
+        self.test_environ[daemon.daemon.INHERITED_LISTEN_FDS_ENV] = "3;4"
+        expect_result = [[3], [4]]
+        result = daemon.daemon.pop_inherited_listen_fds()
+        self.failUnlessEqual(expect_result, result)
+
+    def test_removes_variable_from_environment(self):
+        """ Should remove the variable from the environment. """
+        self.test_environ[daemon.daemon.INHERITED_LISTEN_FDS_ENV] = "3;4"
+        daemon.daemon.pop_inherited_listen_fds()
+        self.failIfIn(
+            self.test_environ, daemon.daemon.INHERITED_LISTEN_FDS_ENV)
+
+
+class make_socket_from_fd_TestCase(scaffold.TestCase):
+    """ Test cases for make_socket_from_fd function. """
+
+    def setUp(self):
+        """ Set up test fixtures. """
+        self.test_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.test_socket.bind(("127.0.0.1", 0))
+        self.test_socket.listen(1)
+        self.test_fd = os.dup(self.test_socket.fileno())
+
+    def tearDown(self):
+        """ Tear down test fixtures. """
+        self.test_socket.close()
+        try:
+            os.close(self.test_fd)
+        except OSError:
+            pass
+
+    def test_returns_socket_with_family_and_type(self):
+        """ Should return a socket with the family and type of the fd. """
+        expect_sockname = self.test_socket.getsockname()
+        result = daemon.daemon.make_socket_from_fd(self.test_fd)
+        try:
+            self.failUnlessEqual(
+                (socket.AF_INET, socket.SOCK_STREAM),
+                (result.family, result.type))
+            self.failUnlessEqual(expect_sockname, result.getsockname())
+        finally:
+            result.close()
+
+    def test_closes_file_descriptor(self):
+        """ Should close the specified file descriptor. """
+        result = daemon.daemon.make_socket_from_fd(self.test_fd)
+        result.close()
+        self.failUnlessRaises(OSError, os.fstat, self.test_fd)
+
+    def test_raises_daemon_error_if_not_socket(self):
+        """ Should raise a DaemonError if the fd is not a socket. """
+        (read_fd, write_fd) = os.pipe()
+        os.close(write_fd)
+        expect_error = daemon.daemon.DaemonOSEnvironmentError
+        try:
+            self.failUnlessRaises(
+                expect_error,
+                daemon.daemon.make_socket_from_fd, read_fd)
+        finally:
+            os.close(read_fd)
+
+
+class adopt_listen_sockets_TestCase(scaffold.TestCase):
+    """ Test cases for adopt_listen_sockets function. """
+
+    def setUp(self):
+        """ Set up test fixtures. """
+        self.mock_tracker = scaffold.MockTracker()
+
+        def mock_make_socket_from_fd(fd):
+            result = u"socket %(fd)d" % vars()
+            return result
+
+        scaffold.mock(
+            u"daemon.daemon.make_socket_from_fd",
+            returns_func=mock_make_socket_from_fd,
+            tracker=self.mock_tracker)
+
+        self.test_addresses = [(u"192.0.2.1", 80), u"/var/run/spam.sock"]
+
+    def tearDown(self):
+        """ Tear down test fixtures. """
+        scaffold.mock_restore()
+
+    def test_returns_sockets_for_each_address(self):
+        """ Should return the sockets for each address. """
+        expect_result = [[u"socket 3", u"socket 4"], [u"socket 5"]]
+        result = daemon.daemon.adopt_listen_sockets(
+            [[3, 4], [5]], self.test_addresses)
+        self.failUnlessEqual(expect_result, result)
+
+    def test_raises_daemon_error_if_addresses_differ(self):
+        """ Should raise a DaemonError if the addresses differ. """
+        expect_error = daemon.daemon.DaemonOSEnvironmentError
+        self.failUnlessRaises(
+            expect_error,
+            daemon.daemon.adopt_listen_sockets,
+            [[3]], self.test_addresses)
+
+
+class pop_activated_fds_TestCase(scaffold.TestCase):
+    """ Test cases for pop_activated_fds function. """
+
+    def setUp(self):
+        """ Set up test fixtures. """
+        self.mock_tracker = scaffold.MockTracker()
+
+        scaffold.mock(
+            u"os.getpid",
+            returns=235,
+            tracker=self.mock_tracker)
+        self.test_environ = {
+            'LISTEN_PID': "235",
+            'LISTEN_FDS': "3",
+            'LISTEN_FDNAMES': "http:https",
+            }
+        scaffold.mock(
+            u"os.environ",
+            mock_obj=self.test_environ,
+            tracker=self.mock_tracker)
+
+    def tearDown(self):
+        """ Tear down test fixtures. """
+        scaffold.mock_restore()
+
+    def test_returns_named_file_descriptors(self):
+        """ Should return the name of each file descriptor from 3. """
+        expect_result = [(u"http", 3), (u"https", 4), (u"unknown", 5)]
+        result = daemon.daemon.pop_activated_fds()
+        self.failUnlessEqual(expect_result, result)
+
+    def test_removes_variables_from_environment(self):
+        """ Should remove the socket activation variables. """
+        daemon.daemon.pop_activated_fds()
+        self.failUnlessEqual({}, self.test_environ)
+
+    def test_returns_none_if_for_other_process(self):
+        """ Should return None if the variables name another process. """
+        self.test_environ['LISTEN_PID'] = "8642"
+        result = daemon.daemon.pop_activated_fds()
+        self.failUnlessIs(None, result)
+        self.failUnlessEqual({}, self.test_environ)
+
+    def test_raises_daemon_error_if_count_invalid(self):
+        """ Should raise a DaemonError if `LISTEN_FDS` is invalid. """
+        self.test_environ['LISTEN_FDS'] = "spam"
+        expect_error = daemon.daemon.DaemonOSEnvironmentError
+        self.failUnlessRaises(
+            expect_error,
+            daemon.daemon.pop_activated_fds)
+
+
+class make_activated_sockets_TestCase(scaffold.TestCase):
+    """ Test cases for make_activated_sockets function. """
+
+    def setUp(self):
+        """ Set up test fixtures. """
+        self.mock_tracker = scaffold.MockTracker()
+
+        scaffold.mock(
+            u"daemon.daemon.is_socket",
+            returns_func=(lambda fd: fd != 5),
+            tracker=self.mock_tracker)
+        scaffold.mock(
+            u"daemon.daemon.make_socket_from_fd",
+            returns_func=(lambda fd: u"socket %(fd)d" % vars()),
+            tracker=self.mock_tracker)
+
+    def tearDown(self):
+        """ Tear down test fixtures. """
+        scaffold.mock_restore()
+
+    def test_returns_sockets_by_name(self):
+        """ Should return the sockets with each name. """
+        activated_fds = [(u"http", 3), (u"http", 4), (u"fifo", 5)]
+        expect_result = {
+            u"http": [u"socket 3", u"socket 4"],
+            u"fifo": [5],
+            }
+        result = daemon.daemon.make_activated_sockets(activated_fds)
+        self.failUnlessEqual(expect_result, result)
+
+
+class find_activated_socket_TestCase(scaffold.TestCase):
+    """ Test cases for find_activated_socket function. """
+
+    def setUp(self):
+        """ Set up test fixtures. """
+        self.test_tcp_socket = socket.socket(
+            socket.AF_INET, socket.SOCK_STREAM)
+        self.test_tcp_socket.bind(("127.0.0.1", 0))
+        self.test_port = self.test_tcp_socket.getsockname()[1]
+        self.test_socket_path = tempfile.mktemp()
+        self.test_unix_socket = socket.socket(
+            socket.AF_UNIX, socket.SOCK_STREAM)
+        self.test_unix_socket.bind(self.test_socket_path)
+        self.test_activated_sockets = {
+            u"http": [self.test_tcp_socket],
+            u"control": [self.test_unix_socket, 7],
+            }
+
+    def tearDown(self):
+        """ Tear down test fixtures. """
+        self.test_tcp_socket.close()
+        self.test_unix_socket.close()
+        os.remove(self.test_socket_path)
+
+    def test_finds_tcp_socket_by_port(self):
+        """ Should find a TCP socket bound to the port on any host. """
+        expect_result = self.test_tcp_socket
+        result = daemon.daemon.find_activated_socket(
+            (u"", self.test_port), self.test_activated_sockets)
+        self.failUnlessIs(expect_result, result)
+
+    def test_finds_tcp_socket_by_host_and_port(self):
+        """ Should find a TCP socket bound to the host and port. """
+        expect_result = self.test_tcp_socket
+        result = daemon.daemon.find_activated_socket(
+            (u"127.0.0.1", self.test_port), self.test_activated_sockets)
+        self.failUnlessIs(expect_result, result)
+
+    def test_finds_unix_socket_by_path(self):
+        """ Should find a Unix-domain socket bound to the path. """
+        expect_result = self.test_unix_socket
+        result = daemon.daemon.find_activated_socket(
+            self.test_socket_path, self.test_activated_sockets)
+        self.failUnlessIs(expect_result, result)
+
+    def test_returns_none_if_not_found(self):
+        """ Should return None if no socket is bound to the address. """
+        for address in [
+                (u"192.0.2.1", self.test_port),
+                (u"", self.test_port + 1),
+                u"/var/run/spam.sock",
+                ]:
+            result = daemon.daemon.find_activated_socket(
+                address, self.test_activated_sockets)
+            self.failUnlessIs(None, result)
+
+    def test_returns_none_if_no_activated_sockets(self):
+        """ Should return None if there are no activated sockets. """
+        result = daemon.daemon.find_activated_socket(
+            self.test_socket_path, None)
+        self.failUnlessIs(None, result)
+
+
+class connect_notify_socket_TestCase(scaffold.TestCase):
+    """ Test cases for connect_notify_socket function. """
+
+    def setUp(self):
+        """ Set up test fixtures. """
+        self.mock_tracker = scaffold.MockTracker()
+
+        self.test_notifier = scaffold.Mock(
+            u"Notifier",
+            tracker=self.mock_tracker)
+        self.test_notifier.enabled = True
+        scaffold.mock(
+            u"daemon.notify.get_default_notifier",
+            returns=self.test_notifier,
+            tracker=self.mock_tracker)
+
+    def tearDown(self):
+        """ Tear down test fixtures. """
+        scaffold.mock_restore()
+
+    def test_connects_and_returns_default_notifier(self):
+        """ Should connect the default notifier, and return it. """
+        expect_mock_output = u"""\
+            Called daemon.notify.get_default_notifier()
+            Called Notifier.connect()
+            """
+        result = daemon.daemon.connect_notify_socket()
+        self.failUnlessMockCheckerMatch(expect_mock_output)
+        self.failUnlessIs(self.test_notifier, result)
+
+    def test_returns_none_if_not_enabled(self):
+        """ Should return None if notification is not enabled. """
+        self.test_notifier.enabled = False
+        unwanted_output = u"""\
+            ...Called Notifier.connect()..."""
+        result = daemon.daemon.connect_notify_socket()
+        self.failIfMockCheckerMatch(unwanted_output)
+        self.failUnlessIs(None, result)
+
+    def test_raises_daemon_error_if_connect_fails(self):
+        """ Should raise a DaemonError if the socket cannot connect. """
+        self.test_notifier.connect.mock_raises = (
+            daemon.notify.NotifySocketError(u"No such file"))
+        expect_error = daemon.daemon.DaemonOSEnvironmentError
+        self.failUnlessRaises(
+            expect_error,
+            daemon.daemon.connect_notify_socket)
+
+
+class start_watchdog_pinger_TestCase(scaffold.TestCase):
+    """ Test cases for start_watchdog_pinger function. """
+
+    def setUp(self):
+        """ Set up test fixtures. """
+        self.mock_tracker = scaffold.MockTracker()
+
+        scaffold.mock(
+            u"daemon.notify.WatchdogPinger.start",
+            tracker=self.mock_tracker)
+
+    def tearDown(self):
+        """ Tear down test fixtures. """
+        scaffold.mock_restore()
+
+    def test_starts_and_returns_pinger(self):
+        """ Should start a watchdog pinger, and return it. """
+        test_notifier = object()
+        expect_mock_output = u"""\
+            Called daemon.notify.WatchdogPinger.start()
+            """
+        result = daemon.daemon.start_watchdog_pinger(test_notifier, 15.0)
+        self.failUnlessMockCheckerMatch(expect_mock_output)
+        self.failUnlessIsInstance(result, daemon.notify.WatchdogPinger)
+        self.failUnlessIs(test_notifier, result.notifier)
+        self.failUnlessEqual(15.0, result.interval)
+
+
+
+class freeze_garbage_collector_TestCase(scaffold.TestCase):
+    """ Test cases for freeze_garbage_collector function. """
+
+    def setUp(self):
+        """ Set up test fixtures. """
+        self.mock_tracker = scaffold.MockTracker()
+
+        scaffold.mock(
+            u"gc.collect",
+            tracker=self.mock_tracker)
+
+        self.gc_freeze_prev = getattr(gc, 'freeze', None)
+        gc.freeze = scaffold.Mock(
+            u"gc.freeze",
+            tracker=self.mock_tracker)
+
+    def tearDown(self):
+        """ Tear down test fixtures. """
+        if self.gc_freeze_prev is None:
+            if hasattr(gc, 'freeze'):
+                del gc.freeze
+        else:
+            gc.freeze = self.gc_freeze_prev
+        scaffold.mock_restore()
+
+    def test_freezes_tracked_objects(self):
+        """ Should freeze the objects tracked by the garbage collector. """
+        expect_mock_output = u"""\
+            Called gc.freeze()
+            """
+        daemon.daemon.freeze_garbage_collector()
+        self.failUnlessMockCheckerMatch(expect_mock_output)
+
+    def test_collects_garbage_before_freezing_if_collect(self):
+        """ Should collect garbage before freezing if `collect` is true. """
+        expect_mock_output = u"""\
+            Called gc.collect()
+            Called gc.freeze()
+            """
+        daemon.daemon.freeze_garbage_collector(collect=True)
+        self.failUnlessMockCheckerMatch(expect_mock_output)
+
+    def test_omits_freeze_if_unavailable(self):
+        """ Should omit freezing if the `gc` module cannot freeze. """
+        del gc.freeze
+        expect_mock_output = u"""\
+            Called gc.collect()
+            """
+        daemon.daemon.freeze_garbage_collector(collect=True)
+        self.failUnlessMockCheckerMatch(expect_mock_output)
+
+
+
+def setup_streams_fixtures(testcase):
+    """ Set up common test fixtures for standard streams. """
+    testcase.mock_tracker = scaffold.MockTracker()
+
+    testcase.stream_file_paths = dict(
+        stdin = tempfile.mktemp(),
+        stdout = tempfile.mktemp(),
+        stderr = tempfile.mktemp(),
+        )
+
+    testcase.stream_files_by_name = dict(
+        (name, FakeFileDescriptorStringIO())
+        for name in ['stdin', 'stdout', 'stderr']
+        )
+
+    testcase.stream_files_by_path = dict(
+        (testcase.stream_file_paths[name],
+            testcase.stream_files_by_name[name])
+        for name in ['stdin', 'stdout', 'stderr']
+        )
+
+    scaffold.mock(
+        u"os.dup2",
+        tracker=testcase.mock_tracker)
+
+
+class redirect_stream_TestCase(scaffold.TestCase):
+    """ Test cases for redirect_stream function. """
+
+    def setUp(self):
+        """ Set up test fixtures. """
+        setup_streams_fixtures(self)
+
+        self.test_system_stream = FakeFileDescriptorStringIO()
+        self.test_target_stream = FakeFileDescriptorStringIO()
+        self.test_null_file = FakeFileDescriptorStringIO()
+
+        def mock_open(path, flag, mode=None):
+            if path == os.devnull:
+                result = self.test_null_file.fileno()
+            else:
+                raise OSError(errno.NOENT, u"No such file", path)
+            return result
+
+        scaffold.mock(
+            u"os.open",
+            returns_func=mock_open,
+            tracker=self.mock_tracker)
+        scaffold.mock(
+            u"os.close",
+            tracker=self.mock_tracker)
+
+    def tearDown(self):
+        """ Tear down test fixtures. """
+        scaffold.mock_restore()
+
+    def test_duplicates_target_file_descriptor(self):
+        """ Should duplicate file descriptor from target to system stream. """
+        system_stream = self.test_system_stream
+        system_fileno = system_stream.fileno()
+        target_stream = self.test_target_stream
+        target_fileno = target_stream.fileno()
+        expect_mock_output = u"""\
+            Called os.dup2(%(target_fileno)r, %(system_fileno)r)
+            """ % vars()
+        daemon.daemon.redirect_stream(system_stream, target_stream)
+        self.failUnlessMockCheckerMatch(expect_mock_output)
+
+    def test_duplicates_null_file_descriptor_by_default(self):
+        """ Should by default duplicate the null file to the system stream. """
+        system_stream = self.test_system_stream
+        system_fileno = system_stream.fileno()
+        target_stream = None
+        null_path = os.devnull
+        null_flag = os.O_RDWR
+        null_file = self.test_null_file
         null_fileno = null_file.fileno()
         expect_mock_output = u"""\
             Called os.open(%(null_path)r, %(null_flag)r)
             Called os.dup2(%(null_fileno)r, %(system_fileno)r)
+            Called os.close(%(null_fileno)r)
             """ % vars()
         daemon.daemon.redirect_stream(system_stream, target_stream)
         self.failUnlessMockCheckerMatch(expect_mock_output)
 
+    def test_keeps_null_file_descriptor_if_system_stream(self):
+        """ Should not close the null file if it is the system stream. """
+        system_stream = self.test_system_stream
+        system_stream._fileno = self.test_null_file.fileno()
+        target_stream = None
+        unwanted_output = u"""\
+            ...Called os.close(...)..."""
+        daemon.daemon.redirect_stream(system_stream, target_stream)
+        self.failIfMockCheckerMatch(unwanted_output)
+
+    def test_duplicates_target_raw_file_descriptor(self):
+        """ Should duplicate a target specified as a file descriptor. """
+        system_stream = self.test_system_stream
+        system_fileno = system_stream.fileno()
+        target_fileno = 47
+        expect_mock_output = u"""\
+            Called os.dup2(%(target_fileno)r, %(system_fileno)r)
+            """ % vars()
+        daemon.daemon.redirect_stream(system_stream, target_fileno)
+        self.failUnlessMockCheckerMatch(expect_mock_output)
+
+
+
+class open_stream_file_TestCase(scaffold.TestCase):
+    """ Test cases for open_stream_file function. """
+
+    def setUp(self):
+        """ Set up test fixtures. """
+        self.mock_tracker = scaffold.MockTracker()
+
+        self.test_path = tempfile.mktemp()
+        self.test_flags = os.O_RDONLY
+        self.test_fd = 17
+        scaffold.mock(
+            u"os.open",
+            returns_func=(lambda path, flags, mode: self.test_fd),
+            tracker=self.mock_tracker)
+        scaffold.mock(
+            u"os.close",
+            tracker=self.mock_tracker)
+        scaffold.mock(
+            u"fcntl.fcntl",
+            returns=23,
+            tracker=self.mock_tracker)
+
+    def tearDown(self):
+        """ Tear down test fixtures. """
+        scaffold.mock_restore()
+
+    def test_returns_opened_file_descriptor(self):
+        """ Should return the file descriptor opened. """
+        expect_result = self.test_fd
+        result = daemon.daemon.open_stream_file(
+            self.test_path, self.test_flags)
+        self.failUnlessEqual(expect_result, result)
+
+    def test_moves_standard_file_descriptor_higher(self):
+        """ Should move a standard stream file descriptor higher. """
+        self.test_fd = 1
+        path = self.test_path
+        flags = self.test_flags
+        expect_mode = 0666
+        expect_command = fcntl.F_DUPFD
+        expect_mock_output = u"""\
+            Called os.open(%(path)r, %(flags)r, %(expect_mode)r)
+            Called fcntl.fcntl(1, %(expect_command)r, 3)
+            Called os.close(1)
+            """ % vars()
+        result = daemon.daemon.open_stream_file(path, flags)
+        self.failUnlessMockCheckerMatch(expect_mock_output)
+        self.failUnlessEqual(23, result)
+
+
+
+class redirect_standard_streams_TestCase(scaffold.TestCase):
+    """ Test cases for redirect_standard_streams function. """
+
+    def setUp(self):
+        """ Set up test fixtures. """
+        setup_streams_fixtures(self)
+
+        self.test_opened_fds = {}
+        fd_iter = itertools.count(40)
+        def mock_open_stream_file(path, flags):
+            fd = fd_iter.next()
+            self.test_opened_fds[fd] = (path, flags)
+            return fd
+
+        scaffold.mock(
+            u"daemon.daemon.open_stream_file",
+            returns_func=mock_open_stream_file,
+            tracker=self.mock_tracker)
+        scaffold.mock(
+            u"daemon.daemon.redirect_stream",
+            tracker=self.mock_tracker)
+        scaffold.mock(
+            u"os.close",
+            tracker=self.mock_tracker)
+        for name in ['stdin', 'stdout', 'stderr']:
+            scaffold.mock(
+                u"sys.%(name)s" % vars(),
+                tracker=self.mock_tracker)
+
+    def tearDown(self):
+        """ Tear down test fixtures. """
+        scaffold.mock_restore()
+
+    def test_redirects_each_stream_to_its_target(self):
+        """ Should redirect each system stream to its target file. """
+        targets = self.stream_files_by_name
+        (stdin, stdout, stderr) = (
+            targets['stdin'], targets['stdout'], targets['stderr'])
+        expect_mock_output = u"""\
+            Called daemon.daemon.redirect_stream(
+                <Mock ... sys.stdin>, %(stdin)r)
+            Called daemon.daemon.redirect_stream(
+                <Mock ... sys.stdout>, %(stdout)r)
+            Called daemon.daemon.redirect_stream(
+                <Mock ... sys.stderr>, %(stderr)r)
+            """ % vars()
+        daemon.daemon.redirect_standard_streams(stdin, stdout, stderr)
+        self.failUnlessMockCheckerMatch(expect_mock_output)
+
+    def test_opens_null_device_once_and_closes_it(self):
+        """ Should open the null device once, then close it. """
+        null_path = os.devnull
+        null_flags = os.O_RDWR
+        expect_mock_output = u"""\
+            Called daemon.daemon.open_stream_file(
+                %(null_path)r, %(null_flags)r)
+            Called daemon.daemon.redirect_stream(<Mock ... sys.stdin>, 40)
+            Called daemon.daemon.redirect_stream(<Mock ... sys.stdout>, 40)
+            Called daemon.daemon.redirect_stream(<Mock ... sys.stderr>, 40)
+            Called os.close(40)
+            """ % vars()
+        daemon.daemon.redirect_standard_streams(None, None, None)
+        self.failUnlessMockCheckerMatch(expect_mock_output)
+
+    def test_opens_paths_for_reading_and_appending(self):
+        """ Should open stdin path for reading, others for appending. """
+        stdin_path = self.stream_file_paths['stdin']
+        stdout_path = self.stream_file_paths['stdout']
+        daemon.daemon.redirect_standard_streams(
+            stdin_path, stdout_path, stdout_path)
+        append_flags = os.O_WRONLY | os.O_CREAT | os.O_APPEND
+        expect_opened = {
+            40: (stdin_path, os.O_RDONLY),
+            41: (stdout_path, append_flags),
+            }
+        self.failUnlessEqual(expect_opened, self.test_opened_fds)
+
+    def test_closes_opened_files_on_error(self):
+        """ Should close opened files if redirection fails. """
+        test_error = OSError(errno.EBADF, u"Bad file descriptor")
+        daemon.daemon.redirect_stream.mock_raises = test_error
+        expect_mock_output = u"""\
+            ...
+            Called os.close(40)
+            """
+        self.failUnlessRaises(
+            OSError,
+            daemon.daemon.redirect_standard_streams, None, None, None)
+        self.failUnlessMockCheckerMatch(expect_mock_output)
+
 
 class make_default_signal_map_TestCase(scaffold.TestCase):
     """ Test cases for make_default_signal_map function. """
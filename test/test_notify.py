@@ -0,0 +1,401 @@
+# -*- coding: utf-8 -*-
+#
+# test/test_notify.py
+# Part of python-daemon, an implementation of PEP 3143.
+#
+# Copyright © 2026 agent <agent@local>
+#
+# This is free software: you may copy, modify, and/or distribute this work
+# under the terms of the Python Software Foundation License, version 2 or
+# later as published by the Python Software Foundation.
+# No warranty expressed or implied. See the file LICENSE.PSF-2 for details.
+
+""" Unit test for notify module.
+    """
+
+import os
+import socket
+import tempfile
+
+import scaffold
+
+from daemon import notify
+
+
+class Exception_TestCase(scaffold.Exception_TestCase):
+    """ Test cases for module exception classes. """
+
+    def __init__(self, *args, **kwargs):
+        """ Set up a new instance. """
+        super(Exception_TestCase, self).__init__(*args, **kwargs)
+
+        self.valid_exceptions = {
+            notify.NotifyError: dict(
+                min_args = 1,
+                types = (Exception,),
+                ),
+            notify.NotifySocketError: dict(
+                min_args = 1,
+                types = (notify.NotifyError, socket.error),
+                ),
+            }
+
+
+def setup_supervisor_fixtures(testcase):
+    """ Set up a notification socket standing in for the supervisor. """
+    testcase.mock_tracker = scaffold.MockTracker()
+
+    testcase.test_socket_dir = tempfile.mkdtemp()
+    testcase.test_socket_path = os.path.join(
+        testcase.test_socket_dir, u"notify")
+    testcase.supervisor_socket = socket.socket(
+        socket.AF_UNIX, socket.SOCK_DGRAM)
+    testcase.supervisor_socket.bind(testcase.test_socket_path)
+    testcase.supervisor_socket.settimeout(5)
+
+    def receive_notification():
+        """ Receive the next notification sent to the supervisor. """
+        return testcase.supervisor_socket.recv(4096)
+
+    testcase.receive_notification = receive_notification
+
+
+def teardown_supervisor_fixtures(testcase):
+    """ Tear down the notification socket standing in for the supervisor. """
+    testcase.supervisor_socket.close()
+    os.remove(testcase.test_socket_path)
+    os.rmdir(testcase.test_socket_dir)
+
+
+class Notifier_TestCase(scaffold.TestCase):
+    """ Test cases for Notifier class. """
+
+    def setUp(self):
+        """ Set up test fixtures. """
+        setup_supervisor_fixtures(self)
+
+        self.test_environ = {
+            notify.NOTIFY_SOCKET_ENV: self.test_socket_path,
+            }
+        scaffold.mock(
+            u"os.environ",
+            mock_obj=self.test_environ,
+            tracker=self.mock_tracker)
+
+        self.test_instance = notify.Notifier()
+
+    def tearDown(self):
+        """ Tear down test fixtures. """
+        self.test_instance.close()
+        scaffold.mock_restore()
+        teardown_supervisor_fixtures(self)
+
+    def test_instantiate(self):
+        """ New instance of Notifier should be created. """
+        self.failUnlessIsInstance(self.test_instance, notify.Notifier)
+
+    def test_has_address_from_environment(self):
+        """ Should have the address named by `NOTIFY_SOCKET`. """
+        instance = self.test_instance
+        self.failUnlessEqual(self.test_socket_path, instance.address)
+        self.failUnless(instance.enabled)
+
+    def test_has_specified_address(self):
+        """ Should have the specified address. """
+        instance = notify.Notifier(address=u"/var/run/spam.sock")
+        self.failUnlessEqual(u"/var/run/spam.sock", instance.address)
+
+    def test_is_disabled_without_environment(self):
+        """ Should be disabled if `NOTIFY_SOCKET` is unset. """
+        del self.test_environ[notify.NOTIFY_SOCKET_ENV]
+        instance = notify.Notifier()
+        self.failIf(instance.enabled)
+
+    def test_disabled_notify_returns_false(self):
+        """ Should return False, and open no socket, when disabled. """
+        del self.test_environ[notify.NOTIFY_SOCKET_ENV]
+        instance = notify.Notifier()
+        result = instance.ready()
+        self.failUnlessIs(False, result)
+        self.failUnlessIs(None, instance.fileno())
+
+    def test_connect_opens_close_on_exec_socket(self):
+        """ Should connect a socket not inherited across `exec`. """
+        import fcntl
+        instance = self.test_instance
+        instance.connect()
+        fd = instance.fileno()
+        self.failIfIs(None, fd)
+        flags = fcntl.fcntl(fd, fcntl.F_GETFD)
+        self.failUnless(flags & fcntl.FD_CLOEXEC)
+
+    def test_connect_raises_error_if_no_supervisor(self):
+        """ Should raise NotifySocketError if the socket is absent. """
+        instance = notify.Notifier(
+            address=os.path.join(self.test_socket_dir, u"absent"))
+        expect_error = notify.NotifySocketError
+        self.failUnlessRaises(expect_error, instance.connect)
+
+    def test_close_closes_socket(self):
+        """ Should close the socket. """
+        instance = self.test_instance
+        instance.connect()
+        instance.close()
+        self.failUnlessIs(None, instance.fileno())
+
+    def test_ready_sends_ready(self):
+        """ Should notify the supervisor that the service is ready. """
+        instance = self.test_instance
+        result = instance.ready()
+        self.failUnlessIs(True, result)
+        self.failUnlessEqual("READY=1", self.receive_notification())
+
+    def test_status_sends_single_line(self):
+        """ Should notify the supervisor of status text on one line. """
+        instance = self.test_instance
+        instance.status(u"Spam\nand eggs")
+        self.failUnlessEqual(
+            "STATUS=Spam and eggs", self.receive_notification())
+
+    def test_watchdog_ping_sends_watchdog(self):
+        """ Should notify the supervisor's watchdog. """
+        instance = self.test_instance
+        instance.watchdog_ping()
+        self.failUnlessEqual("WATCHDOG=1", self.receive_notification())
+
+    def test_stopping_sends_stopping(self):
+        """ Should notify the supervisor that the service is stopping. """
+        instance = self.test_instance
+        instance.stopping()
+        self.failUnlessEqual("STOPPING=1", self.receive_notification())
+
+    def test_main_pid_sends_main_pid(self):
+        """ Should notify the supervisor of the main process ID. """
+        instance = self.test_instance
+        instance.main_pid(235)
+        self.failUnlessEqual("MAINPID=235", self.receive_notification())
+
+    def test_notify_sends_text_encoded(self):
+        """ Should send the state text encoded as UTF-8. """
+        instance = self.test_instance
+        instance.notify(u"STATUS=Café\nREADY=1")
+        self.failUnlessEqual(
+            "STATUS=Caf\xc3\xa9\nREADY=1", self.receive_notification())
+
+    def test_notify_uses_connected_socket(self):
+        """ Should send on the socket connected before the path went. """
+        instance = self.test_instance
+        instance.connect()
+        moved_path = self.test_socket_path + u".moved"
+        os.rename(self.test_socket_path, moved_path)
+        try:
+            instance.ready()
+        finally:
+            os.rename(moved_path, self.test_socket_path)
+        self.failUnlessEqual("READY=1", self.receive_notification())
+
+    def test_notify_raises_error_if_supervisor_gone(self):
+        """ Should raise NotifySocketError if the supervisor is gone. """
+        instance = self.test_instance
+        instance.connect()
+        self.supervisor_socket.close()
+        os.remove(self.test_socket_path)
+        self.supervisor_socket = socket.socket(
+            socket.AF_UNIX, socket.SOCK_DGRAM)
+        self.supervisor_socket.bind(self.test_socket_path)
+        expect_error = notify.NotifySocketError
+        self.failUnlessRaises(expect_error, instance.ready)
+
+
+class WatchdogPinger_TestCase(scaffold.TestCase):
+    """ Test cases for WatchdogPinger class. """
+
+    def setUp(self):
+        """ Set up test fixtures. """
+        setup_supervisor_fixtures(self)
+
+        self.test_notifier = notify.Notifier(
+            address=self.test_socket_path)
+        self.test_interval = 0.01
+        self.test_instance = notify.WatchdogPinger(
+            self.test_notifier, self.test_interval)
+
+    def tearDown(self):
+        """ Tear down test fixtures. """
+        self.test_instance.stop()
+        self.test_notifier.close()
+        teardown_supervisor_fixtures(self)
+
+    def test_sends_watchdog_notifications_until_stopped(self):
+        """ Should notify the watchdog repeatedly until stopped. """
+        instance = self.test_instance
+        instance.start()
+        for count in range(3):
+            self.failUnlessEqual("WATCHDOG=1", self.receive_notification())
+        instance.stop()
+        self.supervisor_socket.settimeout(0)
+        try:
+            while True:
+                self.supervisor_socket.recv(4096)
+        except socket.error:
+            pass
+        self.supervisor_socket.settimeout(self.test_interval * 5)
+        self.failUnlessRaises(socket.error, self.receive_notification)
+
+    def test_stop_returns_promptly(self):
+        """ Should stop without waiting for the interval to pass. """
+        import time
+        instance = notify.WatchdogPinger(self.test_notifier, 60)
+        instance.start()
+        self.receive_notification()
+        start = time.time()
+        instance.stop()
+        self.failUnless(time.time() - start < 5)
+
+    def test_continues_if_notification_fails(self):
+        """ Should keep notifying if a notification fails. """
+        notifier = notify.Notifier(
+            address=os.path.join(self.test_socket_dir, u"absent"))
+        instance = notify.WatchdogPinger(notifier, self.test_interval)
+        instance.start()
+        instance.stop()
+
+    def test_stop_without_start_does_nothing(self):
+        """ Should do nothing if stopped when not started. """
+        self.test_instance.stop()
+
+
+class get_notify_socket_address_TestCase(scaffold.TestCase):
+    """ Test cases for get_notify_socket_address function. """
+
+    def setUp(self):
+        """ Set up test fixtures. """
+        self.mock_tracker = scaffold.MockTracker()
+
+        self.test_environ = {}
+        scaffold.mock(
+            u"os.environ",
+            mock_obj=self.test_environ,
+            tracker=self.mock_tracker)
+
+    def tearDown(self):
+        """ Tear down test fixtures. """
+        scaffold.mock_restore()
+
+    def test_returns_none_if_unset(self):
+        """ Should return None if `NOTIFY_SOCKET` is unset or empty. """
+        self.failUnlessIs(None, notify.get_notify_socket_address())
+        self.test_environ[notify.NOTIFY_SOCKET_ENV] = ""
+        self.failUnlessIs(None, notify.get_notify_socket_address())
+
+    def test_returns_path(self):
+        """ Should return a filesystem path verbatim. """
+        self.test_environ[notify.NOTIFY_SOCKET_ENV] = "/run/notify"
+        expect_result = "/run/notify"
+        result = notify.get_notify_socket_address()
+        self.failUnlessEqual(expect_result, result)
+
+    def test_returns_abstract_address(self):
+        """ Should return an abstract address with a leading null byte. """
+        self.test_environ[notify.NOTIFY_SOCKET_ENV] = "@spam/notify"
+        expect_result = "\0spam/notify"
+        result = notify.get_notify_socket_address()
+        self.failUnlessEqual(expect_result, result)
+
+
+class get_watchdog_interval_TestCase(scaffold.TestCase):
+    """ Test cases for get_watchdog_interval function. """
+
+    def setUp(self):
+        """ Set up test fixtures. """
+        self.mock_tracker = scaffold.MockTracker()
+
+        self.test_pid = 235
+        scaffold.mock(
+            u"os.getpid",
+            returns=self.test_pid,
+            tracker=self.mock_tracker)
+        self.test_environ = {
+            notify.WATCHDOG_USEC_ENV: "30000000",
+            }
+        scaffold.mock(
+            u"os.environ",
+            mock_obj=self.test_environ,
+            tracker=self.mock_tracker)
+
+    def tearDown(self):
+        """ Tear down test fixtures. """
+        scaffold.mock_restore()
+
+    def test_returns_half_the_timeout(self):
+        """ Should return half the watchdog timeout, in seconds. """
+        expect_result = 15.0
+        result = notify.get_watchdog_interval()
+        self.failUnlessEqual(expect_result, result)
+
+    def test_returns_interval_if_watchdog_pid_is_this_process(self):
+        """ Should return the interval if `WATCHDOG_PID` is this process. """
+        self.test_environ[notify.WATCHDOG_PID_ENV] = "235"
+        expect_result = 15.0
+        result = notify.get_watchdog_interval()
+        self.failUnlessEqual(expect_result, result)
+
+    def test_returns_none_if_watchdog_pid_is_other_process(self):
+        """ Should return None if `WATCHDOG_PID` is another process. """
+        self.test_environ[notify.WATCHDOG_PID_ENV] = "8642"
+        result = notify.get_watchdog_interval()
+        self.failUnlessIs(None, result)
+
+    def test_returns_none_if_timeout_unset_or_invalid(self):
+        """ Should return None if `WATCHDOG_USEC` is unset or invalid. """
+        for value in [None, "", "spam", "0", "-5"]:
+            if value is None:
+                del self.test_environ[notify.WATCHDOG_USEC_ENV]
+            else:
+                self.test_environ[notify.WATCHDOG_USEC_ENV] = value
+            result = notify.get_watchdog_interval()
+            self.failUnlessIs(None, result)
+
+
+class module_functions_TestCase(scaffold.TestCase):
+    """ Test cases for the module notification functions. """
+
+    def setUp(self):
+        """ Set up test fixtures. """
+        setup_supervisor_fixtures(self)
+
+        self.test_notifier = notify.Notifier(
+            address=self.test_socket_path)
+        scaffold.mock(
+            u"notify._default_notifier",
+            mock_obj=self.test_notifier,
+            tracker=self.mock_tracker)
+
+    def tearDown(self):
+        """ Tear down test fixtures. """
+        self.test_notifier.close()
+        scaffold.mock_restore()
+        teardown_supervisor_fixtures(self)
+
+    def test_get_default_notifier_returns_shared_notifier(self):
+        """ Should return the notifier shared by this process. """
+        result = notify.get_default_notifier()
+        self.failUnlessIs(self.test_notifier, result)
+
+    def test_get_default_notifier_makes_notifier_once(self):
+        """ Should make the shared notifier on first use only. """
+        notify._default_notifier = None
+        result = notify.get_default_notifier()
+        self.failUnlessIsInstance(result, notify.Notifier)
+        self.failUnlessIs(result, notify.get_default_notifier())
+
+    def test_functions_send_notifications(self):
+        """ Should send each notification with the shared notifier. """
+        notify.ready()
+        notify.status(u"Spam")
+        notify.watchdog_ping()
+        notify.stopping()
+        expect_notifications = [
+            "READY=1", "STATUS=Spam", "WATCHDOG=1", "STOPPING=1"]
+        notifications = [self.receive_notification() for n in range(4)]
+        self.failUnlessEqual(expect_notifications, notifications)
@@ -19,6 +19,11 @@ from StringIO import StringIO
 import itertools
 import tempfile
 import errno
+import signal
+import shutil
+import threading
+import fcntl
+import time
 
 import lockfile
 
@@ -73,6 +78,9 @@ def make_pidlockfile_scenarios():
         u"%(mock_other_pid)d\n" % vars())
     mock_pidfile_bogus = FakeFileDescriptorStringIO(
         u"b0gUs")
+    mock_start_time = 4567
+    mock_pidfile_other_pid_start_time = FakeFileDescriptorStringIO(
+        u"%(mock_other_pid)d\nstart_time=%(mock_start_time)d\n" % vars())
 
     scenarios = {
         'simple': {},
@@ -119,6 +127,11 @@ def make_pidlockfile_scenarios():
             'pidfile_pid': mock_other_pid,
             'locking_pid': mock_other_pid,
             },
+        'exist-other-pid-start-time': {
+            'pidfile': mock_pidfile_other_pid_start_time,
+            'pidfile_pid': mock_other_pid,
+            'pidfile_start_time': mock_start_time,
+            },
         }
 
     for scenario in scenarios.values():
@@ -128,6 +141,8 @@ def make_pidlockfile_scenarios():
             scenario['pidfile'] = mock_pidfile_empty
         if 'pidfile_pid' not in scenario:
             scenario['pidfile_pid'] = None
+        if 'pidfile_start_time' not in scenario:
+            scenario['pidfile_start_time'] = None
         if 'locking_pid' not in scenario:
             scenario['locking_pid'] = None
         if 'open_func_name' not in scenario:
@@ -255,7 +270,8 @@ def setup_pidfile_fixtures(testcase):
     testcase.scenario = NotImplemented
 
 
-def setup_lockfile_method_mocks(testcase, scenario, class_name):
+def setup_lockfile_method_mocks(
+    testcase, scenario, class_name, func_names=None):
     """ Set up common mock methods for lockfile class. """
 
     def mock_read_pid():
@@ -278,11 +294,13 @@ def setup_lockfile_method_mocks(testcase, scenario, class_name):
     def mock_break_lock():
         scenario['locking_pid'] = None
 
-    for func_name in [
-        'read_pid',
-        'is_locked', 'i_am_locking',
-        'acquire', 'release', 'break_lock',
-        ]:
+    if func_names is None:
+        func_names = [
+            'read_pid',
+            'is_locked', 'i_am_locking',
+            'acquire', 'release', 'break_lock',
+            ]
+    for func_name in func_names:
         mock_func = vars()["mock_%(func_name)s" % vars()]
         lockfile_func_name = u"%(class_name)s.%(func_name)s" % vars()
         mock_lockfile_func = scaffold.Mock(
@@ -319,6 +337,9 @@ def set_pidlockfile_scenario(testcase, scenario_name, clear_tracker=True):
     testcase.scenario = testcase.pidlockfile_scenarios[scenario_name]
     setup_lockfile_method_mocks(
         testcase, testcase.scenario, u"lockfile.LinkFileLock")
+    setup_lockfile_method_mocks(
+        testcase, testcase.scenario, u"pidlockfile.WatchedLinkFileLock",
+        func_names=['acquire'])
     testcase.pidlockfile_args = dict(
         path=testcase.scenario['path'],
         )
@@ -349,12 +370,36 @@ class PIDLockFile_TestCase(scaffold.TestCase):
         instance = self.test_instance
         self.failUnlessIsInstance(instance, lockfile.LinkFileLock)
 
+    def test_inherits_from_watchedlinkfilelock(self):
+        """ Should inherit from WatchedLinkFileLock. """
+        instance = self.test_instance
+        self.failUnlessIsInstance(
+            instance, pidlockfile.WatchedLinkFileLock)
+
     def test_has_specified_path(self):
         """ Should have specified path. """
         instance = self.test_instance
         expect_path = self.scenario['path']
         self.failUnlessEqual(expect_path, instance.path)
 
+    def test_has_no_durability_by_default(self):
+        """ Should have durability 'none' by default. """
+        instance = self.test_instance
+        self.failUnlessEqual(u'none', instance.durability)
+
+    def test_has_specified_durability(self):
+        """ Should have specified durability. """
+        instance = pidlockfile.PIDLockFile(
+            self.scenario['path'], durability=u'fsync')
+        self.failUnlessEqual(u'fsync', instance.durability)
+
+    def test_error_when_durability_unknown(self):
+        """ Should raise ValueError when the durability is unknown. """
+        self.failUnlessRaises(
+            ValueError,
+            pidlockfile.PIDLockFile, self.scenario['path'],
+            durability=u'spam')
+
 
 class PIDLockFile_read_pid_TestCase(scaffold.TestCase):
     """ Test cases for PIDLockFile.read_pid method. """
@@ -375,6 +420,58 @@ class PIDLockFile_read_pid_TestCase(scaffold.TestCase):
         result = instance.read_pid()
         self.failUnlessEqual(expect_pid, result)
 
+    def test_gets_pid_via_cache_if_specified(self):
+        """ Should get PID via the specified cache. """
+        test_cache = scaffold.Mock(
+            u"PIDFileCache",
+            tracker=self.mock_tracker)
+        test_cache.read_pid.mock_returns = self.scenario['pidfile_pid']
+        instance = pidlockfile.PIDLockFile(
+            self.scenario['path'], cache=test_cache)
+        pidfile_path = self.scenario['path']
+        expect_mock_output = u"""\
+            Called PIDFileCache.read_pid(%(pidfile_path)r)
+            """ % vars()
+        self.mock_tracker.clear()
+        result = instance.read_pid()
+        self.failUnlessEqual(self.scenario['pidfile_pid'], result)
+        self.failUnlessMockCheckerMatch(expect_mock_output)
+
+
+class PIDLockFile_read_start_time_TestCase(scaffold.TestCase):
+    """ Test cases for PIDLockFile.read_start_time method. """
+
+    def setUp(self):
+        """ Set up test fixtures. """
+        setup_pidlockfile_fixtures(self, 'exist-other-pid-start-time')
+
+    def tearDown(self):
+        """ Tear down test fixtures. """
+        scaffold.mock_restore()
+
+    def test_gets_start_time_recorded_for_pid(self):
+        """ Should get the start time recorded for the specified PID. """
+        instance = self.test_instance
+        test_pid = self.scenario['pidfile_pid']
+        expect_start_time = self.scenario['pidfile_start_time']
+        result = instance.read_start_time(test_pid)
+        self.failUnlessEqual(expect_start_time, result)
+
+    def test_returns_none_for_other_pid(self):
+        """ Should return None if the PID file records another PID. """
+        instance = self.test_instance
+        test_pid = self.scenario['pidfile_pid'] + 1
+        result = instance.read_start_time(test_pid)
+        self.failUnlessIs(None, result)
+
+    def test_returns_none_if_no_start_time(self):
+        """ Should return None if the PID file records no start time. """
+        set_pidlockfile_scenario(self, 'exist-other-pid')
+        instance = self.test_instance
+        test_pid = self.scenario['pidfile_pid']
+        result = instance.read_start_time(test_pid)
+        self.failUnlessIs(None, result)
+
 
 class PIDLockFile_acquire_TestCase(scaffold.TestCase):
     """ Test cases for PIDLockFile.acquire function. """
@@ -388,22 +485,23 @@ class PIDLockFile_acquire_TestCase(scaffold.TestCase):
         """ Tear down test fixtures. """
         scaffold.mock_restore()
 
-    def test_calls_linkfilelock_acquire(self):
-        """ Should first call LinkFileLock.acquire method. """
+    def test_calls_watchedlinkfilelock_acquire(self):
+        """ Should first call WatchedLinkFileLock.acquire method. """
         instance = self.test_instance
         expect_mock_output = u"""\
-            Called lockfile.LinkFileLock.acquire()
+            Called pidlockfile.WatchedLinkFileLock.acquire()
             ...
             """
         instance.acquire()
         self.failUnlessMockCheckerMatch(expect_mock_output)
 
-    def test_calls_linkfilelock_acquire_with_timeout(self):
-        """ Should call LinkFileLock.acquire method with specified timeout. """
+    def test_calls_watchedlinkfilelock_acquire_with_timeout(self):
+        """ Should call WatchedLinkFileLock.acquire with specified timeout. """
         instance = self.test_instance
         test_timeout = object()
         expect_mock_output = u"""\
-            Called lockfile.LinkFileLock.acquire(timeout=%(test_timeout)r)
+            Called pidlockfile.WatchedLinkFileLock.acquire(
+                timeout=%(test_timeout)r)
             ...
             """ % vars()
         instance.acquire(timeout=test_timeout)
@@ -415,7 +513,8 @@ class PIDLockFile_acquire_TestCase(scaffold.TestCase):
         pidfile_path = self.scenario['path']
         expect_mock_output = u"""\
             ...
-            Called pidlockfile.write_pid_to_pidfile(%(pidfile_path)r)
+            Called pidlockfile.write_pid_to_pidfile(
+                %(pidfile_path)r, u'none', {})
             """ % vars()
         instance.acquire()
         scaffold.mock_restore()
@@ -531,6 +630,157 @@ class PIDLockFile_break_lock_TestCase(scaffold.TestCase):
         instance.break_lock()
         self.failUnlessMockCheckerMatch(expect_mock_output)
 
+
+class PIDLockFile_take_over_TestCase(scaffold.TestCase):
+    """ Test cases for PIDLockFile.take_over function. """
+
+    def setUp(self):
+        """ Set up test fixtures. """
+        setup_pidlockfile_fixtures(self)
+        set_pidlockfile_scenario(self, 'exist-other-pid-locked')
+
+        scaffold.mock(
+            u"os.link",
+            tracker=self.mock_tracker)
+        scaffold.mock(
+            u"os.rename",
+            tracker=self.mock_tracker)
+        scaffold.mock(
+            u"pidlockfile.replace_pid_in_pidfile",
+            tracker=self.mock_tracker)
+
+    def tearDown(self):
+        """ Tear down test fixtures. """
+        scaffold.mock_restore()
+
+    def test_replaces_lock_file_then_pidfile(self):
+        """ Should replace the lock file, then the PID file. """
+        instance = self.test_instance
+        unique_name = instance.unique_name
+        link_path = u"%(unique_name)s.link" % vars()
+        lock_file = instance.lock_file
+        pidfile_path = self.scenario['path']
+        expect_mock_output = u"""\
+            Called builtins.open(%(unique_name)r, 'wb')
+            Called os.link(%(unique_name)r, %(link_path)r)
+            Called os.rename(%(link_path)r, %(lock_file)r)
+            Called pidlockfile.replace_pid_in_pidfile(
+                %(pidfile_path)r, u'none', {})
+            """ % vars()
+        instance.take_over()
+        scaffold.mock_restore()
+        self.failUnlessMockCheckerMatch(expect_mock_output)
+
+    def test_raises_lock_failed_on_error(self):
+        """ Should raise LockFailed error if replacing fails. """
+        instance = self.test_instance
+        mock_error = OSError(errno.EACCES, u"Denied")
+        os.rename.mock_raises = mock_error
+        expect_error = pidlockfile.LockFailed
+        self.failUnlessRaises(
+            expect_error,
+            instance.take_over)
+
+
+class PIDLockFile_update_fields_TestCase(scaffold.TestCase):
+    """ Test cases for PIDLockFile.update_fields function. """
+
+    def setUp(self):
+        """ Set up test fixtures. """
+        setup_pidlockfile_fixtures(self)
+        set_pidlockfile_scenario(self, 'exist-current-pid-locked')
+
+        scaffold.mock(
+            u"pidlockfile.replace_pid_in_pidfile",
+            tracker=self.mock_tracker)
+
+    def tearDown(self):
+        """ Tear down test fixtures. """
+        scaffold.mock_restore()
+
+    def test_replaces_pidfile_if_lock_held(self):
+        """ Should replace the PID file with the fields if lock held. """
+        instance = self.test_instance
+        pidfile_path = self.scenario['path']
+        expect_fields = {u'state': u'ready'}
+        expect_mock_output = u"""\
+            ...
+            Called pidlockfile.replace_pid_in_pidfile(
+                %(pidfile_path)r, u'none', %(expect_fields)r)
+            """ % vars()
+        instance.update_fields(expect_fields)
+        scaffold.mock_restore()
+        self.failUnlessMockCheckerMatch(expect_mock_output)
+        self.failUnlessEqual(expect_fields, instance.fields)
+
+    def test_only_sets_fields_if_lock_not_held(self):
+        """ Should only set the fields if the lock is not held. """
+        set_pidlockfile_scenario(self, 'exist-other-pid-locked')
+        instance = self.test_instance
+        unwanted_mock_output = u"""\
+            ...Called pidlockfile.replace_pid_in_pidfile(...)..."""
+        instance.update_fields({u'generation': 2})
+        scaffold.mock_restore()
+        self.failIfMockCheckerMatch(unwanted_mock_output)
+        self.failUnlessEqual({u'generation': 2}, instance.fields)
+
+    def test_raises_lock_failed_on_error(self):
+        """ Should raise LockFailed error if replacing fails. """
+        instance = self.test_instance
+        pidlockfile.replace_pid_in_pidfile.mock_raises = OSError(
+            errno.ENOSPC, u"No space")
+        self.failUnlessRaises(
+            pidlockfile.LockFailed,
+            instance.update_fields, {u'state': u'ready'})
+
+
+class PIDLockFile_relinquish_TestCase(scaffold.TestCase):
+    """ Test cases for PIDLockFile.relinquish function. """
+
+    def setUp(self):
+        """ Set up test fixtures. """
+        setup_pidlockfile_fixtures(self)
+        set_pidlockfile_scenario(self, 'exist-other-pid-locked')
+
+        scaffold.mock(
+            u"os.unlink",
+            tracker=self.mock_tracker)
+
+    def tearDown(self):
+        """ Tear down test fixtures. """
+        scaffold.mock_restore()
+
+    def test_removes_unique_file(self):
+        """ Should remove the unique file of the lock. """
+        instance = self.test_instance
+        unique_name = instance.unique_name
+        expect_mock_output = u"""\
+            ...
+            Called os.unlink(%(unique_name)r)
+            """ % vars()
+        instance.relinquish()
+        scaffold.mock_restore()
+        self.failUnlessMockCheckerMatch(expect_mock_output)
+
+    def test_ignores_unique_file_not_exist_error(self):
+        """ Should ignore error if the unique file does not exist. """
+        instance = self.test_instance
+        os.unlink.mock_raises = OSError(errno.ENOENT, u"Not there")
+        instance.relinquish()
+
+    def test_raises_lock_failed_if_i_am_locking(self):
+        """ Should raise LockFailed if the lock was not taken over. """
+        set_pidlockfile_scenario(self, 'exist-current-pid-locked')
+        instance = self.test_instance
+        expect_error = pidlockfile.LockFailed
+        unwanted_mock_output = u"""\
+            ...Called os.unlink(...)..."""
+        self.failUnlessRaises(
+            expect_error,
+            instance.relinquish)
+        self.failIfMockCheckerMatch(unwanted_mock_output)
+
+
 
 class read_pid_from_pidfile_TestCase(scaffold.TestCase):
     """ Test cases for read_pid_from_pidfile function. """
@@ -598,6 +848,321 @@ class read_pid_from_pidfile_TestCase(scaffold.TestCase):
             expect_error,
             pidlockfile.read_pid_from_pidfile, pidfile_path)
 
+    def test_reads_pid_from_file_with_start_time(self):
+        """ Should read the PID from a file also recording start time. """
+        set_pidlockfile_scenario(self, 'exist-other-pid-start-time')
+        pidfile_path = self.scenario['path']
+        expect_pid = self.scenario['pidfile_pid']
+        pid = pidlockfile.read_pid_from_pidfile(pidfile_path)
+        scaffold.mock_restore()
+        self.failUnlessEqual(expect_pid, pid)
+
+
+class read_pid_and_start_time_from_pidfile_TestCase(scaffold.TestCase):
+    """ Test cases for read_pid_and_start_time_from_pidfile function. """
+
+    def setUp(self):
+        """ Set up test fixtures. """
+        setup_pidfile_fixtures(self)
+
+    def tearDown(self):
+        """ Tear down test fixtures. """
+        scaffold.mock_restore()
+
+    def test_reads_pid_and_start_time_from_file(self):
+        """ Should read the PID and start time from the file. """
+        set_pidlockfile_scenario(self, 'exist-other-pid-start-time')
+        pidfile_path = self.scenario['path']
+        expect_result = (
+            self.scenario['pidfile_pid'],
+            self.scenario['pidfile_start_time'])
+        result = pidlockfile.read_pid_and_start_time_from_pidfile(
+            pidfile_path)
+        scaffold.mock_restore()
+        self.failUnlessEqual(expect_result, result)
+
+    def test_reads_pid_only_from_single_line_file(self):
+        """ Should read no start time from a single-line file. """
+        set_pidlockfile_scenario(self, 'exist-other-pid')
+        pidfile_path = self.scenario['path']
+        expect_result = (self.scenario['pidfile_pid'], None)
+        result = pidlockfile.read_pid_and_start_time_from_pidfile(
+            pidfile_path)
+        scaffold.mock_restore()
+        self.failUnlessEqual(expect_result, result)
+
+    def test_ignores_invalid_start_time(self):
+        """ Should read no start time if it is invalid. """
+        set_pidlockfile_scenario(self, 'exist-other-pid')
+        self.scenario['pidfile'] = FakeFileDescriptorStringIO(
+            u"%(pidfile_pid)d\nstart_time=b0gUs\n" % self.scenario)
+        pidfile_path = self.scenario['path']
+        expect_result = (self.scenario['pidfile_pid'], None)
+        result = pidlockfile.read_pid_and_start_time_from_pidfile(
+            pidfile_path)
+        scaffold.mock_restore()
+        self.failUnlessEqual(expect_result, result)
+
+    def test_returns_none_when_file_nonexist(self):
+        """ Should return None values when the file does not exist. """
+        set_pidlockfile_scenario(self, 'not-exist')
+        pidfile_path = self.scenario['path']
+        result = pidlockfile.read_pid_and_start_time_from_pidfile(
+            pidfile_path)
+        scaffold.mock_restore()
+        self.failUnlessEqual((None, None), result)
+
+
+class PIDFileCache_TestCase(scaffold.TestCase):
+    """ Test cases for ‘PIDFileCache’ class. """
+
+    def setUp(self):
+        """ Set up test fixtures. """
+        self.mock_tracker = scaffold.MockTracker()
+        self.test_dir = tempfile.mkdtemp()
+        self.test_path = os.path.join(self.test_dir, u"spam.pid")
+        self.write_pidfile(u"12345\nstart_time=678\n")
+        self.test_instance = pidlockfile.PIDFileCache()
+        self.real_read_func = pidlockfile.read_pidfile_record
+        scaffold.mock(
+            u"pidlockfile.read_pidfile_record",
+            returns_func=self.real_read_func,
+            tracker=self.mock_tracker)
+
+    def tearDown(self):
+        """ Tear down test fixtures. """
+        scaffold.mock_restore()
+        shutil.rmtree(self.test_dir)
+
+    def write_pidfile(self, text):
+        """ Replace the test PID file with one containing `text`. """
+        new_path = u"%(test_path)s.new" % vars(self)
+        new_file = open(new_path, 'w')
+        new_file.write(text)
+        new_file.close()
+        os.rename(new_path, self.test_path)
+
+    def test_reads_pid_and_start_time(self):
+        """ Should read the PID and start time from the file. """
+        instance = self.test_instance
+        result = instance.read_pid_and_start_time(self.test_path)
+        self.failUnlessEqual((12345, 678), result)
+        self.failUnlessEqual(12345, instance.read_pid(self.test_path))
+
+    def test_reads_unchanged_file_once(self):
+        """ Should read the file only once while it is unchanged. """
+        instance = self.test_instance
+        test_path = self.test_path
+        expect_mock_output = u"""\
+            Called pidlockfile.read_pidfile_record(%(test_path)r)
+            """ % vars()
+        for count in range(3):
+            instance.read_pid(self.test_path)
+        self.failUnlessMockCheckerMatch(expect_mock_output)
+
+    def test_reads_file_again_when_replaced(self):
+        """ Should read the file again once it is replaced. """
+        instance = self.test_instance
+        instance.read_pid(self.test_path)
+        self.write_pidfile(u"23456\n")
+        self.failUnlessEqual(23456, instance.read_pid(self.test_path))
+
+    def test_reads_file_again_when_modified(self):
+        """ Should read the file again once it is modified in place. """
+        instance = self.test_instance
+        instance.read_pid(self.test_path)
+        pidfile = open(self.test_path, 'w')
+        pidfile.write(u"234567\n")
+        pidfile.close()
+        self.failUnlessEqual(234567, instance.read_pid(self.test_path))
+
+    def test_returns_none_when_file_removed(self):
+        """ Should return None values once the file is removed. """
+        instance = self.test_instance
+        instance.read_pid(self.test_path)
+        os.remove(self.test_path)
+        result = instance.read_pid_and_start_time(self.test_path)
+        self.failUnlessEqual((None, None), result)
+        self.failUnlessEqual({}, instance.entries)
+
+    def test_raises_error_each_time_content_invalid(self):
+        """ Should raise PIDFileParseError each time for invalid content. """
+        instance = self.test_instance
+        self.write_pidfile(u"b0gUs\n")
+        for count in range(2):
+            self.failUnlessRaises(
+                pidlockfile.PIDFileParseError,
+                instance.read_pid, self.test_path)
+
+    def test_clear_forgets_files(self):
+        """ Should forget every file read when cleared. """
+        instance = self.test_instance
+        instance.read_pid(self.test_path)
+        instance.clear()
+        self.failUnlessEqual({}, instance.entries)
+
+    def test_read_record_returns_new_mapping(self):
+        """ Should return a new mapping of the record on each read. """
+        instance = self.test_instance
+        result = instance.read_record(self.test_path)
+        self.failUnlessEqual({u'pid': 12345, u'start_time': 678}, result)
+        result[u'pid'] = 0
+        self.failUnlessEqual(
+            12345, instance.read_record(self.test_path)[u'pid'])
+
+
+class read_pidfile_record_TestCase(scaffold.TestCase):
+    """ Test cases for read_pidfile_record function. """
+
+    def setUp(self):
+        """ Set up test fixtures. """
+        self.test_dir = tempfile.mkdtemp()
+        self.test_path = os.path.join(self.test_dir, u"spam.pid")
+
+    def tearDown(self):
+        """ Tear down test fixtures. """
+        shutil.rmtree(self.test_dir)
+
+    def write_pidfile(self, text):
+        """ Write the test PID file containing `text`. """
+        pidfile = open(self.test_path, 'w')
+        pidfile.write(text)
+        pidfile.close()
+
+    def test_returns_none_if_no_file(self):
+        """ Should return None if the PID file does not exist. """
+        result = pidlockfile.read_pidfile_record(self.test_path)
+        self.failUnless(result is None)
+
+    def test_reads_pid_only_file(self):
+        """ Should read a file with only a PID, as for earlier versions. """
+        self.write_pidfile(u"12345\n")
+        expect_record = {u'pid': 12345, u'start_time': None}
+        result = pidlockfile.read_pidfile_record(self.test_path)
+        self.failUnlessEqual(expect_record, result)
+
+    def test_reads_all_fields(self):
+        """ Should read the PID and every field in the file. """
+        self.write_pidfile(
+            u"12345\nstart_time=678\ngeneration=2\nstate=ready\n"
+            u"control_socket=/run/spam.ctl\n"
+            u"listen_address=[::1]:8080\nlisten_address=@spam\n")
+        expect_record = {
+            u'pid': 12345,
+            u'start_time': 678,
+            u'generation': 2,
+            u'state': u"ready",
+            u'control_socket': u"/run/spam.ctl",
+            u'listen_addresses': [u"[::1]:8080", u"@spam"],
+            }
+        result = pidlockfile.read_pidfile_record(self.test_path)
+        self.failUnlessEqual(expect_record, result)
+
+    def test_reads_written_record(self):
+        """ Should read the record written by write_pid_to_pidfile. """
+        test_fields = {
+            u'generation': 7,
+            u'state': u"starting",
+            u'listen_addresses': [u"0.0.0.0:80"],
+            }
+        pidlockfile.write_pid_to_pidfile(
+            self.test_path, fields=test_fields)
+        result = pidlockfile.read_pidfile_record(self.test_path)
+        self.failUnlessEqual(os.getpid(), result.pop(u'pid'))
+        result.pop(u'start_time')
+        self.failUnlessEqual(test_fields, result)
+
+    def test_keeps_unknown_fields_as_text(self):
+        """ Should keep fields it does not know, as text. """
+        self.write_pidfile(u"12345\nspam=eggs=ham\nbeans\n")
+        result = pidlockfile.read_pidfile_record(self.test_path)
+        self.failUnlessEqual(u"eggs=ham", result[u'spam'])
+        self.failIfIn(result, u'beans')
+
+    def test_omits_invalid_generation(self):
+        """ Should omit a generation that is not a number. """
+        self.write_pidfile(u"12345\ngeneration=spam\nstart_time=eggs\n")
+        expect_record = {u'pid': 12345, u'start_time': None}
+        result = pidlockfile.read_pidfile_record(self.test_path)
+        self.failUnlessEqual(expect_record, result)
+
+    def test_raises_error_if_pid_invalid(self):
+        """ Should raise PIDFileParseError if the PID is invalid. """
+        self.write_pidfile(u"state=ready\n12345\n")
+        self.failUnlessRaises(
+            pidlockfile.PIDFileParseError,
+            pidlockfile.read_pidfile_record, self.test_path)
+
+
+class read_pids_TestCase(scaffold.TestCase):
+    """ Test cases for read_pids function. """
+
+    def setUp(self):
+        """ Set up test fixtures. """
+        self.test_dir = tempfile.mkdtemp()
+        self.test_pids = {
+            u"spam.pid": 12345,
+            u"eggs.pid": 23456,
+            u"beans.pid": None,
+            }
+        self.test_paths = []
+        for (name, pid) in self.test_pids.items():
+            path = os.path.join(self.test_dir, name)
+            if pid is not None:
+                open(path, 'w').write(u"%(pid)d\n" % vars())
+            self.test_paths.append(path)
+
+    def tearDown(self):
+        """ Tear down test fixtures. """
+        shutil.rmtree(self.test_dir)
+
+    def test_reads_pid_of_each_path(self):
+        """ Should map each path to its PID, or None if no file. """
+        expect_result = dict(
+            (os.path.join(self.test_dir, name), pid)
+            for (name, pid) in self.test_pids.items())
+        result = pidlockfile.read_pids(self.test_paths)
+        self.failUnlessEqual(expect_result, result)
+
+    def test_maps_invalid_content_to_none(self):
+        """ Should map a path with invalid content to None. """
+        path = os.path.join(self.test_dir, u"spam.pid")
+        open(path, 'w').write(u"b0gUs\n")
+        result = pidlockfile.read_pids(self.test_paths)
+        self.failUnlessIs(None, result[path])
+
+    def test_records_invalid_content_error(self):
+        """ Should record the error for a path with invalid content. """
+        path = os.path.join(self.test_dir, u"spam.pid")
+        open(path, 'w').write(u"b0gUs\n")
+        errors = {}
+        pidlockfile.read_pids(self.test_paths, errors=errors)
+        self.failUnlessEqual([path], errors.keys())
+        self.failUnlessIsInstance(
+            errors[path], pidlockfile.PIDFileParseError)
+
+    def test_continues_past_unreadable_file(self):
+        """ Should map an unreadable path to None and read the rest. """
+        path = os.path.join(self.test_dir, u"spam.pid")
+        os.remove(path)
+        os.mkdir(path)
+        other_path = os.path.join(self.test_dir, u"eggs.pid")
+        errors = {}
+        result = pidlockfile.read_pids(self.test_paths, errors=errors)
+        self.failUnlessIs(None, result[path])
+        self.failUnlessEqual(self.test_pids[u"eggs.pid"], result[other_path])
+        self.failUnlessEqual([path], errors.keys())
+        self.failUnlessIsInstance(errors[path], EnvironmentError)
+
+    def test_reads_through_specified_cache(self):
+        """ Should read each file through the specified cache. """
+        test_cache = pidlockfile.PIDFileCache()
+        pidlockfile.read_pids(self.test_paths, cache=test_cache)
+        expect_paths = set(
+            path for path in self.test_paths
+            if os.path.exists(path))
+        self.failUnlessEqual(expect_paths, set(test_cache.entries))
+
 
 class remove_existing_pidfile_TestCase(scaffold.TestCase):
     """ Test cases for remove_existing_pidfile function. """
@@ -655,56 +1220,225 @@ class write_pid_to_pidfile_TestCase(scaffold.TestCase):
 
     def setUp(self):
         """ Set up test fixtures. """
-        setup_pidfile_fixtures(self)
-        set_pidlockfile_scenario(self, 'not-exist')
+        self.mock_tracker = scaffold.MockTracker()
+        self.test_dir = tempfile.mkdtemp()
+        self.test_path = os.path.join(self.test_dir, u"spam.pid")
+        self.test_start_time = None
+        scaffold.mock(
+            u"pidlockfile.get_process_start_time",
+            returns_func=lambda pid: self.test_start_time,
+            tracker=self.mock_tracker)
 
     def tearDown(self):
         """ Tear down test fixtures. """
         scaffold.mock_restore()
+        shutil.rmtree(self.test_dir)
 
-    def test_opens_specified_filename(self):
-        """ Should attempt to open specified PID file filename. """
-        pidfile_path = self.scenario['path']
-        expect_flags = (os.O_CREAT | os.O_EXCL | os.O_WRONLY)
-        expect_mode = 0644
-        expect_mock_output = u"""\
-            Called os.open(%(pidfile_path)r, %(expect_flags)r, %(expect_mode)r)
-            ...
-            """ % vars()
-        pidlockfile.write_pid_to_pidfile(pidfile_path)
-        scaffold.mock_restore()
-        self.failUnlessMockCheckerMatch(expect_mock_output)
+    def read_pidfile(self):
+        """ Get the content of the test PID file. """
+        pidfile = open(self.test_path)
+        try:
+            result = pidfile.read()
+        finally:
+            pidfile.close()
+        return result
 
     def test_writes_pid_to_file(self):
         """ Should write the current PID to the specified file. """
-        pidfile_path = self.scenario['path']
-        self.scenario['pidfile'].close = scaffold.Mock(
-            u"PIDLockFile.close",
-            tracker=self.mock_tracker)
-        expect_line = u"%(pid)d\n" % self.scenario
-        pidlockfile.write_pid_to_pidfile(pidfile_path)
-        scaffold.mock_restore()
-        self.failUnlessEqual(expect_line, self.scenario['pidfile'].getvalue())
+        expect_text = u"%d\n" % os.getpid()
+        pidlockfile.write_pid_to_pidfile(self.test_path)
+        self.failUnlessEqual(expect_text, self.read_pidfile())
+
+    def test_writes_start_time_to_file(self):
+        """ Should write the start time of the current process. """
+        self.test_start_time = 4567
+        expect_text = u"%d\nstart_time=4567\n" % os.getpid()
+        pidlockfile.write_pid_to_pidfile(self.test_path)
+        self.failUnlessEqual(expect_text, self.read_pidfile())
+
+    def test_creates_file_writable_only_by_owner(self):
+        """ Should create the file writable only by its owner. """
+        pidlockfile.write_pid_to_pidfile(self.test_path)
+        mode = os.stat(self.test_path).st_mode & 0777
+        self.failUnlessEqual(0644, mode)
+
+    def test_leaves_no_other_files(self):
+        """ Should leave no file but the PID file in the directory. """
+        pidlockfile.write_pid_to_pidfile(self.test_path)
+        self.failUnlessEqual([u"spam.pid"], os.listdir(self.test_dir))
+
+    def test_raises_error_if_file_exists(self):
+        """ Should raise OSError, leaving an existing file unchanged. """
+        open(self.test_path, 'w').write("spam")
+        try:
+            pidlockfile.write_pid_to_pidfile(self.test_path)
+        except OSError, exc:
+            self.failUnlessEqual(errno.EEXIST, exc.errno)
+        else:
+            self.fail(u"OSError not raised")
+        self.failUnlessEqual("spam", self.read_pidfile())
+        self.failUnlessEqual([u"spam.pid"], os.listdir(self.test_dir))
+
+    def test_does_not_sync_by_default(self):
+        """ Should not write the file to disk by default. """
+        scaffold.mock(u"os.fdatasync", tracker=self.mock_tracker)
+        scaffold.mock(u"os.fsync", tracker=self.mock_tracker)
+        pidlockfile.write_pid_to_pidfile(self.test_path)
+        expect_mock_output = u"""\
+            Called pidlockfile.get_process_start_time(...)
+            """
+        self.failUnlessMockCheckerMatch(expect_mock_output)
 
-    def test_closes_file_after_write(self):
-        """ Should close the specified file after writing. """
-        pidfile_path = self.scenario['path']
-        self.scenario['pidfile'].write = scaffold.Mock(
-            u"PIDLockFile.write",
-            tracker=self.mock_tracker)
-        self.scenario['pidfile'].close = scaffold.Mock(
-            u"PIDLockFile.close",
-            tracker=self.mock_tracker)
+    def test_syncs_file_data_if_durability_fdatasync(self):
+        """ Should write the file data to disk for 'fdatasync'. """
+        scaffold.mock(u"os.fdatasync", tracker=self.mock_tracker)
+        scaffold.mock(u"os.fsync", tracker=self.mock_tracker)
+        pidlockfile.write_pid_to_pidfile(self.test_path, u'fdatasync')
         expect_mock_output = u"""\
-            ...
-            Called PIDLockFile.write(...)
-            Called PIDLockFile.close()
-            """ % vars()
-        pidlockfile.write_pid_to_pidfile(pidfile_path)
-        scaffold.mock_restore()
+            Called pidlockfile.get_process_start_time(...)
+            Called os.fdatasync(...)
+            """
         self.failUnlessMockCheckerMatch(expect_mock_output)
 
-
+    def test_syncs_directory_if_durability_fsync(self):
+        """ Should write the file data, then the directory, for 'fsync'. """
+        scaffold.mock(u"os.fdatasync", tracker=self.mock_tracker)
+        scaffold.mock(u"os.fsync", tracker=self.mock_tracker)
+        pidlockfile.write_pid_to_pidfile(self.test_path, u'fsync')
+        expect_mock_output = u"""\
+            Called pidlockfile.get_process_start_time(...)
+            Called os.fdatasync(...)
+            Called os.fsync(...)
+            """
+        self.failUnlessMockCheckerMatch(expect_mock_output)
+
+    def test_error_when_durability_unknown(self):
+        """ Should raise ValueError when the durability is unknown. """
+        self.failUnlessRaises(
+            ValueError,
+            pidlockfile.write_pid_to_pidfile, self.test_path, u'spam')
+        self.failUnlessEqual([], os.listdir(self.test_dir))
+
+    def test_writes_fields_after_pid(self):
+        """ Should write the extra fields after the PID, in order. """
+        self.test_start_time = 4567
+        test_fields = {
+            u'state': u'ready',
+            u'listen_addresses': [u"127.0.0.1:8080", u"/run/spam.sock"],
+            u'generation': 3,
+            u'control_socket': u"/run/spam.ctl",
+            }
+        expect_text = u"""\
+%d
+start_time=4567
+generation=3
+state=ready
+control_socket=/run/spam.ctl
+listen_address=127.0.0.1:8080
+listen_address=/run/spam.sock
+""" % os.getpid()
+        pidlockfile.write_pid_to_pidfile(
+            self.test_path, fields=test_fields)
+        self.failUnlessEqual(expect_text, self.read_pidfile())
+        self.failUnlessEqual(
+            os.getpid(), pidlockfile.read_pid_from_pidfile(self.test_path))
+
+    def test_error_when_field_invalid(self):
+        """ Should raise ValueError, writing no file, for invalid fields. """
+        for test_fields in [
+                {u'spam': u"eggs"},
+                {u'generation': u"3"},
+                {u'state': u"ready\nstart_time=0"},
+                {u'listen_addresses': u"127.0.0.1:8080"},
+                ]:
+            self.failUnlessRaises(
+                ValueError,
+                pidlockfile.write_pid_to_pidfile, self.test_path,
+                fields=test_fields)
+        self.failUnlessEqual([], os.listdir(self.test_dir))
+
+    def test_reader_never_sees_partial_content(self):
+        """ Should never show a concurrent reader partial content. """
+        writer_pid = os.fork()
+        if writer_pid == 0:
+            try:
+                for count in range(200):
+                    pidlockfile.write_pid_to_pidfile(self.test_path)
+                    pidlockfile.replace_pid_in_pidfile(self.test_path)
+                    time.sleep(0.001)
+                    pidlockfile.remove_existing_pidfile(self.test_path)
+            finally:
+                os._exit(0)
+        pids_read = set()
+        while not os.waitpid(writer_pid, os.WNOHANG)[0]:
+            pid = pidlockfile.read_pid_from_pidfile(self.test_path)
+            pids_read.add(pid)
+        pids_read.discard(None)
+        self.failUnlessEqual(set([writer_pid]), pids_read)
+        self.failUnlessEqual([], os.listdir(self.test_dir))
+
+
+class get_process_start_time_TestCase(scaffold.TestCase):
+    """ Test cases for get_process_start_time function. """
+
+    def test_returns_start_time_of_current_process(self):
+        """ Should return the same start time for the current process. """
+        pid = os.getpid()
+        start_time = pidlockfile.get_process_start_time(pid)
+        if os.path.isdir(u"/proc/self"):
+            self.failUnlessIsInstance(start_time, (int, long))
+            self.failUnlessEqual(
+                start_time, pidlockfile.get_process_start_time(pid))
+
+    def test_returns_none_if_process_not_exist(self):
+        """ Should return None if there is no such process. """
+        pid = os.fork()
+        if pid == 0:
+            os._exit(0)
+        os.waitpid(pid, 0)
+        start_time = pidlockfile.get_process_start_time(pid)
+        self.failUnlessIs(None, start_time)
+
+
+class replace_pid_in_pidfile_TestCase(scaffold.TestCase):
+    """ Test cases for replace_pid_in_pidfile function. """
+
+    def setUp(self):
+        """ Set up test fixtures. """
+        self.mock_tracker = scaffold.MockTracker()
+
+        self.test_dir = tempfile.mkdtemp()
+        self.test_path = os.path.join(self.test_dir, u"spam.pid")
+        open(self.test_path, 'w').write("12345\n")
+
+    def tearDown(self):
+        """ Tear down test fixtures. """
+        shutil.rmtree(self.test_dir)
+
+    def test_replaces_pidfile(self):
+        """ Should replace the PID file with one for the current PID. """
+        old_stat = os.stat(self.test_path)
+        pidlockfile.replace_pid_in_pidfile(self.test_path)
+        self.failUnlessEqual(
+            os.getpid(), pidlockfile.read_pid_from_pidfile(self.test_path))
+        self.failIfEqual(old_stat.st_ino, os.stat(self.test_path).st_ino)
+        self.failUnlessEqual([u"spam.pid"], os.listdir(self.test_dir))
+
+    def test_leaves_pidfile_if_write_fails(self):
+        """ Should leave the PID file unchanged if writing fails. """
+        scaffold.mock(
+            u"pidlockfile.write_pid_to_pidfile_descriptor",
+            raises=OSError(errno.ENOSPC, u"No space left on device"),
+            tracker=self.mock_tracker)
+        self.failUnlessRaises(
+            OSError,
+            pidlockfile.replace_pid_in_pidfile, self.test_path)
+        scaffold.mock_restore()
+        self.failUnlessEqual(
+            12345, pidlockfile.read_pid_from_pidfile(self.test_path))
+        self.failUnlessEqual([u"spam.pid"], os.listdir(self.test_dir))
+
+
 class TimeoutPIDLockFile_TestCase(scaffold.TestCase):
     """ Test cases for ‘TimeoutPIDLockFile’ class. """
 
@@ -789,3 +1523,551 @@ class TimeoutPIDLockFile_TestCase(scaffold.TestCase):
             """ % vars()
         instance.acquire()
         self.failUnlessMockCheckerMatch(expect_mock_output)
+
+
+class WatchedLinkFileLock_TestCase(scaffold.TestCase):
+    """ Test cases for ‘WatchedLinkFileLock’ class. """
+
+    def setUp(self):
+        """ Set up test fixtures. """
+        self.mock_tracker = scaffold.MockTracker()
+        self.test_dir = tempfile.mkdtemp()
+        self.test_path = os.path.join(self.test_dir, u"spam.pid")
+        self.test_instance = pidlockfile.WatchedLinkFileLock(
+            self.test_path)
+
+    def tearDown(self):
+        """ Tear down test fixtures. """
+        scaffold.mock_restore()
+        self.test_instance._close_removal_watch()
+        shutil.rmtree(self.test_dir)
+
+    def fork_holder(self, hold_time):
+        """ Fork a process that holds the lock for `hold_time` seconds.
+            :Return: The PID of the process, once it holds the lock.
+            """
+        (read_fd, write_fd) = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            try:
+                holder = pidlockfile.WatchedLinkFileLock(self.test_path)
+                holder.acquire()
+                os.write(write_fd, "L")
+                time.sleep(hold_time)
+                holder.release()
+            finally:
+                os._exit(0)
+        os.read(read_fd, 1)
+        os.close(read_fd)
+        os.close(write_fd)
+        return pid
+
+    def test_acquire_locks(self):
+        """ Should lock, by linking the lock file. """
+        instance = self.test_instance
+        instance.acquire()
+        self.failUnless(instance.i_am_locking())
+        instance.release()
+        self.failIf(instance.is_locked())
+
+    def test_acquire_raises_already_locked_without_timeout(self):
+        """ Should raise AlreadyLocked if locked and timeout is zero. """
+        pid = self.fork_holder(0.2)
+        instance = self.test_instance
+        self.failUnlessRaises(
+            pidlockfile.AlreadyLocked,
+            instance.acquire, 0)
+        self.failIf(os.path.exists(instance.unique_name))
+        os.waitpid(pid, 0)
+
+    def test_acquire_raises_lock_timeout_after_timeout(self):
+        """ Should raise LockTimeout if still locked after timeout. """
+        pid = self.fork_holder(0.5)
+        instance = self.test_instance
+        start_time = time.time()
+        self.failUnlessRaises(
+            pidlockfile.LockTimeout,
+            instance.acquire, 0.05)
+        self.failUnless(time.time() - start_time >= 0.05)
+        self.failIf(os.path.exists(instance.unique_name))
+        os.waitpid(pid, 0)
+
+    def test_acquire_wakes_when_released(self):
+        """ Should acquire the lock as soon as it is released. """
+        pid = self.fork_holder(0.1)
+        instance = self.test_instance
+        start_time = time.time()
+        instance.acquire(10)
+        os.waitpid(pid, 0)
+        self.failUnless(time.time() - start_time < 0.5)
+        self.failUnless(instance.i_am_locking())
+
+    def test_acquire_polls_without_directory_watch(self):
+        """ Should poll for the lock if directories cannot be watched. """
+        scaffold.mock(
+            u"pidlockfile.open_directory_watch",
+            returns=(None, None),
+            tracker=self.mock_tracker)
+        pid = self.fork_holder(0.1)
+        instance = self.test_instance
+        start_time = time.time()
+        instance.acquire(10)
+        os.waitpid(pid, 0)
+        self.failUnless(time.time() - start_time < 0.5)
+        self.failUnless(instance.i_am_locking())
+
+    def test_read_removed_names_gets_removed_entries(self):
+        """ Should get the names of entries removed from a directory. """
+        (fd, watch) = pidlockfile.open_directory_watch(self.test_dir)
+        if fd is None:
+            return
+        open(self.test_path, 'w').close()
+        os.rename(self.test_path, u"%(test_path)s.new" % vars(self))
+        os.remove(u"%(test_path)s.new" % vars(self))
+        names = pidlockfile.read_removed_names(fd)
+        os.close(fd)
+        self.failUnlessEqual(set(["spam.pid", "spam.pid.new"]), names)
+
+
+class read_flocked_file_ids_TestCase(scaffold.TestCase):
+    """ Test cases for read_flocked_file_ids function. """
+
+    def setUp(self):
+        """ Set up test fixtures. """
+        self.test_dir = tempfile.mkdtemp()
+        self.test_locks_path = os.path.join(self.test_dir, u"locks")
+        open(self.test_locks_path, 'w').write(
+            u"1: FLOCK  ADVISORY  WRITE 3512 fe:00:13533307 0 EOF\n"
+            u"1: -> FLOCK  ADVISORY  WRITE 3513 fe:00:13533307 0 EOF\n"
+            u"2: POSIX  ADVISORY  WRITE 3514 fe:00:23456 0 EOF\n"
+            u"3: FLOCK  ADVISORY  READ 3515 08:1f:34567 0 EOF\n")
+        self.proc_locks_path_prev = pidlockfile.proc_locks_path
+        pidlockfile.proc_locks_path = self.test_locks_path
+
+    def tearDown(self):
+        """ Tear down test fixtures. """
+        pidlockfile.proc_locks_path = self.proc_locks_path_prev
+        shutil.rmtree(self.test_dir)
+
+    def test_returns_id_of_each_flocked_file(self):
+        """ Should return the id of each file with a flock lock held. """
+        expect_result = set([(0xfe, 0, 13533307), (0x08, 0x1f, 34567)])
+        result = pidlockfile.read_flocked_file_ids()
+        self.failUnlessEqual(expect_result, result)
+
+    def test_returns_none_if_locks_not_listed(self):
+        """ Should return None if the kernel does not list its locks. """
+        os.remove(self.test_locks_path)
+        result = pidlockfile.read_flocked_file_ids()
+        self.failUnlessIs(None, result)
+
+
+class FlockPIDLockFile_TestCase(scaffold.TestCase):
+    """ Test cases for ‘FlockPIDLockFile’ class. """
+
+    def setUp(self):
+        """ Set up test fixtures. """
+        self.test_dir = tempfile.mkdtemp()
+        self.test_path = os.path.join(self.test_dir, u"spam.pid")
+        self.test_instance = pidlockfile.FlockPIDLockFile(self.test_path)
+        self.test_other_instance = pidlockfile.FlockPIDLockFile(
+            self.test_path)
+        self.proc_locks_path_prev = pidlockfile.proc_locks_path
+
+    def tearDown(self):
+        """ Tear down test fixtures. """
+        scaffold.mock_restore()
+        pidlockfile.proc_locks_path = self.proc_locks_path_prev
+        for instance in [self.test_instance, self.test_other_instance]:
+            if instance.fd is not None:
+                os.close(instance.fd)
+        shutil.rmtree(self.test_dir)
+
+    def fork_process(self, func):
+        """ Fork a process that calls `func`, then exits. """
+        pid = os.fork()
+        if pid == 0:
+            try:
+                func()
+            finally:
+                os._exit(0)
+        os.waitpid(pid, 0)
+
+    def test_acquire_writes_pid_and_locks(self):
+        """ Should lock the PID file and write the current PID to it. """
+        instance = self.test_instance
+        instance.acquire()
+        self.failUnlessEqual(os.getpid(), instance.read_pid())
+        self.failUnless(instance.is_locked())
+        self.failUnless(instance.i_am_locking())
+        self.failUnless(instance.fileno() is not None)
+
+    def test_update_fields_sets_fields_until_acquired(self):
+        """ Should set the fields, and write them once acquired. """
+        instance = self.test_instance
+        instance.update_fields({u'generation': 1, u'state': u"starting"})
+        self.failIf(os.path.exists(self.test_path))
+        instance.acquire()
+        record = instance.read_record()
+        self.failUnlessEqual(1, record[u'generation'])
+        self.failUnlessEqual(u"starting", record[u'state'])
+
+    def test_update_fields_replaces_locked_pidfile(self):
+        """ Should replace the PID file, keeping it locked. """
+        instance = self.test_instance
+        instance.update_fields({u'state': u"starting"})
+        instance.acquire()
+        old_stat = os.stat(self.test_path)
+        instance.update_fields({
+            u'state': u"ready", u'listen_addresses': [u"@spam"]})
+        record = instance.read_record()
+        self.failUnlessEqual(u"ready", record[u'state'])
+        self.failUnlessEqual([u"@spam"], record[u'listen_addresses'])
+        self.failIfEqual(old_stat.st_ino, os.stat(self.test_path).st_ino)
+        self.failUnless(
+            pidlockfile.is_file_at_path(instance.fileno(), self.test_path))
+        self.failUnlessRaises(
+            pidlockfile.AlreadyLocked,
+            self.test_other_instance.acquire, 0)
+        self.failUnlessEqual([u"spam.pid"], os.listdir(self.test_dir))
+
+    def test_update_fields_removes_fields_set_to_none(self):
+        """ Should remove each field given as None. """
+        instance = self.test_instance
+        instance.update_fields({u'generation': 2, u'state': u"starting"})
+        instance.update_fields({u'state': None})
+        self.failUnlessEqual({u'generation': 2}, instance.fields)
+
+    def test_update_fields_rejects_invalid_fields(self):
+        """ Should raise ValueError, keeping the fields, if invalid. """
+        instance = self.test_instance
+        instance.update_fields({u'state': u"ready"})
+        self.failUnlessRaises(
+            ValueError,
+            instance.update_fields, {u'spam': u"eggs"})
+        self.failUnlessEqual({u'state': u"ready"}, instance.fields)
+
+    def test_acquire_replaces_unlocked_pidfile(self):
+        """ Should replace a PID file left by a process that exited. """
+        self.fork_process(self.test_other_instance.acquire)
+        old_stat = os.stat(self.test_path)
+        instance = self.test_instance
+        instance.acquire(0)
+        self.failIfEqual(old_stat.st_ino, os.stat(self.test_path).st_ino)
+        self.failUnless(
+            pidlockfile.is_file_at_path(instance.fileno(), self.test_path))
+        self.failUnlessEqual([u"spam.pid"], os.listdir(self.test_dir))
+
+    def test_reader_never_sees_partial_content(self):
+        """ Should never show a concurrent reader partial content. """
+        pid = os.fork()
+        if pid == 0:
+            try:
+                for count in range(200):
+                    self.test_other_instance.acquire()
+                    time.sleep(0.001)
+                    self.test_other_instance.release()
+            finally:
+                os._exit(0)
+        pids_read = set()
+        while not os.waitpid(pid, os.WNOHANG)[0]:
+            pids_read.add(self.test_instance.read_pid())
+        pids_read.discard(None)
+        self.failUnlessEqual(set([pid]), pids_read)
+
+    def test_other_instance_sees_lock(self):
+        """ Should be locked, but not by another instance. """
+        self.test_instance.acquire()
+        instance = self.test_other_instance
+        self.failUnless(instance.is_locked())
+        self.failIf(instance.i_am_locking())
+        self.failUnlessIs(None, instance.fileno())
+
+    def test_acquire_raises_already_locked_without_timeout(self):
+        """ Should raise AlreadyLocked if locked and timeout is zero. """
+        self.test_instance.acquire()
+        instance = self.test_other_instance
+        self.failUnlessRaises(
+            pidlockfile.AlreadyLocked,
+            instance.acquire, 0)
+
+    def test_acquire_raises_lock_timeout_after_timeout(self):
+        """ Should raise LockTimeout if still locked after timeout. """
+        self.test_instance.acquire()
+        instance = self.test_other_instance
+        previous_handler = signal.getsignal(signal.SIGALRM)
+        start_time = time.time()
+        self.failUnlessRaises(
+            pidlockfile.LockTimeout,
+            instance.acquire, 0.05)
+        self.failUnless(time.time() - start_time >= 0.05)
+        self.failUnlessIs(
+            previous_handler, signal.getsignal(signal.SIGALRM))
+        self.failUnlessEqual(
+            (0.0, 0.0), signal.getitimer(signal.ITIMER_REAL))
+
+    def test_acquire_raises_lock_timeout_in_thread(self):
+        """ Should raise LockTimeout after timeout in another thread. """
+        self.test_instance.acquire()
+        instance = self.test_other_instance
+        errors = []
+        def acquire():
+            try:
+                instance.acquire(0.05)
+            except pidlockfile.LockTimeout, exc:
+                errors.append(exc)
+        thread = threading.Thread(target=acquire)
+        thread.start()
+        thread.join()
+        self.failUnlessEqual(1, len(errors))
+
+    def test_acquire_waits_until_released(self):
+        """ Should acquire the lock as soon as it is released. """
+        holder = self.test_instance
+        holder.acquire()
+        timer = threading.Timer(0.1, holder.release)
+        timer.start()
+        instance = self.test_other_instance
+        start_time = time.time()
+        instance.acquire(10)
+        timer.join()
+        self.failUnless(time.time() - start_time < 5)
+        self.failUnless(instance.i_am_locking())
+        self.failUnless(os.path.exists(self.test_path))
+
+    def test_timeout_instance_uses_acquire_timeout(self):
+        """ Should use the acquire timeout by default. """
+        self.test_instance.acquire()
+        instance = pidlockfile.TimeoutFlockPIDLockFile(self.test_path, 0)
+        self.failUnlessRaises(
+            pidlockfile.AlreadyLocked,
+            instance.acquire)
+
+    def test_release_removes_pidfile_and_unlocks(self):
+        """ Should remove the PID file and release the lock. """
+        instance = self.test_instance
+        instance.acquire()
+        instance.release()
+        self.failIf(os.path.exists(self.test_path))
+        self.failIf(instance.is_locked())
+        self.failUnlessIs(None, instance.fileno())
+
+    def test_release_raises_error_if_not_locked(self):
+        """ Should raise NotLocked if not locked. """
+        instance = self.test_instance
+        self.failUnlessRaises(
+            pidlockfile.NotLocked,
+            instance.release)
+
+    def test_release_raises_error_if_locked_elsewhere(self):
+        """ Should raise NotMyLock if locked by another instance. """
+        self.test_instance.acquire()
+        instance = self.test_other_instance
+        self.failUnlessRaises(
+            pidlockfile.NotMyLock,
+            instance.release)
+
+    def test_lock_released_when_process_exits(self):
+        """ Should be unlocked once the process holding it exits. """
+        self.fork_process(self.test_other_instance.acquire)
+        instance = self.test_instance
+        self.failUnless(os.path.exists(self.test_path))
+        self.failIf(instance.is_locked())
+        instance.acquire(0)
+        self.failUnlessEqual(os.getpid(), instance.read_pid())
+
+    def test_is_locked_takes_no_lock(self):
+        """ Should find the lock held without taking a lock itself. """
+        if pidlockfile.read_flocked_file_ids() is None:
+            return
+        self.test_other_instance.acquire()
+        self.mock_tracker = scaffold.MockTracker()
+        scaffold.mock(u"fcntl.flock", tracker=self.mock_tracker)
+        unwanted_output = u"""\
+            ...Called fcntl.flock(...)..."""
+        self.failUnless(self.test_instance.is_locked())
+        self.failIfMockCheckerMatch(unwanted_output)
+
+    def test_is_locked_tests_lock_if_locks_not_listed(self):
+        """ Should test the lock if the kernel does not list locks. """
+        pidlockfile.proc_locks_path = os.path.join(
+            self.test_dir, u"locks")
+        instance = self.test_instance
+        self.failIf(instance.is_locked())
+        self.test_other_instance.acquire()
+        self.failUnless(instance.is_locked())
+        self.test_other_instance.release()
+        self.failIf(instance.is_locked())
+
+    def test_break_lock_removes_unlocked_pidfile(self):
+        """ Should remove a PID file that is not locked. """
+        self.fork_process(self.test_other_instance.acquire)
+        self.test_instance.break_lock()
+        self.failIf(os.path.exists(self.test_path))
+
+    def test_break_lock_keeps_locked_pidfile(self):
+        """ Should not remove a PID file that is locked. """
+        self.test_other_instance.acquire()
+        self.test_instance.break_lock()
+        self.failUnless(os.path.exists(self.test_path))
+        self.failUnless(self.test_instance.is_locked())
+
+    def test_take_over_shares_inherited_lock(self):
+        """ Should take over the lock from the inherited file. """
+        holder = self.test_instance
+        holder.acquire()
+        instance = self.test_other_instance
+        def take_over():
+            instance.take_over(os.dup(holder.fileno()))
+            os.write(write_fd, str(instance.read_pid()))
+        (read_fd, write_fd) = os.pipe()
+        self.fork_process(take_over)
+        child_pid = int(os.read(read_fd, 20))
+        os.close(read_fd)
+        os.close(write_fd)
+        self.failUnlessEqual(child_pid, holder.read_pid())
+        self.failIf(holder.i_am_locking())
+        self.failUnless(holder.is_locked())
+        holder.relinquish()
+        self.failUnlessIs(None, holder.fileno())
+
+    def test_take_over_raises_error_without_inherited_lock(self):
+        """ Should raise LockFailed without an inherited lock. """
+        instance = self.test_instance
+        self.failUnlessRaises(
+            pidlockfile.LockFailed,
+            instance.take_over, None)
+
+    def test_relinquish_raises_error_if_not_taken_over(self):
+        """ Should raise LockFailed if the lock is not taken over. """
+        instance = self.test_instance
+        instance.acquire()
+        self.failUnlessRaises(
+            pidlockfile.LockFailed,
+            instance.relinquish)
+        self.failUnless(instance.i_am_locking())
+
+
+class PIDLockPool_TestCase(scaffold.TestCase):
+    """ Test cases for ‘PIDLockPool’ class. """
+
+    def setUp(self):
+        """ Set up test fixtures. """
+        self.test_dir = tempfile.mkdtemp()
+        self.test_path = os.path.join(self.test_dir, u"spam.pid")
+        self.test_locks = [
+            pidlockfile.FlockPIDLockFile(
+                pidlockfile.get_pidfile_slot_path(self.test_path, slot))
+            for slot in range(3)]
+        self.test_other_locks = [
+            pidlockfile.FlockPIDLockFile(lock.path)
+            for lock in self.test_locks]
+        self.test_instance = pidlockfile.PIDLockPool(
+            self.test_path, self.test_locks)
+
+    def tearDown(self):
+        """ Tear down test fixtures. """
+        for lock in self.test_locks + self.test_other_locks:
+            if lock.fd is not None:
+                os.close(lock.fd)
+        shutil.rmtree(self.test_dir)
+
+    def test_slot_paths_insert_index_before_extension(self):
+        """ Should name each slot PID file by its index. """
+        expect_paths = [
+            os.path.join(self.test_dir, u"spam.%(slot)d.pid" % vars())
+            for slot in range(3)]
+        self.failUnlessEqual(
+            expect_paths, [lock.path for lock in self.test_locks])
+
+    def test_acquire_claims_first_free_slot(self):
+        """ Should claim the first slot whose lock is free. """
+        instance = self.test_instance
+        self.test_other_locks[0].acquire()
+        self.test_other_locks[2].acquire()
+        instance.acquire(0)
+        self.failUnlessEqual(1, instance.slot)
+        self.failUnlessIs(self.test_locks[1], instance.lock)
+        self.failUnless(instance.i_am_locking())
+        self.failUnlessEqual(
+            os.getpid(),
+            pidlockfile.read_pid_from_pidfile(self.test_locks[1].path))
+
+    def test_acquire_raises_already_locked_if_every_slot_held(self):
+        """ Should raise AlreadyLocked at once if every slot is held. """
+        instance = self.test_instance
+        for lock in self.test_other_locks:
+            lock.acquire()
+        self.failUnlessRaises(
+            pidlockfile.AlreadyLocked,
+            instance.acquire, 0)
+        self.failUnless(instance.slot is None)
+        self.failIf(instance.i_am_locking())
+
+    def test_acquire_raises_timeout_if_no_slot_freed(self):
+        """ Should raise LockTimeout if no slot is freed in time. """
+        instance = self.test_instance
+        for lock in self.test_other_locks:
+            lock.acquire()
+        self.failUnlessRaises(
+            pidlockfile.LockTimeout,
+            instance.acquire, 0.05)
+
+    def test_acquire_waits_until_slot_freed(self):
+        """ Should wait until a slot is freed, then claim it. """
+        instance = self.test_instance
+        for lock in self.test_other_locks:
+            lock.acquire()
+        releaser = threading.Timer(0.05, self.test_other_locks[2].release)
+        releaser.start()
+        try:
+            instance.acquire(5)
+        finally:
+            releaser.join()
+        self.failUnlessEqual(2, instance.slot)
+
+    def test_release_frees_slot(self):
+        """ Should release the lock on the slot claimed. """
+        instance = self.test_instance
+        instance.acquire()
+        instance.release()
+        self.failUnless(instance.slot is None)
+        self.failIf(instance.is_locked())
+        self.failUnlessEqual([], os.listdir(self.test_dir))
+
+    def test_release_raises_not_locked_if_no_slot(self):
+        """ Should raise NotLocked if no slot is claimed. """
+        self.failUnlessRaises(
+            pidlockfile.NotLocked,
+            self.test_instance.release)
+
+    def test_context_manager_claims_then_releases_slot(self):
+        """ Should claim a slot on entry, and release it on exit. """
+        instance = self.test_instance
+        self.test_other_locks[0].acquire()
+        result = instance.__enter__()
+        self.failUnlessIs(instance, result)
+        self.failUnlessEqual(1, instance.slot)
+        instance.__exit__(None, None, None)
+        self.failUnless(instance.slot is None)
+        self.failIf(self.test_locks[1].is_locked())
+
+    def test_update_fields_records_fields_in_slot_claimed(self):
+        """ Should update the fields of only the slot claimed. """
+        instance = self.test_instance
+        instance.acquire()
+        instance.update_fields({u'state': u"ready"})
+        self.failUnlessEqual({u'state': u"ready"}, instance.lock.fields)
+        for lock in self.test_locks[1:]:
+            self.failUnlessEqual({}, lock.fields)
+        record = pidlockfile.read_pidfile_record(instance.lock.path)
+        self.failUnlessEqual(u"ready", record[u'state'])
+
+    def test_update_fields_raises_error_if_no_slot_claimed(self):
+        """ Should raise NotLocked if no slot is claimed. """
+        instance = self.test_instance
+        self.failUnlessRaises(
+            pidlockfile.NotLocked,
+            instance.update_fields, {u'state': u"starting"})
+        for lock in self.test_locks:
+            self.failUnlessEqual({}, lock.fields)
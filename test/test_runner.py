@@ -19,6 +19,11 @@ import sys
 import tempfile
 import errno
 import signal
+import fcntl
+import socket
+import time
+import json
+import threading
 
 import scaffold
 from test_pidlockfile import (
@@ -34,6 +39,7 @@ import daemon.daemon
 
 from daemon import pidlockfile
 from daemon import runner
+from daemon.notify import NotifySocketError
 
 
 class Exception_TestCase(scaffold.Exception_TestCase):
@@ -60,6 +66,10 @@ class Exception_TestCase(scaffold.Exception_TestCase):
                 min_args = 1,
                 types = (runner.DaemonRunnerError, RuntimeError),
                 ),
+            runner.DaemonRunnerReloadFailureError: dict(
+                min_args = 1,
+                types = (runner.DaemonRunnerError, RuntimeError),
+                ),
             }
 
 
@@ -152,11 +162,14 @@ def setup_runner_fixtures(testcase):
 
     testcase.TestApp = TestApp
 
+    testcase.mock_daemon_context = scaffold.Mock(
+        u"DaemonContext",
+        tracker=testcase.mock_tracker)
+    testcase.mock_daemon_context.signal_map = {}
+    testcase.mock_daemon_context.notifier = None
     scaffold.mock(
         u"daemon.runner.DaemonContext",
-        returns=scaffold.Mock(
-            u"DaemonContext",
-            tracker=testcase.mock_tracker),
+        returns=testcase.mock_daemon_context,
         tracker=testcase.mock_tracker)
 
     testcase.test_app = testcase.TestApp()
@@ -168,6 +181,8 @@ def setup_runner_fixtures(testcase):
         'start': [testcase.test_program_path, 'start'],
         'stop': [testcase.test_program_path, 'stop'],
         'restart': [testcase.test_program_path, 'restart'],
+        'reload': [testcase.test_program_path, 'reload'],
+        'status': [testcase.test_program_path, 'status'],
         }
 
     def mock_open(filename, mode=None, buffering=None):
@@ -188,6 +203,16 @@ def setup_runner_fixtures(testcase):
         u"os.kill",
         tracker=testcase.mock_tracker)
 
+    # Starting the daemon must not block signals in, nor start a
+    # reload thread from, the test process.
+    scaffold.mock(
+        u"daemon.runner.set_thread_signal_mask",
+        tracker=None)
+    scaffold.mock(
+        u"threading.Thread",
+        returns=scaffold.Mock(u"Thread", tracker=None),
+        tracker=None)
+
     scaffold.mock(
         u"sys.argv",
         mock_obj=testcase.valid_argv_params['start'],
@@ -232,6 +257,13 @@ class DaemonRunner_TestCase(scaffold.TestCase):
         """ Should have specified application object. """
         self.failUnlessIs(self.test_app, self.test_instance.app)
 
+    def test_daemon_context_handles_reload_signal(self):
+        """ DaemonContext component should handle the reload signal. """
+        instance = self.test_instance
+        expect_handler = instance._handle_reload_signal
+        signal_map = instance.daemon_context.signal_map
+        self.failUnlessEqual(expect_handler, signal_map[runner.reload_signal])
+
     def test_sets_pidfile_none_when_pidfile_path_is_none(self):
         """ Should set ‘pidfile’ to ‘None’ when ‘pidfile_path’ is ‘None’. """
         pidfile_path = None
@@ -267,11 +299,46 @@ class DaemonRunner_TestCase(scaffold.TestCase):
             ...
             Called %(lockfile_class_name)s(
                 %(pidfile_path)r,
-                %(pidfile_timeout)r)
+                %(pidfile_timeout)r,
+                durability=u'none')
             """ % vars()
         scaffold.mock_restore()
         self.failUnlessMockCheckerMatch(expect_mock_output)
  
+    def test_creates_flock_lock_if_app_pidfile_lock_is_flock(self):
+        """ Should create a TimeoutFlockPIDLockFile for 'flock'. """
+        self.test_app.pidfile_lock = u'flock'
+        test_lock = object()
+        scaffold.mock(
+            u"pidlockfile.TimeoutFlockPIDLockFile",
+            returns=test_lock,
+            tracker=self.mock_tracker)
+        instance = runner.DaemonRunner(self.test_app)
+        self.failUnlessIs(test_lock, instance.pidfile)
+
+    def test_creates_lock_with_app_pidfile_durability(self):
+        """ Should create the lock with the app's PID file durability. """
+        self.test_app.pidfile_durability = u'fsync'
+        lockfile_class_name = self.lockfile_class_name
+        expect_mock_output = u"""\
+            ...
+            Called %(lockfile_class_name)s(
+                ...,
+                durability=u'fsync')
+            """ % vars()
+        self.mock_tracker.clear()
+        instance = runner.DaemonRunner(self.test_app)
+        scaffold.mock_restore()
+        self.failUnlessMockCheckerMatch(expect_mock_output)
+
+    def test_error_when_pidfile_lock_unknown(self):
+        """ Should raise ValueError when the PID file lock is unknown. """
+        self.test_app.pidfile_lock = u'spam'
+        expect_error = ValueError
+        self.failUnlessRaises(
+            expect_error,
+            runner.DaemonRunner, self.test_app)
+
     def test_has_created_pidfile(self):
         """ Should have new PID lock file as `pidfile` attribute. """
         expect_pidfile = self.mock_runner_lock
@@ -286,52 +353,190 @@ class DaemonRunner_TestCase(scaffold.TestCase):
         self.failUnlessIs(
             expect_pidfile, daemon_context.pidfile)
 
+    def test_does_not_open_stream_files(self):
+        """ Should not open the stream files of the app. """
+        self.failIfIn(self.mock_tracker.dump(), u"Called builtins.open")
+
+    def test_daemon_context_has_app_preload(self):
+        """ DaemonContext component should have app's preload callable. """
+        self.test_app.preload = object()
+        expect_preload = self.test_app.preload
+        instance = runner.DaemonRunner(self.test_app)
+        self.failUnlessIs(expect_preload, instance.daemon_context.preload)
+
+    def test_daemon_context_has_no_preload_if_app_has_none(self):
+        """ DaemonContext component should have no preload by default. """
+        expect_preload = None
+        daemon_context = self.test_instance.daemon_context
+        self.failUnlessIs(expect_preload, daemon_context.preload)
+
+    def test_daemon_context_has_app_resource_limits(self):
+        """ DaemonContext component should have app's resource limits. """
+        self.test_app.resource_limits = {u'NOFILE': u'hard'}
+        expect_limits = self.test_app.resource_limits
+        instance = runner.DaemonRunner(self.test_app)
+        self.failUnlessEqual(
+            expect_limits, instance.daemon_context.resource_limits)
+
+    def test_daemon_context_has_no_resource_limits_if_app_has_none(self):
+        """ DaemonContext component should have no resource limits. """
+        expect_limits = None
+        daemon_context = self.test_instance.daemon_context
+        self.failUnlessIs(expect_limits, daemon_context.resource_limits)
+
+    def test_daemon_context_has_app_ready_timeout(self):
+        """ DaemonContext component should have app's ready timeout. """
+        self.test_app.ready_timeout = 5
+        instance = runner.DaemonRunner(self.test_app)
+        self.failUnlessEqual(5, instance.daemon_context.ready_timeout)
+
+    def test_daemon_context_has_default_ready_timeout(self):
+        """ DaemonContext component should have runner's ready timeout. """
+        expect_timeout = runner.DaemonRunner.ready_timeout
+        daemon_context = self.test_instance.daemon_context
+        self.failUnlessEqual(expect_timeout, daemon_context.ready_timeout)
+
+    def test_has_app_stop_options(self):
+        """ Should have the app's stop timeout and kill options. """
+        self.test_app.stop_timeout = 3
+        self.test_app.stop_kill = True
+        instance = runner.DaemonRunner(self.test_app)
+        self.failUnlessEqual(3, instance.stop_timeout)
+        self.failUnlessIs(True, instance.stop_kill)
+
+    def test_has_default_stop_options(self):
+        """ Should have the runner's stop timeout and kill options. """
+        instance = self.test_instance
+        self.failUnlessEqual(
+            runner.DaemonRunner.stop_timeout, instance.stop_timeout)
+        self.failUnlessIs(False, instance.stop_kill)
+
+    def test_has_no_worker_pool_if_app_has_no_workers(self):
+        """ Should have no worker pool if app has no `workers`. """
+        expect_worker_pool = None
+        instance = self.test_instance
+        self.failUnlessIs(expect_worker_pool, instance.worker_pool)
+
+    def test_creates_worker_pool_with_app_workers(self):
+        """ Should create a worker pool with the app's `workers`. """
+        self.test_app.workers = 3
+        expect_workers = self.test_app.workers
+        instance = runner.DaemonRunner(self.test_app)
+        self.failUnlessIsInstance(
+            instance.worker_pool, runner.WorkerPool)
+        self.failUnlessEqual(expect_workers, instance.worker_pool.workers)
+
+    def test_worker_pool_runs_runner_worker(self):
+        """ Worker pool should have the runner's worker as target. """
+        self.test_app.workers = 3
+        instance = runner.DaemonRunner(self.test_app)
+        expect_target = instance._run_worker
+        self.failUnlessEqual(expect_target, instance.worker_pool.target)
+
+    def test_worker_pool_reports_ready_once_started(self):
+        """ Worker pool should report ready once its workers start. """
+        self.test_app.workers = 3
+        instance = runner.DaemonRunner(self.test_app)
+        expect_action = instance.report_ready
+        self.failUnlessEqual(
+            expect_action, instance.worker_pool.start_action)
+
+    def test_daemon_context_has_app_listen_addresses(self):
+        """ DaemonContext component should have app's listen addresses. """
+        self.test_app.listen_addresses = [(u"", 8080)]
+        expect_addresses = self.test_app.listen_addresses
+        instance = runner.DaemonRunner(self.test_app)
+        self.failUnlessEqual(
+            expect_addresses, instance.daemon_context.listen_addresses)
+
+    def test_error_when_listen_strategy_unknown(self):
+        """ Should raise ValueError when listen strategy is unknown. """
+        self.test_app.listen_strategy = u"bogus"
+        expect_error = ValueError
+        self.failUnlessRaises(
+            expect_error,
+            runner.DaemonRunner, self.test_app)
+
+    def test_daemon_context_has_socket_copy_per_worker_for_reuseport(self):
+        """ Should request a socket copy per worker for 'reuseport'. """
+        self.test_app.workers = 3
+        self.test_app.listen_strategy = u'reuseport'
+        expect_copies = self.test_app.workers
+        instance = runner.DaemonRunner(self.test_app)
+        self.failUnlessEqual(
+            expect_copies, instance.daemon_context.reuse_port_copies)
+
+
+class DaemonRunner_open_streams_TestCase(scaffold.TestCase):
+    """ Test cases for DaemonRunner.open_streams method. """
+
+    def setUp(self):
+        """ Set up test fixtures. """
+        setup_runner_fixtures(self)
+        set_runner_scenario(self, 'simple')
+
+    def tearDown(self):
+        """ Tear down test fixtures. """
+        scaffold.mock_restore()
+
     def test_daemon_context_has_specified_stdin_stream(self):
         """ DaemonContext component should have specified stdin file. """
-        test_app = self.test_app
         expect_file = self.stream_files_by_name['stdin']
-        daemon_context = self.test_instance.daemon_context
+        instance = self.test_instance
+        instance.open_streams()
+        daemon_context = instance.daemon_context
         self.failUnlessEqual(expect_file, daemon_context.stdin)
 
     def test_daemon_context_has_stdin_in_read_mode(self):
         """ DaemonContext component should open stdin file for read. """
         expect_mode = 'r'
-        daemon_context = self.test_instance.daemon_context
+        instance = self.test_instance
+        instance.open_streams()
+        daemon_context = instance.daemon_context
         self.failUnlessIn(daemon_context.stdin.mode, expect_mode)
 
     def test_daemon_context_has_specified_stdout_stream(self):
         """ DaemonContext component should have specified stdout file. """
-        test_app = self.test_app
         expect_file = self.stream_files_by_name['stdout']
-        daemon_context = self.test_instance.daemon_context
+        instance = self.test_instance
+        instance.open_streams()
+        daemon_context = instance.daemon_context
         self.failUnlessEqual(expect_file, daemon_context.stdout)
 
     def test_daemon_context_has_stdout_in_append_mode(self):
         """ DaemonContext component should open stdout file for append. """
-        expect_mode = 'w+'
-        daemon_context = self.test_instance.daemon_context
+        expect_mode = 'a+'
+        instance = self.test_instance
+        instance.open_streams()
+        daemon_context = instance.daemon_context
         self.failUnlessIn(daemon_context.stdout.mode, expect_mode)
 
     def test_daemon_context_has_specified_stderr_stream(self):
         """ DaemonContext component should have specified stderr file. """
-        test_app = self.test_app
         expect_file = self.stream_files_by_name['stderr']
-        daemon_context = self.test_instance.daemon_context
+        instance = self.test_instance
+        instance.open_streams()
+        daemon_context = instance.daemon_context
         self.failUnlessEqual(expect_file, daemon_context.stderr)
 
     def test_daemon_context_has_stderr_in_append_mode(self):
         """ DaemonContext component should open stderr file for append. """
-        expect_mode = 'w+'
-        daemon_context = self.test_instance.daemon_context
+        expect_mode = 'a+'
+        instance = self.test_instance
+        instance.open_streams()
+        daemon_context = instance.daemon_context
         self.failUnlessIn(daemon_context.stderr.mode, expect_mode)
 
     def test_daemon_context_has_stderr_with_no_buffering(self):
         """ DaemonContext component should open stderr file unbuffered. """
         expect_buffering = 0
-        daemon_context = self.test_instance.daemon_context
+        instance = self.test_instance
+        instance.open_streams()
+        daemon_context = instance.daemon_context
         self.failUnlessEqual(
             expect_buffering, daemon_context.stderr.buffering)
 
+
 
 class DaemonRunner_usage_exit_TestCase(scaffold.TestCase):
     """ Test cases for DaemonRunner.usage_exit method. """
@@ -367,6 +572,45 @@ class DaemonRunner_usage_exit_TestCase(scaffold.TestCase):
         self.failUnlessOutputCheckerMatch(
             expect_stderr_output, self.mock_stderr.getvalue())
 
+    def get_exit_code_for_argv(self, argv):
+        """ Get the exit code of a new runner for the arguments `argv`. """
+        scaffold.mock(
+            u"sys.argv",
+            mock_obj=argv,
+            tracker=self.mock_tracker)
+        result = None
+        try:
+            runner.DaemonRunner(self.test_app)
+        except SystemExit, exc:
+            result = exc.code
+        return result
+
+    def test_new_runner_emits_usage_for_unknown_action(self):
+        """ Should emit usage and exit from a runner for unknown action. """
+        progname = self.test_program_name
+        argv = [self.test_program_path, u'bogus']
+        expect_stderr_output = u"""\
+            usage: %(progname)s ...
+            """ % vars()
+        exit_code = self.get_exit_code_for_argv(argv)
+        self.failUnlessEqual(2, exit_code)
+        self.failUnlessOutputCheckerMatch(
+            expect_stderr_output, self.mock_stderr.getvalue())
+        self.failIfIn(self.mock_stderr.getvalue(), u"[SLOT|all]")
+
+    def test_new_runner_with_slots_emits_usage_for_unknown_action(self):
+        """ Should emit usage with slots from a runner for unknown action. """
+        self.test_app.pidfile_slots = 3
+        progname = self.test_program_name
+        argv = [self.test_program_path, u'bogus']
+        expect_stderr_output = u"""\
+            usage: %(progname)s ... [SLOT|all]
+            """ % vars()
+        exit_code = self.get_exit_code_for_argv(argv)
+        self.failUnlessEqual(2, exit_code)
+        self.failUnlessOutputCheckerMatch(
+            expect_stderr_output, self.mock_stderr.getvalue())
+
 
 class DaemonRunner_parse_args_TestCase(scaffold.TestCase):
     """ Test cases for DaemonRunner.parse_args method. """
@@ -432,6 +676,15 @@ class DaemonRunner_parse_args_TestCase(scaffold.TestCase):
             instance.parse_args(argv)
             self.failUnlessEqual(expect_action, instance.action)
 
+    def test_sets_reload_argv_to_start_program(self):
+        """ Should set the command to start a new daemon on reload. """
+        instance = self.test_instance
+        argv = self.valid_argv_params['reload'] + ['--spam']
+        expect_argv = [
+            sys.executable, self.test_program_path, u'start', '--spam']
+        instance.parse_args(argv)
+        self.failUnlessEqual(expect_argv, instance.reload_argv)
+
 
 class DaemonRunner_do_action_TestCase(scaffold.TestCase):
     """ Test cases for DaemonRunner.do_action method. """
@@ -487,6 +740,62 @@ class DaemonRunner_do_action_start_TestCase(scaffold.TestCase):
                 u"Failed to raise " + expect_error.__name__)
         self.failUnlessIn(unicode(exc.message), expect_message_content)
 
+    def test_reports_failure_if_pidfile_locked(self):
+        """ Should report start-up failure if PID file is locked. """
+        set_pidlockfile_scenario(self, 'exist-other-pid-locked')
+        instance = self.test_instance
+        instance.daemon_context.open.mock_raises = (
+            pidlockfile.AlreadyLocked)
+        pidfile_path = self.scenario['pidfile_path']
+        expect_reason = u"PID file %(pidfile_path)r already locked" % vars()
+        expect_mock_output = u"""\
+            ...
+            Called DaemonContext.report_failed(%(expect_reason)r)
+            """ % vars()
+        self.failUnlessRaises(
+            runner.DaemonRunnerStartFailureError,
+            instance.do_action)
+        self.failUnlessMockCheckerMatch(expect_mock_output)
+
+    def test_reports_exception_name_if_no_reason(self):
+        """ Should report the exception name if it has no message. """
+        instance = self.test_instance
+        instance.daemon_context.open.mock_raises = RuntimeError()
+        expect_mock_output = u"""\
+            ...
+            Called DaemonContext.report_failed(u'RuntimeError')
+            """
+        self.failUnlessRaises(RuntimeError, instance.do_action)
+        self.failUnlessMockCheckerMatch(expect_mock_output)
+
+    def test_reports_ready_before_app_run(self):
+        """ Should report the daemon ready before the app runs. """
+        instance = self.test_instance
+        lockfile_class_name = self.lockfile_class_name
+        expect_mock_output = u"""\
+            ...
+            Called DaemonContext.open()
+            Called %(lockfile_class_name)s.update_fields(...)
+            Called DaemonContext.report_ready()
+            Called TestApp.run()
+            """ % vars()
+        instance.do_action()
+        self.failUnlessMockCheckerMatch(expect_mock_output)
+
+    def test_gives_app_report_ready_if_app_reports_ready(self):
+        """ Should let an app that reports ready do so, as it runs. """
+        instance = self.test_instance
+        self.test_app.reports_ready = True
+        expect_mock_output = u"""\
+            ...
+            Called DaemonContext.open()
+            Called TestApp.run()
+            """
+        instance.do_action()
+        self.failUnlessMockCheckerMatch(expect_mock_output)
+        self.failUnlessEqual(
+            instance.report_ready, self.test_app.report_ready)
+
     def test_breaks_lock_if_no_such_process(self):
         """ Should request breaking lock if PID file process is not running. """
         set_runner_scenario(self, 'pidfile-locked')
@@ -509,6 +818,20 @@ class DaemonRunner_do_action_start_TestCase(scaffold.TestCase):
         scaffold.mock_restore()
         self.failUnlessMockCheckerMatch(expect_mock_output)
 
+    def test_opens_streams_before_daemon_context(self):
+        """ Should open the stream files before the daemon context. """
+        instance = self.test_instance
+        stdin_path = self.stream_file_paths['stdin']
+        expect_mock_output = u"""\
+            ...
+            Called builtins.open(%(stdin_path)r, 'r')
+            ...
+            Called DaemonContext.open()
+            ...
+            """ % vars()
+        instance.do_action()
+        self.failUnlessMockCheckerMatch(expect_mock_output)
+
     def test_requests_daemon_context_open(self):
         """ Should request the daemon context to open. """
         instance = self.test_instance
@@ -520,6 +843,43 @@ class DaemonRunner_do_action_start_TestCase(scaffold.TestCase):
         instance.do_action()
         self.failUnlessMockCheckerMatch(expect_mock_output)
 
+    def test_notifies_supervisor_ready(self):
+        """ Should notify the supervisor of the daemon PID and readiness. """
+        instance = self.test_instance
+        instance.daemon_context.notifier = scaffold.Mock(
+            u"Notifier",
+            tracker=self.mock_tracker)
+        current_pid = self.scenario['pid']
+        expect_state = u"MAINPID=%(current_pid)d\nREADY=1" % vars()
+        expect_mock_output = u"""\
+            ...
+            Called Notifier.notify(%(expect_state)r)
+            Called TestApp.run()
+            """ % vars()
+        instance.do_action()
+        self.failUnlessMockCheckerMatch(expect_mock_output)
+
+    def test_emits_message_if_notification_fails(self):
+        """ Should emit a message and run if notification fails. """
+        instance = self.test_instance
+        instance.daemon_context.notifier = scaffold.Mock(
+            u"Notifier",
+            tracker=self.mock_tracker)
+        instance.daemon_context.notifier.notify.mock_raises = (
+            NotifySocketError(u"Connection refused"))
+        expect_stderr = u"""\
+            ...
+            notification failed: Connection refused
+            """
+        expect_mock_output = u"""\
+            ...
+            Called TestApp.run()
+            """
+        instance.do_action()
+        self.failUnlessOutputCheckerMatch(
+            expect_stderr, self.mock_stderr.getvalue())
+        self.failUnlessMockCheckerMatch(expect_mock_output)
+
     def test_emits_start_message_to_stderr(self):
         """ Should emit start message to stderr. """
         instance = self.test_instance
@@ -541,123 +901,1929 @@ class DaemonRunner_do_action_start_TestCase(scaffold.TestCase):
         instance.do_action()
         self.failUnlessMockCheckerMatch(expect_mock_output)
 
+    def test_records_daemon_pid(self):
+        """ Should record the PID of the daemon process. """
+        instance = self.test_instance
+        expect_pid = self.scenario['pid']
+        instance.do_action()
+        self.failUnlessEqual(expect_pid, instance.daemon_pid)
 
-class DaemonRunner_do_action_stop_TestCase(scaffold.TestCase):
-    """ Test cases for DaemonRunner.do_action method, action 'stop'. """
+    def test_records_starting_state_in_pidfile(self):
+        """ Should record the first generation, starting, in PID file. """
+        instance = self.test_instance
+        lockfile_class_name = self.lockfile_class_name
+        expect_mock_output = u"""\
+            ...
+            Called %(lockfile_class_name)s.update_fields(
+                {u'generation': 1, u'state': u'starting'})
+            ...
+            Called DaemonContext.open()
+            ...
+            """ % vars()
+        instance.do_action()
+        self.failUnlessMockCheckerMatch(expect_mock_output)
+
+    def test_records_ready_state_in_pidfile(self):
+        """ Should record the ready state and addresses in PID file. """
+        instance = self.test_instance
+        daemon_context = instance.daemon_context
+        test_socket = scaffold.Mock(
+            u"socket",
+            tracker=self.mock_tracker)
+        test_socket.getsockname.mock_returns = ("127.0.0.1", 8080)
+        daemon_context.listen_addresses = [(u"127.0.0.1", 8080)]
+        daemon_context.listen_sockets = [[test_socket]]
+        daemon_context.get_listen_sockets.mock_returns = [test_socket]
+        expect_fields = {
+            u'state': u'ready',
+            u'listen_addresses': [u"127.0.0.1:8080"],
+            }
+        fields = []
+        def mock_update_fields(changes):
+            fields.append(changes)
+        self.mock_runner_lock.update_fields.mock_returns_func = (
+            mock_update_fields)
+        instance.do_action()
+        self.failUnlessEqual(expect_fields, fields[-1])
+
+    def test_lets_reload_signal_interrupt_system_calls(self):
+        """ Should let the reload signal interrupt the daemon process. """
+        instance = self.test_instance
+        scaffold.mock(
+            u"signal.siginterrupt",
+            tracker=self.mock_tracker)
+        unwanted_mock_output = u"""\
+            ...Called signal.siginterrupt(...)..."""
+        instance.do_action()
+        self.failIfMockCheckerMatch(unwanted_mock_output)
+
+
+class DaemonRunner_do_action_start_reload_TestCase(scaffold.TestCase):
+    """ Test cases for DaemonRunner action 'start' from a reload. """
 
     def setUp(self):
         """ Set up test fixtures. """
         setup_runner_fixtures(self)
         set_runner_scenario(self, 'pidfile-locked')
 
-        self.test_instance.action = u'stop'
+        self.test_instance.action = u'start'
+        self.test_instance.daemon_context.files_preserve = None
 
-        self.mock_runner_lock.is_locked.mock_returns = True
-        self.mock_runner_lock.i_am_locking.mock_returns = False
-        self.mock_runner_lock.read_pid.mock_returns = (
-            self.scenario['pidlockfile_scenario']['pidfile_pid'])
+        self.test_reload_socket = scaffold.Mock(
+            u"reload_socket",
+            tracker=self.mock_tracker)
+        scaffold.mock(
+            u"daemon.runner.pop_reload_socket",
+            returns=self.test_reload_socket,
+            tracker=self.mock_tracker)
+        scaffold.mock(
+            u"daemon.runner.DaemonRunner._take_over_daemon",
+            tracker=self.mock_tracker)
 
     def tearDown(self):
         """ Tear down test fixtures. """
         scaffold.mock_restore()
 
-    def test_raises_error_if_pidfile_not_locked(self):
-        """ Should raise error if PID file is not locked. """
-        set_runner_scenario(self, 'simple')
+    def test_does_not_check_pidfile(self):
+        """ Should not check or break the lock of the PID file. """
         instance = self.test_instance
-        self.mock_runner_lock.is_locked.mock_returns = False
-        self.mock_runner_lock.i_am_locking.mock_returns = False
-        self.mock_runner_lock.read_pid.mock_returns = (
-            self.scenario['pidlockfile_scenario']['pidfile_pid'])
-        pidfile_path = self.scenario['pidfile_path']
-        expect_error = runner.DaemonRunnerStopFailureError
-        expect_message_content = pidfile_path
-        try:
-            instance.do_action()
-        except expect_error, exc:
-            pass
-        else:
-            raise self.failureException(
-                u"Failed to raise " + expect_error.__name__)
-        scaffold.mock_restore()
-        self.failUnlessIn(str(exc), expect_message_content)
+        unwanted_mock_output = u"""\
+            ...Called os.kill(...)..."""
+        instance.do_action()
+        self.failIfMockCheckerMatch(unwanted_mock_output)
 
-    def test_breaks_lock_if_pidfile_stale(self):
-        """ Should break lock if PID file is stale. """
+    def test_opens_daemon_context_without_pidfile(self):
+        """ Should open the daemon context without the PID file. """
         instance = self.test_instance
-        pidfile_path = self.scenario['pidfile_path']
-        test_pid = self.scenario['pidlockfile_scenario']['pidfile_pid']
-        expect_signal = signal.SIG_DFL
-        error = OSError(errno.ESRCH, u"Not running")
-        os.kill.mock_raises = error
-        lockfile_class_name = self.lockfile_class_name
-        expect_mock_output = u"""\
-            ...
-            Called %(lockfile_class_name)s.break_lock()
-            """ % vars()
+        pidfiles = []
+        def mock_open():
+            pidfiles.append(instance.daemon_context.pidfile)
+        instance.daemon_context.open.mock_returns_func = mock_open
+        instance.do_action()
+        self.failUnlessEqual([None], pidfiles)
+
+    def test_preserves_reload_socket(self):
+        """ Should preserve the reload socket when closing files. """
+        instance = self.test_instance
+        expect_files_preserve = [self.test_reload_socket]
+        instance.do_action()
+        self.failUnlessEqual(
+            expect_files_preserve, instance.daemon_context.files_preserve)
+
+    def test_preserves_inherited_pidfile_lock(self):
+        """ Should preserve the inherited PID file lock, if any. """
+        instance = self.test_instance
+        scaffold.mock(
+            u"daemon.runner.pop_inherited_lock_fd",
+            returns=7,
+            tracker=self.mock_tracker)
+        expect_files_preserve = [self.test_reload_socket, 7]
+        instance.do_action()
+        self.failUnlessEqual(
+            expect_files_preserve, instance.daemon_context.files_preserve)
+        self.failUnlessEqual(7, instance._inherited_lock_fd)
+
+    def test_records_next_generation_in_pidfile(self):
+        """ Should record the generation after that of the PID file. """
+        instance = self.test_instance
+        self.mock_runner_lock.read_record.mock_returns = {
+            u'pid': self.scenario['pidlockfile_scenario']['pidfile_pid'],
+            u'start_time': None,
+            u'generation': 4,
+            }
+        lockfile_class_name = self.lockfile_class_name
+        expect_mock_output = u"""\
+            ...
+            Called %(lockfile_class_name)s.read_record()
+            Called %(lockfile_class_name)s.update_fields(
+                {u'generation': 5, u'state': u'starting'})
+            ...
+            """ % vars()
         instance.do_action()
-        scaffold.mock_restore()
         self.failUnlessMockCheckerMatch(expect_mock_output)
 
-    def test_sends_terminate_signal_to_process_from_pidfile(self):
-        """ Should send SIGTERM to the daemon process. """
+    def test_takes_over_daemon_before_app_run(self):
+        """ Should take over from the previous daemon, then run. """
         instance = self.test_instance
-        test_pid = self.scenario['pidlockfile_scenario']['pidfile_pid']
-        expect_signal = signal.SIGTERM
+        lockfile_class_name = self.lockfile_class_name
         expect_mock_output = u"""\
             ...
-            Called os.kill(%(test_pid)r, %(expect_signal)r)
+            Called DaemonContext.open()
+            Called daemon.runner.DaemonRunner._take_over_daemon(
+                <Mock ... reload_socket>)
+            Called %(lockfile_class_name)s.update_fields(...)
+            Called DaemonContext.report_ready()
+            Called TestApp.run()
             """ % vars()
         instance.do_action()
+        self.failUnlessMockCheckerMatch(expect_mock_output)
+
+    def test_reports_failure_if_take_over_fails(self):
+        """ Should report start-up failure if it cannot take over. """
+        instance = self.test_instance
+        runner.DaemonRunner._take_over_daemon.mock_raises = (
+            runner.DaemonRunnerStartFailureError(u"Declined"))
+        expect_mock_output = u"""\
+            ...
+            Called DaemonContext.report_failed(u'Declined')
+            """
+        self.failUnlessRaises(
+            runner.DaemonRunnerStartFailureError,
+            instance.do_action)
+        self.failUnlessMockCheckerMatch(expect_mock_output)
+
+
+class DaemonRunner_do_action_start_worker_pool_TestCase(scaffold.TestCase):
+    """ Test cases for DaemonRunner action 'start' with worker pool. """
+
+    def setUp(self):
+        """ Set up test fixtures. """
+        setup_runner_fixtures(self)
+        set_runner_scenario(self, 'simple')
+
+        self.test_instance.action = u'start'
+        self.test_instance.worker_pool = scaffold.Mock(
+            u"WorkerPool",
+            tracker=self.mock_tracker)
+
+    def tearDown(self):
+        """ Tear down test fixtures. """
         scaffold.mock_restore()
+
+    def test_requests_worker_pool_run(self):
+        """ Should request the worker pool to run. """
+        instance = self.test_instance
+        expect_mock_output = u"""\
+            ...
+            Called DaemonContext.open()
+            Called WorkerPool.run()
+            """
+        instance.do_action()
         self.failUnlessMockCheckerMatch(expect_mock_output)
 
-    def test_raises_error_if_cannot_send_signal_to_process(self):
-        """ Should raise error if cannot send signal to daemon process. """
+    def test_does_not_request_app_run(self):
+        """ Should not request the application to run in the master. """
         instance = self.test_instance
-        test_pid = self.scenario['pidlockfile_scenario']['pidfile_pid']
-        pidfile_path = self.scenario['pidfile_path']
-        error = OSError(errno.EPERM, u"Nice try")
-        os.kill.mock_raises = error
-        expect_error = runner.DaemonRunnerStopFailureError
-        expect_message_content = str(test_pid)
-        try:
-            instance.do_action()
-        except expect_error, exc:
-            pass
-        else:
-            raise self.failureException(
-                u"Failed to raise " + expect_error.__name__)
+        unwanted_mock_output = u"""\
+            ...
+            Called TestApp.run()
+            ...
+            """
+        instance.do_action()
+        self.failIfMockCheckerMatch(unwanted_mock_output)
+
+
+class DaemonRunner_run_worker_TestCase(scaffold.TestCase):
+    """ Test cases for DaemonRunner._run_worker method. """
+
+    def setUp(self):
+        """ Set up test fixtures. """
+        setup_runner_fixtures(self)
+        set_runner_scenario(self, 'simple')
+
+        self.test_index = 2
+
+    def tearDown(self):
+        """ Tear down test fixtures. """
         scaffold.mock_restore()
-        self.failUnlessIn(unicode(exc), expect_message_content)
 
+    def test_requests_app_run_worker_with_index(self):
+        """ Should request the app's `run_worker` with the index. """
+        instance = self.test_instance
+        self.test_app.run_worker = scaffold.Mock(
+            u"TestApp.run_worker",
+            tracker=self.mock_tracker)
+        test_index = self.test_index
+        expect_mock_output = u"""\
+            Called TestApp.run_worker(%(test_index)r)
+            """ % vars()
+        instance._run_worker(test_index)
+        self.failUnlessMockCheckerMatch(expect_mock_output)
 
-class DaemonRunner_do_action_restart_TestCase(scaffold.TestCase):
-    """ Test cases for DaemonRunner.do_action method, action 'restart'. """
+    def test_requests_app_run_if_app_has_no_run_worker(self):
+        """ Should request the app's `run` if it has no `run_worker`. """
+        instance = self.test_instance
+        expect_mock_output = u"""\
+            Called TestApp.run()
+            """
+        instance._run_worker(self.test_index)
+        self.failUnlessMockCheckerMatch(expect_mock_output)
+
+    def test_lets_system_calls_resume_after_reload_signal(self):
+        """ Should let system calls resume after the reload signal. """
+        instance = self.test_instance
+        scaffold.mock(
+            u"signal.siginterrupt",
+            tracker=self.mock_tracker)
+        reload_signal = runner.reload_signal
+        expect_mock_output = u"""\
+            Called signal.siginterrupt(%(reload_signal)r, False)
+            Called TestApp.run()
+            """ % vars()
+        instance._run_worker(self.test_index)
+        self.failUnlessMockCheckerMatch(expect_mock_output)
+
+    def test_sets_worker_cpu_affinity_from_sequence(self):
+        """ Should pin the worker to its CPUs from the sequence. """
+        instance = self.test_instance
+        instance.worker_cpu_affinity = [[0, 1], [2, 3]]
+        scaffold.mock(
+            u"daemon.runner.set_cpu_affinity",
+            tracker=self.mock_tracker)
+        expect_mock_output = u"""\
+            Called daemon.runner.set_cpu_affinity([0, 1])
+            Called TestApp.run()
+            """
+        self.mock_tracker.clear()
+        instance._run_worker(self.test_index)
+        self.failUnlessMockCheckerMatch(expect_mock_output)
+
+    def test_spreads_workers_across_available_cpus(self):
+        """ Should pin each worker to a distinct available CPU. """
+        instance = self.test_instance
+        instance.worker_cpu_affinity = u'spread'
+        scaffold.mock(
+            u"daemon.runner.get_cpu_affinity",
+            returns=set([4, 5, 6, 7]),
+            tracker=self.mock_tracker)
+        scaffold.mock(
+            u"daemon.runner.set_cpu_affinity",
+            tracker=self.mock_tracker)
+        expect_mock_output = u"""\
+            Called daemon.runner.get_cpu_affinity()
+            Called daemon.runner.set_cpu_affinity([6])
+            Called TestApp.run()
+            """
+        self.mock_tracker.clear()
+        instance._run_worker(self.test_index)
+        self.failUnlessMockCheckerMatch(expect_mock_output)
+
+    def test_omits_cpu_affinity_if_not_specified(self):
+        """ Should not change CPU affinity if not specified. """
+        instance = self.test_instance
+        scaffold.mock(
+            u"daemon.runner.set_cpu_affinity",
+            tracker=self.mock_tracker)
+        unwanted_output = u"""\
+            ...Called daemon.runner.set_cpu_affinity(...)..."""
+        instance._run_worker(self.test_index)
+        self.failIfMockCheckerMatch(unwanted_output)
+
+    def test_gives_app_worker_listen_sockets(self):
+        """ Should give the app the listening sockets for the worker. """
+        instance = self.test_instance
+        daemon_context = instance.daemon_context
+        daemon_context.listen_addresses = [object(), object()]
+        shared_socket = scaffold.Mock(
+            u"shared_socket",
+            tracker=self.mock_tracker)
+        copy_sockets = [
+            scaffold.Mock(
+                u"copy_socket_%(i)d" % vars(),
+                tracker=self.mock_tracker)
+            for i in range(3)]
+        daemon_context.listen_sockets = [[shared_socket], copy_sockets]
+        worker_sockets = [shared_socket, copy_sockets[self.test_index]]
+        daemon_context.get_listen_sockets.mock_returns = worker_sockets
+        test_index = self.test_index
+        expect_mock_output = u"""\
+            Called DaemonContext.get_listen_sockets(%(test_index)r)
+            Called copy_socket_0.close()
+            Called copy_socket_1.close()
+            Called TestApp.run()
+            """ % vars()
+        self.mock_tracker.clear()
+        instance._run_worker(test_index)
+        self.failUnlessMockCheckerMatch(expect_mock_output)
+        self.failUnlessEqual(worker_sockets, self.test_app.listen_sockets)
+
+
+class DaemonRunner_report_ready_TestCase(scaffold.TestCase):
+    """ Test cases for DaemonRunner.report_ready method. """
+
+    def setUp(self):
+        """ Set up test fixtures. """
+        setup_runner_fixtures(self)
+        set_runner_scenario(self, 'simple')
+
+        self.test_instance.daemon_pid = self.scenario['pid']
+        self.test_instance.daemon_context.notifier = scaffold.Mock(
+            u"Notifier",
+            tracker=self.mock_tracker)
+        self.test_instance.daemon_context.listen_addresses = None
+
+    def tearDown(self):
+        """ Tear down test fixtures. """
+        scaffold.mock_restore()
+
+    def test_reports_ready(self):
+        """ Should record, report, and notify that the daemon is ready. """
+        instance = self.test_instance
+        lockfile_class_name = self.lockfile_class_name
+        test_pid = self.scenario['pid']
+        expect_state = u"MAINPID=%(test_pid)d\nREADY=1" % vars()
+        expect_mock_output = u"""\
+            Called %(lockfile_class_name)s.update_fields(
+                {u'listen_addresses': None, u'state': u'ready'})
+            Called DaemonContext.report_ready()
+            Called Notifier.notify(%(expect_state)r)
+            """ % vars()
+        instance.report_ready()
+        self.failUnlessMockCheckerMatch(expect_mock_output)
+
+    def test_reports_ready_only_once(self):
+        """ Should have no effect after the first call. """
+        instance = self.test_instance
+        instance.report_ready()
+        self.mock_tracker.clear()
+        instance.report_ready()
+        self.failUnlessMockCheckerMatch(u"")
+
+
+class DaemonRunner_do_action_stop_TestCase(scaffold.TestCase):
+    """ Test cases for DaemonRunner.do_action method, action 'stop'. """
 
     def setUp(self):
         """ Set up test fixtures. """
         setup_runner_fixtures(self)
         set_runner_scenario(self, 'pidfile-locked')
 
-        self.test_instance.action = u'restart'
+        self.test_instance.action = u'stop'
+
+        self.mock_runner_lock.is_locked.mock_returns = True
+        self.mock_runner_lock.i_am_locking.mock_returns = False
+        self.mock_runner_lock.read_pid.mock_returns = (
+            self.scenario['pidlockfile_scenario']['pidfile_pid'])
+
+        scaffold.mock(
+            u"daemon.runner.open_process_fd",
+            returns=None,
+            tracker=self.mock_tracker)
+        scaffold.mock(
+            u"daemon.runner.wait_for_process_exit",
+            returns=True,
+            tracker=self.mock_tracker)
 
     def tearDown(self):
         """ Tear down test fixtures. """
         scaffold.mock_restore()
 
-    def test_requests_stop_then_start(self):
-        """ Should request stop, then start. """
+    def test_raises_error_if_pidfile_not_locked(self):
+        """ Should raise error if PID file is not locked. """
+        set_runner_scenario(self, 'simple')
+        instance = self.test_instance
+        self.mock_runner_lock.is_locked.mock_returns = False
+        self.mock_runner_lock.i_am_locking.mock_returns = False
+        self.mock_runner_lock.read_pid.mock_returns = (
+            self.scenario['pidlockfile_scenario']['pidfile_pid'])
+        pidfile_path = self.scenario['pidfile_path']
+        expect_error = runner.DaemonRunnerStopFailureError
+        expect_message_content = pidfile_path
+        try:
+            instance.do_action()
+        except expect_error, exc:
+            pass
+        else:
+            raise self.failureException(
+                u"Failed to raise " + expect_error.__name__)
+        scaffold.mock_restore()
+        self.failUnlessIn(str(exc), expect_message_content)
+
+    def test_breaks_lock_if_pidfile_stale(self):
+        """ Should break lock if PID file is stale. """
+        instance = self.test_instance
+        pidfile_path = self.scenario['pidfile_path']
+        test_pid = self.scenario['pidlockfile_scenario']['pidfile_pid']
+        expect_signal = signal.SIG_DFL
+        error = OSError(errno.ESRCH, u"Not running")
+        os.kill.mock_raises = error
+        lockfile_class_name = self.lockfile_class_name
+        expect_mock_output = u"""\
+            ...
+            Called %(lockfile_class_name)s.break_lock()
+            """ % vars()
+        instance.do_action()
+        scaffold.mock_restore()
+        self.failUnlessMockCheckerMatch(expect_mock_output)
+
+    def test_breaks_lock_if_pid_reused(self):
+        """ Should break lock, not signal, if the PID has been reused. """
         instance = self.test_instance
+        test_pid = self.scenario['pidlockfile_scenario']['pidfile_pid']
+        self.mock_runner_lock.read_start_time.mock_returns = 4567
         scaffold.mock(
-            u"daemon.runner.DaemonRunner._start",
+            u"pidlockfile.get_process_start_time",
+            returns=8901,
             tracker=self.mock_tracker)
+        expect_signal = signal.SIGTERM
+        lockfile_class_name = self.lockfile_class_name
+        expect_mock_output = u"""\
+            ...
+            Called %(lockfile_class_name)s.read_start_time(%(test_pid)r)
+            Called pidlockfile.get_process_start_time(%(test_pid)r)
+            Called %(lockfile_class_name)s.break_lock()
+            """ % vars()
+        instance.do_action()
+        scaffold.mock_restore()
+        self.failUnlessMockCheckerMatch(expect_mock_output)
+        self.failIfIn(
+            self.mock_tracker.dump(),
+            u"Called os.kill(%(test_pid)r, %(expect_signal)r)" % vars())
+
+    def test_sends_terminate_signal_if_start_time_matches(self):
+        """ Should send SIGTERM if the process start time matches. """
+        instance = self.test_instance
+        test_pid = self.scenario['pidlockfile_scenario']['pidfile_pid']
+        self.mock_runner_lock.read_start_time.mock_returns = 4567
         scaffold.mock(
-            u"daemon.runner.DaemonRunner._stop",
+            u"pidlockfile.get_process_start_time",
+            returns=4567,
             tracker=self.mock_tracker)
+        expect_signal = signal.SIGTERM
         expect_mock_output = u"""\
-            Called daemon.runner.DaemonRunner._stop()
-            Called daemon.runner.DaemonRunner._start()
-            """
+            ...
+            Called os.kill(%(test_pid)r, %(expect_signal)r)
+            ...
+            """ % vars()
+        instance.do_action()
+        scaffold.mock_restore()
+        self.failUnlessMockCheckerMatch(expect_mock_output)
+
+    def test_sends_terminate_signal_to_process_from_pidfile(self):
+        """ Should send SIGTERM to the daemon process. """
+        instance = self.test_instance
+        test_pid = self.scenario['pidlockfile_scenario']['pidfile_pid']
+        expect_signal = signal.SIGTERM
+        expect_mock_output = u"""\
+            ...
+            Called os.kill(%(test_pid)r, %(expect_signal)r)
+            ...
+            """ % vars()
         instance.do_action()
+        scaffold.mock_restore()
         self.failUnlessMockCheckerMatch(expect_mock_output)
+
+    def test_waits_for_process_to_exit(self):
+        """ Should wait for the daemon process to exit. """
+        instance = self.test_instance
+        instance.stop_timeout = 5
+        test_pidfd = 9
+        runner.open_process_fd.mock_returns = test_pidfd
+        scaffold.mock(
+            u"os.close",
+            tracker=self.mock_tracker)
+        test_pid = self.scenario['pidlockfile_scenario']['pidfile_pid']
+        expect_signal = signal.SIGTERM
+        expect_mock_output = u"""\
+            ...
+            Called daemon.runner.open_process_fd(%(test_pid)r)
+            Called os.kill(%(test_pid)r, %(expect_signal)r)
+            Called daemon.runner.wait_for_process_exit(
+                %(test_pid)r,
+                5,
+                %(test_pidfd)r)
+            Called os.close(%(test_pidfd)r)
+            """ % vars()
+        instance.do_action()
+        scaffold.mock_restore()
+        self.failUnlessMockCheckerMatch(expect_mock_output)
+
+    def test_raises_error_if_process_does_not_exit(self):
+        """ Should raise error if the daemon process does not exit. """
+        instance = self.test_instance
+        runner.wait_for_process_exit.mock_returns = False
+        test_pid = self.scenario['pidlockfile_scenario']['pidfile_pid']
+        unwanted_mock_output = u"""\
+            ...Called os.kill(%(test_pid)r, 9)...""" % vars()
+        expect_error = runner.DaemonRunnerStopFailureError
+        self.failUnlessRaises(expect_error, instance.do_action)
+        scaffold.mock_restore()
+        self.failIfMockCheckerMatch(unwanted_mock_output)
+
+    def test_kills_process_if_stop_kill(self):
+        """ Should kill the daemon process if it does not exit in time. """
+        instance = self.test_instance
+        instance.stop_kill = True
+        wait_results = [False, True]
+        runner.wait_for_process_exit.mock_returns = None
+        runner.wait_for_process_exit.mock_returns_iter = wait_results
+        test_pid = self.scenario['pidlockfile_scenario']['pidfile_pid']
+        expect_signal = signal.SIGKILL
+        expect_mock_output = u"""\
+            ...
+            Called os.kill(%(test_pid)r, %(expect_signal)r)
+            Called daemon.runner.wait_for_process_exit(...)
+            ...
+            """ % vars()
+        instance.do_action()
+        scaffold.mock_restore()
+        self.failUnlessMockCheckerMatch(expect_mock_output)
+
+    def test_breaks_lock_after_killing_process(self):
+        """ Should break the lock left by the killed daemon process. """
+        instance = self.test_instance
+        instance.stop_kill = True
+        wait_results = [False, True]
+        runner.wait_for_process_exit.mock_returns = None
+        runner.wait_for_process_exit.mock_returns_iter = wait_results
+        killed = []
+        def mock_kill(pid, signal_number):
+            if signal_number == signal.SIGKILL:
+                killed.append(pid)
+            elif signal_number == signal.SIG_DFL and killed:
+                raise OSError(errno.ESRCH, u"Not running")
+        os.kill.mock_returns_func = mock_kill
+        lockfile_class_name = self.lockfile_class_name
+        expect_mock_output = u"""\
+            ...
+            Called os.kill(..., %(sigkill)r)
+            ...
+            Called %(lockfile_class_name)s.break_lock()
+            """ % dict(vars(), sigkill=signal.SIGKILL)
+        instance.do_action()
+        scaffold.mock_restore()
+        self.failUnlessMockCheckerMatch(expect_mock_output)
+
+    def test_raises_error_if_killed_process_does_not_exit(self):
+        """ Should raise error if the killed process does not exit. """
+        instance = self.test_instance
+        instance.stop_kill = True
+        runner.wait_for_process_exit.mock_returns = False
+        expect_error = runner.DaemonRunnerStopFailureError
+        self.failUnlessRaises(expect_error, instance.do_action)
+        scaffold.mock_restore()
+
+    def test_raises_error_if_cannot_send_signal_to_process(self):
+        """ Should raise error if cannot send signal to daemon process. """
+        instance = self.test_instance
+        test_pid = self.scenario['pidlockfile_scenario']['pidfile_pid']
+        pidfile_path = self.scenario['pidfile_path']
+        error = OSError(errno.EPERM, u"Nice try")
+        os.kill.mock_raises = error
+        expect_error = runner.DaemonRunnerStopFailureError
+        expect_message_content = str(test_pid)
+        try:
+            instance.do_action()
+        except expect_error, exc:
+            pass
+        else:
+            raise self.failureException(
+                u"Failed to raise " + expect_error.__name__)
+        scaffold.mock_restore()
+        self.failUnlessIn(unicode(exc), expect_message_content)
+
+
+class DaemonRunner_do_action_restart_TestCase(scaffold.TestCase):
+    """ Test cases for DaemonRunner.do_action method, action 'restart'. """
+
+    def setUp(self):
+        """ Set up test fixtures. """
+        setup_runner_fixtures(self)
+        set_runner_scenario(self, 'pidfile-locked')
+
+        self.test_instance.action = u'restart'
+
+    def tearDown(self):
+        """ Tear down test fixtures. """
+        scaffold.mock_restore()
+
+    def test_requests_stop_then_start(self):
+        """ Should request stop, then start. """
+        instance = self.test_instance
+        scaffold.mock(
+            u"daemon.runner.DaemonRunner._start",
+            tracker=self.mock_tracker)
+        scaffold.mock(
+            u"daemon.runner.DaemonRunner._stop",
+            tracker=self.mock_tracker)
+        expect_mock_output = u"""\
+            Called daemon.runner.DaemonRunner._stop()
+            Called daemon.runner.DaemonRunner._start()
+            """
+        instance.do_action()
+        self.failUnlessMockCheckerMatch(expect_mock_output)
+
+
+class DaemonRunner_do_action_reload_TestCase(scaffold.TestCase):
+    """ Test cases for DaemonRunner.do_action method, action 'reload'. """
+
+    def setUp(self):
+        """ Set up test fixtures. """
+        setup_runner_fixtures(self)
+        set_runner_scenario(self, 'pidfile-locked')
+
+        self.test_instance.action = u'reload'
+
+        self.mock_runner_lock.is_locked.mock_returns = True
+        self.mock_runner_lock.i_am_locking.mock_returns = False
+        self.mock_runner_lock.read_pid.mock_returns = (
+            self.scenario['pidlockfile_scenario']['pidfile_pid'])
+
+    def tearDown(self):
+        """ Tear down test fixtures. """
+        scaffold.mock_restore()
+
+    def test_raises_error_if_pidfile_not_locked(self):
+        """ Should raise error if PID file is not locked. """
+        instance = self.test_instance
+        self.mock_runner_lock.is_locked.mock_returns = False
+        expect_error = runner.DaemonRunnerReloadFailureError
+        self.failUnlessRaises(
+            expect_error,
+            instance.do_action)
+
+    def test_raises_error_if_pidfile_stale(self):
+        """ Should raise error if PID file is stale. """
+        instance = self.test_instance
+        os.kill.mock_raises = OSError(errno.ESRCH, u"Not running")
+        expect_error = runner.DaemonRunnerReloadFailureError
+        self.failUnlessRaises(
+            expect_error,
+            instance.do_action)
+
+    def test_sends_reload_signal_to_process_from_pidfile(self):
+        """ Should send the reload signal to the daemon process. """
+        instance = self.test_instance
+        test_pid = self.scenario['pidlockfile_scenario']['pidfile_pid']
+        expect_signal = runner.reload_signal
+        expect_mock_output = u"""\
+            ...
+            Called os.kill(%(test_pid)r, %(expect_signal)r)
+            """ % vars()
+        instance.do_action()
+        scaffold.mock_restore()
+        self.failUnlessMockCheckerMatch(expect_mock_output)
+
+    def test_raises_error_if_cannot_send_signal_to_process(self):
+        """ Should raise error if cannot send signal to daemon process. """
+        instance = self.test_instance
+        test_pid = self.scenario['pidlockfile_scenario']['pidfile_pid']
+        def mock_kill(pid, signal_number):
+            if signal_number == runner.reload_signal:
+                raise OSError(errno.EPERM, u"Nice try")
+        os.kill.mock_returns_func = mock_kill
+        expect_error = runner.DaemonRunnerReloadFailureError
+        expect_message_content = str(test_pid)
+        try:
+            instance.do_action()
+        except expect_error, exc:
+            pass
+        else:
+            raise self.failureException(
+                u"Failed to raise " + expect_error.__name__)
+        scaffold.mock_restore()
+        self.failUnlessIn(unicode(exc), expect_message_content)
+
+
+class DaemonRunner_do_action_status_TestCase(scaffold.TestCase):
+    """ Test cases for DaemonRunner.do_action method, action 'status'. """
+
+    def setUp(self):
+        """ Set up test fixtures. """
+        setup_runner_fixtures(self)
+        set_runner_scenario(self, 'pidfile-locked')
+
+        self.test_instance.action = u'status'
+
+        self.test_pid = self.scenario['pidlockfile_scenario']['pidfile_pid']
+        self.mock_runner_lock.read_pid.mock_returns = self.test_pid
+
+        self.mock_stdout = FakeFileDescriptorStringIO()
+        scaffold.mock(
+            u"sys.stdout",
+            mock_obj=self.mock_stdout,
+            tracker=self.mock_tracker)
+
+        self.test_time = 1234567890.0
+        self.test_process_info = dict(
+            start_time=(self.test_time - 100.0), rss=40960, fds=7)
+        scaffold.mock(
+            u"time.time",
+            returns=self.test_time,
+            tracker=self.mock_tracker)
+        scaffold.mock(
+            u"daemon.runner.get_process_info",
+            returns=self.test_process_info,
+            tracker=self.mock_tracker)
+        scaffold.mock(
+            u"os.path.getmtime",
+            returns=(self.test_time - 99.5),
+            tracker=self.mock_tracker)
+
+    def tearDown(self):
+        """ Tear down test fixtures. """
+        scaffold.mock_restore()
+
+    def get_status_and_exit_code(self):
+        """ Perform the action, and get the status and exit code. """
+        instance = self.test_instance
+        try:
+            instance.do_action()
+        except SystemExit, exc:
+            pass
+        else:
+            raise self.failureException(u"Failed to raise SystemExit")
+        status = json.loads(self.mock_stdout.getvalue())
+        return (status, exc.code)
+
+    def test_reports_running_process(self):
+        """ Should report details of the running daemon process. """
+        expect_status = {
+            u'status': u'running', u'pid': self.test_pid,
+            u'uptime': 100.0, u'rss': 40960, u'fds': 7,
+            }
+        (status, exit_code) = self.get_status_and_exit_code()
+        self.failUnlessEqual(expect_status, status)
+        self.failUnlessEqual(0, exit_code)
+
+    def test_reports_fields_recorded_in_pidfile(self):
+        """ Should report the fields recorded in the PID file. """
+        self.mock_runner_lock.read_record.mock_returns = {
+            u'pid': self.test_pid, u'start_time': None,
+            u'generation': 2, u'state': u'ready',
+            u'listen_addresses': [u"[::]:8080"],
+            }
+        expect_status = {
+            u'status': u'running', u'pid': self.test_pid,
+            u'uptime': 100.0, u'rss': 40960, u'fds': 7,
+            u'generation': 2, u'state': u'ready',
+            u'listen_addresses': [u"[::]:8080"],
+            }
+        (status, exit_code) = self.get_status_and_exit_code()
+        self.failUnlessEqual(expect_status, status)
+
+    def test_does_not_open_stream_files(self):
+        """ Should not open the stream files when created. """
+        scaffold.mock(
+            u"sys.argv",
+            mock_obj=self.valid_argv_params['status'])
+        self.mock_tracker.clear()
+        instance = runner.DaemonRunner(self.test_app)
+        self.failIfIn(self.mock_tracker.dump(), u"Called builtins.open")
+
+    def test_checks_process_with_null_signal(self):
+        """ Should check the process is running with the null signal. """
+        test_pid = self.test_pid
+        expect_signal = signal.SIG_DFL
+        expect_mock_output = u"""\
+            ...
+            Called os.kill(%(test_pid)r, %(expect_signal)r)
+            ...
+            """ % vars()
+        self.get_status_and_exit_code()
+        scaffold.mock_restore()
+        self.failUnlessMockCheckerMatch(expect_mock_output)
+
+    def test_reports_not_running_if_no_pidfile(self):
+        """ Should report not running if there is no PID file. """
+        self.mock_runner_lock.read_pid.mock_returns = None
+        expect_status = {u'status': u'not running', u'pid': None}
+        (status, exit_code) = self.get_status_and_exit_code()
+        self.failUnlessEqual(expect_status, status)
+        self.failUnlessEqual(3, exit_code)
+
+    def test_reports_dead_if_process_not_running(self):
+        """ Should report dead if the process is not running. """
+        os.kill.mock_raises = OSError(errno.ESRCH, u"Not running")
+        expect_status = {u'status': u'dead', u'pid': self.test_pid}
+        (status, exit_code) = self.get_status_and_exit_code()
+        self.failUnlessEqual(expect_status, status)
+        self.failUnlessEqual(1, exit_code)
+
+    def test_reports_dead_if_process_is_zombie(self):
+        """ Should report dead if no information for the process. """
+        runner.get_process_info.mock_returns = None
+        expect_status = {u'status': u'dead', u'pid': self.test_pid}
+        (status, exit_code) = self.get_status_and_exit_code()
+        self.failUnlessEqual(expect_status, status)
+        self.failUnlessEqual(1, exit_code)
+
+    def test_reports_dead_if_process_started_after_pidfile(self):
+        """ Should report dead if the PID was reused by a later process. """
+        os.path.getmtime.mock_returns = self.test_time - 200.0
+        expect_status = {u'status': u'dead', u'pid': self.test_pid}
+        (status, exit_code) = self.get_status_and_exit_code()
+        self.failUnlessEqual(expect_status, status)
+        self.failUnlessEqual(1, exit_code)
+
+    def test_reports_dead_if_start_time_differs(self):
+        """ Should report dead if the recorded start time differs. """
+        self.mock_runner_lock.read_start_time.mock_returns = 4567
+        scaffold.mock(
+            u"pidlockfile.get_process_start_time",
+            returns=8901,
+            tracker=self.mock_tracker)
+        expect_status = {u'status': u'dead', u'pid': self.test_pid}
+        (status, exit_code) = self.get_status_and_exit_code()
+        self.failUnlessEqual(expect_status, status)
+        self.failUnlessEqual(1, exit_code)
+
+    def test_uses_recorded_start_time_instead_of_pidfile_time(self):
+        """ Should ignore the PID file time if it records start time. """
+        self.mock_runner_lock.read_start_time.mock_returns = 4567
+        scaffold.mock(
+            u"pidlockfile.get_process_start_time",
+            returns=4567,
+            tracker=self.mock_tracker)
+        os.path.getmtime.mock_returns = self.test_time - 200.0
+        (status, exit_code) = self.get_status_and_exit_code()
+        self.failUnlessEqual(u'running', status[u'status'])
+        self.failUnlessEqual(0, exit_code)
+
+    def test_reports_running_if_start_time_unavailable(self):
+        """ Should report running if the start time is unavailable. """
+        runner.get_process_info.mock_returns = dict(
+            start_time=None, rss=None, fds=None)
+        expect_status = {
+            u'status': u'running', u'pid': self.test_pid,
+            u'uptime': None, u'rss': None, u'fds': None,
+            }
+        (status, exit_code) = self.get_status_and_exit_code()
+        self.failUnlessEqual(expect_status, status)
+        self.failUnlessEqual(0, exit_code)
+
+    def test_reports_unknown_if_pidfile_invalid(self):
+        """ Should report unknown if the PID file is invalid. """
+        self.mock_runner_lock.read_pid.mock_raises = (
+            pidlockfile.PIDFileParseError(u"Invalid"))
+        expect_status = {u'status': u'unknown', u'pid': None}
+        (status, exit_code) = self.get_status_and_exit_code()
+        self.failUnlessEqual(expect_status, status)
+        self.failUnlessEqual(4, exit_code)
+
+    def test_reports_unknown_if_no_pidfile_path(self):
+        """ Should report unknown if the app has no PID file. """
+        self.test_instance.pidfile = None
+        expect_status = {u'status': u'unknown', u'pid': None}
+        (status, exit_code) = self.get_status_and_exit_code()
+        self.failUnlessEqual(expect_status, status)
+        self.failUnlessEqual(4, exit_code)
+
+
+class DaemonRunner_pidfile_pool_TestCase(scaffold.TestCase):
+    """ Test cases for DaemonRunner with a pool of PID file slots. """
+
+    def setUp(self):
+        """ Set up test fixtures. """
+        setup_runner_fixtures(self)
+        set_runner_scenario(self, 'simple')
+
+        self.test_app.pidfile_slots = 3
+        self.test_slot_locks = []
+        def mock_make_lock(path, *args, **kwargs):
+            slot = len(self.test_slot_locks)
+            lock = scaffold.Mock(
+                u"slot%(slot)d" % vars(),
+                tracker=self.mock_tracker)
+            lock.path = path
+            lock.read_pid.mock_returns = None
+            self.test_slot_locks.append(lock)
+            return lock
+        scaffold.mock(
+            self.lockfile_class_name,
+            returns_func=mock_make_lock,
+            tracker=self.mock_tracker)
+
+        self.mock_stdout = FakeFileDescriptorStringIO()
+        scaffold.mock(
+            u"sys.stdout",
+            mock_obj=self.mock_stdout,
+            tracker=self.mock_tracker)
+
+    def tearDown(self):
+        """ Tear down test fixtures. """
+        scaffold.mock_restore()
+
+    def set_argv(self, *args):
+        """ Set the command-line arguments `args` for the runner. """
+        argv = [self.test_program_path] + list(args)
+        scaffold.mock(
+            u"sys.argv",
+            mock_obj=argv,
+            tracker=self.mock_tracker)
+
+    def make_instance(self, *args):
+        """ Make a runner with the command-line arguments `args`. """
+        self.set_argv(*args)
+        instance = runner.DaemonRunner(self.test_app)
+        return instance
+
+    def test_makes_lock_for_each_slot(self):
+        """ Should make a pool with a lock on each slot PID file. """
+        instance = self.make_instance(u'start')
+        (root, extension) = os.path.splitext(self.scenario['pidfile_path'])
+        expect_paths = [
+            u"%(root)s.%(slot)d%(extension)s" % vars()
+            for slot in range(3)]
+        pool = instance.pidfile_pool
+        self.failUnlessIsInstance(pool, pidlockfile.PIDLockPool)
+        self.failUnlessEqual(self.test_slot_locks, pool.locks)
+        self.failUnlessEqual(
+            expect_paths, [lock.path for lock in pool.locks])
+        self.failUnlessIs(pool, instance.pidfile)
+        self.failUnlessIs(pool, instance.daemon_context.pidfile)
+
+    def test_error_when_pidfile_slots_invalid(self):
+        """ Should raise ValueError when the number of slots is invalid. """
+        self.test_app.pidfile_slots = 0
+        self.set_argv(u'start')
+        self.failUnlessRaises(
+            ValueError,
+            runner.DaemonRunner, self.test_app)
+
+    def test_uses_slot_named_on_command_line(self):
+        """ Should use the lock of the slot named on the command line. """
+        instance = self.make_instance(u'start', u'2')
+        expect_lock = self.test_slot_locks[2]
+        self.failUnlessIs(expect_lock, instance.pidfile)
+        self.failUnlessIs(expect_lock, instance.daemon_context.pidfile)
+        self.failUnlessEqual(2, self.test_app.pidfile_slot)
+        self.failUnlessEqual([u'start', u'2'], instance.reload_argv[2:])
+
+    def test_emits_usage_message_when_slot_unknown(self):
+        """ Should emit a usage message and exit for an unknown slot. """
+        progname = self.test_program_name
+        expect_stderr_output = u"""\
+            usage: %(progname)s ... [SLOT|all]
+            """ % vars()
+        for slot_arg in [u'3', u'-1', u'spam']:
+            self.set_argv(u'stop', slot_arg)
+            self.mock_stderr.truncate(0)
+            exit_code = None
+            try:
+                runner.DaemonRunner(self.test_app)
+            except SystemExit, exc:
+                exit_code = exc.code
+            self.failUnlessEqual(2, exit_code)
+            self.failUnlessOutputCheckerMatch(
+                expect_stderr_output, self.mock_stderr.getvalue())
+
+    def test_start_sets_starting_fields_on_each_slot(self):
+        """ Should set the starting fields on each slot before opening. """
+        instance = self.make_instance(u'start')
+        pool = instance.pidfile_pool
+        def mock_open():
+            pool.slot = 0
+        instance.daemon_context.open.mock_returns_func = mock_open
+        expect_mock_output = u"""\
+            ...
+            Called slot0.update_fields(...'starting'...)
+            Called slot1.update_fields(...'starting'...)
+            Called slot2.update_fields(...'starting'...)
+            ...
+            Called DaemonContext.open()
+            ...
+            """
+        instance.do_action()
+        self.failUnlessMockCheckerMatch(expect_mock_output)
+
+    def test_start_claims_free_slot(self):
+        """ Should use the slot claimed when the daemon context opens. """
+        instance = self.make_instance(u'start')
+        pool = instance.pidfile_pool
+        def mock_open():
+            pool.slot = 1
+        instance.daemon_context.open.mock_returns_func = mock_open
+        slots = []
+        def mock_run():
+            slots.append(self.test_app.pidfile_slot)
+        self.test_app.run.mock_returns_func = mock_run
+        instance.do_action()
+        self.failUnlessEqual([1], slots)
+        self.failUnlessIs(self.test_slot_locks[1], instance.pidfile)
+        self.failUnlessEqual([u'start', u'1'], instance.reload_argv[2:])
+
+    def test_start_breaks_stale_slot_locks(self):
+        """ Should break the lock of each stale slot before starting. """
+        instance = self.make_instance(u'start')
+        pool = instance.pidfile_pool
+        def mock_open():
+            pool.slot = 0
+        instance.daemon_context.open.mock_returns_func = mock_open
+        stale_lock = self.test_slot_locks[1]
+        stale_lock.read_pid.mock_returns = 1234
+        os.kill.mock_raises = OSError(errno.ESRCH, u"Not running")
+        expect_mock_output = u"""\
+            ...
+            Called slot1.break_lock()
+            ...
+            Called DaemonContext.open()
+            ...
+            """
+        unwanted_mock_output = u"""\
+            ...Called slot0.break_lock()..."""
+        instance.do_action()
+        self.failUnlessMockCheckerMatch(expect_mock_output)
+        self.failIfMockCheckerMatch(unwanted_mock_output)
+
+    def test_stop_stops_each_locked_slot(self):
+        """ Should stop the daemon in each locked slot. """
+        instance = self.make_instance(u'stop')
+        for (lock, locked) in zip(self.test_slot_locks, [True, False, True]):
+            lock.is_locked.mock_returns = locked
+        pidfiles = []
+        scaffold.mock(
+            u"daemon.runner.DaemonRunner._stop",
+            returns_func=lambda: pidfiles.append(instance.pidfile),
+            tracker=self.mock_tracker)
+        instance.do_action()
+        expect_pidfiles = [self.test_slot_locks[0], self.test_slot_locks[2]]
+        self.failUnlessEqual(expect_pidfiles, pidfiles)
+        self.failUnlessIs(instance.pidfile_pool, instance.pidfile)
+
+    def test_stop_error_if_no_slot_locked(self):
+        """ Should raise error if no slot is locked. """
+        instance = self.make_instance(u'stop', u'all')
+        for lock in self.test_slot_locks:
+            lock.is_locked.mock_returns = False
+        self.failUnlessRaises(
+            runner.DaemonRunnerStopFailureError,
+            instance.do_action)
+
+    def test_status_reports_each_slot(self):
+        """ Should report every slot, and exit 0 if any is running. """
+        instance = self.make_instance(u'status')
+        test_statuses = {
+            self.test_slot_locks[0]: {u'status': u'running', u'pid': 2},
+            self.test_slot_locks[1]: {u'status': u'not running', u'pid': None},
+            self.test_slot_locks[2]: {u'status': u'dead', u'pid': 3},
+            }
+        scaffold.mock(
+            u"daemon.runner.DaemonRunner._get_daemon_status",
+            returns_func=lambda: test_statuses[instance.pidfile],
+            tracker=self.mock_tracker)
+        expect_status = {
+            u"0": {u'status': u'running', u'pid': 2},
+            u"1": {u'status': u'not running', u'pid': None},
+            u"2": {u'status': u'dead', u'pid': 3},
+            }
+        try:
+            instance.do_action()
+        except SystemExit, exc:
+            pass
+        else:
+            raise self.failureException(u"Failed to raise SystemExit")
+        status = json.loads(self.mock_stdout.getvalue())
+        self.failUnlessEqual(expect_status, status)
+        self.failUnlessEqual(0, exc.code)
+
+
+class DaemonRunner_take_over_daemon_TestCase(scaffold.TestCase):
+    """ Test cases for DaemonRunner._take_over_daemon method. """
+
+    def setUp(self):
+        """ Set up test fixtures. """
+        setup_runner_fixtures(self)
+        set_runner_scenario(self, 'simple')
+
+        self.test_instance.daemon_context.pidfile = None
+        self.test_reload_socket = scaffold.Mock(
+            u"reload_socket",
+            tracker=self.mock_tracker)
+
+        scaffold.mock(
+            u"daemon.runner.send_reload_message",
+            tracker=self.mock_tracker)
+        scaffold.mock(
+            u"daemon.runner.receive_reload_message",
+            returns=u"proceed",
+            tracker=self.mock_tracker)
+
+    def tearDown(self):
+        """ Tear down test fixtures. """
+        scaffold.mock_restore()
+
+    def test_takes_over_pidfile_when_ready(self):
+        """ Should report ready, then take over the PID file. """
+        instance = self.test_instance
+        lockfile_class_name = self.lockfile_class_name
+        expect_mock_output = u"""\
+            Called daemon.runner.send_reload_message(
+                <Mock ... reload_socket>,
+                u'ready')
+            Called daemon.runner.receive_reload_message(
+                <Mock ... reload_socket>,
+                ...)
+            Called %(lockfile_class_name)s.take_over(None)
+            Called daemon.runner.send_reload_message(
+                <Mock ... reload_socket>,
+                u'done')
+            Called reload_socket.close()
+            """ % vars()
+        instance._take_over_daemon(self.test_reload_socket)
+        self.failUnlessMockCheckerMatch(expect_mock_output)
+
+    def test_takes_over_pidfile_with_inherited_lock(self):
+        """ Should take over the PID file with the inherited lock. """
+        instance = self.test_instance
+        instance._inherited_lock_fd = 7
+        lockfile_class_name = self.lockfile_class_name
+        expect_mock_output = u"""\
+            ...
+            Called %(lockfile_class_name)s.take_over(7)
+            ...
+            """ % vars()
+        instance._take_over_daemon(self.test_reload_socket)
+        self.failUnlessMockCheckerMatch(expect_mock_output)
+
+    def test_restores_pidfile_to_daemon_context(self):
+        """ Should give the PID file taken over to the daemon context. """
+        instance = self.test_instance
+        expect_pidfile = instance.pidfile
+        instance._take_over_daemon(self.test_reload_socket)
+        self.failUnlessIs(expect_pidfile, instance.daemon_context.pidfile)
+
+    def test_raises_error_if_declined(self):
+        """ Should raise error without taking over if declined. """
+        instance = self.test_instance
+        runner.receive_reload_message.mock_returns = u"spam"
+        expect_error = runner.DaemonRunnerStartFailureError
+        unwanted_mock_output = u"""\
+            ...Called %(lockfile_class_name)s.take_over(...)...""" % vars(self)
+        self.failUnlessRaises(
+            expect_error,
+            instance._take_over_daemon, self.test_reload_socket)
+        self.failIfMockCheckerMatch(unwanted_mock_output)
+
+    def test_ignores_error_reporting_done(self):
+        """ Should keep the PID file if reporting it is done fails. """
+        instance = self.test_instance
+        def mock_send_reload_message(sock, message):
+            if message == u"done":
+                raise runner.DaemonRunnerReloadFailureError(u"Gone")
+        runner.send_reload_message.mock_returns_func = (
+            mock_send_reload_message)
+        expect_pidfile = instance.pidfile
+        instance._take_over_daemon(self.test_reload_socket)
+        self.failUnlessIs(expect_pidfile, instance.daemon_context.pidfile)
+
+
+class DaemonRunner_hand_over_daemon_TestCase(scaffold.TestCase):
+    """ Test cases for DaemonRunner._hand_over_daemon method. """
+
+    def setUp(self):
+        """ Set up test fixtures. """
+        setup_runner_fixtures(self)
+        set_runner_scenario(self, 'simple')
+
+        self.test_instance.reload_argv = [
+            u"/usr/bin/python", self.test_program_path, u'start']
+        self.test_instance.daemon_context.listen_sockets = []
+        self.mock_runner_lock.i_am_locking.mock_returns = False
+
+        self.test_control_socket = scaffold.Mock(
+            u"control_socket",
+            tracker=self.mock_tracker)
+        self.test_control_socket.fileno.mock_returns = 3
+        self.test_reload_socket = scaffold.Mock(
+            u"reload_socket",
+            tracker=self.mock_tracker)
+        self.test_reload_socket.fileno.mock_returns = 4
+        scaffold.mock(
+            u"socket.socketpair",
+            returns=(self.test_control_socket, self.test_reload_socket),
+            tracker=self.mock_tracker)
+
+        self.test_environ = {'SPAM': 'eggs'}
+        scaffold.mock(
+            u"os.environ",
+            mock_obj=self.test_environ,
+            tracker=self.mock_tracker)
+
+        self.test_child_pid = 4242
+        scaffold.mock(
+            u"os.fork",
+            returns=self.test_child_pid,
+            tracker=self.mock_tracker)
+
+        self.test_messages = [u"ready", u"done"]
+        def mock_receive_reload_message(sock, deadline):
+            result = self.test_messages.pop(0)
+            return result
+
+        scaffold.mock(
+            u"daemon.runner.receive_reload_message",
+            returns_func=mock_receive_reload_message,
+            tracker=self.mock_tracker)
+
+        for name in [
+                u"set_close_on_exec",
+                u"exec_new_daemon",
+                u"send_reload_message",
+                u"reap_child_process",
+                ]:
+            scaffold.mock(
+                u"daemon.runner.%(name)s" % vars(),
+                tracker=self.mock_tracker)
+
+    def tearDown(self):
+        """ Tear down test fixtures. """
+        scaffold.mock_restore()
+
+    def test_executes_new_daemon_in_child_process(self):
+        """ Should execute the new daemon in the child process. """
+        instance = self.test_instance
+        os.fork.mock_returns = 0
+        sock = scaffold.Mock(
+            u"socket",
+            tracker=self.mock_tracker)
+        sock.fileno.mock_returns = 5
+        instance.daemon_context.listen_sockets = [[sock]]
+        argv = instance.reload_argv
+        environ = {
+            'SPAM': 'eggs',
+            runner.RELOAD_FD_ENV: '4',
+            daemon.daemon.INHERITED_LISTEN_FDS_ENV: '5',
+            }
+        expect_mock_output = u"""\
+            ...
+            Called os.fork()
+            Called daemon.runner.exec_new_daemon(
+                %(argv)r,
+                %(environ)r,
+                [4, 5])
+            ...
+            """ % vars()
+        instance._hand_over_daemon()
+        self.failUnlessMockCheckerMatch(expect_mock_output)
+
+    def test_new_daemon_inherits_pidfile_lock(self):
+        """ Should let the new daemon inherit the PID file lock. """
+        instance = self.test_instance
+        os.fork.mock_returns = 0
+        self.mock_runner_lock.fileno.mock_returns = 6
+        argv = instance.reload_argv
+        environ = {
+            'SPAM': 'eggs',
+            runner.RELOAD_FD_ENV: '4',
+            runner.RELOAD_LOCK_FD_ENV: '6',
+            }
+        expect_mock_output = u"""\
+            ...
+            Called daemon.runner.exec_new_daemon(
+                %(argv)r,
+                %(environ)r,
+                [4, 6])
+            ...
+            """ % vars()
+        instance._hand_over_daemon()
+        self.failUnlessMockCheckerMatch(expect_mock_output)
+
+    def test_closes_control_socket_on_exec(self):
+        """ Should not let the new daemon inherit the control socket. """
+        instance = self.test_instance
+        expect_mock_output = u"""\
+            ...
+            Called daemon.runner.set_close_on_exec(3, True)
+            ...
+            Called os.fork()
+            ...
+            """
+        instance._hand_over_daemon()
+        self.failUnlessMockCheckerMatch(expect_mock_output)
+
+    def test_lets_new_daemon_proceed_when_ready(self):
+        """ Should let the new daemon proceed once it is ready. """
+        instance = self.test_instance
+        lockfile_class_name = self.lockfile_class_name
+        expect_mock_output = u"""\
+            ...
+            Called reload_socket.close()
+            Called daemon.runner.receive_reload_message(
+                <Mock ... control_socket>,
+                ...)
+            Called daemon.runner.send_reload_message(
+                <Mock ... control_socket>,
+                u'proceed')
+            Called daemon.runner.receive_reload_message(
+                <Mock ... control_socket>,
+                ...)
+            Called %(lockfile_class_name)s.i_am_locking()
+            Called %(lockfile_class_name)s.relinquish()
+            Called control_socket.close()
+            Called daemon.runner.reap_child_process(4242, 0)
+            """ % vars()
+        instance._hand_over_daemon()
+        self.failUnlessMockCheckerMatch(expect_mock_output)
+
+    def test_gives_up_pidfile(self):
+        """ Should remove the PID file from the daemon context. """
+        instance = self.test_instance
+        instance._hand_over_daemon()
+        self.failUnlessIs(None, instance.daemon_context.pidfile)
+
+    def test_raises_error_if_new_daemon_not_ready(self):
+        """ Should raise error if the new daemon does not become ready. """
+        instance = self.test_instance
+        def mock_receive_reload_message(sock, deadline):
+            raise runner.DaemonRunnerReloadFailureError(u"Timed out")
+        runner.receive_reload_message.mock_returns_func = (
+            mock_receive_reload_message)
+        expect_error = runner.DaemonRunnerReloadFailureError
+        unwanted_mock_output = u"""\
+            ...Called daemon.runner.send_reload_message(...)..."""
+        self.failUnlessRaises(
+            expect_error,
+            instance._hand_over_daemon)
+        self.failIfMockCheckerMatch(unwanted_mock_output)
+
+    def test_raises_error_if_pidfile_not_taken_over(self):
+        """ Should raise error if the PID file was not taken over. """
+        instance = self.test_instance
+        self.mock_runner_lock.i_am_locking.mock_returns = True
+        expect_pidfile = instance.pidfile
+        expect_error = runner.DaemonRunnerReloadFailureError
+        self.failUnlessRaises(
+            expect_error,
+            instance._hand_over_daemon)
+        self.failUnlessIs(expect_pidfile, instance.daemon_context.pidfile)
+
+    def test_closes_control_socket_and_reaps_child_on_error(self):
+        """ Should close the socket and wait to reap the child if it fails. """
+        instance = self.test_instance
+        instance.reload_reap_timeout = 7
+        self.test_messages[:] = [u"spam"]
+        expect_mock_output = u"""\
+            ...
+            Called control_socket.close()
+            Called daemon.runner.reap_child_process(4242, 7)
+            """
+        try:
+            instance._hand_over_daemon()
+        except runner.DaemonRunnerReloadFailureError:
+            pass
+        self.failUnlessMockCheckerMatch(expect_mock_output)
+
+
+class DaemonRunner_handle_reload_signal_TestCase(scaffold.TestCase):
+    """ Test cases for DaemonRunner._handle_reload_signal method. """
+
+    def setUp(self):
+        """ Set up test fixtures. """
+        setup_runner_fixtures(self)
+        set_runner_scenario(self, 'simple')
+
+        self.test_instance.daemon_pid = self.scenario['pid']
+        scaffold.mock(
+            u"daemon.runner.DaemonRunner._reload_daemon_process",
+            tracker=self.mock_tracker)
+
+        self.test_args = dict(
+            signal_number=runner.reload_signal,
+            stack_frame=object(),
+            )
+
+    def tearDown(self):
+        """ Tear down test fixtures. """
+        scaffold.mock_restore()
+
+    def test_ignores_signal(self):
+        """ Should not reload the daemon process from the handler. """
+        instance = self.test_instance
+        instance._handle_reload_signal(**self.test_args)
+        self.failUnlessMockCheckerMatch(u"")
+
+
+class DaemonRunner_start_reload_thread_TestCase(scaffold.TestCase):
+    """ Test cases for DaemonRunner._start_reload_thread method. """
+
+    def setUp(self):
+        """ Set up test fixtures. """
+        setup_runner_fixtures(self)
+        set_runner_scenario(self, 'simple')
+
+        self.mock_thread = scaffold.Mock(
+            u"Thread",
+            tracker=self.mock_tracker)
+        scaffold.mock(
+            u"threading.Thread",
+            returns=self.mock_thread,
+            tracker=self.mock_tracker)
+        scaffold.mock(
+            u"daemon.runner.set_thread_signal_mask",
+            tracker=self.mock_tracker)
+        scaffold.mock(
+            u"daemon.runner.emit_message",
+            tracker=self.mock_tracker)
+
+    def tearDown(self):
+        """ Tear down test fixtures. """
+        scaffold.mock_restore()
+
+    def test_blocks_reload_signal_then_starts_thread(self):
+        """ Should block the reload signal, then start the thread. """
+        instance = self.test_instance
+        expect_mock_output = u"""\
+            Called daemon.runner.set_thread_signal_mask(
+                0, [%(reload_signal)d])
+            Called threading.Thread(
+                name='reload', target=<bound method ...>)
+            Called Thread.start()
+            """ % dict(reload_signal=runner.reload_signal)
+        instance._start_reload_thread()
+        self.failUnlessMockCheckerMatch(expect_mock_output)
+        self.failUnless(self.mock_thread.daemon)
+
+    def test_emits_message_if_signal_cannot_be_blocked(self):
+        """ Should emit a message, and start no thread, on OSError. """
+        instance = self.test_instance
+        test_error = OSError(errno.ENOSYS, u"Function not implemented")
+        runner.set_thread_signal_mask.mock_raises = test_error
+        expect_mock_output = u"""\
+            Called daemon.runner.set_thread_signal_mask(...)
+            Called daemon.runner.emit_message(
+                u'reload unavailable: ...')
+            """
+        instance._start_reload_thread()
+        self.failUnlessMockCheckerMatch(expect_mock_output)
+
+
+class StopReloadLoop(Exception):
+    """ Raised to stop the reload loop under test. """
+
+
+class DaemonRunner_run_reload_loop_TestCase(scaffold.TestCase):
+    """ Test cases for DaemonRunner._run_reload_loop method. """
+
+    def setUp(self):
+        """ Set up test fixtures. """
+        setup_runner_fixtures(self)
+        set_runner_scenario(self, 'simple')
+
+        scaffold.mock(
+            u"daemon.runner.set_thread_signal_mask",
+            tracker=self.mock_tracker)
+        scaffold.mock(
+            u"daemon.runner.wait_for_signal",
+            returns=runner.reload_signal,
+            tracker=self.mock_tracker)
+        self.reload_count = 0
+        def mock_reload_daemon_process():
+            self.reload_count += 1
+            if self.reload_count > 1:
+                raise StopReloadLoop()
+        scaffold.mock(
+            u"daemon.runner.DaemonRunner._reload_daemon_process",
+            returns_func=mock_reload_daemon_process,
+            tracker=self.mock_tracker)
+
+    def tearDown(self):
+        """ Tear down test fixtures. """
+        scaffold.mock_restore()
+
+    def test_reloads_each_time_reload_signal_arrives(self):
+        """ Should block every signal, then reload on each reload signal. """
+        instance = self.test_instance
+        expect_mock_output = u"""\
+            Called daemon.runner.set_thread_signal_mask(2)
+            Called daemon.runner.wait_for_signal([%(reload_signal)d])
+            Called daemon.runner.DaemonRunner._reload_daemon_process()
+            Called daemon.runner.wait_for_signal([%(reload_signal)d])
+            Called daemon.runner.DaemonRunner._reload_daemon_process()
+            """ % dict(reload_signal=runner.reload_signal)
+        self.failUnlessRaises(
+            StopReloadLoop,
+            instance._run_reload_loop)
+        self.failUnlessMockCheckerMatch(expect_mock_output)
+
+
+class DaemonRunner_reload_daemon_process_TestCase(scaffold.TestCase):
+    """ Test cases for DaemonRunner._reload_daemon_process method. """
+
+    def setUp(self):
+        """ Set up test fixtures. """
+        setup_runner_fixtures(self)
+        set_runner_scenario(self, 'simple')
+
+        self.test_instance.daemon_pid = self.scenario['pid']
+        scaffold.mock(
+            u"daemon.runner.DaemonRunner._hand_over_daemon",
+            tracker=self.mock_tracker)
+
+    def tearDown(self):
+        """ Tear down test fixtures. """
+        scaffold.mock_restore()
+
+    def test_hands_over_then_terminates(self):
+        """ Should hand over the daemon, then terminate it. """
+        instance = self.test_instance
+        test_pid = self.scenario['pid']
+        expect_signal = signal.SIGTERM
+        expect_mock_output = u"""\
+            Called daemon.runner.DaemonRunner._hand_over_daemon()
+            Called os.kill(%(test_pid)r, %(expect_signal)r)
+            """ % vars()
+        instance._reload_daemon_process()
+        self.failUnlessMockCheckerMatch(expect_mock_output)
+
+    def test_emits_message_and_continues_if_reload_fails(self):
+        """ Should emit a message and not terminate if reload fails. """
+        instance = self.test_instance
+        runner.DaemonRunner._hand_over_daemon.mock_raises = (
+            runner.DaemonRunnerReloadFailureError(u"Not ready"))
+        expect_stderr = u"""\
+            reload failed: Not ready
+            """
+        unwanted_mock_output = u"""\
+            ...Called os.kill(...)..."""
+        instance._reload_daemon_process()
+        self.failIfMockCheckerMatch(unwanted_mock_output)
+        self.failUnlessOutputCheckerMatch(
+            expect_stderr, self.mock_stderr.getvalue())
+
+    def test_notifies_supervisor_of_own_pid_if_reload_fails(self):
+        """ Should notify the supervisor it is still main if reload fails. """
+        instance = self.test_instance
+        instance.daemon_context.notifier = scaffold.Mock(
+            u"Notifier",
+            tracker=self.mock_tracker)
+        runner.DaemonRunner._hand_over_daemon.mock_raises = (
+            runner.DaemonRunnerReloadFailureError(u"Not ready"))
+        test_pid = self.scenario['pid']
+        expect_state = u"MAINPID=%(test_pid)d" % vars()
+        expect_mock_output = u"""\
+            ...
+            Called Notifier.notify(%(expect_state)r)
+            """ % vars()
+        instance._reload_daemon_process()
+        self.failUnlessMockCheckerMatch(expect_mock_output)
+
+
+class set_close_on_exec_TestCase(scaffold.TestCase):
+    """ Test cases for set_close_on_exec function. """
+
+    def setUp(self):
+        """ Set up test fixtures. """
+        (self.test_read_fd, self.test_write_fd) = os.pipe()
+
+    def tearDown(self):
+        """ Tear down test fixtures. """
+        os.close(self.test_read_fd)
+        os.close(self.test_write_fd)
+
+    def test_sets_and_clears_flag(self):
+        """ Should set, then clear, the close-on-exec flag. """
+        fd = self.test_read_fd
+        runner.set_close_on_exec(fd, True)
+        self.failUnless(fcntl.fcntl(fd, fcntl.F_GETFD) & fcntl.FD_CLOEXEC)
+        runner.set_close_on_exec(fd, False)
+        self.failIf(fcntl.fcntl(fd, fcntl.F_GETFD) & fcntl.FD_CLOEXEC)
+
+
+class pop_reload_socket_TestCase(scaffold.TestCase):
+    """ Test cases for pop_reload_socket function. """
+
+    def setUp(self):
+        """ Set up test fixtures. """
+        self.mock_tracker = scaffold.MockTracker()
+
+        self.test_environ = {}
+        scaffold.mock(
+            u"os.environ",
+            mock_obj=self.test_environ,
+            tracker=self.mock_tracker)
+
+    def tearDown(self):
+        """ Tear down test fixtures. """
+        scaffold.mock_restore()
+
+    def test_returns_none_if_not_reloaded(self):
+        """ Should return None if not started by reload. """
+        result = runner.pop_reload_socket()
+        self.failUnlessIs(None, result)
+
+    def test_returns_socket_and_removes_variable(self):
+        """ Should return the socket, and remove it from environment. """
+        (sock, peer) = socket.socketpair()
+        self.test_environ[runner.RELOAD_FD_ENV] = str(sock.fileno())
+        try:
+            result = runner.pop_reload_socket()
+            result.sendall("spam")
+            self.failUnlessEqual("spam", peer.recv(4))
+            self.failIfIn(self.test_environ, runner.RELOAD_FD_ENV)
+        finally:
+            result.close()
+            peer.close()
+
+    def test_raises_error_if_invalid(self):
+        """ Should raise error if the variable is invalid. """
+        self.test_environ[runner.RELOAD_FD_ENV] = "spam"
+        expect_error = runner.DaemonRunnerStartFailureError
+        self.failUnlessRaises(
+            expect_error,
+            runner.pop_reload_socket)
+
+
+class pop_inherited_lock_fd_TestCase(scaffold.TestCase):
+    """ Test cases for pop_inherited_lock_fd function. """
+
+    def setUp(self):
+        """ Set up test fixtures. """
+        self.test_environ = {}
+        scaffold.mock(
+            u"os.environ",
+            mock_obj=self.test_environ)
+
+    def tearDown(self):
+        """ Tear down test fixtures. """
+        scaffold.mock_restore()
+
+    def test_returns_none_if_not_inherited(self):
+        """ Should return None if no lock was inherited. """
+        result = runner.pop_inherited_lock_fd()
+        self.failUnlessIs(None, result)
+
+    def test_returns_fd_and_removes_variable(self):
+        """ Should return the file descriptor, and remove the variable. """
+        self.test_environ[runner.RELOAD_LOCK_FD_ENV] = "7"
+        result = runner.pop_inherited_lock_fd()
+        self.failUnlessEqual(7, result)
+        self.failIfIn(self.test_environ, runner.RELOAD_LOCK_FD_ENV)
+
+    def test_raises_error_if_invalid(self):
+        """ Should raise error if the variable is invalid. """
+        self.test_environ[runner.RELOAD_LOCK_FD_ENV] = "spam"
+        expect_error = runner.DaemonRunnerStartFailureError
+        self.failUnlessRaises(
+            expect_error,
+            runner.pop_inherited_lock_fd)
+
+
+class reload_message_TestCase(scaffold.TestCase):
+    """ Test cases for send_reload_message and receive_reload_message. """
+
+    def setUp(self):
+        """ Set up test fixtures. """
+        (self.test_socket, self.test_peer) = socket.socketpair()
+
+    def tearDown(self):
+        """ Tear down test fixtures. """
+        self.test_socket.close()
+        self.test_peer.close()
+
+    def test_receives_message_sent(self):
+        """ Should receive each message sent. """
+        runner.send_reload_message(self.test_peer, u"ready")
+        runner.send_reload_message(self.test_peer, u"done")
+        deadline = time.time() + 5
+        self.failUnlessEqual(
+            [u"ready", u"done"],
+            [runner.receive_reload_message(self.test_socket, deadline)
+                for i in range(2)])
+
+    def test_raises_error_if_connection_closed(self):
+        """ Should raise error if the connection is closed. """
+        self.test_peer.close()
+        deadline = time.time() + 5
+        expect_error = runner.DaemonRunnerReloadFailureError
+        self.failUnlessRaises(
+            expect_error,
+            runner.receive_reload_message, self.test_socket, deadline)
+
+    def test_raises_error_if_deadline_passes(self):
+        """ Should raise error if the deadline passes. """
+        deadline = time.time() + 0.01
+        expect_error = runner.DaemonRunnerReloadFailureError
+        self.failUnlessRaises(
+            expect_error,
+            runner.receive_reload_message, self.test_socket, deadline)
+
+
+class reap_child_process_TestCase(scaffold.TestCase):
+    """ Test cases for reap_child_process function. """
+
+    def fork_child(self, func):
+        """ Fork a child process that calls `func`, then exits. """
+        pid = os.fork()
+        if pid == 0:
+            try:
+                func()
+            finally:
+                os._exit(0)
+        return pid
+
+    def test_reaps_child_that_exits_within_timeout(self):
+        """ Should wait for and reap a child that exits in time. """
+        pid = self.fork_child(lambda: time.sleep(0.05))
+        result = runner.reap_child_process(pid, 5)
+        self.failUnless(result)
+        self.failUnlessRaises(OSError, os.waitpid, pid, os.WNOHANG)
+
+    def test_returns_false_if_child_still_running(self):
+        """ Should return False if the child has not exited in time. """
+        pid = self.fork_child(lambda: time.sleep(5))
+        try:
+            result = runner.reap_child_process(pid, 0.05)
+            self.failIf(result)
+        finally:
+            os.kill(pid, signal.SIGKILL)
+            os.waitpid(pid, 0)
+
+    def test_returns_true_if_not_a_child(self):
+        """ Should return True for a process that is not a child. """
+        pid = self.fork_child(lambda: None)
+        os.waitpid(pid, 0)
+        result = runner.reap_child_process(pid, 5)
+        self.failUnless(result)
+
+
+class format_socket_address_TestCase(scaffold.TestCase):
+    """ Test cases for format_socket_address function. """
+
+    def test_formats_each_kind_of_address(self):
+        """ Should format each kind of socket address as text. """
+        for (address, expect_text) in [
+                (("127.0.0.1", 8080), u"127.0.0.1:8080"),
+                (("::1", 8080, 0, 0), u"[::1]:8080"),
+                ("/run/spam.sock", u"/run/spam.sock"),
+                ("\0spam", u"@spam"),
+                ]:
+            self.failUnlessEqual(
+                expect_text, runner.format_socket_address(address))
+
+    def test_formats_bound_socket_address(self):
+        """ Should format the address of a bound socket. """
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            sock.bind("\0python-daemon-test-%d" % os.getpid())
+            expect_text = u"@python-daemon-test-%d" % os.getpid()
+            self.failUnlessEqual(
+                expect_text, runner.format_socket_address(sock.getsockname()))
+        finally:
+            sock.close()
+
+
+class process_exit_TestCase(scaffold.TestCase):
+    """ Test cases for waiting for a process to exit. """
+
+    def setUp(self):
+        """ Set up test fixtures. """
+        (read_fd, write_fd) = os.pipe()
+        self.test_pid = os.fork()
+        if self.test_pid == 0:
+            os.close(write_fd)
+            os.read(read_fd, 1)
+            os._exit(0)
+        os.close(read_fd)
+        self.test_exit_fd = write_fd
+        self.test_pidfd = None
+
+    def tearDown(self):
+        """ Tear down test fixtures. """
+        self.make_process_exit()
+        if self.test_pidfd is not None:
+            os.close(self.test_pidfd)
+
+    def make_process_exit(self):
+        """ Make the test process exit, and reap it. """
+        if self.test_exit_fd is not None:
+            os.close(self.test_exit_fd)
+            self.test_exit_fd = None
+            os.waitpid(self.test_pid, 0)
+
+    def test_process_is_running(self):
+        """ Should report the process is running until it exits. """
+        self.failUnless(runner.is_process_running(self.test_pid))
+        self.make_process_exit()
+        self.failIf(runner.is_process_running(self.test_pid))
+
+    def test_open_process_fd_returns_fd_or_none(self):
+        """ Should return a file descriptor, or None if not supported. """
+        self.test_pidfd = runner.open_process_fd(self.test_pid)
+        if self.test_pidfd is not None:
+            os.fstat(self.test_pidfd)
+
+    def test_open_process_fd_returns_none_if_unsupported(self):
+        """ Should return None if the system call is not supported. """
+        scaffold.mock(
+            u"daemon.runner.call_libc_function",
+            raises=OSError(errno.ENOSYS, u"Not implemented"),
+            tracker=scaffold.MockTracker())
+        try:
+            result = runner.open_process_fd(self.test_pid)
+        finally:
+            scaffold.mock_restore()
+        self.failUnlessIs(None, result)
+
+    def test_wait_returns_false_if_process_runs(self):
+        """ Should return False if the process runs past the timeout. """
+        self.test_pidfd = runner.open_process_fd(self.test_pid)
+        for pidfd in [self.test_pidfd, None]:
+            result = runner.wait_for_process_exit(
+                self.test_pid, 0.01, pidfd)
+            self.failUnlessIs(False, result)
+
+    def test_wait_returns_true_when_process_exits(self):
+        """ Should return True once the process has exited. """
+        self.test_pidfd = runner.open_process_fd(self.test_pid)
+        self.make_process_exit()
+        for pidfd in [self.test_pidfd, None]:
+            result = runner.wait_for_process_exit(self.test_pid, 5, pidfd)
+            self.failUnlessIs(True, result)
+
+
+class get_process_info_TestCase(scaffold.TestCase):
+    """ Test cases for get_process_info function. """
+
+    def setUp(self):
+        """ Set up test fixtures. """
+        (read_fd, write_fd) = os.pipe()
+        self.test_pid = os.fork()
+        if self.test_pid == 0:
+            os.close(write_fd)
+            os.read(read_fd, 1)
+            os._exit(0)
+        os.close(read_fd)
+        self.test_exit_fd = write_fd
+        self.test_reaped = False
+        self.has_proc = os.path.isdir(
+            os.path.join(runner.proc_root, "self"))
+
+    def tearDown(self):
+        """ Tear down test fixtures. """
+        if self.test_exit_fd is not None:
+            os.close(self.test_exit_fd)
+        if not self.test_reaped:
+            os.waitpid(self.test_pid, 0)
+
+    def test_returns_info_for_running_process(self):
+        """ Should return information about the running process. """
+        info = runner.get_process_info(self.test_pid)
+        if self.has_proc:
+            self.failUnless(abs(time.time() - info['start_time']) < 60)
+            self.failUnless(info['rss'] > 0)
+            self.failUnless(info['fds'] > 0)
+
+    def test_returns_none_for_zombie_process(self):
+        """ Should return None once the process has exited. """
+        os.close(self.test_exit_fd)
+        self.test_exit_fd = None
+        if self.has_proc:
+            deadline = time.time() + 10
+            info = runner.get_process_info(self.test_pid)
+            while info is not None and time.time() < deadline:
+                time.sleep(0.01)
+                info = runner.get_process_info(self.test_pid)
+            self.failUnlessIs(None, info)
+
+    def test_returns_none_for_reaped_process(self):
+        """ Should return None once the process has been reaped. """
+        os.close(self.test_exit_fd)
+        self.test_exit_fd = None
+        os.waitpid(self.test_pid, 0)
+        self.test_reaped = True
+        if self.has_proc:
+            self.failUnlessIs(None, runner.get_process_info(self.test_pid))
+
+    def test_returns_no_info_without_proc(self):
+        """ Should return only ‘None’ values without ‘/proc’. """
+        scaffold.mock(
+            u"daemon.runner.proc_root",
+            mock_obj=tempfile.mkdtemp())
+        try:
+            info = runner.get_process_info(self.test_pid)
+        finally:
+            os.rmdir(runner.proc_root)
+            scaffold.mock_restore()
+        expect_info = dict(start_time=None, rss=None, fds=None)
+        self.failUnlessEqual(expect_info, info)
@@ -0,0 +1,678 @@
+# -*- coding: utf-8 -*-
+#
+# test/test_workerpool.py
+# Part of python-daemon, an implementation of PEP 3143.
+#
+# Copyright © 2026 agent <agent@local>
+#
+# This is free software: you may copy, modify, and/or distribute this work
+# under the terms of the Python Software Foundation License, version 2 or
+# later as published by the Python Software Foundation.
+# No warranty expressed or implied. See the file LICENSE.PSF-2 for details.
+
+""" Unit test for workerpool module.
+    """
+
+import os
+import errno
+import signal
+import time
+import traceback
+import tempfile
+
+import scaffold
+
+from daemon import workerpool
+
+
+class Exception_TestCase(scaffold.Exception_TestCase):
+    """ Test cases for module exception classes. """
+
+    def __init__(self, *args, **kwargs):
+        """ Set up a new instance. """
+        super(Exception_TestCase, self).__init__(*args, **kwargs)
+
+        self.valid_exceptions = {
+            workerpool.WorkerPoolError: dict(
+                min_args = 1,
+                types = (Exception,),
+                ),
+            workerpool.WorkerPoolValueError: dict(
+                min_args = 1,
+                types = (workerpool.WorkerPoolError, ValueError),
+                ),
+            }
+
+
+def setup_worker_pool_fixtures(testcase):
+    """ Set up common test fixtures for WorkerPool test case. """
+    testcase.mock_tracker = scaffold.MockTracker()
+
+    testcase.test_target = scaffold.Mock(
+        u"target",
+        tracker=testcase.mock_tracker)
+    testcase.test_workers = 3
+    testcase.test_instance = workerpool.WorkerPool(
+        testcase.test_target, testcase.test_workers)
+
+    testcase.test_time = 100.0
+    scaffold.mock(
+        u"time.time",
+        returns_func=lambda: testcase.test_time,
+        tracker=testcase.mock_tracker)
+
+
+class WorkerPool_TestCase(scaffold.TestCase):
+    """ Test cases for WorkerPool class. """
+
+    def setUp(self):
+        """ Set up test fixtures. """
+        setup_worker_pool_fixtures(self)
+
+    def tearDown(self):
+        """ Tear down test fixtures. """
+        scaffold.mock_restore()
+
+    def test_instantiate(self):
+        """ New instance of WorkerPool should be created. """
+        self.failUnlessIsInstance(self.test_instance, workerpool.WorkerPool)
+
+    def test_has_specified_target(self):
+        """ Should have specified target. """
+        self.failUnlessIs(self.test_target, self.test_instance.target)
+
+    def test_has_specified_workers(self):
+        """ Should have specified number of workers. """
+        self.failUnlessEqual(self.test_workers, self.test_instance.workers)
+
+    def test_workers_default_to_available_cpu_count(self):
+        """ Should default to the number of available CPUs. """
+        test_cpu_count = 7
+        scaffold.mock(
+            u"workerpool.get_available_cpu_count",
+            returns=test_cpu_count,
+            tracker=self.mock_tracker)
+        instance = workerpool.WorkerPool(self.test_target)
+        self.failUnlessEqual(test_cpu_count, instance.workers)
+
+    def test_error_when_workers_less_than_one(self):
+        """ Should raise WorkerPoolValueError if `workers` below 1. """
+        expect_error = workerpool.WorkerPoolValueError
+        self.failUnlessRaises(
+            expect_error,
+            workerpool.WorkerPool, self.test_target, 0)
+
+
+class WorkerPool_spawn_worker_TestCase(scaffold.TestCase):
+    """ Test cases for WorkerPool.spawn_worker method. """
+
+    def setUp(self):
+        """ Set up test fixtures. """
+        setup_worker_pool_fixtures(self)
+
+        self.test_pid = 2345
+        self.test_index = 1
+        scaffold.mock(
+            u"os.fork",
+            returns=self.test_pid,
+            tracker=self.mock_tracker)
+        scaffold.mock(
+            u"workerpool.WorkerPool._run_worker",
+            tracker=self.mock_tracker)
+
+    def tearDown(self):
+        """ Tear down test fixtures. """
+        scaffold.mock_restore()
+
+    def test_returns_worker_pid(self):
+        """ Should return the process ID of the worker. """
+        instance = self.test_instance
+        expect_result = self.test_pid
+        result = instance.spawn_worker(self.test_index)
+        self.failUnlessEqual(expect_result, result)
+
+    def test_records_worker_index_by_pid(self):
+        """ Should record the worker index by process ID. """
+        instance = self.test_instance
+        expect_worker_pids = {self.test_pid: self.test_index}
+        instance.spawn_worker(self.test_index)
+        self.failUnlessEqual(expect_worker_pids, instance.worker_pids)
+
+    def test_records_worker_start_time(self):
+        """ Should record the start time of the worker. """
+        instance = self.test_instance
+        expect_start_times = {self.test_index: self.test_time}
+        instance.spawn_worker(self.test_index)
+        self.failUnlessEqual(expect_start_times, instance.worker_start_times)
+
+    def test_parent_does_not_run_worker(self):
+        """ Should not run the worker in the parent process. """
+        instance = self.test_instance
+        unwanted_mock_output = u"""\
+            ...
+            Called workerpool.WorkerPool._run_worker(...)
+            ...
+            """
+        instance.spawn_worker(self.test_index)
+        self.failIfMockCheckerMatch(unwanted_mock_output)
+
+    def test_child_runs_worker_with_index(self):
+        """ Should run the worker with its index in the child process. """
+        instance = self.test_instance
+        os.fork.mock_returns = 0
+        test_index = self.test_index
+        expect_mock_output = u"""\
+            Called os.fork()
+            Called workerpool.WorkerPool._run_worker(%(test_index)r)
+            ...
+            """ % vars()
+        instance.spawn_worker(test_index)
+        self.failUnlessMockCheckerMatch(expect_mock_output)
+
+
+class WorkerPool_run_worker_TestCase(scaffold.TestCase):
+    """ Test cases for WorkerPool._run_worker method. """
+
+    def setUp(self):
+        """ Set up test fixtures. """
+        setup_worker_pool_fixtures(self)
+
+        self.test_index = 2
+        scaffold.mock(
+            u"workerpool.WorkerPool._restore_signal_handlers",
+            tracker=self.mock_tracker)
+        scaffold.mock(
+            u"os._exit",
+            tracker=self.mock_tracker)
+        scaffold.mock(
+            u"traceback.print_exc",
+            tracker=self.mock_tracker)
+
+    def tearDown(self):
+        """ Tear down test fixtures. """
+        scaffold.mock_restore()
+
+    def test_runs_target_with_index_after_restoring_handlers(self):
+        """ Should restore signal handlers, then run the target. """
+        instance = self.test_instance
+        test_index = self.test_index
+        expect_mock_output = u"""\
+            Called workerpool.WorkerPool._restore_signal_handlers()
+            Called target(%(test_index)r)
+            ...
+            """ % vars()
+        instance._run_worker(test_index)
+        self.failUnlessMockCheckerMatch(expect_mock_output)
+
+    def test_exits_with_success_when_target_returns(self):
+        """ Should exit with status 0 when the target returns. """
+        instance = self.test_instance
+        expect_mock_output = u"""\
+            ...
+            Called os._exit(0)
+            """
+        instance._run_worker(self.test_index)
+        self.failUnlessMockCheckerMatch(expect_mock_output)
+
+    def test_exits_with_system_exit_status(self):
+        """ Should exit with the status of a SystemExit from the target. """
+        instance = self.test_instance
+        test_status = 3
+        self.test_target.mock_raises = SystemExit(test_status)
+        expect_mock_output = u"""\
+            ...
+            Called os._exit(%(test_status)r)
+            """ % vars()
+        instance._run_worker(self.test_index)
+        self.failUnlessMockCheckerMatch(expect_mock_output)
+
+    def test_exits_with_failure_when_target_raises_error(self):
+        """ Should report the error, then exit with status 1. """
+        instance = self.test_instance
+        self.test_target.mock_raises = ValueError(u"Bad value")
+        expect_mock_output = u"""\
+            ...
+            Called traceback.print_exc()
+            Called os._exit(1)
+            """
+        instance._run_worker(self.test_index)
+        self.failUnlessMockCheckerMatch(expect_mock_output)
+
+
+class WorkerPool_reap_workers_TestCase(scaffold.TestCase):
+    """ Test cases for WorkerPool.reap_workers method. """
+
+    def setUp(self):
+        """ Set up test fixtures. """
+        setup_worker_pool_fixtures(self)
+
+        instance = self.test_instance
+        instance.worker_pids = {1001: 0, 1002: 1, 1003: 2}
+        instance.worker_start_times = {0: 10.0, 1: 10.0, 2: 10.0}
+
+        self.test_exits = [(1002, 0)]
+        def mock_waitpid(pid, options):
+            if self.test_exits:
+                result = self.test_exits.pop(0)
+            else:
+                result = (0, 0)
+            return result
+
+        scaffold.mock(
+            u"os.waitpid",
+            returns_func=mock_waitpid,
+            tracker=self.mock_tracker)
+
+    def tearDown(self):
+        """ Tear down test fixtures. """
+        scaffold.mock_restore()
+
+    def test_waits_without_blocking(self):
+        """ Should wait for any child process without blocking. """
+        instance = self.test_instance
+        expect_options = os.WNOHANG
+        expect_mock_output = u"""\
+            Called os.waitpid(-1, %(expect_options)r)
+            ...
+            """ % vars()
+        instance.reap_workers()
+        self.failUnlessMockCheckerMatch(expect_mock_output)
+
+    def test_forgets_reaped_worker(self):
+        """ Should remove each reaped worker from the pool. """
+        instance = self.test_instance
+        expect_worker_pids = {1001: 0, 1003: 2}
+        instance.reap_workers()
+        self.failUnlessEqual(expect_worker_pids, instance.worker_pids)
+
+    def test_schedules_immediate_respawn(self):
+        """ Should schedule a replacement due now for a reaped worker. """
+        instance = self.test_instance
+        expect_respawns = {1: self.test_time}
+        instance.reap_workers()
+        self.failUnlessEqual(expect_respawns, instance.pending_respawns)
+
+    def test_delays_respawn_of_short_lived_worker(self):
+        """ Should delay replacing a worker that exited soon after start. """
+        instance = self.test_instance
+        instance.respawn_delay = 5.0
+        start_time = self.test_time - 2.0
+        instance.worker_start_times[1] = start_time
+        expect_respawns = {1: start_time + instance.respawn_delay}
+        instance.reap_workers()
+        self.failUnlessEqual(expect_respawns, instance.pending_respawns)
+
+    def test_does_not_schedule_respawn_when_stopping(self):
+        """ Should not schedule a replacement if the pool is stopping. """
+        instance = self.test_instance
+        instance.stop_signal = signal.SIGTERM
+        expect_respawns = {}
+        instance.reap_workers()
+        self.failUnlessEqual(expect_respawns, instance.pending_respawns)
+
+    def test_stops_when_no_child_processes(self):
+        """ Should stop reaping when there are no child processes. """
+        instance = self.test_instance
+        os.waitpid.mock_raises = OSError(errno.ECHILD, u"No children")
+        expect_worker_pids = dict(instance.worker_pids)
+        instance.reap_workers()
+        self.failUnlessEqual(expect_worker_pids, instance.worker_pids)
+
+
+class WorkerPool_respawn_workers_TestCase(scaffold.TestCase):
+    """ Test cases for WorkerPool.respawn_workers method. """
+
+    def setUp(self):
+        """ Set up test fixtures. """
+        setup_worker_pool_fixtures(self)
+
+        scaffold.mock(
+            u"workerpool.WorkerPool.spawn_worker",
+            tracker=self.mock_tracker)
+
+    def tearDown(self):
+        """ Tear down test fixtures. """
+        scaffold.mock_restore()
+
+    def test_spawns_only_due_workers(self):
+        """ Should spawn only the replacement workers now due. """
+        instance = self.test_instance
+        instance.pending_respawns = {
+            0: self.test_time - 1.0,
+            2: self.test_time + 1.0,
+            }
+        expect_mock_output = u"""\
+            Called time.time()
+            Called workerpool.WorkerPool.spawn_worker(0)
+            """
+        instance.respawn_workers()
+        self.failUnlessMockCheckerMatch(expect_mock_output)
+        self.failUnlessEqual(
+            {2: self.test_time + 1.0}, instance.pending_respawns)
+
+
+class WorkerPool_stop_workers_TestCase(scaffold.TestCase):
+    """ Test cases for WorkerPool.stop_workers method. """
+
+    def setUp(self):
+        """ Set up test fixtures. """
+        setup_worker_pool_fixtures(self)
+
+        instance = self.test_instance
+        instance.worker_pids = {1001: 0}
+        instance.pending_respawns = {1: self.test_time}
+
+        scaffold.mock(
+            u"os.kill",
+            tracker=self.mock_tracker)
+        scaffold.mock(
+            u"os.waitpid",
+            returns=(1001, 0),
+            tracker=self.mock_tracker)
+
+    def tearDown(self):
+        """ Tear down test fixtures. """
+        scaffold.mock_restore()
+
+    def test_sends_signal_then_waits_for_workers(self):
+        """ Should send the signal to each worker, then wait for it. """
+        instance = self.test_instance
+        test_signal = signal.SIGINT
+        expect_mock_output = u"""\
+            Called os.kill(1001, %(test_signal)r)
+            Called os.waitpid(-1, 0)
+            """ % vars()
+        instance.stop_workers(test_signal)
+        self.failUnlessMockCheckerMatch(expect_mock_output)
+
+    def test_discards_pending_respawns(self):
+        """ Should discard any pending replacement workers. """
+        instance = self.test_instance
+        instance.stop_workers()
+        self.failUnlessEqual({}, instance.pending_respawns)
+
+    def test_ignores_worker_already_exited(self):
+        """ Should ignore a worker that no longer exists. """
+        instance = self.test_instance
+        os.kill.mock_raises = OSError(errno.ESRCH, u"No such process")
+        instance.stop_workers()
+        self.failUnlessEqual({}, instance.worker_pids)
+
+
+class WorkerPool_run_TestCase(scaffold.TestCase):
+    """ Test cases for WorkerPool.run method. """
+
+    def setUp(self):
+        """ Set up test fixtures. """
+        setup_worker_pool_fixtures(self)
+
+        instance = self.test_instance
+        for name in [
+                u"_install_signal_handlers",
+                u"_restore_signal_handlers",
+                u"spawn_worker",
+                u"reap_workers",
+                u"perform_signal_actions",
+                u"respawn_workers",
+                u"stop_workers",
+                ]:
+            scaffold.mock(
+                u"workerpool.WorkerPool.%(name)s" % vars(),
+                tracker=self.mock_tracker)
+
+        self.test_wakeups = [None, signal.SIGTERM]
+        def mock_wait_for_wakeup(timeout):
+            instance.stop_signal = self.test_wakeups.pop(0)
+
+        scaffold.mock(
+            u"workerpool.WorkerPool._wait_for_wakeup",
+            returns_func=mock_wait_for_wakeup,
+            tracker=self.mock_tracker)
+
+    def tearDown(self):
+        """ Tear down test fixtures. """
+        scaffold.mock_restore()
+
+    def test_supervises_workers_until_stop_signal(self):
+        """ Should spawn, reap and respawn workers until stopped. """
+        instance = self.test_instance
+        expect_signal = signal.SIGTERM
+        expect_mock_output = u"""\
+            Called workerpool.WorkerPool._install_signal_handlers()
+            Called workerpool.WorkerPool.spawn_worker(0)
+            Called workerpool.WorkerPool.spawn_worker(1)
+            Called workerpool.WorkerPool.spawn_worker(2)
+            Called workerpool.WorkerPool._wait_for_wakeup(None)
+            Called workerpool.WorkerPool.reap_workers()
+            Called workerpool.WorkerPool.perform_signal_actions()
+            Called workerpool.WorkerPool.respawn_workers()
+            Called workerpool.WorkerPool._wait_for_wakeup(None)
+            Called workerpool.WorkerPool.reap_workers()
+            Called workerpool.WorkerPool.stop_workers(%(expect_signal)r)
+            Called workerpool.WorkerPool._restore_signal_handlers()
+            """ % vars()
+        instance.run()
+        self.failUnlessMockCheckerMatch(expect_mock_output)
+
+    def test_calls_start_action_once_workers_spawned(self):
+        """ Should call the start action once the workers are spawned. """
+        instance = self.test_instance
+        instance.start_action = scaffold.Mock(
+            u"start_action",
+            tracker=self.mock_tracker)
+        expect_mock_output = u"""\
+            Called workerpool.WorkerPool._install_signal_handlers()
+            Called workerpool.WorkerPool.spawn_worker(0)
+            Called workerpool.WorkerPool.spawn_worker(1)
+            Called workerpool.WorkerPool.spawn_worker(2)
+            Called start_action()
+            Called workerpool.WorkerPool._wait_for_wakeup(None)
+            ...
+            """
+        instance.run()
+        self.failUnlessMockCheckerMatch(expect_mock_output)
+
+    def test_restores_signal_handlers_on_error(self):
+        """ Should restore the signal handlers if an error occurs. """
+        instance = self.test_instance
+        workerpool.WorkerPool.spawn_worker.mock_raises = OSError(
+            errno.EAGAIN, u"Resource temporarily unavailable")
+        expect_mock_output = u"""\
+            ...
+            Called workerpool.WorkerPool._restore_signal_handlers()
+            """
+        try:
+            instance.run()
+        except OSError:
+            pass
+        self.failUnlessMockCheckerMatch(expect_mock_output)
+
+
+class WorkerPool_handle_signal_TestCase(scaffold.TestCase):
+    """ Test cases for WorkerPool._handle_signal method. """
+
+    def setUp(self):
+        """ Set up test fixtures. """
+        setup_worker_pool_fixtures(self)
+
+        self.test_instance._wakeup_fds = (7, 8)
+        scaffold.mock(
+            u"os.write",
+            tracker=self.mock_tracker)
+
+    def tearDown(self):
+        """ Tear down test fixtures. """
+        scaffold.mock_restore()
+
+    def test_records_stop_signal(self):
+        """ Should record a stop signal. """
+        instance = self.test_instance
+        test_signal = signal.SIGTERM
+        instance._handle_signal(test_signal, None)
+        self.failUnlessEqual(test_signal, instance.stop_signal)
+
+    def test_does_not_record_child_signal(self):
+        """ Should not record ``SIGCHLD`` as a stop signal. """
+        instance = self.test_instance
+        instance._handle_signal(signal.SIGCHLD, None)
+        self.failUnlessIs(None, instance.stop_signal)
+
+    def test_records_pending_signal_with_action(self):
+        """ Should record a signal with an action, without calling it. """
+        instance = self.test_instance
+        test_signal = signal.SIGUSR2
+        action = scaffold.Mock(
+            u"action",
+            tracker=self.mock_tracker)
+        instance.signal_actions[test_signal] = action
+        unwanted_output = u"""\
+            ...Called action()..."""
+        instance._handle_signal(test_signal, None)
+        self.failUnlessEqual(set([test_signal]), instance.pending_signals)
+        self.failUnlessIs(None, instance.stop_signal)
+        self.failIfMockCheckerMatch(unwanted_output)
+
+    def test_writes_to_wakeup_pipe(self):
+        """ Should write to the wake-up pipe. """
+        instance = self.test_instance
+        expect_mock_output = u"""\
+            Called os.write(8, ...)
+            """
+        instance._handle_signal(signal.SIGCHLD, None)
+        self.failUnlessMockCheckerMatch(expect_mock_output)
+
+    def test_ignores_full_wakeup_pipe(self):
+        """ Should ignore a wake-up pipe that is already full. """
+        instance = self.test_instance
+        os.write.mock_raises = OSError(errno.EAGAIN, u"Try again")
+        instance._handle_signal(signal.SIGCHLD, None)
+
+
+class WorkerPool_perform_signal_actions_TestCase(scaffold.TestCase):
+    """ Test cases for WorkerPool.perform_signal_actions method. """
+
+    def setUp(self):
+        """ Set up test fixtures. """
+        setup_worker_pool_fixtures(self)
+
+        self.test_signal = signal.SIGUSR2
+        self.mock_action = scaffold.Mock(
+            u"action",
+            tracker=self.mock_tracker)
+        self.test_instance.signal_actions[self.test_signal] = (
+            self.mock_action)
+
+    def tearDown(self):
+        """ Tear down test fixtures. """
+        scaffold.mock_restore()
+
+    def test_calls_action_of_pending_signal_once(self):
+        """ Should call the action of each pending signal once. """
+        instance = self.test_instance
+        instance.pending_signals.add(self.test_signal)
+        expect_mock_output = u"""\
+            Called action()
+            """
+        instance.perform_signal_actions()
+        self.failUnlessMockCheckerMatch(expect_mock_output)
+        self.failUnlessEqual(set(), instance.pending_signals)
+
+    def test_calls_no_action_if_none_pending(self):
+        """ Should call no action if no signal is pending. """
+        instance = self.test_instance
+        unwanted_output = u"""\
+            ...Called action()..."""
+        instance.perform_signal_actions()
+        self.failIfMockCheckerMatch(unwanted_output)
+
+    def test_master_handles_signals_with_actions(self):
+        """ Should handle each signal with an action in the master. """
+        instance = self.test_instance
+        self.failUnlessIn(
+            instance._get_master_signals(), self.test_signal)
+
+
+class get_available_cpu_count_TestCase(scaffold.TestCase):
+    """ Test cases for get_available_cpu_count function. """
+
+    def setUp(self):
+        """ Set up test fixtures. """
+        self.mock_tracker = scaffold.MockTracker()
+
+        self.test_allowed_count = 6
+        self.test_online_count = 8
+        scaffold.mock(
+            u"workerpool.read_allowed_cpu_count",
+            returns=self.test_allowed_count,
+            tracker=self.mock_tracker)
+        scaffold.mock(
+            u"os.sysconf",
+            returns=self.test_online_count,
+            tracker=self.mock_tracker)
+
+    def tearDown(self):
+        """ Tear down test fixtures. """
+        scaffold.mock_restore()
+
+    def test_returns_allowed_cpu_count(self):
+        """ Should return the number of CPUs this process may use. """
+        expect_result = self.test_allowed_count
+        result = workerpool.get_available_cpu_count()
+        self.failUnlessEqual(expect_result, result)
+
+    def test_returns_online_cpu_count_if_allowed_unknown(self):
+        """ Should return the number of online CPUs if not known. """
+        workerpool.read_allowed_cpu_count.mock_returns = None
+        expect_result = self.test_online_count
+        result = workerpool.get_available_cpu_count()
+        self.failUnlessEqual(expect_result, result)
+
+    def test_returns_one_if_count_unknown(self):
+        """ Should return 1 if the number of CPUs cannot be found. """
+        workerpool.read_allowed_cpu_count.mock_returns = None
+        os.sysconf.mock_raises = ValueError(u"Unknown name")
+        expect_result = 1
+        result = workerpool.get_available_cpu_count()
+        self.failUnlessEqual(expect_result, result)
+
+
+class read_allowed_cpu_count_TestCase(scaffold.TestCase):
+    """ Test cases for read_allowed_cpu_count function. """
+
+    def setUp(self):
+        """ Set up test fixtures. """
+        self.test_path = tempfile.mktemp()
+
+    def tearDown(self):
+        """ Tear down test fixtures. """
+        if os.path.exists(self.test_path):
+            os.remove(self.test_path)
+
+    def write_status_file(self, text):
+        """ Write the test status file with the specified text. """
+        status_file = open(self.test_path, 'w')
+        status_file.write(text)
+        status_file.close()
+
+    def test_counts_allowed_cpu_list(self):
+        """ Should count the CPUs in the ``Cpus_allowed_list`` field. """
+        self.write_status_file(
+            "Name:\tpython\n"
+            "Cpus_allowed:\tf0f\n"
+            "Cpus_allowed_list:\t0-3,8,10-11\n")
+        expect_result = 7
+        result = workerpool.read_allowed_cpu_count(self.test_path)
+        self.failUnlessEqual(expect_result, result)
+
+    def test_returns_none_if_field_absent(self):
+        """ Should return ``None`` if the field is absent. """
+        self.write_status_file("Name:\tpython\n")
+        expect_result = None
+        result = workerpool.read_allowed_cpu_count(self.test_path)
+        self.failUnlessIs(expect_result, result)
+
+    def test_returns_none_if_file_absent(self):
+        """ Should return ``None`` if the file does not exist. """
+        expect_result = None
+        result = workerpool.read_allowed_cpu_count(self.test_path)
+        self.failUnlessIs(expect_result, result)